@@ -0,0 +1,14 @@
+"""
+Benchmarks of the conversion pipeline, the API and model saving.
+
+Run from the ``latex2image`` folder::
+
+    python -m benchmarks run --output before.json
+    python -m benchmarks run --output after.json
+    python -m benchmarks compare before.json after.json
+
+By default a stub toolchain (:mod:`benchmarks.stub_bin`) simulating the
+latency and output of the TeX engines and converters is used, so no TeX
+Live installation is needed. Use ``--real-toolchain`` to benchmark the
+installed binaries.
+"""
@@ -0,0 +1,173 @@
+import argparse
+import json
+import platform
+import subprocess
+import sys
+from datetime import datetime, timezone
+
+from benchmarks.corpus import CATEGORIES
+
+SUITES = ("convert", "optimize", "api", "model")
+
+
+def get_git_commit():
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "HEAD"],
+            stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def get_result_id(result):
+    return tuple(
+        result.get(k) for k in
+        ("suite", "name", "category", "compiler", "image_format"))
+
+
+def format_result_id(result_id):
+    return " ".join(str(k) for k in result_id if k is not None)
+
+
+def print_results(results):
+    for result in results:
+        print("%-55s p50 %9s ms  p95 %9s ms  %8s/s  errors %d" % (
+            format_result_id(get_result_id(result)),
+            result["p50_ms"], result["p95_ms"],
+            result.get("throughput_per_s"), result["errors"]))
+        if result.get("mean_bytes") is not None:
+            print("    %-51s %d bytes" % ("mean size", result["mean_bytes"]))
+        if "size_ratio" in result:
+            print("    %-51s %d -> %d bytes (x%s)" % (
+                "size", result["bytes_before"], result["bytes_after"],
+                result["size_ratio"]))
+        for stage, summary in result.get("stages", {}).items():
+            print("    %-51s p50 %9s ms  p95 %9s ms" % (
+                stage, summary["p50_ms"], summary["p95_ms"]))
+
+
+def run(args):
+    from benchmarks import runners
+
+    runners.setup_django()
+
+    from benchmarks.stub_toolchain import StubToolchain
+
+    results = []
+    with (StubToolchain(args.latency_scale) if not args.real_toolchain
+          else _NullContext()):
+        if "convert" in args.suite:
+            results.extend(runners.run_convert_benchmarks(
+                args.iterations, args.category))
+
+        if "optimize" in args.suite:
+            results.extend(runners.run_optimize_benchmarks(
+                args.iterations, args.category))
+
+        if "api" in args.suite or "model" in args.suite:
+            with runners.TestDatabase():
+                if "api" in args.suite:
+                    results.extend(runners.run_api_benchmarks(args.iterations))
+                if "model" in args.suite:
+                    results.extend(
+                        runners.run_model_benchmarks(args.iterations))
+
+    print_results(results)
+
+    report = {
+        "meta": {
+            "commit": get_git_commit(),
+            "time": datetime.now(timezone.utc).isoformat(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "iterations": args.iterations,
+            "toolchain": "real" if args.real_toolchain else "stub",
+            "latency_scale": (
+                None if args.real_toolchain else args.latency_scale),
+        },
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    return 0
+
+
+def compare(args):
+    with open(args.base) as f:
+        base = {get_result_id(r): r for r in json.load(f)["results"]}
+    with open(args.new) as f:
+        new = json.load(f)["results"]
+
+    n_regressions = 0
+    for result in new:
+        result_id = get_result_id(result)
+        base_result = base.get(result_id)
+        if base_result is None:
+            continue
+
+        changes = []
+        for key in ("p50_ms", "p95_ms"):
+            old_value, new_value = base_result.get(key), result.get(key)
+            if not old_value or new_value is None:
+                changes.append("%s n/a" % key)
+                continue
+            change = (new_value - old_value) / old_value
+            flag = ""
+            if change > args.threshold:
+                flag = " !"
+                n_regressions += 1
+            changes.append("%s %+7.1f%%%s" % (key, change * 100, flag))
+
+        print("%-55s %s" % (format_result_id(result_id), "  ".join(changes)))
+
+    if n_regressions and args.fail_on_regression:
+        return 1
+    return 0
+
+
+class _NullContext(object):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m benchmarks")
+    subparsers = parser.add_subparsers(dest="command")
+    subparsers.required = True
+
+    run_parser = subparsers.add_parser("run", help="run the benchmarks")
+    run_parser.add_argument(
+        "--suite", nargs="+", choices=SUITES, default=list(SUITES))
+    run_parser.add_argument(
+        "--category", nargs="+", choices=CATEGORIES, default=None,
+        help="corpus categories of the convert suite, default to all")
+    run_parser.add_argument("--iterations", type=int, default=10)
+    run_parser.add_argument(
+        "--latency-scale", type=float, default=1.,
+        help="multiplier of the simulated latency of the stub toolchain")
+    run_parser.add_argument(
+        "--real-toolchain", action="store_true",
+        help="use the installed TeX toolchain instead of the stubs")
+    run_parser.add_argument("--output", help="path of the JSON report")
+    run_parser.set_defaults(func=run)
+
+    compare_parser = subparsers.add_parser(
+        "compare", help="compare two JSON reports")
+    compare_parser.add_argument("base")
+    compare_parser.add_argument("new")
+    compare_parser.add_argument(
+        "--threshold", type=float, default=0.1,
+        help="relative slowdown flagged as a regression, default to 0.1")
+    compare_parser.add_argument("--fail-on-regression", action="store_true")
+    compare_parser.set_defaults(func=compare)
+
+    args = parser.parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,43 @@
+"""
+The benchmark corpus, one folder per category of TeX source.
+"""
+
+import os
+
+from latex.constants import ALLOWED_COMPILER_FORMAT_COMBINATION
+
+CORPUS_DIR = os.path.dirname(os.path.abspath(__file__))
+
+CATEGORIES = ("inline_math", "display_math", "tikz", "cjk", "long")
+
+# Categories which only compile with some of the compilers, others
+# are compiled with all of them.
+CATEGORY_COMPILERS = {
+    "cjk": ("xelatex",),
+}
+
+
+def get_category_sources(category):
+    """
+    :return: a list of (file name, tex source) of the category.
+    """
+    folder = os.path.join(CORPUS_DIR, category)
+    sources = []
+    for filename in sorted(os.listdir(folder)):
+        if not filename.endswith(".tex"):
+            continue
+        with open(os.path.join(folder, filename), encoding="utf-8") as f:
+            sources.append((filename, f.read()))
+    return sources
+
+
+def get_combinations(category):
+    """
+    :return: the (compiler, image_format) combinations to be benchmarked
+        for the category.
+    """
+    compilers = CATEGORY_COMPILERS.get(category)
+    return [
+        (compiler, image_format)
+        for compiler, image_format in ALLOWED_COMPILER_FORMAT_COMBINATION
+        if compilers is None or compiler in compilers]
@@ -0,0 +1,405 @@
+"""
+Benchmark runners. Each runner returns a list of result dicts, which carry
+the latency percentiles, the throughput and, where available, the same
+figures for each stage of the pipeline.
+"""
+
+import os
+import shutil
+import sys
+import tempfile
+from contextlib import contextmanager
+from math import floor
+from time import perf_counter
+
+from benchmarks.corpus import (CATEGORIES, get_category_sources,
+                               get_combinations)
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def setup_django():
+    if BASE_DIR not in sys.path:
+        sys.path.insert(0, BASE_DIR)
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "latex2image.settings")
+    os.environ.setdefault(
+        "L2I_LOCAL_TEST_SETTINGS",
+        os.path.join(BASE_DIR, "tests", "settings_for_tests.py"))
+
+    import django
+    django.setup()
+
+
+# {{{ statistics
+
+def percentile(sorted_values, q):
+    """Linear interpolated percentile, *q* in [0, 1]."""
+    if not sorted_values:
+        return None
+    k = (len(sorted_values) - 1) * q
+    f = floor(k)
+    c = min(f + 1, len(sorted_values) - 1)
+    return sorted_values[f] + (sorted_values[c] - sorted_values[f]) * (k - f)
+
+
+def _ms(seconds):
+    return None if seconds is None else round(seconds * 1000, 3)
+
+
+def summarize(durations, wall_time=None, errors=0):
+    values = sorted(durations)
+    summary = {
+        "n": len(values),
+        "errors": errors,
+        "p50_ms": _ms(percentile(values, 0.5)),
+        "p95_ms": _ms(percentile(values, 0.95)),
+        "p99_ms": _ms(percentile(values, 0.99)),
+        "mean_ms": _ms(sum(values) / len(values)) if values else None,
+        "total_ms": _ms(sum(values)),
+    }
+    if wall_time is not None:
+        summary["throughput_per_s"] = (
+            round(len(values) / wall_time, 3) if wall_time > 0 else None)
+    return summary
+
+
+class StageTimer(object):
+    """
+    Collects the durations of the pipeline stages, as recorded by the
+    spans of :mod:`latex.timing`.
+    """
+
+    def __init__(self):
+        self.durations = {}
+
+    @contextmanager
+    def record(self):
+        from latex.timing import recording
+
+        with recording() as recorder:
+            yield
+        for stage, duration in recorder.durations.items():
+            self.durations.setdefault(stage, []).append(duration)
+
+    def summarize(self):
+        return {stage: summarize(durations)
+                for stage, durations in sorted(self.durations.items())}
+
+# }}}
+
+
+# {{{ converter benchmarks
+
+def run_convert_benchmarks(iterations, categories=None):
+    from latex.compression import split_data_url
+    from latex.converter import tex_to_img_converter
+
+    results = []
+    for category in categories or CATEGORIES:
+        sources = get_category_sources(category)
+        for compiler, image_format in get_combinations(category):
+            timer = StageTimer()
+            durations = []
+            sizes = []
+            errors = []
+            wall_start = perf_counter()
+            for i in range(iterations):
+                _filename, tex_source = sources[i % len(sources)]
+                start = perf_counter()
+                try:
+                    with timer.record():
+                        data_url = tex_to_img_converter(
+                            compiler, tex_source, image_format,
+                            tex_key="bench_%s_%d" % (category, i),
+                        ).get_converted_data_url()
+                except Exception as e:
+                    errors.append("%s: %s" % (type(e).__name__, str(e)))
+                    continue
+                durations.append(perf_counter() - start)
+                sizes.append(len(split_data_url(data_url)[1]))
+
+            result = {
+                "suite": "convert",
+                "name": "convert",
+                "category": category,
+                "compiler": compiler,
+                "image_format": image_format,
+            }
+            result.update(summarize(
+                durations, perf_counter() - wall_start, len(errors)))
+            result["mean_bytes"] = (
+                round(sum(sizes) / len(sizes)) if sizes else None)
+            result["stages"] = timer.summarize()
+            if errors:
+                result["first_error"] = errors[0][:500]
+            results.append(result)
+    return results
+
+# }}}
+
+
+# {{{ optimizer benchmarks
+
+# The optimizer options benchmarked for each image format
+OPTIMIZER_OPTIONS = {
+    "png": [
+        {"filter_strategy": "none", "max_colors": 0},
+        {"filter_strategy": "none"},
+        {"filter_strategy": "adaptive"},
+        {"filter_strategy": "search"},
+    ],
+    "svg": [
+        {"precision": None, "dedup": False},
+        {"precision": 3, "dedup": False},
+        {"precision": 3},
+        {"precision": 2},
+        {"precision": 1},
+    ],
+}
+
+
+def _format_options(options):
+    return ",".join(
+        "%s=%s" % (key, value) for key, value in sorted(options.items()))
+
+
+def _get_converted_images(category, image_format):
+    """
+    :return: a list of (compiler, the bytes of the images of the sources of
+        the category converted by compiler), not optimized. Images converted
+        to another format, e.g., TikZ pictures converted to svg by latex
+        for png, are left out.
+    """
+    from django.test.utils import override_settings
+
+    from latex.compression import split_data_url
+    from latex.constants import IMAGE_FORMAT_MIME_TYPES
+    from latex.converter import tex_to_img_converter
+
+    images = []
+    with override_settings(L2I_IMAGE_OPTIMIZERS={}):
+        for compiler, _format in get_combinations(category):
+            if _format != image_format:
+                continue
+            for i, (_filename, tex_source) in enumerate(
+                    get_category_sources(category)):
+                data_url = tex_to_img_converter(
+                    compiler, tex_source, image_format,
+                    tex_key="bench_optimize_%s_%d" % (category, i),
+                ).get_converted_data_url()
+                mime_type, data = split_data_url(data_url)
+                if mime_type != IMAGE_FORMAT_MIME_TYPES[image_format]:
+                    continue
+                images.append((compiler, data))
+    return images
+
+
+def run_optimize_benchmarks(iterations, categories=None):
+    """
+    Benchmark the size reduction versus the CPU cost of the image optimizers
+    (see :mod:`latex.optimizers`) with each of :data:`OPTIMIZER_OPTIONS`,
+    on the images converted from the corpus.
+    """
+    from latex.optimizers import make_image_optimizer
+
+    results = []
+    for category in categories or CATEGORIES:
+        for image_format, options_list in sorted(OPTIMIZER_OPTIONS.items()):
+            images = _get_converted_images(category, image_format)
+            if not images:
+                continue
+            for options in options_list:
+                try:
+                    optimizer = make_image_optimizer(image_format, options)
+                except ValueError:
+                    # e.g., an optional dependency is not installed
+                    continue
+                durations = []
+                errors = 0
+                bytes_before = bytes_after = 0
+                wall_start = perf_counter()
+                for i in range(iterations):
+                    _compiler, data = images[i % len(images)]
+                    start = perf_counter()
+                    try:
+                        optimized = optimizer.optimize(data)
+                    except Exception:
+                        errors += 1
+                        continue
+                    durations.append(perf_counter() - start)
+                    bytes_before += len(data)
+                    bytes_after += min(len(optimized), len(data))
+
+                result = {
+                    "suite": "optimize",
+                    "name": "optimize[%s]" % _format_options(options),
+                    "category": category,
+                    "image_format": image_format,
+                    "bytes_before": bytes_before,
+                    "bytes_after": bytes_after,
+                    "size_ratio": (
+                        round(bytes_after / bytes_before, 4)
+                        if bytes_before else None),
+                }
+                result.update(summarize(
+                    durations, perf_counter() - wall_start, errors))
+                results.append(result)
+    return results
+
+# }}}
+
+
+# {{{ api and model benchmarks
+
+class TestDatabase(object):
+    """
+    Context manager creating the test database and a temporary storage,
+    in the same way the test runner does.
+
+    :param sqlite_file: if the database is SQLite, create the test database
+        in this file instead of in memory, so that it can be shared by the
+        threads of a server.
+    """
+
+    def __init__(self, sqlite_file=None):
+        self.sqlite_file = sqlite_file
+
+    def __enter__(self):
+        from django.db import connection
+        from django.test.utils import override_settings, setup_test_environment
+
+        setup_test_environment()
+        self.old_db_name = connection.settings_dict["NAME"]
+        if self.sqlite_file and connection.vendor == "sqlite":
+            connection.settings_dict.setdefault("TEST", {})["NAME"] = (
+                self.sqlite_file)
+        connection.creation.create_test_db(verbosity=0, autoclobber=True)
+
+        self.media_root = tempfile.mkdtemp(prefix="l2i_bench_")
+        self.settings_override = override_settings(MEDIA_ROOT=self.media_root)
+        self.settings_override.enable()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        from django.db import connection
+        from django.test.utils import teardown_test_environment
+
+        self.settings_override.disable()
+        shutil.rmtree(self.media_root, ignore_errors=True)
+        connection.creation.destroy_test_db(self.old_db_name, verbosity=0)
+        teardown_test_environment()
+
+
+def _timed_requests(request_func, iterations):
+    timer = StageTimer()
+    durations = []
+    errors = 0
+    wall_start = perf_counter()
+    for i in range(iterations):
+        start = perf_counter()
+        with timer.record():
+            resp = request_func(i)
+        elapsed = perf_counter() - start
+        if resp.status_code >= 400:
+            errors += 1
+        else:
+            durations.append(elapsed)
+    summary = summarize(durations, perf_counter() - wall_start, errors)
+    summary["stages"] = timer.summarize()
+    return summary
+
+
+def _get_user():
+    from django.contrib.auth import get_user_model
+    user, _ = get_user_model().objects.get_or_create(username="l2i_bench")
+    return user
+
+
+def run_api_benchmarks(iterations):
+    import django.core.cache as cache
+    from django.urls import reverse
+    from rest_framework.test import APIClient
+
+    client = APIClient()
+    client.force_authenticate(user=_get_user())
+    _filename, tex_source = get_category_sources("inline_math")[0]
+
+    results = []
+
+    def add_result(name, summary, **kwargs):
+        result = {"suite": "api", "name": name}
+        result.update(kwargs)
+        result.update(summary)
+        results.append(result)
+
+    for compiler, image_format in get_combinations("inline_math"):
+        prefix = "bench_api_%s_%s" % (compiler, image_format)
+
+        def post_create(i):
+            return client.post(reverse("create"), data={
+                "compiler": compiler,
+                "image_format": image_format,
+                "tex_source": tex_source,
+                "tex_key": "%s_%d" % (prefix, i),
+                "fields": "image",
+            }, format="json")
+
+        add_result("api.create.uncached", _timed_requests(
+            post_create, iterations),
+            compiler=compiler, image_format=image_format)
+
+        add_result("api.create.cached", _timed_requests(
+            post_create, iterations),
+            compiler=compiler, image_format=image_format)
+
+    # Requests below don't depend on the compiler and format
+    prefix = "bench_api_xelatex_svg"
+    add_result("api.detail.cached", _timed_requests(
+        lambda i: client.get(
+            reverse("detail", args=("%s_%d" % (prefix, i),)),
+            {"fields": "image"}),
+        iterations))
+
+    cache.caches["default"].clear()
+    add_result("api.detail.uncached", _timed_requests(
+        lambda i: client.get(
+            reverse("detail", args=("%s_%d" % (prefix, i),)),
+            {"fields": "image"}),
+        iterations))
+
+    add_result("api.list", _timed_requests(
+        lambda i: client.get(reverse("list")), iterations))
+
+    return results
+
+
+def run_model_benchmarks(iterations):
+    from benchmarks.stub_bin import make_png
+
+    from latex.models import LatexImage
+    from latex.utils import get_data_url_from_buf_and_mimetype
+
+    user = _get_user()
+    data_url = get_data_url_from_buf_and_mimetype(
+        make_png(400, 40), "image/png")
+
+    timer = StageTimer()
+    durations = []
+    wall_start = perf_counter()
+    for i in range(iterations):
+        instance = LatexImage(
+            tex_key="bench_model_%d" % i, data_url=data_url, creator=user)
+        start = perf_counter()
+        with timer.record():
+            instance.save()
+        durations.append(perf_counter() - start)
+
+    result = {"suite": "model", "name": "model.save"}
+    result.update(summarize(durations, perf_counter() - wall_start))
+    result["stages"] = timer.summarize()
+    return [result]
+
+# }}}
+
+
+# vim: foldmethod=marker
@@ -0,0 +1,255 @@
+"""
+A fake TeX toolchain binary used by the benchmark suite.
+
+It is invoked as ``stub_bin.py <tool> [args...]`` by the wrapper scripts
+installed by :class:`benchmarks.stub_toolchain.StubToolchain`, sleeps for a
+simulated latency and writes plausible output files, so that the whole
+conversion pipeline can run without a TeX Live installation.
+
+The latency of each tool is ``base + per_kb * size_of_input_in_kb``
+seconds (see ``LATENCY``), multiplied by the ``L2I_STUB_LATENCY_SCALE``
+environment variable (default 1.0). The latency of a single tool can be
+overridden with ``L2I_STUB_<TOOL>_LATENCY`` (e.g.
+``L2I_STUB_XELATEX_LATENCY=0.8``).
+
+This module must not depend on Django, as it runs in a bare interpreter.
+"""
+
+import os
+import re
+import struct
+import sys
+import time
+import zlib
+
+# tool name: (base seconds, seconds per KB of input)
+LATENCY = {
+    "latex": (0.15, 0.02),
+    "pdflatex": (0.2, 0.02),
+    "xelatex": (0.5, 0.03),
+    "lualatex": (0.6, 0.03),
+    "latexmk": (0.02, 0.0),
+    "dvipng": (0.03, 0.005),
+    "dvisvgm": (0.05, 0.01),
+    "pdf2svg": (0.04, 0.01),
+    "pdfcrop": (0.1, 0.0),
+    "imagemagick": (0.08, 0.01),
+}
+
+VERSIONS = {
+    "latexmk": "Latexmk, John Collins, 26 Dec. 2019. Version 4.67",
+    "latex": "pdfTeX 3.14159265-2.6-1.40.21 (TeX Live 2020)",
+    "pdflatex": "pdfTeX 3.14159265-2.6-1.40.21 (TeX Live 2020)",
+    "xelatex": "XeTeX 3.14159265-2.6-0.999992 (TeX Live 2020)",
+    "lualatex": "This is LuaHBTeX, Version 1.12.0 (TeX Live 2020)",
+    "dvipng": "dvipng (TeX Live) 1.15",
+    "dvisvgm": "dvisvgm 2.9.1",
+    "convert": "Version: ImageMagick 6.9.10-23 Q16 x86_64",
+}
+
+# Sources containing this marker fail to compile, with a TeX-like log.
+COMPILE_ERROR_MARKER = r"\L2IStubError"
+
+PAGES_RE = re.compile(rb"%%Pages: (\d+)")
+
+
+def simulate_latency(tool, input_size=0):
+    base, per_kb = LATENCY.get(tool, (0., 0.))
+    latency = os.environ.get("L2I_STUB_%s_LATENCY" % tool.upper())
+    seconds = (float(latency) if latency is not None
+               else base + per_kb * input_size / 1024)
+    seconds *= float(os.environ.get("L2I_STUB_LATENCY_SCALE", 1))
+    if seconds > 0:
+        time.sleep(seconds)
+
+
+def _read(path):
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def _write(path, content):
+    with open(path, "wb") as f:
+        f.write(content)
+
+
+def get_n_pages(compiled):
+    m = PAGES_RE.search(compiled)
+    return int(m.group(1)) if m else 1
+
+
+def make_png(width, height):
+    """A valid grayscale PNG with a diagonal stroke, sized like a formula."""
+    rows = []
+    for y in range(height):
+        row = bytearray(b"\xff" * width)
+        x = y * width // max(height, 1)
+        row[x:x + 2] = b"\x00\x00"
+        rows.append(b"\x00" + bytes(row))
+
+    def chunk(kind, data):
+        return (struct.pack(">I", len(data)) + kind + data
+                + struct.pack(">I", zlib.crc32(kind + data) & 0xffffffff))
+
+    return b"".join([
+        b"\x89PNG\r\n\x1a\n",
+        chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 0, 0, 0, 0)),
+        chunk(b"IDAT", zlib.compress(b"".join(rows), 9)),
+        chunk(b"IEND", b""),
+    ])
+
+
+def get_png_size(compiled):
+    # Roughly one pixel column per 2 bytes of source
+    return max(16, min(len(compiled) // 2, 2000)), 40
+
+
+def make_svg(compiled):
+    # Like dvisvgm, the glyphs are paths defined once per font (thus the
+    # same glyph possibly more than once), with 6 decimals, and placed by
+    # <use> elements
+    n_glyphs = max(1, len(compiled) // 40)
+    paths = "\n".join(
+        "<path id='g%(font)d-%(glyph)d' d='M%(x).6f %(y).6f "
+        "L%(x2).6f %(y).6f'/>"
+        % {"font": i % 2, "glyph": i // 2, "x": i // 2 * 1.123456,
+           "y": i // 2 * 0.5, "x2": i // 2 * 1.123456 + 3.14159}
+        for i in range(n_glyphs))
+    uses = "\n".join(
+        "<use x='%.6f' y='0' xlink:href='#g%d-%d'/>"
+        % (i * 5.123456, i % 2, i // 2)
+        for i in range(n_glyphs))
+    return (
+        "<?xml version='1.0' encoding='UTF-8'?>\n"
+        "<svg version='1.1' xmlns='http://www.w3.org/2000/svg' "
+        "xmlns:xlink='http://www.w3.org/1999/xlink' "
+        "width='%(w)dpt' height='20pt'>\n<defs>\n%(paths)s\n</defs>\n"
+        "<g id='page1'>\n%(uses)s\n</g>\n</svg>\n"
+        % {"w": n_glyphs, "paths": paths, "uses": uses}).encode()
+
+
+def latexmk(args):
+    simulate_latency("latexmk")
+    input_path = args[-1]
+    source = _read(input_path)
+
+    engine = "latex"
+    output_ext = ".dvi"
+    for arg in args[:-1]:
+        if arg == "-pdf":
+            output_ext = ".pdf"
+        m = re.match(r"-(?:pdf)?latex=(.+)", arg)
+        if m:
+            engine = os.path.basename(m.group(1)).lower()
+            engine = os.path.splitext(engine)[0].replace("-dev", "")
+
+    simulate_latency(engine, len(source))
+
+    base_path = os.path.splitext(input_path)[0]
+    if COMPILE_ERROR_MARKER.encode() in source:
+        _write(base_path + ".log", (
+            "This is a stub TeX engine\n"
+            "! Undefined control sequence.\n"
+            "l.1 %s\n"
+            "Here is how much of TeX's memory you used:\n"
+            % COMPILE_ERROR_MARKER).encode())
+        sys.stderr.write("Latexmk: Errors, so I did not complete making "
+                         "targets\n")
+        return 12
+
+    n_pages = source.count(rb"\newpage") + 1
+    _write(base_path + ".log", b"This is a stub TeX engine\n")
+    _write(base_path + output_ext,
+           b"%%STUB-" + output_ext[1:].upper().encode() + b"\n"
+           + b"%%Pages: " + str(n_pages).encode() + b"\n" + source)
+    return 0
+
+
+def dvipng(args):
+    output_path = args[args.index("-o") + 1]
+    compiled = _read(args[-1])
+    simulate_latency("dvipng", len(compiled))
+    _write(output_path, make_png(*get_png_size(compiled)))
+    return 0
+
+
+def dvisvgm(args):
+    output_path = args[args.index("-o") + 1]
+    compiled = _read(args[-1])
+    simulate_latency("dvisvgm", len(compiled))
+    _write(output_path, make_svg(compiled))
+    return 0
+
+
+def pdfcrop(args):
+    simulate_latency("pdfcrop")
+    input_path, output_path = args[0], args[1]
+    if input_path != output_path:
+        _write(output_path, _read(input_path))
+    return 0
+
+
+def pdf2svg(args):
+    input_path, output_path = args[0], args[1]
+    compiled = _read(input_path)
+    simulate_latency("pdf2svg", len(compiled))
+    _write(output_path, make_svg(compiled))
+    return 0
+
+
+# The white border around the formula on a rasterized page, which the trim
+# removes
+PAGE_BORDER = 4
+
+
+def imagemagick_convert(compiled_file_path, image_path, scale=None,
+                        trim=True):
+    """
+    Simulates Wand rasterizing a pdf: a multi-page pdf produces
+    ``<name>-<n>.png`` files, like ImageMagick does. The image is larger by
+    *scale* (rasterized at a higher resolution), and has the border of the
+    page unless *trim*.
+    """
+    compiled = _read(compiled_file_path)
+    simulate_latency("imagemagick", len(compiled))
+    width, height = get_png_size(compiled)
+    if not trim:
+        width += 2 * PAGE_BORDER
+        height += 2 * PAGE_BORDER
+    if scale is not None:
+        width = max(1, int(round(width * scale)))
+        height = max(1, int(round(height * scale)))
+    png = make_png(width, height)
+    n_pages = get_n_pages(compiled)
+    if n_pages == 1:
+        _write(image_path, png)
+    else:
+        base, ext = os.path.splitext(image_path)
+        for i in range(n_pages):
+            _write("%s-%d%s" % (base, i, ext), png)
+
+
+TOOLS = {
+    "latexmk": latexmk,
+    "dvipng": dvipng,
+    "dvisvgm": dvisvgm,
+    "pdfcrop": pdfcrop,
+    "pdf2svg": pdf2svg,
+}
+
+
+def main(argv):
+    tool, args = argv[0], argv[1:]
+    if args == ["--version"]:
+        print(VERSIONS.get(tool, "%s 1.0.0" % tool))
+        return 0
+
+    if tool not in TOOLS:
+        sys.stderr.write("stub %s does not run directly\n" % tool)
+        return 1
+
+    return TOOLS[tool](args)
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,84 @@
+"""
+Install the fake toolchain of :mod:`benchmarks.stub_bin` for the current
+process.
+"""
+
+import os
+import shutil
+import stat
+import sys
+import tempfile
+from unittest import mock
+
+from benchmarks import stub_bin
+
+STUB_BIN_PATH = os.path.abspath(stub_bin.__file__)
+
+STUB_COMMANDS = (
+    "latexmk", "latex", "pdflatex", "xelatex", "lualatex",
+    "dvipng", "dvisvgm", "pdf2svg", "pdfcrop", "convert")
+
+
+def _stub_imagemagick_convert(self, compiled_file_path, image_path,
+                              working_dir, scale=None, trim=True):
+    try:
+        stub_bin.imagemagick_convert(
+            compiled_file_path, image_path, scale=scale, trim=trim)
+    except Exception as e:
+        return False, "%s: %s" % (type(e).__name__, str(e))
+    return True, ""
+
+
+class StubToolchain(object):
+    """
+    Context manager which puts wrapper scripts of the stub binaries in
+    front of $PATH, and replaces the (in-process, Wand based) ImageMagick
+    conversion with a stub.
+
+    :param latency_scale: a multiplier of the simulated latencies, 0 means
+        no latency at all.
+    """
+
+    def __init__(self, latency_scale=1.):
+        self.latency_scale = latency_scale
+        self.bin_dir = None
+        self._env_patch = None
+        self._imagemagick_patch = None
+
+    def _write_wrappers(self):
+        for cmd in STUB_COMMANDS:
+            path = os.path.join(self.bin_dir, cmd)
+            with open(path, "w") as f:
+                f.write('#!/bin/sh\nexec "%s" "%s" %s "$@"\n'
+                        % (sys.executable, STUB_BIN_PATH, cmd))
+            os.chmod(path, os.stat(path).st_mode | stat.S_IEXEC)
+
+    def __enter__(self):
+        from latex.converter import ImageMagick, clear_toolchain_registry
+
+        self.bin_dir = tempfile.mkdtemp(prefix="l2i_stub_bin_")
+        self._write_wrappers()
+
+        self._env_patch = mock.patch.dict(os.environ, {
+            "PATH": os.pathsep.join([self.bin_dir, os.environ.get("PATH", "")]),
+            "L2I_STUB_LATENCY_SCALE": str(self.latency_scale),
+        })
+        self._env_patch.start()
+
+        # The rasterization only, the optimization and encoding stages
+        # (see latex.converter.PillowEncodedImageMagick) are run
+        self._imagemagick_patch = mock.patch.object(
+            ImageMagick, "_convert", _stub_imagemagick_convert)
+        self._imagemagick_patch.start()
+
+        # Binary paths are memoized, resolve them again against the stubs
+        clear_toolchain_registry()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        from latex.converter import clear_toolchain_registry
+
+        self._imagemagick_patch.stop()
+        self._env_patch.stop()
+        clear_toolchain_registry()
+        shutil.rmtree(self.bin_dir, ignore_errors=True)
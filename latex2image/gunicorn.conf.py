@@ -0,0 +1,9 @@
+# Loaded automatically by gunicorn from the working directory.
+
+
+def child_exit(server, worker):
+    # Drop the in-progress gauges of dead workers from the aggregated metrics
+    import os
+    if "PROMETHEUS_MULTIPROC_DIR" in os.environ:
+        from prometheus_client import multiprocess
+        multiprocess.mark_process_dead(worker.pid)
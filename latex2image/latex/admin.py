@@ -3,7 +3,7 @@ from django.contrib import admin
 from django.contrib.admin import SimpleListFilter
 from django.utils.translation import gettext_lazy as _
 
-from latex.models import LatexImage
+from latex.models import CreatorUsage, ImageBlob, LatexImage
 
 
 class LatexImageAdminForm(forms.ModelForm):
@@ -28,8 +28,8 @@ class HasCompileErrorFilter(SimpleListFilter):
 
 
 class LatexImageAdmin(admin.ModelAdmin):
-    _readonly_fields = ["data_url", "compile_error"]
-    readonly_fields = ["image_tag"]
+    _readonly_fields = ["compile_error", "blob"]
+    readonly_fields = ["image_tag", "data_url"]
     list_display = (
             "id",
             "tex_key",
@@ -56,3 +56,27 @@ class LatexImageAdmin(admin.ModelAdmin):
 
 
 admin.site.register(LatexImage, LatexImageAdmin)
+
+
+class CreatorUsageAdmin(admin.ModelAdmin):
+    list_display = ("creator", "n_objects", "n_bytes")
+    ordering = ("-n_bytes",)
+    readonly_fields = ("creator", "n_objects", "n_bytes")
+
+    def has_add_permission(self, request):
+        return False
+
+
+admin.site.register(CreatorUsage, CreatorUsageAdmin)
+
+
+class ImageBlobAdmin(admin.ModelAdmin):
+    list_display = ("digest", "ref_count", "size", "creation_time")
+    search_fields = ("digest",)
+    readonly_fields = ("digest", "image", "size", "ref_count", "creation_time")
+
+    def has_add_permission(self, request):
+        return False
+
+
+admin.site.register(ImageBlob, ImageBlobAdmin)
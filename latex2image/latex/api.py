@@ -22,23 +22,47 @@ OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
 THE SOFTWARE.
 """
 
+import os
 from copy import deepcopy
 
 from django.conf import settings
 from django.core.exceptions import ImproperlyConfigured
-from django.core.files.storage import default_storage
 from django.db import transaction
+from django.http import Http404, HttpResponse, HttpResponseBadRequest
+from django.urls import reverse
+from django.utils.cache import patch_vary_headers
 from django.utils.translation import gettext_lazy as _
+from django.views.decorators.http import require_safe
 from rest_framework import generics, permissions, status
 from rest_framework.exceptions import ValidationError
 from rest_framework.parsers import JSONParser
 from rest_framework.renderers import JSONRenderer
 from rest_framework.response import Response
 
-from latex.converter import LatexCompileError, tex_to_img_converter
-from latex.models import UPLOAD_TO, LatexImage
+from latex.archive import archive_conversion, is_source_archive_enabled
+from latex.compression import (COMPRESSED_EXTENSIONS, accepts_encoding,
+                               decompress, get_cache_value,
+                               get_cache_value_size, get_file_name_encoding,
+                               get_svg_compression, get_value_from_cache)
+from latex.converter import (ImageConvertError, LatexCompileError,
+                             tex_to_img_converter)
+from latex.metrics import (CACHE_LOOKUPS, TEX_KEY_LOOKUPS,
+                           observe_storage_operation)
+from latex.models import (LatexImage, get_image_mime_type,
+                          get_image_path_candidates, get_image_storage)
+from latex.recolor import get_palette, recolor_image
 from latex.serializers import (LatexImageCreateDataSerialzier,
                                LatexImageSerializer)
+from latex.srcset import get_scaled_image_names, get_srcset, save_scaled_images
+from latex.storage_manifest import image_file_exists
+from latex.timing import span
+from latex.variants import (get_compiler_formats, get_source_compiler,
+                            get_variant, get_variant_formats,
+                            negotiate_image_formats)
+from latex.write_behind import (PENDING_RESULT_FIELDS, can_write_behind,
+                                commit_record, enqueue,
+                                get_instance_from_record, get_pending_record,
+                                is_write_behind_enabled, make_record)
 
 
 class L2IRenderer(JSONRenderer):
@@ -78,20 +102,30 @@ def get_cached_attribute_by_tex_key(tex_key, attr, request):
 
         if ret_value is not None:
             # print("Got value in cache!")
-            result_dict[attr] = ret_value
+            CACHE_LOOKUPS.labels(field=attr, result="hit").inc()
+            result_dict[attr] = get_value_from_cache(ret_value)
             return result_dict
 
         compile_error_cache_key = get_field_cache_key(tex_key, "compile_error")
         cached_compile_error = def_cache.get(compile_error_cache_key)
         if cached_compile_error is not None:
+            CACHE_LOOKUPS.labels(field=attr, result="hit").inc()
             return {"compile_error": cached_compile_error}
 
+        CACHE_LOOKUPS.labels(field=attr, result="miss").inc()
+
     # Check db if it exists
     objs = LatexImage.objects.filter(tex_key=tex_key)
-    if not objs.count():
-        return None if request.method == "POST" else {}
-
-    obj = objs[0]
+    if objs.count():
+        obj = objs[0]
+    else:
+        # The result may be queued but not committed yet
+        record = None
+        if attr in PENDING_RESULT_FIELDS and is_write_behind_enabled():
+            record = get_pending_record(tex_key)
+        if record is None:
+            return None if request.method == "POST" else {}
+        obj = get_instance_from_record(record)
 
     serializer = LatexImageSerializer(obj, fields=attr, context={"request": request})
 
@@ -113,15 +147,58 @@ def get_cached_attribute_by_tex_key(tex_key, attr, request):
     assert isinstance(ret_value, str)
 
     # Ignore attribute value with size (byte) over L2I_CACHE_MAX_BYTES
-    if (cache_key is not None
-            and len(ret_value) <= getattr(settings, "L2I_CACHE_MAX_BYTES", 0)):
-        def_cache.add(cache_key, ret_value, None)
+    if cache_key is not None:
+        cache_value = get_cache_value(attr, ret_value)
+        if (get_cache_value_size(cache_value)
+                <= getattr(settings, "L2I_CACHE_MAX_BYTES", 0)):
+            def_cache.add(cache_key, cache_value, None)
 
     result_dict[attr] = ret_value
     return result_dict
 
 
+def get_srcset_by_tex_key(instance, scales, converter, request):
+    """
+    :return: the ``srcset`` of the image of *instance* at *scales*, of which
+        the missing images are rasterized by *converter*, see
+        :func:`latex.srcset.get_scaled_image_names`.
+    """
+    try:
+        import django.core.cache as cache
+
+        def_cache = cache.caches["default"]
+        cache_key = get_field_cache_key(instance.tex_key, "scaled_images")
+    except ImproperlyConfigured:
+        cache_key = None
+
+    names = {}
+    if cache_key is not None:
+        names = def_cache.get(cache_key) or {}
+        CACHE_LOOKUPS.labels(
+            field="scaled_images",
+            result="hit" if set(scales) - {1} <= set(names) else "miss").inc()
+
+    missing = [scale for scale in scales if scale != 1 and scale not in names]
+    if missing:
+        names.update(get_scaled_image_names(instance, missing, converter))
+        if cache_key is not None:
+            def_cache.set(cache_key, names, None)
+
+    names = {scale: names[scale] for scale in scales if scale != 1}
+    if 1 in scales:
+        names[1] = instance.image.name
+    return get_srcset(names, request)
+
+
 class CreateMixin:
+    def get_result_data(self, instance, fields, converter, scales):
+        data = self.get_serializer(instance, fields=fields).data
+        if scales and instance.image:
+            with span("srcset"):
+                data["srcset"] = get_srcset_by_tex_key(
+                    instance, scales, converter, self.request)
+        return data
+
     def create(self, request, *args, **kwargs):
         req_params = JSONParser().parse(request)
         req_params_copy = deepcopy(req_params)
@@ -138,11 +215,15 @@ class CreateMixin:
 
         fields = data.get("fields")
         tex_key = data.get("tex_key")
+        scales = data.get("scales")
 
-        if fields and len(fields) == 1 and tex_key is not None:
+        if (fields and len(fields) == 1 and tex_key is not None
+                and not scales):
             # Try to get cached result
-            cached_result = (
-                get_cached_attribute_by_tex_key(tex_key, fields[0], request))
+            with span("cache_lookup"):
+                cached_result = (
+                    get_cached_attribute_by_tex_key(
+                        tex_key, fields[0], request))
             if cached_result:
                 return Response(cached_result, status=status.HTTP_200_OK)
             else:
@@ -175,30 +256,87 @@ class CreateMixin:
                 {"error": f"{type(e).__name__}: {str(e)}"},
                 status=status.HTTP_400_BAD_REQUEST)
 
-        qs = LatexImage.objects.filter(tex_key=_converter.tex_key)
-        instance = None
-
-        if qs.count():
-            instance = qs[0]
-        else:
+        if tex_key is None and is_source_archive_enabled():
+            # Only generated keys change with L2I_KEY_VERSION, see
+            # latex.archive.RerenderPipeline
+            with span("archive"):
+                archive_conversion(
+                    _converter.tex_source, data["compiler"], image_format,
+                    self.request.user)
+
+        with span("db_lookup"):
+            qs = LatexImage.objects.filter(tex_key=_converter.tex_key)
+            instance = None
+
+            if qs.count():
+                instance = qs[0]
+                TEX_KEY_LOOKUPS.labels(result="hit").inc()
+
+            elif (_converter.legacy_tex_key is not None
+                  and getattr(settings, "L2I_LEGACY_KEY_LOOKUP", True)):
+                # Results created before source canonicalization was enabled
+                instance = LatexImage.objects.filter(
+                    tex_key=_converter.legacy_tex_key).first()
+                if instance is not None:
+                    TEX_KEY_LOOKUPS.labels(result="legacy_hit").inc()
+
+            if instance is None:
+                TEX_KEY_LOOKUPS.labels(result="miss").inc()
+
+        write_behind = is_write_behind_enabled()
+        if instance is None and write_behind:
+            record = get_pending_record(_converter.tex_key)
+            if record is not None:
+                if can_write_behind(fields) and not scales:
+                    return Response(
+                        self.get_serializer(
+                            get_instance_from_record(record), fields=fields).data,
+                        status=status.HTTP_200_OK)
+                # The id or image are requested, which only exist once saved
+                with span("save"):
+                    instance = commit_record(record)
+
+        if instance is None:
             if use_storage_file_if_exists:
                 # Set Django's FileField to an existing file
                 # https://stackoverflow.com/a/10906037/3437454
-                _path = "/".join(
-                    [UPLOAD_TO, ".".join([_converter.tex_key, image_format])])
-                if default_storage.exists(_path):
-                    with transaction.atomic():
-                        instance = LatexImage(
-                            tex_key=_converter.tex_key,
-                            creator=self.request.user
-                        )
-                        instance.image = _path
-                        instance.save()
+                # The image may be stored in either the sharded or the
+                # flat layout (before the storage was sharded).
+                # With L2I_SVG_COMPRESSION, SVG images are stored
+                # compressed, or uncompressed before it was enabled.
+                file_names = [".".join([_converter.tex_key, image_format])]
+                svg_compression = get_svg_compression()
+                if image_format == "svg" and svg_compression is not None:
+                    file_names.insert(0, _converter.tex_key
+                                      + COMPRESSED_EXTENSIONS[svg_compression])
+                paths = []
+                for file_name in file_names:
+                    paths.extend(get_image_path_candidates(file_name))
+
+                for _path in paths:
+                    with span("storage_exists"), \
+                            observe_storage_operation("exists"):
+                        storage_file_exists = image_file_exists(
+                            get_image_storage(), _path)
+                    if storage_file_exists:
+                        with span("save"), transaction.atomic():
+                            instance = LatexImage(
+                                tex_key=_converter.tex_key,
+                                creator=self.request.user
+                            )
+                            instance.image = _path
+                            instance.save()
+                        break
 
         if instance:
-            image_serializer = self.get_serializer(instance, fields=fields)
-            return Response(
-                image_serializer.data, status=status.HTTP_200_OK)
+            try:
+                data = self.get_result_data(
+                    instance, fields, _converter, scales)
+            except (ImageConvertError, LatexCompileError) as e:
+                return Response(
+                    {"error": f"{type(e).__name__}: {str(e)}"},
+                    status=status.HTTP_400_BAD_REQUEST)
+            return Response(data, status=status.HTTP_200_OK)
 
         try:
             data_url = _converter.get_converted_data_url()
@@ -214,17 +352,34 @@ class CreateMixin:
         data = {"tex_key": _converter.tex_key}
         if data_url is not None:
             data["data_url"] = data_url
+            data.update(_converter.metadata)
         else:
             data["compile_error"] = error
 
         data["creator"] = self.request.user.pk
 
+        if write_behind and can_write_behind(fields) and not scales:
+            # Return at once, the result is saved by a background worker
+            record = make_record(
+                _converter.tex_key, self.request.user.pk,
+                data_url=data_url, compile_error=error,
+                metadata=_converter.metadata)
+            with span("enqueue"):
+                enqueue(record)
+            return Response(
+                self.get_serializer(
+                    get_instance_from_record(record), fields=fields).data,
+                status=status.HTTP_201_CREATED)
+
         image_serializer = self.get_serializer(data=data)
 
         if image_serializer.is_valid():
-            instance = image_serializer.save()
+            with span("save"):
+                instance = image_serializer.save()
+                if _converter.scaled_images:
+                    save_scaled_images(instance, _converter.scaled_images)
             return Response(
-                self.get_serializer(instance, fields=fields).data,
+                self.get_result_data(instance, fields, _converter, scales),
                 status=status.HTTP_201_CREATED)
         return Response(
             # For example, tex_key already exists.
@@ -284,5 +439,137 @@ class LatexImageList(
 
     def get_queryset(self):
         if not self.request.user.is_superuser:
-            return LatexImage.objects.filter(creator=self.request.user)
-        return LatexImage.objects.all()
+            queryset = LatexImage.objects.filter(creator=self.request.user)
+        else:
+            queryset = LatexImage.objects.all()
+
+        fields = self.request.GET.getlist('fields')
+        if not fields or "data_url" in fields[0].split(","):
+            # In one query, instead of one per result
+            queryset = queryset.prefetch_related("data_url_blob")
+        return queryset
+
+
+def read_image_file(instance):
+    name = instance.image.name
+    try:
+        with span("storage_read"), observe_storage_operation("open"):
+            with instance.image.storage.open(name) as f:
+                return f.read()
+    except FileNotFoundError:
+        raise Http404()
+
+
+def get_recolored_image(instance, palette):
+    """
+    :return: the (uncompressed) image of *instance* recolored by
+        *palette*, cached by (tex_key, palette).
+    :raises ValueError: if the image can't be recolored.
+    """
+    try:
+        import django.core.cache as cache
+
+        def_cache = cache.caches["default"]
+        # The creation time tells apart a result deleted then created again
+        cache_key = get_field_cache_key(instance.tex_key, "recolored:%s:%s" % (
+            palette.key, instance.creation_time.timestamp()))
+    except ImproperlyConfigured:
+        cache_key = None
+
+    if cache_key is not None:
+        content = def_cache.get(cache_key)
+        CACHE_LOOKUPS.labels(
+            field="recolored",
+            result="miss" if content is None else "hit").inc()
+        if content is not None:
+            return content
+
+    name = instance.image.name
+    content = read_image_file(instance)
+    encoding = get_file_name_encoding(name)
+    if encoding is not None:
+        content = decompress(content, encoding)
+        image_format = "svg"
+    else:
+        image_format = os.path.splitext(name)[1][1:].lower()
+    with span("recolor"):
+        content = recolor_image(content, image_format, palette)
+
+    if (cache_key is not None
+            and len(content) <= getattr(settings, "L2I_CACHE_MAX_BYTES", 0)):
+        def_cache.add(cache_key, content, None)
+    return content
+
+
+@require_safe
+def image_file(request, tex_key):
+    """
+    The image file of *tex_key*. An image stored compressed (see
+    settings.L2I_SVG_COMPRESSION) is sent as is, with its
+    ``Content-Encoding``, to clients accepting the encoding, and
+    decompressed for the others.
+
+    With settings.L2I_VARIANT_FORMATS, *tex_key* may also be the key of a
+    source (a generated tex_key without the image format), of which the
+    image is sent in the format negotiated on the ``Accept`` header. As
+    this view is not authenticated, only those formats are converted, each
+    at most once per source.
+
+    With a ``palette`` query parameter, the name of a palette of
+    settings.L2I_PALETTES (see :func:`latex.recolor.get_palette`), the image
+    is sent recolored, e.g., for a dark theme.
+    """
+    palette = None
+    if request.GET.get("palette"):
+        try:
+            palette = get_palette(request.GET["palette"])
+        except ValueError as e:
+            return HttpResponseBadRequest(str(e))
+
+    instance = LatexImage.objects.filter(tex_key=tex_key).only(
+        "tex_key", "image", "creation_time").first()
+    negotiated = False
+    if instance is None:
+        variant_formats = get_variant_formats()
+        compiler = get_source_compiler(tex_key)
+        if variant_formats and compiler is not None:
+            image_formats = negotiate_image_formats(
+                request.META.get("HTTP_ACCEPT"),
+                [image_format for image_format in variant_formats
+                 if image_format in get_compiler_formats(compiler)])
+            if not image_formats:
+                response = HttpResponse(status=406)
+                patch_vary_headers(response, ["Accept"])
+                return response
+            with span("variant"):
+                instance = get_variant(tex_key, image_formats)
+            negotiated = True
+
+    if instance is None or not instance.image:
+        raise Http404()
+
+    name = instance.image.name
+    response = HttpResponse(content_type=get_image_mime_type(name))
+    if palette is not None:
+        try:
+            content = get_recolored_image(instance, palette)
+        except ValueError as e:
+            return HttpResponseBadRequest(str(e))
+    else:
+        content = read_image_file(instance)
+        encoding = get_file_name_encoding(name)
+        if encoding is not None:
+            if accepts_encoding(request, encoding):
+                response["Content-Encoding"] = encoding
+            else:
+                content = decompress(content, encoding)
+            patch_vary_headers(response, ["Accept-Encoding"])
+    if negotiated:
+        # Each variant cached apart by CDNs
+        patch_vary_headers(response, ["Accept"])
+        location = reverse("image", kwargs={"tex_key": instance.tex_key})
+        if palette is not None:
+            location = "%s?%s" % (location, request.GET.urlencode())
+        response["Content-Location"] = location
+    response.content = content
+    return response
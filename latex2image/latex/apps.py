@@ -6,8 +6,20 @@ class Latex2ImageConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
 
     def ready(self):
+        import mimetypes
+
         import latex.receivers  # noqa
         from latex.checks import register_startup_checks
+        from latex.compression import ZSTD
+        from latex.constants import IMAGE_FORMAT_MIME_TYPES
+
+        for image_format, mime_type in IMAGE_FORMAT_MIME_TYPES.items():
+            mimetypes.add_type(mime_type, ".%s" % image_format)
+
+        # So that compressed images are guessed as svg with their encoding
+        # (".svgz" already is), e.g., by storages setting the Content-Type
+        # and Content-Encoding of the files they save
+        mimetypes.encodings_map.setdefault(".zst", ZSTD)
 
         # register checks
         register_startup_checks()
@@ -0,0 +1,315 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import division
+
+__copyright__ = "Copyright (C) 2020 Dong Zhuang"
+
+__license__ = """
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+"""
+
+import json
+import threading
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from hashlib import sha256
+from time import perf_counter, sleep
+from typing import Any, Dict, List, Optional, Text, Tuple  # noqa
+
+from django.core.exceptions import ValidationError
+from django.db import IntegrityError
+
+from latex.converter import LatexCompileError, tex_to_img_converter
+from latex.models import ArchivedConversion, ArchivedTexSource, LatexImage
+from latex.utils import write_json_atomically
+
+# Rerender outcomes
+RENDERED = "rendered"
+COMPILE_ERROR = "compile_error"
+SKIPPED = "skipped"
+FAILED = "failed"
+
+
+def is_source_archive_enabled():
+    # type: () -> bool
+    from django.conf import settings
+    return getattr(settings, "L2I_SOURCE_ARCHIVE", False)
+
+
+def get_source_digest(tex_source):
+    # type: (Text) -> Text
+    return sha256(tex_source.encode("utf-8")).hexdigest()
+
+
+def archive_conversion(tex_source, compiler, image_format, creator):
+    # type: (Text, Text, Text, Any) -> ArchivedConversion
+    """
+    Archive the source of a conversion, the source is saved once whatever
+    the number of compilers and formats it is converted with.
+    """
+    source, _ = ArchivedTexSource.objects.get_or_create(
+        digest=get_source_digest(tex_source),
+        defaults={"data": zlib.compress(tex_source.encode("utf-8"), 9)})
+    conversion, _ = ArchivedConversion.objects.get_or_create(
+        source=source, compiler=compiler, image_format=image_format,
+        defaults={"creator": creator})
+    return conversion
+
+
+class RateLimiter(object):
+    """
+    Thread safe limiter of the rate of events, e.g., compilations.
+
+    :param rate: maximum number of events per second, None for no limit.
+    """
+
+    def __init__(self, rate=None):
+        # type: (Optional[float]) -> None
+        self.interval = 1 / rate if rate else 0
+        self._next = perf_counter()
+        self._lock = threading.Lock()
+
+    def wait(self):
+        # type: () -> None
+        if not self.interval:
+            return
+        with self._lock:
+            now = perf_counter()
+            start = max(now, self._next)
+            self._next = start + self.interval
+        if start > now:
+            sleep(start - now)
+
+
+class RerenderProgress(object):
+    def __init__(self, total):
+        # type: (int) -> None
+        self.total = total
+        self.counts = {
+            RENDERED: 0, COMPILE_ERROR: 0, SKIPPED: 0,
+            FAILED: 0}  # type: Dict[Text, int]
+        self.start = perf_counter()
+        self._lock = threading.Lock()
+
+    def add(self, outcome):
+        # type: (Text) -> None
+        with self._lock:
+            self.counts[outcome] += 1
+
+    @property
+    def done(self):
+        # type: () -> int
+        return sum(self.counts.values())
+
+    def as_dict(self):
+        # type: () -> Dict[Text, Any]
+        elapsed = perf_counter() - self.start
+        done = self.done
+        # Skipped items are cheap, they don't tell the rate of compiles
+        compiled = done - self.counts[SKIPPED]
+        rate = compiled / elapsed if elapsed > 0 else 0
+        remaining = self.total - done
+        result = {
+            "total": self.total,
+            "done": done,
+            "percent": round(100 * done / self.total, 1) if self.total else 100.,
+            "elapsed_s": round(elapsed, 1),
+            "rate_per_s": round(rate, 3),
+            "eta_s": round(remaining / rate, 1) if rate else None,
+        }
+        result.update(self.counts)
+        return result
+
+
+class RerenderPipeline(object):
+    """
+    Render the archived conversions under the tex_keys of *key_version*,
+    so that the results exist before settings.L2I_KEY_VERSION is switched
+    to it. Results which already exist are skipped.
+
+    Conversions are processed in batches, by *workers* threads, with at
+    most *rate* compilations per second. With a *state_file*, the last
+    finished batch and the conversions which failed are saved there, and
+    the next run with the same key version retries those, then resumes
+    after that batch.
+    """
+
+    def __init__(self, key_version, workers=1, rate=None, batch_size=100,
+                 state_file=None, progress_callback=None):
+        # type: (...) -> None
+        self.key_version = str(key_version)
+        self.workers = workers
+        self.rate_limiter = RateLimiter(rate)
+        self.batch_size = batch_size
+        self.state_file = state_file
+        self.progress_callback = progress_callback
+
+    # {{{ state
+
+    def load_state(self):
+        # type: () -> Tuple[int, List[int]]
+        """
+        :return: the pk after which the run resumes, and the pks of the
+            conversions which failed before it, retried first.
+        """
+        if not self.state_file:
+            return 0, []
+        try:
+            with open(self.state_file) as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            return 0, []
+        if not isinstance(state, dict):
+            return 0, []
+        if state.get("key_version") != self.key_version:
+            return 0, []
+        return state.get("last_pk", 0), state.get("failed_pks", [])
+
+    def save_state(self, last_pk, failed_pks):
+        # type: (int, List[int]) -> None
+        if self.state_file:
+            write_json_atomically(self.state_file, {
+                "key_version": self.key_version, "last_pk": last_pk,
+                "failed_pks": failed_pks})
+
+    # }}}
+
+    def get_converter(self, conversion):
+        return tex_to_img_converter(
+            conversion.compiler, conversion.source.tex_source,
+            conversion.image_format, key_version=self.key_version)
+
+    def render(self, conversion):
+        # type: (ArchivedConversion) -> Text
+        try:
+            converter = self.get_converter(conversion)
+        except Exception:
+            return FAILED
+
+        if LatexImage.objects.filter(tex_key=converter.tex_key).exists():
+            return SKIPPED
+
+        self.rate_limiter.wait()
+
+        instance = LatexImage(
+            tex_key=converter.tex_key, creator_id=conversion.creator_id)
+        try:
+            instance.data_url = converter.get_converted_data_url()
+            for field, value in converter.metadata.items():
+                setattr(instance, field, value)
+        except LatexCompileError as e:
+            instance.compile_error = "%s: %s" % (type(e).__name__, str(e))
+        except Exception:
+            # Not saved, retried by the next run
+            return FAILED
+
+        try:
+            instance.save()
+        except (IntegrityError, ValidationError):
+            # Created concurrently, e.g., by a request
+            if LatexImage.objects.filter(tex_key=converter.tex_key).exists():
+                return SKIPPED
+            return FAILED
+
+        return RENDERED if instance.compile_error is None else COMPILE_ERROR
+
+    def get_queryset(self):
+        return ArchivedConversion.objects.select_related("source").order_by("pk")
+
+    def get_status(self):
+        # type: () -> Dict[Text, int]
+        """
+        :return: the number of archived conversions and of those already
+            rendered under the key version, without rendering anything.
+        """
+        total = rendered = 0
+        for conversion in self.get_queryset().iterator(chunk_size=self.batch_size):
+            total += 1
+            try:
+                tex_key = self.get_converter(conversion).tex_key
+            except Exception:
+                continue
+            if LatexImage.objects.filter(tex_key=tex_key).exists():
+                rendered += 1
+        return {"total": total, "rendered": rendered, "missing": total - rendered}
+
+    def _process(self, progress, conversion):
+        # type: (RerenderProgress, ArchivedConversion) -> Text
+        outcome = self.render(conversion)
+        progress.add(outcome)
+        if self.progress_callback is not None:
+            self.progress_callback(progress)
+        return outcome
+
+    def _process_batch(self, executor, progress, batch):
+        # type: (Any, RerenderProgress, List[ArchivedConversion]) -> List[int]
+        """
+        :return: the pks of the conversions of *batch* which failed.
+        """
+        if executor is None:
+            outcomes = [
+                self._process(progress, conversion) for conversion in batch]
+        else:
+            outcomes = [
+                future.result() for future in [
+                    executor.submit(self._process, progress, conversion)
+                    for conversion in batch]]
+        return [conversion.pk
+                for conversion, outcome in zip(batch, outcomes)
+                if outcome == FAILED]
+
+    def run(self):
+        # type: () -> RerenderProgress
+        last_pk, retried_pks = self.load_state()
+        qs = self.get_queryset()
+        progress = RerenderProgress(
+            qs.filter(pk__in=retried_pks).count()
+            + qs.filter(pk__gt=last_pk).count())
+
+        executor = None
+        if self.workers > 1:
+            executor = ThreadPoolExecutor(max_workers=self.workers)
+
+        # Failed conversions don't hold the checkpoint back, they are saved
+        # with it and retried first by the next run
+        failed_pks = []  # type: List[int]
+        try:
+            while retried_pks:
+                batch = list(qs.filter(pk__in=retried_pks[:self.batch_size]))
+                retried_pks = retried_pks[self.batch_size:]
+                failed_pks.extend(
+                    self._process_batch(executor, progress, batch))
+                self.save_state(last_pk, failed_pks + retried_pks)
+
+            while True:
+                batch = list(qs.filter(pk__gt=last_pk)[:self.batch_size])
+                if not batch:
+                    break
+
+                failed_pks.extend(
+                    self._process_batch(executor, progress, batch))
+                last_pk = batch[-1].pk
+                self.save_state(last_pk, failed_pks)
+        finally:
+            if executor is not None:
+                executor.shutdown()
+
+        return progress
+
+# vim: foldmethod=marker
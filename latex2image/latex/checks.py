@@ -24,9 +24,49 @@ OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
 THE SOFTWARE.
 """
 
-from django.core.checks import register
+import json
+import os
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
 
-from latex.utils import CriticalCheckMessage, get_all_indirect_subclasses
+from django.core.checks import Warning, register
+
+from latex.utils import (CriticalCheckMessage, get_all_indirect_subclasses,
+                         write_json_atomically)
+
+BIN_CHECK_CACHE_FILE_NAME = "l2i_bin_check_cache.json"
+
+
+def get_bin_check_cache_file():
+    """
+    Path of the file persisting successful toolchain checks, configured by
+    settings.L2I_BIN_CHECK_CACHE_FILE. Setting it to None (or empty)
+    disables the cache.
+    """
+    from django.conf import settings
+    default = os.path.join(tempfile.gettempdir(), BIN_CHECK_CACHE_FILE_NAME)
+    return getattr(settings, "L2I_BIN_CHECK_CACHE_FILE", default)
+
+
+def _load_bin_check_cache(cache_file):
+    try:
+        with open(cache_file) as f:
+            cached = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    return cached if isinstance(cached, dict) else {}
+
+
+def _save_bin_check_cache(cache_file, cached):
+    # Concurrent manage.py runs never see a partially written cache.
+    try:
+        write_json_atomically(cache_file, cached)
+    except OSError:
+        pass
+
+
+def _get_command_check_id(cls):
+    return "%s.%s" % (cls.__module__, cls.__qualname__)
 
 
 def bin_check(app_configs, **kwargs):
@@ -34,14 +74,50 @@ def bin_check(app_configs, **kwargs):
     Check if all tex compiler and image converter
     are correctly configured, if latex utility is
     enabled.
+
+    Results of successful checks are persisted and reused as long as the
+    binary (path, mtime and size) and the version requirements are
+    unchanged. Remaining checks run their version probes in parallel.
     """
-    from latex.converter import CommandBase
+    from latex.converter import CommandBase, get_command_instance
 
     klass = get_all_indirect_subclasses(CommandBase)
-    instance_list = [cls() for cls in klass]
+
+    cache_file = get_bin_check_cache_file()
+    cached = _load_bin_check_cache(cache_file) if cache_file else {}
+
+    to_check = []
+    cache_keys = {}
+    for cls in klass:
+        instance = get_command_instance(cls)
+        check_id = _get_command_check_id(cls)
+        cache_key = instance.get_check_cache_key()
+        if cache_key is not None and cached.get(check_id) == cache_key:
+            continue
+        cache_keys[check_id] = cache_key
+        to_check.append((check_id, instance))
+
+    if not to_check:
+        return []
+
+    with ThreadPoolExecutor(max_workers=len(to_check)) as executor:
+        results = list(executor.map(
+            lambda item: (item[0], item[1].check()), to_check))
+
     errors = []
-    for instance in instance_list:
-        errors.extend(instance.check())
+    updated = False
+    for check_id, instance_errors in results:
+        if instance_errors:
+            errors.extend(instance_errors)
+            if cached.pop(check_id, None) is not None:
+                updated = True
+        elif cache_keys[check_id] is not None:
+            cached[check_id] = cache_keys[check_id]
+            updated = True
+
+    if cache_file and updated:
+        _save_bin_check_cache(cache_file, cached)
+
     return errors
 
 
@@ -70,6 +146,34 @@ def settings_check(app_configs, **kwargs):
                         "must be a positive int",
                     id="imagemagick_png_resolution.E001"))
 
+    trim_margin = getattr(settings, "L2I_TRIM_MARGIN", None)
+    if trim_margin is not None and not (
+            isinstance(trim_margin, int) and trim_margin >= 0):
+        errors.append(
+            CriticalCheckMessage(
+                msg="if set, settings.L2I_TRIM_MARGIN must be a "
+                    "non-negative int",
+                id="trim_margin.E001"))
+
+    for name in ["L2I_WEBP_QUALITY", "L2I_AVIF_QUALITY"]:
+        quality = getattr(settings, name, None)
+        if quality is not None and not (
+                isinstance(quality, int) and 0 <= quality <= 100):
+            errors.append(
+                CriticalCheckMessage(
+                    msg="if set, settings.%s must be an int in [0, 100]"
+                        % name,
+                    id="%s.E001" % name[4:].lower()))
+
+    # Not an error, as png and svg images are still converted
+    from latex.constants import UNAVAILABLE_IMAGE_FORMATS
+    for image_format in UNAVAILABLE_IMAGE_FORMATS:
+        errors.append(
+            Warning(
+                msg="Pillow is not built with %s support, the %s image "
+                    "format is not offered" % (image_format, image_format),
+                id="image_formats.W001"))
+
     use_existing_storage_image_to_create_instance = (
         getattr(settings,
                 "L2I_USE_EXISTING_STORAGE_IMAGE_TO_CREATE_INSTANCE",
@@ -82,6 +186,91 @@ def settings_check(app_configs, **kwargs):
                         "must be a bool value",
                     id="use_existing_storage_image_to_create_instance.E001"))
 
+    storage_manifest = getattr(settings, "L2I_STORAGE_MANIFEST", None)
+    if storage_manifest and storage_manifest != "redis":
+        from latex.models import get_image_storage
+        try:
+            get_image_storage().path("")
+        except NotImplementedError:
+            # e.g., S3, shared by all the nodes, while each node would keep
+            # its own SQLite manifest, unaware of the files of the others
+            errors.append(
+                CriticalCheckMessage(
+                    msg="settings.L2I_STORAGE_MANIFEST must be \"redis\" "
+                        "when the image storage is not on the local "
+                        "filesystem, as a SQLite manifest is local to "
+                        "the node",
+                    id="storage_manifest.E001"))
+
+    svg_compression = getattr(settings, "L2I_SVG_COMPRESSION", None)
+    if svg_compression:
+        from latex.compression import ENCODINGS, ZSTD, is_zstd_available
+        if svg_compression not in ENCODINGS:
+            errors.append(
+                CriticalCheckMessage(
+                    msg="if set, settings.L2I_SVG_COMPRESSION must be one of "
+                        "%s" % ", ".join(ENCODINGS),
+                    id="svg_compression.E001"))
+        elif svg_compression == ZSTD and not is_zstd_available():
+            errors.append(
+                CriticalCheckMessage(
+                    msg="settings.L2I_SVG_COMPRESSION is \"zstd\", which "
+                        "requires the zstandard package",
+                    id="svg_compression.E002"))
+
+    image_optimizers = getattr(settings, "L2I_IMAGE_OPTIMIZERS", None)
+    if image_optimizers:
+        from latex.optimizers import make_image_optimizer
+        if not isinstance(image_optimizers, dict):
+            errors.append(
+                CriticalCheckMessage(
+                    msg="if set, settings.L2I_IMAGE_OPTIMIZERS must be a dict",
+                    id="image_optimizers.E001"))
+        else:
+            for image_format, options in image_optimizers.items():
+                try:
+                    make_image_optimizer(image_format, options)
+                except ValueError as e:
+                    errors.append(
+                        CriticalCheckMessage(
+                            msg="settings.L2I_IMAGE_OPTIMIZERS['%s']: %s"
+                                % (image_format, str(e)),
+                            id="image_optimizers.E002"))
+
+    variant_formats = getattr(settings, "L2I_VARIANT_FORMATS", None)
+    if variant_formats:
+        from latex.constants import ALLOWED_LATEX2IMG_FORMAT
+        if (not isinstance(variant_formats, (list, tuple))
+                or not set(variant_formats) <= set(ALLOWED_LATEX2IMG_FORMAT)):
+            errors.append(
+                CriticalCheckMessage(
+                    msg="if set, settings.L2I_VARIANT_FORMATS must be a list "
+                        "of image formats among %s"
+                        % ", ".join(ALLOWED_LATEX2IMG_FORMAT),
+                    id="variant_formats.E001"))
+
+    palettes = getattr(settings, "L2I_PALETTES", None)
+    if palettes:
+        from latex.recolor import Palette, parse_color
+        if not isinstance(palettes, dict):
+            errors.append(
+                CriticalCheckMessage(
+                    msg="if set, settings.L2I_PALETTES must be a dict",
+                    id="palettes.E001"))
+        else:
+            for name, colors in palettes.items():
+                try:
+                    if not isinstance(colors, dict):
+                        raise ValueError("not a dict of colors")
+                    Palette([(parse_color(source), parse_color(target))
+                             for source, target in colors.items()])
+                except ValueError as e:
+                    errors.append(
+                        CriticalCheckMessage(
+                            msg="settings.L2I_PALETTES['%s']: %s"
+                                % (name, str(e)),
+                            id="palettes.E002"))
+
     return errors
 
 
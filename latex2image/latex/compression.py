@@ -0,0 +1,218 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import division
+
+__copyright__ = "Copyright (C) 2020 Dong Zhuang"
+
+__license__ = """
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+"""
+
+
+import gzip
+from binascii import a2b_base64
+from collections import namedtuple
+from typing import Any, Dict, Optional, Text, Tuple  # noqa
+
+from latex.utils import get_data_url_from_buf_and_mimetype
+
+SVG_MIME_TYPE = "image/svg+xml"
+
+GZIP = "gzip"
+ZSTD = "zstd"
+ENCODINGS = (GZIP, ZSTD)
+
+# Extensions of the compressed image files, replacing ".svg"
+COMPRESSED_EXTENSIONS = {GZIP: ".svgz", ZSTD: ".svg.zst"}
+
+# The (SVG) data_url of a result, compressed, as cached
+CompressedDataUrl = namedtuple(
+    "CompressedDataUrl", ["mime_type", "encoding", "data"])
+
+
+# {{{ settings
+
+def get_svg_compression():
+    # type: () -> Optional[Text]
+    """
+    :return: the encoding SVG images are stored with
+        (settings.L2I_SVG_COMPRESSION), or None if they are not compressed.
+    """
+    from django.conf import settings
+    return getattr(settings, "L2I_SVG_COMPRESSION", None) or None
+
+
+def is_zstd_available():
+    # type: () -> bool
+    try:
+        import zstandard  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+# }}}
+
+
+# {{{ compress and decompress
+
+def compress(data, encoding):
+    # type: (bytes, Text) -> bytes
+    if encoding == GZIP:
+        # mtime=0, so that the same content is always compressed to the
+        # same bytes, which are then not uploaded again (see
+        # latex.models.OverwriteStorage) and deduplicated
+        return gzip.compress(data, compresslevel=9, mtime=0)
+    if encoding == ZSTD:
+        import zstandard
+        return zstandard.ZstdCompressor(level=19).compress(data)
+    raise ValueError("Unknown encoding: '%s'" % encoding)
+
+
+def decompress(data, encoding):
+    # type: (bytes, Text) -> bytes
+    if encoding == GZIP:
+        return gzip.decompress(data)
+    if encoding == ZSTD:
+        import zstandard
+        return zstandard.ZstdDecompressor().decompress(data)
+    raise ValueError("Unknown encoding: '%s'" % encoding)
+
+
+def get_file_name_encoding(name):
+    # type: (Text) -> Optional[Text]
+    """
+    :return: the encoding of the image file *name* if it's compressed, else
+        None.
+    """
+    for encoding, ext in COMPRESSED_EXTENSIONS.items():
+        if name.endswith(ext):
+            return encoding
+    return None
+
+# }}}
+
+
+# {{{ data urls
+
+def split_data_url(data_url):
+    # type: (Text) -> Tuple[Text, bytes]
+    """
+    :return: the (mime type, content) of *data_url*.
+    """
+    return (data_url[5: data_url.index(";")],
+            a2b_base64(data_url[data_url.index("base64,") + 7:]))
+
+
+def get_data_url_compression(data_url):
+    # type: (Optional[Text]) -> Optional[Text]
+    """
+    :return: the encoding *data_url* is to be stored with, or None if it's
+        to be stored as is.
+    """
+    if not data_url or not data_url.startswith("data:%s;" % SVG_MIME_TYPE):
+        return None
+    return get_svg_compression()
+
+
+def compress_data_url(data_url, encoding):
+    # type: (Text, Text) -> CompressedDataUrl
+    mime_type, content = split_data_url(data_url)
+    return CompressedDataUrl(mime_type, encoding, compress(content, encoding))
+
+
+def decompress_data_url(compressed):
+    # type: (CompressedDataUrl) -> Text
+    return get_data_url_from_buf_and_mimetype(
+        buf=decompress(compressed.data, compressed.encoding),
+        mime_type=compressed.mime_type)
+
+# }}}
+
+
+# {{{ cache values
+
+def get_cache_value(attr, value):
+    # type: (Text, Any) -> Any
+    """
+    :return: *value* of the field *attr* as it is to be cached, i.e., a
+        :class:`CompressedDataUrl` for a data_url to be compressed.
+    """
+    if attr == "data_url" and isinstance(value, str):
+        encoding = get_data_url_compression(value)
+        if encoding is not None:
+            return compress_data_url(value, encoding)
+    return value
+
+
+def get_value_from_cache(value):
+    # type: (Any) -> Any
+    if isinstance(value, CompressedDataUrl):
+        return decompress_data_url(value)
+    return value
+
+
+def get_cache_value_size(value):
+    # type: (Any) -> int
+    """
+    :return: the size compared with settings.L2I_CACHE_MAX_BYTES.
+    """
+    if isinstance(value, CompressedDataUrl):
+        return len(value.data)
+    return len(str(value))
+
+# }}}
+
+
+# {{{ content negotiation
+
+def parse_quality_values(header):
+    # type: (Text) -> Dict[Text, float]
+    """
+    :return: the values listed in *header* (e.g., of ``Accept`` or
+        ``Accept-Encoding``), lowercased, mapped to their quality.
+    """
+    qualities = {}
+    for item in header.split(","):
+        value, _sep, params = item.strip().partition(";")
+        quality = 1.
+        for param in params.split(";"):
+            name, _sep, param_value = param.strip().partition("=")
+            if name == "q":
+                try:
+                    quality = float(param_value)
+                except ValueError:
+                    quality = 0.
+        if value:
+            qualities[value.strip().lower()] = quality
+    return qualities
+
+
+def accepts_encoding(request, encoding):
+    # type: (Any, Text) -> bool
+    """
+    :return: whether the ``Accept-Encoding`` header of *request* accepts
+        *encoding*, i.e., lists it (or ``*``) with a non-zero quality.
+    """
+    accepted = parse_quality_values(
+        request.META.get("HTTP_ACCEPT_ENCODING", ""))
+    return accepted.get(encoding, accepted.get("*", 0.)) > 0
+
+# }}}
+
+# vim: foldmethod=marker
@@ -1,12 +1,63 @@
+# The formats encoded by Pillow, which may be built without them: those it
+# can't encode are not offered
+PILLOW_IMAGE_FORMATS = ['webp', 'avif']
+
+
+def is_pillow_format_available(image_format):
+    # type: (str) -> bool
+    from PIL import features
+    try:
+        return bool(features.check_module(image_format))
+    except ValueError:
+        # Unknown to this version of Pillow
+        return False
+
+
+UNAVAILABLE_IMAGE_FORMATS = [
+    image_format for image_format in PILLOW_IMAGE_FORMATS
+    if not is_pillow_format_available(image_format)]
+
 ALLOWED_COMPILER = ['latex', 'pdflatex', 'xelatex', 'lualatex']
-ALLOWED_LATEX2IMG_FORMAT = ['png', 'svg']
-ALLOWED_COMPILER_FORMAT_COMBINATION = (
+ALLOWED_LATEX2IMG_FORMAT = [
+    image_format for image_format in ['png', 'svg', 'webp', 'avif']
+    if image_format not in UNAVAILABLE_IMAGE_FORMATS]
+# The formats rasterized, which can be requested at several scales (srcset)
+RASTER_IMAGE_FORMATS = [
+    image_format for image_format in ['png', 'webp', 'avif']
+    if image_format not in UNAVAILABLE_IMAGE_FORMATS]
+MIN_IMAGE_SCALE = 0.25
+MAX_IMAGE_SCALE = 4
+MAX_IMAGE_SCALES = 4
+
+# The dimensions in pt of a result compiled on a tight page, see
+# latex.utils.get_preview_metadata
+IMAGE_METADATA_FIELDS = ['width', 'height', 'depth']
+COMPILER_FORMAT_COMBINATIONS = (
     ("latex", "png"),
     ("latex", "svg"),
     ("lualatex", "png"),
     ("lualatex", "svg"),
+    ("lualatex", "webp"),
+    ("lualatex", "avif"),
     ("pdflatex", "png"),
     ("pdflatex", "svg"),
+    ("pdflatex", "webp"),
+    ("pdflatex", "avif"),
     ("xelatex", "png"),
     ("xelatex", "svg"),
+    ("xelatex", "webp"),
+    ("xelatex", "avif"),
 )
+ALLOWED_COMPILER_FORMAT_COMBINATION = tuple(
+    (compiler, image_format)
+    for compiler, image_format in COMPILER_FORMAT_COMBINATIONS
+    if image_format not in UNAVAILABLE_IMAGE_FORMATS)
+
+# Not all of them are known by the mimetypes module of older Pythons,
+# they are registered when the app is ready.
+IMAGE_FORMAT_MIME_TYPES = {
+    "png": "image/png",
+    "svg": "image/svg+xml",
+    "webp": "image/webp",
+    "avif": "image/avif",
+}
@@ -29,24 +29,32 @@ import os
 import re
 import shutil
 import sys
+from functools import lru_cache
 from hashlib import md5
 
 from django.core.management.base import CommandError
 from django.utils.encoding import DEFAULT_LOCALE_ENCODING
 from django.utils.translation import gettext as _
-from wand.image import Image as wand_image
 
 from latex.constants import (ALLOWED_COMPILER,
                              ALLOWED_COMPILER_FORMAT_COMBINATION,
                              ALLOWED_LATEX2IMG_FORMAT)
-from latex.utils import (CriticalCheckMessage, file_read, file_write,
+from latex.metrics import (COMPILE_DURATION, COMPILE_ERRORS,
+                           COMPILES_IN_PROGRESS)
+from latex.optimizers import is_numpy_available, optimize_image_file
+from latex.timing import span
+from latex.trim import save_trimmed_pages
+from latex.utils import (CANONICAL_FORM_VERSION, CriticalCheckMessage,
+                         canonicalize_tex_source, file_read, file_write,
                          get_abstract_latex_log,
-                         get_data_url_from_buf_and_mimetype, popen_wrapper,
-                         string_concat)
+                         get_data_url_from_buf_and_mimetype,
+                         get_preview_metadata, popen_wrapper, string_concat,
+                         wrap_tight_page)
 
 debug = False
 
-from typing import TYPE_CHECKING, Any, List, Optional, Text  # noqa
+from typing import (TYPE_CHECKING, Any, Dict, List, Optional, Text,  # noqa
+                    Tuple, Type)
 
 if TYPE_CHECKING:
     from django.core.checks.messages import CheckMessage  # noqa
@@ -67,6 +75,50 @@ class ImageConvertError(RuntimeError):
     pass
 
 
+# {{{ toolchain registry
+
+@lru_cache(maxsize=None)
+def resolve_bin_path(cmd):
+    # type: (Text) -> Text
+    """
+    Resolve the absolute path of a command once per process. Fall back to
+    the bare command name (resolved by the OS at Popen time) if it is not
+    found in $PATH.
+    """
+    return shutil.which(cmd) or cmd
+
+
+@lru_cache(maxsize=None)
+def get_command_instance(command_class):
+    # type: (Type[CommandBase]) -> CommandBase
+    """
+    Memoized instance of a compiler/converter class, created on first use
+    instead of at import time.
+    """
+    return command_class()
+
+
+def parse_version(version):
+    # type: (Text) -> Tuple[int, ...]
+    """
+    Parse a dotted numeric version string into a comparable tuple, with
+    trailing zeros dropped so that "4.39" == "4.39.0". This avoids importing
+    the (slow) pkg_resources for the version checks at startup.
+    """
+    parts = [int(d) for d in re.findall(r"\d+", version)]
+    while parts and parts[-1] == 0:
+        parts.pop()
+    return tuple(parts)
+
+
+def clear_toolchain_registry():
+    # type: () -> None
+    resolve_bin_path.cache_clear()
+    get_command_instance.cache_clear()
+
+# }}}
+
+
 # {{{ latex compiler classes and image converter classes
 
 
@@ -101,7 +153,22 @@ class CommandBase(object):
         self.bin_path = self.get_bin_path()
 
     def get_bin_path(self):
-        return self.cmd.lower()
+        return resolve_bin_path(self.cmd.lower())
+
+    def get_check_cache_key(self):
+        # type: () -> Optional[List[Any]]
+        """
+        The identity of the binary used to decide whether a previous
+        check result is still valid, or None if the binary can not be
+        located on disk (in which case the check is never cached).
+        """
+        bin_path = self.get_bin_path()
+        try:
+            stat = os.stat(bin_path)
+        except (OSError, TypeError):
+            return None
+        return [bin_path, stat.st_mtime, stat.st_size,
+                self.min_version, self.max_version]
 
     def version_popen(self):
         return popen_wrapper(
@@ -151,7 +218,6 @@ class CommandBase(object):
             ))
         else:
             version = ".".join(d for d in m.groups() if d)
-            from pkg_resources import parse_version
             if self.min_version:
                 if parse_version(version) < parse_version(self.min_version):
                     errors.append(CriticalCheckMessage(
@@ -222,12 +288,12 @@ class LatexCompiler(TexCompilerBase):
         # pdflatex or "-pdflatex=/path/to/xelatex" for xelatex
         """
         return (
-            "-%s=%s" % (self.name.lower(), self.bin_path.lower())
+            "-%s=%s" % (self.name.lower(), self.bin_path)
         )
 
     def get_latexmk_subpro_cmdline(self, input_path):
         # type: (Text) -> List[Text]
-        latexmk = Latexmk()
+        latexmk = get_command_instance(Latexmk)
         args = [
             latexmk.bin_path,
             "-%s" % self.output_format,
@@ -286,9 +352,36 @@ class ImageConverter(CommandBase):
     def convert_popen(cmdline, cwd):
         return popen_wrapper(cmdline, cwd=cwd)
 
-    def do_convert(self, compiled_file_path, image_path, working_dir):
+    # Whether the images can be rasterized at a multiple of the resolution
+    supports_scale = False
+
+    def do_convert(self, compiled_file_path, image_path, working_dir,
+                   scale=None, trim=True):
+        """
+        :param scale: if not None, rasterize at *scale* times the
+            resolution, with a converter which *supports_scale*.
+        :param trim: whether the page is trimmed to its content. Pages
+            compiled tight (see :func:`latex.utils.wrap_tight_page`) are
+            kept as they are, which their metadata describes.
+        """
+        kwargs = {}  # type: Dict[Text, Any]
+        if scale is not None:
+            assert self.supports_scale
+            kwargs["scale"] = scale
+        if not trim:
+            kwargs["trim"] = trim
+        success, error = self._convert(
+            compiled_file_path, image_path, working_dir, **kwargs)
+
+        # Optional post-convert stage, see latex.optimizers
+        if success and os.path.isfile(image_path):
+            optimize_image_file(image_path, self.output_format)
+
+        return success, error
+
+    def _convert(self, compiled_file_path, image_path, working_dir, **kwargs):
         cmdlines = self._get_convert_cmdlines(
-            compiled_file_path, image_path)
+            compiled_file_path, image_path, **kwargs)
 
         status = None
         error = None
@@ -303,8 +396,8 @@ class ImageConverter(CommandBase):
         return status == 0, error
 
     def _get_convert_cmdlines(
-            self, input_filepath, output_filepath):
-        # type: (Text, Text) -> List[List[Text]]
+            self, input_filepath, output_filepath, trim=True):
+        # type: (Text, Text, bool) -> List[List[Text]]
         raise NotImplementedError
 
 
@@ -315,16 +408,24 @@ class Dvipng(TexCompilerBase, ImageConverter):
     name = "dvipng"
     cmd = "dvipng"
     output_format = "png"
+    supports_scale = True
+
+    # The default resolution of dvipng
+    resolution = 100
 
     def _get_convert_cmdlines(
-            self, input_filepath, output_filepath):
-        # type: (Text, Text) -> List[List[Text]]
-        return [[self.bin_path,
-                 '-o', output_filepath,
-                 '-pp', '1',
-                 '-T', 'tight',
-                 '-z9',
-                 input_filepath]]
+            self, input_filepath, output_filepath, scale=None, trim=True):
+        # type: (Text, Text, Optional[float], bool) -> List[List[Text]]
+        cmdline = [self.bin_path,
+                   '-o', output_filepath,
+                   '-pp', '1',
+                   '-z9']
+        if trim:
+            # Else the page size of the preview package is used
+            cmdline.extend(['-T', 'tight'])
+        if scale is not None:
+            cmdline.extend(['-D', str(int(round(self.resolution * scale)))])
+        return [cmdline + [input_filepath]]
 
 
 class Dvisvg(TexCompilerBase, ImageConverter):
@@ -336,12 +437,12 @@ class Dvisvg(TexCompilerBase, ImageConverter):
     output_format = "svg"
 
     def _get_convert_cmdlines(
-            self, input_filepath, output_filepath):
-        # type: (Text, Text) -> List[List[Text]]
-        return [[self.bin_path,
-                 '--no-fonts',
-                 '-o', output_filepath,
-                 input_filepath]]
+            self, input_filepath, output_filepath, trim=True):
+        # type: (Text, Text, bool) -> List[List[Text]]
+        cmdline = [self.bin_path, '--no-fonts']
+        if not trim:
+            cmdline.append('--bbox=preview')
+        return [cmdline + ['-o', output_filepath, input_filepath]]
 
 
 class Pdf2svg(TexCompilerBase, ImageConverter):
@@ -353,12 +454,12 @@ class Pdf2svg(TexCompilerBase, ImageConverter):
     skip_version_check = True
 
     def _get_convert_cmdlines(
-            self, input_filepath, output_filepath):
-        # type: (Text, Text) -> List[List[Text]]
-        return [
-            ["pdfcrop", input_filepath, input_filepath],
-            [self.bin_path, input_filepath, output_filepath]
-        ]
+            self, input_filepath, output_filepath, trim=True):
+        # type: (Text, Text, bool) -> List[List[Text]]
+        cmdlines = [[self.bin_path, input_filepath, output_filepath]]
+        if trim:
+            cmdlines.insert(0, ["pdfcrop", input_filepath, input_filepath])
+        return cmdlines
 
 
 class ImageMagick(ImageConverter):
@@ -366,6 +467,10 @@ class ImageMagick(ImageConverter):
     cmd = "convert"
     output_format = "png"
 
+    # The format the pages are rasterized in
+    raster_format = "png"
+    supports_scale = True
+
     def get_bin_path(self):
         if sys.platform.startswith("win"):  # pragma: no cover, this happens when debugging  # noqa
             from wand.api import library_paths
@@ -376,25 +481,131 @@ class ImageMagick(ImageConverter):
         else:
             return super().get_bin_path()
 
-    def do_convert(self, compiled_file_path, image_path, working_dir):
+    @staticmethod
+    def get_raster_pages(image):
+        # type: (Any) -> List[Tuple[int, int, bytes]]
+        """
+        :return: the width, the height and the 8-bit RGBA pixels of each
+            page of the Wand *image*.
+        """
+        from wand.image import Image as wand_image
+        pages = []
+        for page in image.sequence:
+            with wand_image(image=page) as page_image:
+                page_image.depth = 8
+                pages.append((page_image.width, page_image.height,
+                              page_image.make_blob("RGBA")))
+        return pages
+
+    def _convert(self, compiled_file_path, image_path, working_dir,
+                 scale=None, trim=True):
         success = True
         error = ""
         try:
+            # Loading Wand (and the MagickWand shared library) is deferred
+            # until a job actually needs ImageMagick.
             from django.conf import settings
+            from wand.image import Image as wand_image
             resolution = int(
                 getattr(settings, "L2I_IMAGEMAGICK_PNG_RESOLUTION", 96))
+            margin = int(getattr(settings, "L2I_TRIM_MARGIN", 0))
+            if scale is not None:
+                resolution = int(round(resolution * scale))
+                margin = int(round(margin * scale))
             with wand_image(
                     filename=compiled_file_path, resolution=resolution
             ) as original:
-                with original.convert(self.output_format) as converted:
-                    converted.trim()
-                    converted.save(filename=image_path)
+                with original.convert(self.raster_format) as converted:
+                    if trim and is_numpy_available():
+                        # The pages are trimmed on their pixel buffers, all
+                        # together, see latex.trim
+                        with span("trim"):
+                            save_trimmed_pages(
+                                self.get_raster_pages(converted), image_path,
+                                margin)
+                    else:
+                        if trim:
+                            converted.trim()
+                        converted.save(filename=image_path)
         except Exception as e:
             success = False
             error = "%s: %s" % (type(e).__name__, str(e))
 
         return success, error
 
+
+class PillowEncodedImageMagick(ImageMagick):
+    """
+    Rasterize the pages with ImageMagick, as png, then encode them in
+    *output_format* with Pillow, which (unlike the delegates of ImageMagick)
+    is always built with the encoders, and whose options do not depend on
+    the version of ImageMagick.
+    """
+
+    # The format name of Pillow
+    pillow_format = None  # type: Optional[Text]
+
+    def get_save_options(self):
+        # type: () -> Dict[Text, Any]
+        raise NotImplementedError
+
+    def _convert(self, compiled_file_path, image_path, working_dir,
+                 **kwargs):
+        base, ext = os.path.splitext(image_path)
+        raster_ext = ".%s" % self.raster_format
+        raster_path = base + raster_ext
+        success, error = super()._convert(
+            compiled_file_path, raster_path, working_dir, **kwargs)
+        if not success:
+            return success, error
+
+        # Multiple pages are named as ImageMagick does, so that they are
+        # counted by get_number_of_images()
+        n_pages = get_number_of_images(raster_path, raster_ext)
+        if n_pages == 1:
+            paths = [(raster_path, image_path)]
+        else:
+            paths = [("%s-%d%s" % (base, i, raster_ext),
+                      "%s-%d%s" % (base, i, ext)) for i in range(n_pages)]
+
+        try:
+            from PIL import Image
+            for page_raster_path, path in paths:
+                with Image.open(page_raster_path) as image:
+                    image.save(path, format=self.pillow_format,
+                               **self.get_save_options())
+        except Exception as e:
+            return False, "%s: %s" % (type(e).__name__, str(e))
+
+        return True, error
+
+
+class ImageMagickWebp(PillowEncodedImageMagick):
+    output_format = "webp"
+    pillow_format = "WEBP"
+
+    def get_save_options(self):
+        # type: () -> Dict[Text, Any]
+        from django.conf import settings
+        quality = getattr(settings, "L2I_WEBP_QUALITY", None)
+        if quality is None:
+            # With lossless, "quality" is the compression effort
+            return {"lossless": True, "quality": 100, "method": 6}
+        return {"quality": int(quality), "method": 6}
+
+
+class ImageMagickAvif(PillowEncodedImageMagick):
+    output_format = "avif"
+    pillow_format = "AVIF"
+
+    def get_save_options(self):
+        # type: () -> Dict[Text, Any]
+        from django.conf import settings
+        quality = getattr(settings, "L2I_AVIF_QUALITY", 90)
+
+        # No chroma subsampling, which blurs the edges of colored glyphs
+        return {"quality": int(quality), "subsampling": "4:4:4"}
+
 # }}}
 
 
@@ -418,26 +629,77 @@ def get_data_url(file_path):
 
 # {{{ Base tex2img class
 
-def build_key(tex_source, cmd, image_format):
+def is_tex_source_canonicalization_enabled():
+    # type: () -> bool
+    from django.conf import settings
+    return getattr(settings, "L2I_CANONICALIZE_TEX_SOURCE", False)
+
+
+def is_tight_page_enabled():
+    # type: () -> bool
     from django.conf import settings
-    version = getattr(settings, "L2I_KEY_VERSION", 1)
+    return getattr(settings, "L2I_TIGHT_PAGE", False)
+
+
+def build_key(tex_source, cmd, image_format, canonicalize=None, version=None):
+    # type: (Text, Text, Text, Optional[bool], Optional[Any]) -> Text
+    """
+    :param version: the key version, default to settings.L2I_KEY_VERSION.
+    :param canonicalize: whether to hash the canonical form of
+        *tex_source* (see :func:`latex.utils.canonicalize_tex_source`),
+        default to settings.L2I_CANONICALIZE_TEX_SOURCE. The version part of
+        such keys is suffixed with the version of the canonical form, e.g.,
+        ``v1c1``, so they never collide with keys of verbatim sources.
+    """
+    if version is None:
+        from django.conf import settings
+        version = getattr(settings, "L2I_KEY_VERSION", 1)
+
+    if canonicalize is None:
+        canonicalize = is_tex_source_canonicalization_enabled()
+    if canonicalize:
+        tex_source = canonicalize_tex_source(tex_source)
+        version = "%sc%d" % (version, CANONICAL_FORM_VERSION)
 
     return "%s_%s_%s_v%s" % (
         md5(tex_source.encode("utf-8")).hexdigest(),
         cmd, image_format, version)
 
 
+TEX_KEY_RE = re.compile(
+    r"^(?P<digest>[0-9a-f]{32})_(?P<compiler>[a-z]+)_(?P<image_format>[a-z]+)"
+    r"_v(?P<version>[a-zA-Z0-9]+)$")
+
+
+def get_source_key(tex_key):
+    # type: (Text) -> Optional[Text]
+    """
+    :return: the key of the source of *tex_key*, a key generated by
+        :func:`build_key`, whatever the image format, i.e., *tex_key*
+        without the image format, or None if *tex_key* is not generated.
+    """
+    match = TEX_KEY_RE.match(tex_key)
+    if match is None:
+        return None
+    return "%s_%s_v%s" % match.group("digest", "compiler", "version")
+
+
 class Tex2ImgBase(object):
     """The abstract class of converting tex source to images.
     """
 
+    compiler_class = None  # type: Optional[Type[LatexCompiler]]
+    converter_class = None  # type: Optional[Type[ImageConverter]]
+
     @property
     def compiler(self):
         # type: () -> LatexCompiler
         """
         :return: an instance of `LatexCompiler`
         """
-        raise NotImplementedError()
+        if self.compiler_class is None:
+            raise NotImplementedError()
+        return get_command_instance(self.compiler_class)  # type: ignore
 
     @property
     def converter(self):
@@ -445,9 +707,12 @@ class Tex2ImgBase(object):
         """
         :return: an instance of `ImageConverter`
         """
-        raise NotImplementedError()
+        if self.converter_class is None:
+            raise NotImplementedError()
+        return get_command_instance(self.converter_class)  # type: ignore
 
-    def __init__(self, tex_source, tex_key=None, force_overwrite=False):
+    def __init__(self, tex_source, tex_key=None, force_overwrite=False,
+                 key_version=None, scales=None, tight_page=None):
         # type: (...) -> None
         """
         :param tex_source: Required, a string representing the
@@ -455,6 +720,15 @@ class Tex2ImgBase(object):
         :param tex_key: a string which is the identifier of
         the tex_source, if None, it will be generated using
         `tex_source`.
+        :param key_version: the version of the generated tex_key,
+        default to settings.L2I_KEY_VERSION.
+        :param scales: the multiples of the resolution the image is also
+        rasterized at, from the same compiled file, see `scaled_images`.
+        :param tight_page: whether the source is compiled on a tight page
+        (see `latex.utils.wrap_tight_page`), which is not trimmed, default
+        to settings.L2I_TIGHT_PAGE. Sources which can't be wrapped are
+        compiled as they are. When a compiled file is converted, whether
+        it was compiled so.
         """
 
         tex_source = tex_source.strip()
@@ -470,14 +744,50 @@ class Tex2ImgBase(object):
         self.compiled_ext = (
                 ".%s" % self.compiler.output_format.replace(".", "").lower())
 
+        # The key the source would have had before canonicalization was
+        # enabled, under which existing results can be looked up.
+        self.legacy_tex_key = None  # type: Optional[Text]
+
+        # The key of the source in all image formats, see latex.variants
+        self.source_key = None  # type: Optional[Text]
+
         if tex_key is None:
             tex_key = build_key(
                 self.tex_source,
-                self.compiler.cmd, self.image_format
+                self.compiler.cmd, self.image_format, version=key_version
             )
+            if is_tex_source_canonicalization_enabled():
+                self.legacy_tex_key = build_key(
+                    self.tex_source,
+                    self.compiler.cmd, self.image_format, canonicalize=False,
+                    version=key_version)
+            self.source_key = get_source_key(tex_key)
         self.tex_key = tex_key
         self.force_overwrite = force_overwrite
 
+        self.scales = sorted(set(scales or []) - {1})  # type: List[float]
+        if self.scales and not self.converter.supports_scale:
+            raise ValueError(
+                _("Scales are not supported with image format '%s'")
+                % self.image_format)
+
+        # The images rasterized at self.scales, by scale
+        self.scaled_images = {}  # type: Dict[float, bytes]
+
+        if tight_page is None:
+            tight_page = is_tight_page_enabled()
+        self.compiled_tex_source = self.tex_source
+        if tight_page and self.tex_source:
+            wrapped_tex_source = wrap_tight_page(self.tex_source)
+            tight_page = wrapped_tex_source is not None
+            if tight_page:
+                self.compiled_tex_source = wrapped_tex_source
+        self.tight_page = tight_page
+
+        # The dimensions of the page compiled tight, see
+        # latex.utils.get_preview_metadata
+        self.metadata = {}  # type: Dict[Text, float]
+
     def get_compiler_cmdline(self, tex_path):
         # type: (Text) -> List[Text]
         return self.compiler.get_latexmk_subpro_cmdline(tex_path)
@@ -526,7 +836,8 @@ class Tex2ImgBase(object):
         assert self.working_dir is not None
         tex_filename_to_compile = self.tex_key + ".tex"
         tex_path = os.path.join(self.working_dir, tex_filename_to_compile)
-        file_write(tex_path, self.tex_source.encode('UTF-8'))
+        with span("tex_write"):
+            file_write(tex_path, self.compiled_tex_source.encode('UTF-8'))
 
         assert tex_path is not None
         log_path = tex_path.replace(".tex", ".log")
@@ -534,7 +845,8 @@ class Tex2ImgBase(object):
             ".tex", self.compiled_ext)
 
         cmdline = self.get_compiler_cmdline(tex_path)
-        output, error, status = self.compile_popen(cmdline)
+        with span("compile"):
+            output, error, status = self.compile_popen(cmdline)
 
         if status != 0:
             try:
@@ -549,6 +861,13 @@ class Tex2ImgBase(object):
             raise LatexCompileError(log)
 
         if os.path.isfile(compiled_file_path):
+            if self.tight_page:
+                try:
+                    log = file_read(log_path).decode("utf-8", "replace")
+                except OSError:
+                    pass
+                else:
+                    self.metadata = get_preview_metadata(log) or {}
             return compiled_file_path
         else:
             self._remove_working_dir()
@@ -560,27 +879,50 @@ class Tex2ImgBase(object):
                     % self.compiler.output_format)
             )
 
-    def get_converted_data_url(self):
-        # type: () -> Optional[Text]
+    def write_compiled_file(self, compiled_data):
+        # type: (bytes) -> Text
+        """
+        Write *compiled_data*, which was compiled from the source
+        earlier, in place of compiling it.
+        :return: string, the path of the compiled file.
+        """
+        from tempfile import mkdtemp
+
+        self.working_dir = mkdtemp(prefix="LATEX_")  # type: ignore
+        compiled_file_path = os.path.join(
+            self.working_dir, self.tex_key + self.compiled_ext)
+        file_write(compiled_file_path, compiled_data)
+        return compiled_file_path
+
+    def get_converted_data_url(self, compiled_data=None):
+        # type: (Optional[bytes]) -> Optional[Text]
         """
         Convert compiled file into image.
+        :param compiled_data: if not None, the compiled file to convert,
+            the source is not compiled.
         :return: string, the data_url
         """
-        compiled_file_path = self.get_compiled_file()
-        assert compiled_file_path
+        labels = {"compiler": self.compiler.cmd,
+                  "image_format": self.image_format}
 
-        image_path = compiled_file_path.replace(
-            self.compiled_ext,
-            self.image_ext)
-
-        convert_success, error = self.converter.do_convert(
-            compiled_file_path, image_path, self.working_dir)
+        with COMPILES_IN_PROGRESS.track_inprogress(), \
+                COMPILE_DURATION.labels(**labels).time():
+            try:
+                return self._get_converted_data_url(compiled_data)
+            except Exception as e:
+                COMPILE_ERRORS.labels(
+                    exception=type(e).__name__, **labels).inc()
+                raise
 
-        if not convert_success:
-            self._remove_working_dir()
-            raise ImageConvertError(error)
+    def get_convert_kwargs(self):
+        # type: () -> Dict[Text, Any]
+        # Pages compiled tight are kept as they are
+        return {"trim": False} if self.tight_page else {}
 
-        n_images = get_number_of_images(image_path, self.image_ext)
+    def check_number_of_images(self, image_path):
+        # type: (Text) -> None
+        with span("count_images"):
+            n_images = get_number_of_images(image_path, self.image_ext)
 
         if n_images == 0:
             raise ImageConvertError(
@@ -593,8 +935,87 @@ class Tex2ImgBase(object):
                     % (n_images, )
                 ))
 
+    def convert_scales(self, compiled_file_path, image_path):
+        # type: (Text, Text) -> None
+        """
+        Rasterize *compiled_file_path* at each of self.scales, into
+        self.scaled_images.
+        """
+        base, ext = os.path.splitext(image_path)
+        for scale in self.scales:
+            scaled_image_path = "%s@%s%s" % (base, scale, ext)
+            convert_success, error = self.converter.do_convert(
+                compiled_file_path, scaled_image_path, self.working_dir,
+                scale=scale, **self.get_convert_kwargs())
+            if not convert_success:
+                raise ImageConvertError(error)
+
+            self.check_number_of_images(scaled_image_path)
+            self.scaled_images[scale] = file_read(scaled_image_path)
+
+    def get_scaled_images(self, compiled_data=None):
+        # type: (Optional[bytes]) -> Dict[float, bytes]
+        """
+        Rasterize the source at self.scales only, i.e., when the image
+        at the resolution exists already.
+        :param compiled_data: if not None, the compiled file to convert,
+            the source is not compiled.
+        :return: self.scaled_images
+        """
+        if compiled_data is not None:
+            compiled_file_path = self.write_compiled_file(compiled_data)
+        else:
+            compiled_file_path = self.get_compiled_file()
+            assert compiled_file_path
+
+        image_path = compiled_file_path.replace(
+            self.compiled_ext, self.image_ext)
+        try:
+            with span("convert_scales"):
+                self.convert_scales(compiled_file_path, image_path)
+        finally:
+            self._remove_working_dir()
+        return self.scaled_images
+
+    def _get_converted_data_url(self, compiled_data=None):
+        # type: (Optional[bytes]) -> Optional[Text]
+        if compiled_data is not None:
+            compiled_file_path = self.write_compiled_file(compiled_data)
+        else:
+            compiled_file_path = self.get_compiled_file()
+            assert compiled_file_path
+
+            if self.source_key is not None:
+                # Kept to convert to the other image formats
+                from latex.variants import keep_compiled_file
+                keep_compiled_file(self.source_key, compiled_file_path)
+
+        image_path = compiled_file_path.replace(
+            self.compiled_ext,
+            self.image_ext)
+
+        with span("convert"):
+            convert_success, error = self.converter.do_convert(
+                compiled_file_path, image_path, self.working_dir,
+                **self.get_convert_kwargs())
+
+        if not convert_success:
+            self._remove_working_dir()
+            raise ImageConvertError(error)
+
+        self.check_number_of_images(image_path)
+
+        if self.scales:
+            try:
+                with span("convert_scales"):
+                    self.convert_scales(compiled_file_path, image_path)
+            except Exception:
+                self._remove_working_dir()
+                raise
+
         try:
-            data_url = get_data_url(image_path)
+            with span("data_url"):
+                data_url = get_data_url(image_path)
         except Exception as e:
             raise ImageConvertError(
                 "%s:%s" % (type(e).__name__, str(e))
@@ -610,43 +1031,73 @@ class Tex2ImgBase(object):
 # {{{ derived tex2img converter
 
 class Latex2Svg(Tex2ImgBase):
-    compiler = Latex()
-    converter = Dvisvg()
+    compiler_class = Latex
+    converter_class = Dvisvg
 
 
 class Lualatex2Png(Tex2ImgBase):
-    compiler = LuaLatex()
-    converter = ImageMagick()
+    compiler_class = LuaLatex
+    converter_class = ImageMagick
 
 
 class Latex2Png(Tex2ImgBase):
-    compiler = Latex()
-    converter = Dvipng()
+    compiler_class = Latex
+    converter_class = Dvipng
 
 
 class Pdflatex2Png(Tex2ImgBase):
-    compiler = PdfLatex()
-    converter = ImageMagick()
+    compiler_class = PdfLatex
+    converter_class = ImageMagick
 
 
 class Pdflatex2Svg(Tex2ImgBase):
-    compiler = PdfLatex()
-    converter = Pdf2svg()
+    compiler_class = PdfLatex
+    converter_class = Pdf2svg
 
 
 class Lualatex2Svg(Tex2ImgBase):
-    compiler = LuaLatex()
-    converter = Pdf2svg()
+    compiler_class = LuaLatex
+    converter_class = Pdf2svg
 
 
 class Xelatex2Png(Tex2ImgBase):
-    compiler = XeLatex()
-    converter = ImageMagick()
+    compiler_class = XeLatex
+    converter_class = ImageMagick
 
 
 class Xelatex2Svg(Tex2ImgBase):
-    compiler = XeLatex()
-    converter = Pdf2svg()
+    compiler_class = XeLatex
+    converter_class = Pdf2svg
+
+
+class Pdflatex2Webp(Tex2ImgBase):
+    compiler_class = PdfLatex
+    converter_class = ImageMagickWebp
+
+
+class Lualatex2Webp(Tex2ImgBase):
+    compiler_class = LuaLatex
+    converter_class = ImageMagickWebp
+
+
+class Xelatex2Webp(Tex2ImgBase):
+    compiler_class = XeLatex
+    converter_class = ImageMagickWebp
+
+
+class Pdflatex2Avif(Tex2ImgBase):
+    compiler_class = PdfLatex
+    converter_class = ImageMagickAvif
+
+
+class Lualatex2Avif(Tex2ImgBase):
+    compiler_class = LuaLatex
+    converter_class = ImageMagickAvif
+
+
+class Xelatex2Avif(Tex2ImgBase):
+    compiler_class = XeLatex
+    converter_class = ImageMagickAvif
 
 # }}}
 
@@ -709,8 +1160,9 @@ def get_number_of_images(image_path, image_ext):
 
 
 def tex_to_img_converter(
-        compiler, tex_source, image_format, tex_key=None, **kwargs):
-    # type: (Text, Text, Text, Optional[Text], **Any) -> Tex2ImgBase
+        compiler, tex_source, image_format, tex_key=None, key_version=None,
+        scales=None, **kwargs):
+    # type: (...) -> Tex2ImgBase
     '''Convert LaTeX to IMG tag'''
 
     # https://lists.gnu.org/archive/html/dvipng/2010-11/msg00001.html
@@ -725,6 +1177,8 @@ def tex_to_img_converter(
     latex2img = tex2img_class(
         tex_source=tex_source,
         tex_key=tex_key,
+        key_version=key_version,
+        scales=scales,
         )
 
     return latex2img
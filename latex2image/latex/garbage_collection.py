@@ -0,0 +1,284 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import division
+
+__copyright__ = "Copyright (C) 2020 Dong Zhuang"
+
+__license__ = """
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+"""
+
+import heapq
+import os
+import shutil
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from itertools import chain
+from time import time
+from typing import (Any, Callable, Dict, Iterable, Iterator, Optional,  # noqa
+                    Text, Tuple)
+
+from django.db import transaction
+
+from latex.models import (BLOB_UPLOAD_TO, UPLOAD_TO, CreatorUsage, ImageBlob,
+                          LatexImage, ScaledImage, move_storage_file)
+from latex.storage_manifest import (get_storage_manifest,
+                                    iter_storage_file_names)
+from latex.utils import iter_batches
+
+QUARANTINE_TO = "l2i_quarantine"
+
+# Prefix of the working dirs of conversions, see
+# latex.converter.Tex2ImgBase.get_compiled_file
+TEMP_DIR_PREFIX = "LATEX_"
+
+# Orphan actions
+DELETE = "delete"
+QUARANTINE = "quarantine"
+
+# Diff results
+ORPHAN = "orphan"
+MISSING = "missing"
+
+
+# {{{ sorted merge
+
+def iter_sorted(names, run_size=100000):
+    # type: (Iterable[Text], int) -> Iterator[Text]
+    """
+    Yield *names* sorted, holding at most *run_size* of them in memory:
+    sorted runs are spilled to temp files, then merged.
+    """
+    runs = []
+    try:
+        for run in iter_batches(names, run_size):
+            run.sort()
+            f = tempfile.TemporaryFile("w+", encoding="utf-8")
+            f.writelines(name + "\n" for name in run)
+            f.seek(0)
+            runs.append(f)
+
+        yield from heapq.merge(
+            *[(line[:-1] for line in f) for f in runs])
+    finally:
+        for f in runs:
+            f.close()
+
+
+def iter_unique(names):
+    # type: (Iterable[Text]) -> Iterator[Text]
+    """Yield the sorted *names* without repetitions."""
+    previous = None
+    for name in names:
+        if name != previous:
+            yield name
+        previous = name
+
+
+def iter_sorted_diff(stored, referenced):
+    # type: (Iterator[Text], Iterator[Text]) -> Iterator[Tuple[Text, Text]]
+    """
+    Merge the sorted names of the *stored* files and of the files
+    *referenced* by the database.
+
+    :return: an iterator of (ORPHAN, name) for the files stored but not
+        referenced, and (MISSING, name) for those referenced but not stored.
+    """
+    sentinel = None
+    stored_name = next(stored, sentinel)
+    referenced_name = next(referenced, sentinel)
+    while stored_name is not sentinel or referenced_name is not sentinel:
+        if (referenced_name is sentinel
+                or (stored_name is not sentinel
+                    and stored_name < referenced_name)):
+            yield ORPHAN, stored_name
+            stored_name = next(stored, sentinel)
+        elif stored_name is sentinel or referenced_name < stored_name:
+            yield MISSING, referenced_name
+            referenced_name = next(referenced, sentinel)
+        else:
+            stored_name = next(stored, sentinel)
+            referenced_name = next(referenced, sentinel)
+
+# }}}
+
+
+def iter_referenced_image_names(chunk_size=2000):
+    # type: (int) -> Iterator[Text]
+    """
+    :return: an iterator of the names of the files of the results, of
+        their scaled images and of the image blobs, which are repeated if
+        shared by results.
+    """
+    return chain(
+        LatexImage.objects
+        .exclude(image__isnull=True).exclude(image="")
+        .values_list("image", flat=True)
+        .iterator(chunk_size=chunk_size),
+        ScaledImage.objects
+        .values_list("image", flat=True)
+        .iterator(chunk_size=chunk_size),
+        ImageBlob.objects
+        .values_list("image", flat=True)
+        .iterator(chunk_size=chunk_size))
+
+
+class OrphanCollector(object):
+    """
+    Find the image files which no result references, e.g., left by failed
+    saves or database restores, and delete them or move them to
+    ``l2i_quarantine/`` (with *action*), in batches of *batch_size* files
+    handled by *workers* threads.
+
+    Files modified less than *min_age* seconds ago are kept, they may
+    belong to results being saved.
+    """
+
+    def __init__(self, storage, action=None, min_age=3600, workers=8,
+                 batch_size=500, run_size=100000):
+        # type: (...) -> None
+        assert action in (None, DELETE, QUARANTINE)
+        self.storage = storage
+        self.action = action
+        self.min_age = min_age
+        self.workers = workers
+        self.batch_size = batch_size
+        self.run_size = run_size
+
+    def iter_diff(self):
+        # type: () -> Iterator[Tuple[Text, Text]]
+        return iter_sorted_diff(
+            iter_sorted(
+                chain(iter_storage_file_names(self.storage, UPLOAD_TO),
+                      iter_storage_file_names(self.storage, BLOB_UPLOAD_TO)),
+                self.run_size),
+            iter_unique(
+                iter_sorted(iter_referenced_image_names(), self.run_size)))
+
+    def is_old_enough(self, name):
+        # type: (Text) -> bool
+        try:
+            modified = self.storage.get_modified_time(name)
+        except NotImplementedError:
+            return True
+        return modified.timestamp() <= time() - self.min_age
+
+    def collect(self, name):
+        # type: (Text) -> Tuple[Text, Optional[int], Optional[Text]]
+        """
+        :return: (name, size, error), size is None if the file is kept
+            because it's too recent.
+        """
+        try:
+            if not self.is_old_enough(name):
+                return name, None, None
+            size = self.storage.size(name)
+            if self.action == DELETE:
+                self.storage.delete(name)
+            elif self.action == QUARANTINE:
+                move_storage_file(
+                    self.storage, name, "/".join([QUARANTINE_TO, name]))
+                manifest = get_storage_manifest()
+                if manifest is not None:
+                    manifest.discard([name])
+        except Exception as e:
+            return name, None, "%s: %s: %s" % (name, type(e).__name__, str(e))
+        return name, size, None
+
+    def run(self, error_callback=None):
+        # type: (Optional[Callable[[Text], None]]) -> Dict[Text, int]
+        counts = {"orphans": 0, "orphan_bytes": 0, "recent": 0,
+                  "missing": 0, "failed": 0}
+
+        def iter_orphans():
+            for result, name in self.iter_diff():
+                if result == MISSING:
+                    counts["missing"] += 1
+                else:
+                    yield name
+
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            for batch in iter_batches(iter_orphans(), self.batch_size):
+                for name, size, error in executor.map(self.collect, batch):
+                    if error is not None:
+                        counts["failed"] += 1
+                        if error_callback is not None:
+                            error_callback(error)
+                    elif size is None:
+                        counts["recent"] += 1
+                    else:
+                        counts["orphans"] += 1
+                        counts["orphan_bytes"] += size
+        return counts
+
+
+def clean_temp_dirs(min_age=3600, dry_run=True, temp_dir=None):
+    # type: (float, bool, Optional[Text]) -> Tuple[int, int]
+    """
+    Remove the working dirs of conversions older than *min_age* seconds,
+    left by killed workers.
+
+    :return: the number and the total size of the dirs (to be) removed.
+    """
+    temp_dir = temp_dir or tempfile.gettempdir()
+    n_dirs = n_bytes = 0
+    with os.scandir(temp_dir) as it:
+        for entry in it:
+            if (not entry.name.startswith(TEMP_DIR_PREFIX)
+                    or not entry.is_dir(follow_symlinks=False)):
+                continue
+            try:
+                if entry.stat().st_mtime > time() - min_age:
+                    continue
+                size = 0
+                for root, _dirs, files in os.walk(entry.path):
+                    for file_name in files:
+                        size += os.path.getsize(os.path.join(root, file_name))
+                if not dry_run:
+                    shutil.rmtree(entry.path)
+            except FileNotFoundError:
+                # Removed meanwhile
+                continue
+            n_dirs += 1
+            n_bytes += size
+    return n_dirs, n_bytes
+
+
+def recount_usage(chunk_size=2000):
+    # type: (int) -> int
+    """
+    Recount the usage of all creators from the database.
+
+    :return: the number of creators.
+    """
+    usage = {}  # type: Dict[int, Tuple[int, int]]
+    qs = LatexImage.objects.values_list("creator_id", "data_url_blob__size")
+    for creator_id, size in qs.iterator(chunk_size=chunk_size):
+        n_objects, n_bytes = usage.get(creator_id, (0, 0))
+        usage[creator_id] = (n_objects + 1, n_bytes + (size or 0))
+
+    with transaction.atomic():
+        CreatorUsage.objects.exclude(creator_id__in=list(usage)).delete()
+        for creator_id, (n_objects, n_bytes) in usage.items():
+            CreatorUsage.objects.update_or_create(
+                creator_id=creator_id,
+                defaults={"n_objects": n_objects, "n_bytes": n_bytes})
+    return len(usage)
+
+# vim: foldmethod=marker
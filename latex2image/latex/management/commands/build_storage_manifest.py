@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import division
+
+__copyright__ = "Copyright (C) 2020 Dong Zhuang"
+
+__license__ = """
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+"""
+
+from django.core.management.base import BaseCommand, CommandError
+
+from latex.models import UPLOAD_TO, get_image_storage
+from latex.storage_manifest import (get_storage_manifest,
+                                    iter_storage_file_names)
+
+
+class Command(BaseCommand):
+    help = (
+        "Build the manifest of the image storage (see "
+        "settings.L2I_STORAGE_MANIFEST) from a listing of the storage.")
+
+    requires_system_checks = []
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size", type=int, default=1000,
+            help="number of names added to the manifest at once, "
+                 "default to 1000")
+        parser.add_argument(
+            "--status", action="store_true",
+            help="only print the number of names in the manifest")
+
+    def handle(self, *args, **options):
+        manifest = get_storage_manifest()
+        if manifest is None:
+            raise CommandError("settings.L2I_STORAGE_MANIFEST is not configured")
+
+        if options["status"]:
+            self.stdout.write("%d names, %s" % (
+                len(manifest),
+                "complete" if manifest.is_complete() else "incomplete"))
+            return
+
+        n_names = manifest.rebuild(
+            iter_storage_file_names(get_image_storage(), UPLOAD_TO),
+            batch_size=options["batch_size"])
+        self.stdout.write("Manifest built with %d names" % n_names)
@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import division
+
+__copyright__ = "Copyright (C) 2020 Dong Zhuang"
+
+__license__ = """
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+"""
+
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management.base import BaseCommand, CommandError
+
+from latex.api import get_field_cache_key
+from latex.models import ImageBlob, LatexImage
+
+
+def store_as_blob(instance):
+    # type: (LatexImage) -> bool
+    """
+    Make *instance* reference the blob of its image, then delete the file
+    of its tex_key.
+
+    :return: False if *instance* was changed concurrently, thus left as is.
+    """
+    old_name = instance.image.name
+    blob = ImageBlob.acquire(instance.data_url)
+    if not LatexImage.objects.filter(
+            pk=instance.pk, blob__isnull=True,
+            data_url_blob__data_url=instance.data_url
+    ).update(blob=blob, image=blob.image.name):
+        ImageBlob.release(blob.pk)
+        return False
+
+    if old_name and old_name != blob.image.name:
+        instance.image.storage.delete(old_name)
+    return True
+
+
+class Command(BaseCommand):
+    help = (
+        "Store the images of the existing results as content addressed "
+        "blobs (l2i_blobs/ab/cd/<sha256>.<ext>, see "
+        "settings.L2I_DEDUP_STORAGE), so that identical images are stored "
+        "once, and delete their files named by tex_key.")
+
+    requires_system_checks = []
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size", type=int, default=500,
+            help="number of results per batch, default to 500")
+        parser.add_argument(
+            "--dry-run", action="store_true",
+            help="only count the results to be stored as blobs")
+
+    def handle(self, *args, **options):
+        if options["batch_size"] < 1:
+            raise CommandError("--batch-size must be positive")
+
+        queryset = LatexImage.objects.filter(
+            blob__isnull=True, data_url_blob__isnull=False)
+
+        if options["dry_run"]:
+            self.stdout.write(
+                "%d results to be stored as blobs" % queryset.count())
+            return
+
+        try:
+            import django.core.cache as cache
+            def_cache = cache.caches["default"]
+        except ImproperlyConfigured:
+            def_cache = None
+
+        n_stored = n_failed = 0
+        last_pk = None
+        while True:
+            batch = queryset.order_by("pk")
+            if last_pk is not None:
+                batch = batch.filter(pk__gt=last_pk)
+            batch = list(
+                batch.prefetch_related("data_url_blob")[:options["batch_size"]])
+            if not batch:
+                break
+
+            for instance in batch:
+                last_pk = instance.pk
+                try:
+                    if not store_as_blob(instance):
+                        continue
+                except Exception as e:
+                    n_failed += 1
+                    self.stderr.write("%s: %s: %s" % (
+                        instance.tex_key, type(e).__name__, str(e)))
+                    continue
+                n_stored += 1
+                if def_cache is not None:
+                    def_cache.delete(
+                        get_field_cache_key(instance.tex_key, "image"))
+
+            self.stdout.write(
+                "%d results stored as blobs, %d failed" % (n_stored, n_failed))
+
+        self.stdout.write(
+            "Done: %d results stored as blobs, %d failed"
+            % (n_stored, n_failed))
@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import division
+
+__copyright__ = "Copyright (C) 2020 Dong Zhuang"
+
+__license__ = """
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+"""
+
+from django.core.management.base import BaseCommand
+
+from latex.write_behind import get_queue
+
+
+class Command(BaseCommand):
+    help = (
+        "Commit the results queued in write behind mode (see "
+        "settings.L2I_WRITE_BEHIND), e.g., those left by a stopped server.")
+
+    requires_system_checks = []
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--claim-timeout", type=float, default=300,
+            help="entries claimed by a worker more than this number of "
+                 "seconds ago are committed too, default to 300")
+        parser.add_argument(
+            "--status", action="store_true",
+            help="only print the number of queued results")
+
+    def handle(self, *args, **options):
+        queue = get_queue()
+        if options["status"]:
+            self.stdout.write(
+                "%d results queued in %s" % (len(queue), queue.directory))
+            return
+
+        n_recovered = queue.recover(options["claim_timeout"])
+        if n_recovered:
+            self.stdout.write(
+                "%d results claimed by a stopped worker are retried"
+                % n_recovered)
+
+        counts = queue.drain()
+        self.stdout.write(
+            "%(committed)d results committed, %(failed)d failed" % counts)
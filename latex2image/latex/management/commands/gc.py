@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import division
+
+__copyright__ = "Copyright (C) 2020 Dong Zhuang"
+
+__license__ = """
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+"""
+
+from django.core.management.base import BaseCommand, CommandError
+
+from latex.garbage_collection import (DELETE, QUARANTINE, QUARANTINE_TO,
+                                      OrphanCollector, clean_temp_dirs,
+                                      recount_usage)
+from latex.models import CreatorUsage, get_image_storage
+
+
+class Command(BaseCommand):
+    help = (
+        "Find the image files which no result references and the leaked "
+        "working dirs of conversions, and report them, or delete them "
+        "(--delete), or move the files to %s/ (--quarantine)."
+        % QUARANTINE_TO)
+
+    requires_system_checks = []
+
+    def add_arguments(self, parser):
+        action = parser.add_mutually_exclusive_group()
+        action.add_argument(
+            "--delete", action="store_const", dest="action", const=DELETE,
+            help="delete the orphan files and leaked dirs")
+        action.add_argument(
+            "--quarantine", action="store_const", dest="action",
+            const=QUARANTINE,
+            help="move the orphan files to %s/, and delete leaked dirs"
+                 % QUARANTINE_TO)
+        parser.add_argument(
+            "--min-age", type=float, default=3600,
+            help="files and dirs modified less than this number of seconds "
+                 "ago are kept, default to 3600")
+        parser.add_argument(
+            "--workers", type=int, default=8,
+            help="number of files handled in parallel, default to 8")
+        parser.add_argument(
+            "--batch-size", type=int, default=500,
+            help="number of files per batch, default to 500")
+        parser.add_argument(
+            "--run-size", type=int, default=100000,
+            help="number of names sorted in memory at once, default to "
+                 "100000")
+        parser.add_argument(
+            "--recount-usage", action="store_true",
+            help="recount the usage of each creator from the database")
+        parser.add_argument(
+            "--usage", action="store_true",
+            help="only print the usage of each creator")
+
+    def handle(self, *args, **options):
+        if options["usage"]:
+            self.print_usage()
+            return
+
+        if min(options["workers"], options["batch_size"],
+               options["run_size"]) < 1:
+            raise CommandError(
+                "--workers, --batch-size and --run-size must be positive")
+
+        action = options["action"]
+        collector = OrphanCollector(
+            get_image_storage(), action=action, min_age=options["min_age"],
+            workers=options["workers"], batch_size=options["batch_size"],
+            run_size=options["run_size"])
+        counts = collector.run(error_callback=self.stderr.write)
+
+        verb = {None: "found", DELETE: "deleted",
+                QUARANTINE: "quarantined"}[action]
+        self.stdout.write(
+            "%d orphan files (%d bytes) %s, %d recent ones kept, %d failed"
+            % (counts["orphans"], counts["orphan_bytes"], verb,
+               counts["recent"], counts["failed"]))
+        if counts["missing"]:
+            self.stdout.write(
+                "%d results reference a missing image file" % counts["missing"])
+
+        n_dirs, n_bytes = clean_temp_dirs(
+            min_age=options["min_age"], dry_run=action is None)
+        self.stdout.write(
+            "%d leaked working dirs (%d bytes) %s"
+            % (n_dirs, n_bytes, "found" if action is None else "deleted"))
+
+        if options["recount_usage"]:
+            n_creators = recount_usage()
+            self.stdout.write("Usage of %d creators recounted" % n_creators)
+
+    def print_usage(self):
+        for usage in (CreatorUsage.objects.select_related("creator")
+                      .order_by("-n_bytes")):
+            self.stdout.write("%s: %d objects, %d bytes" % (
+                usage.creator.get_username(), usage.n_objects, usage.n_bytes))
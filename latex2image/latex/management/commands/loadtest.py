@@ -0,0 +1,536 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import division
+
+__copyright__ = "Copyright (C) 2020 Dong Zhuang"
+
+__license__ = """
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+"""
+
+import json
+import os
+import random
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack
+from datetime import datetime, timezone
+from time import perf_counter, time
+from urllib.error import HTTPError, URLError
+from urllib.parse import urlencode
+from urllib.request import Request, urlopen
+
+from django.core.management.base import BaseCommand, CommandError
+
+ENDPOINTS = ("create", "detail", "list")
+
+# Request line format of the NDJSON files read by --replay and written by
+# --record, e.g.:
+#   {"endpoint": "create", "data": {"compiler": "xelatex", ...}}
+#   {"endpoint": "detail", "tex_key": "abc", "data": {"fields": "image"}}
+#   {"endpoint": "list", "data": {}}
+# An optional "label" (e.g., "create.cached") groups the results, and
+# defaults to the endpoint.
+
+
+# {{{ request plans
+
+def parse_mix(value):
+    """
+    Parse an endpoint mix like ``create=0.7,detail=0.2,list=0.1`` into a
+    dict of weights.
+    """
+    mix = {}
+    for item in value.split(","):
+        endpoint, _, weight = item.partition("=")
+        endpoint = endpoint.strip()
+        if endpoint not in ENDPOINTS:
+            raise CommandError(
+                "Unknown endpoint '%s' in mix, allowed are %s"
+                % (endpoint, ", ".join(ENDPOINTS)))
+        try:
+            mix[endpoint] = float(weight)
+        except ValueError:
+            raise CommandError("Invalid weight in mix: '%s'" % item)
+    if not sum(mix.values()) > 0:
+        raise CommandError("The weights of the mix must not all be zero")
+    return mix
+
+
+def read_ndjson(path):
+    requests = []
+    with open(path, encoding="utf-8") as f:
+        for lineno, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                req = json.loads(line)
+            except ValueError as e:
+                raise CommandError("%s:%d: %s" % (path, lineno, e))
+            if req.get("endpoint") not in ENDPOINTS:
+                raise CommandError(
+                    "%s:%d: 'endpoint' must be one of %s"
+                    % (path, lineno, ", ".join(ENDPOINTS)))
+            if req["endpoint"] == "detail" and not req.get("tex_key"):
+                raise CommandError(
+                    "%s:%d: 'tex_key' is required for detail requests"
+                    % (path, lineno))
+            requests.append(req)
+    if not requests:
+        raise CommandError("No requests found in %s" % path)
+    return requests
+
+
+class CorpusPlan(object):
+    """
+    Generates requests from the benchmark corpus. A *cached_ratio* of the
+    create and detail requests target the tex_keys created during warm up
+    (and ask for the image field only, which is served from the cache),
+    the other create requests use new tex_keys, so the source is compiled.
+    """
+
+    def __init__(self, mix, cached_ratio, categories=None, seed=0):
+        from benchmarks.corpus import (CATEGORIES, get_category_sources,
+                                       get_combinations)
+
+        self.mix = mix
+        self.cached_ratio = cached_ratio
+        self.random = random.Random(seed)
+        self.run_id = "%x" % int(time())
+
+        self.sources = []
+        for category in categories or CATEGORIES:
+            for _filename, tex_source in get_category_sources(category):
+                for compiler, image_format in get_combinations(category):
+                    self.sources.append((tex_source, compiler, image_format))
+
+        self.warm_keys = []
+        self._n = 0
+
+    def _create_data(self, tex_key, source):
+        tex_source, compiler, image_format = source
+        return {
+            "compiler": compiler,
+            "image_format": image_format,
+            "tex_source": tex_source,
+            "tex_key": tex_key,
+            "fields": "image",
+        }
+
+    def _new_key(self):
+        self._n += 1
+        return "loadtest_%s_%d" % (self.run_id, self._n)
+
+    def get_warmup_requests(self, n):
+        requests = []
+        for i in range(n):
+            tex_key = self._new_key()
+            self.warm_keys.append(tex_key)
+            requests.append({
+                "endpoint": "create", "label": "create.warmup",
+                "data": self._create_data(
+                    tex_key, self.sources[i % len(self.sources)])})
+        return requests
+
+    def get_requests(self, n):
+        endpoints = list(self.mix)
+        weights = [self.mix[e] for e in endpoints]
+        requests = []
+        for _i in range(n):
+            endpoint = self.random.choices(endpoints, weights)[0]
+            cached = (bool(self.warm_keys)
+                      and self.random.random() < self.cached_ratio)
+            if endpoint == "list":
+                requests.append({"endpoint": "list", "data": {}})
+            elif endpoint == "detail":
+                # Without warm keys, detail requests can only 404
+                tex_key = (self.random.choice(self.warm_keys)
+                           if self.warm_keys else self._new_key())
+                requests.append({
+                    "endpoint": "detail",
+                    "label": "detail.cached" if cached else "detail.uncached",
+                    "tex_key": tex_key,
+                    "data": {"fields": "image"} if cached else {}})
+            elif cached:
+                index = self.random.randrange(len(self.warm_keys))
+                requests.append({
+                    "endpoint": "create", "label": "create.cached",
+                    "data": self._create_data(
+                        self.warm_keys[index],
+                        self.sources[index % len(self.sources)])})
+            else:
+                requests.append({
+                    "endpoint": "create", "label": "create.uncached",
+                    "data": self._create_data(
+                        self._new_key(), self.random.choice(self.sources))})
+        return requests
+
+
+class ReplayPlan(object):
+    """Replays the requests of an NDJSON file, repeating it if needed."""
+
+    def __init__(self, requests):
+        self.requests = requests
+        self._pos = 0
+
+    def get_warmup_requests(self, n):
+        return []
+
+    def get_requests(self, n):
+        requests = []
+        for _i in range(n):
+            requests.append(self.requests[self._pos % len(self.requests)])
+            self._pos += 1
+        return requests
+
+# }}}
+
+
+# {{{ http
+
+class Client(object):
+    def __init__(self, base_url, token=None, timeout=60):
+        self.base_url = base_url.rstrip("/")
+        self.token = token
+        self.timeout = timeout
+
+    def _get_request(self, req):
+        endpoint = req["endpoint"]
+        data = req.get("data") or {}
+        headers = {"Accept": "application/json"}
+        if self.token:
+            headers["Authorization"] = "Token %s" % self.token
+
+        if endpoint == "create":
+            headers["Content-Type"] = "application/json"
+            return Request(
+                "%s/api/create/" % self.base_url,
+                data=json.dumps(data).encode(), headers=headers,
+                method="POST")
+
+        if endpoint == "detail":
+            url = "%s/api/detail/%s" % (self.base_url, req["tex_key"])
+        else:
+            url = "%s/api/list/" % self.base_url
+        if data:
+            url = "%s?%s" % (url, urlencode(data))
+        return Request(url, headers=headers, method="GET")
+
+    def send(self, req):
+        """
+        :return: a tuple (status, elapsed seconds), status is None if no
+            response was received.
+        """
+        start = perf_counter()
+        try:
+            with urlopen(self._get_request(req), timeout=self.timeout) as resp:
+                resp.read()
+                status = resp.status
+        except HTTPError as e:
+            e.read()
+            status = e.code
+        except (URLError, OSError):
+            status = None
+        return status, perf_counter() - start
+
+# }}}
+
+
+# {{{ run and report
+
+def run_level(client, requests, concurrency):
+    """
+    Send *requests* with *concurrency* threads, and return a list of
+    (label, status, elapsed seconds) and the wall time.
+    """
+    lock = threading.Lock()
+    it = iter(requests)
+    outcomes = []
+
+    def worker():
+        while True:
+            with lock:
+                req = next(it, None)
+            if req is None:
+                return
+            status, elapsed = client.send(req)
+            with lock:
+                outcomes.append(
+                    (req.get("label", req["endpoint"]), status, elapsed))
+
+    wall_start = perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for future in [executor.submit(worker) for _i in range(concurrency)]:
+            future.result()
+    return outcomes, perf_counter() - wall_start
+
+
+def _is_error(status):
+    return status is None or status >= 400
+
+
+def summarize_outcomes(outcomes, wall_time):
+    from benchmarks.runners import summarize
+
+    errors = sum(1 for _label, status, _elapsed in outcomes if _is_error(status))
+    summary = summarize(
+        [elapsed for _label, status, elapsed in outcomes
+         if not _is_error(status)],
+        wall_time, errors)
+    summary["requests"] = len(outcomes)
+    summary["error_rate"] = (
+        round(errors / len(outcomes), 4) if outcomes else None)
+    summary["statuses"] = {}
+    for _label, status, _elapsed in outcomes:
+        key = str(status) if status is not None else "no_response"
+        summary["statuses"][key] = summary["statuses"].get(key, 0) + 1
+    return summary
+
+
+def get_level_result(concurrency, outcomes, wall_time):
+    result = {"concurrency": concurrency}
+    result.update(summarize_outcomes(outcomes, wall_time))
+
+    by_label = {}
+    for outcome in outcomes:
+        by_label.setdefault(outcome[0], []).append(outcome)
+    result["endpoints"] = {
+        label: summarize_outcomes(label_outcomes, wall_time)
+        for label, label_outcomes in sorted(by_label.items())}
+    return result
+
+# }}}
+
+
+class Command(BaseCommand):
+    help = (
+        "Drive the API (create, detail and list) at increasing concurrency "
+        "levels, with requests generated from the benchmark corpus or "
+        "replayed from an NDJSON file, and report latency percentiles, "
+        "error rates and throughput.")
+
+    # The toolchain is not needed to drive a remote server, and --serve
+    # uses the stub toolchain
+    requires_system_checks = []
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--url", default="http://127.0.0.1:8020",
+            help="base url of the server, default to http://127.0.0.1:8020")
+        parser.add_argument(
+            "--token", default=os.environ.get("L2I_LOADTEST_TOKEN"),
+            help="API token, default to env L2I_LOADTEST_TOKEN")
+        parser.add_argument(
+            "--serve", action="store_true",
+            help="serve the site in process, on a temporary database and "
+                 "storage and with the stub toolchain, and test it "
+                 "(--url and --token are ignored)")
+        parser.add_argument(
+            "--latency-scale", type=float, default=1.,
+            help="with --serve, the multiplier of the simulated latency "
+                 "of the stub toolchain")
+        parser.add_argument(
+            "--concurrency", type=int, nargs="+", default=[1, 2, 4, 8],
+            help="concurrency levels, default to 1 2 4 8")
+        parser.add_argument(
+            "--requests", type=int, default=100,
+            help="number of requests per concurrency level, default to 100")
+        parser.add_argument(
+            "--replay", metavar="NDJSON",
+            help="replay the requests of the file instead of generating "
+                 "them from the corpus")
+        parser.add_argument(
+            "--record", metavar="NDJSON",
+            help="write the requests sent to the file, to be replayed later")
+        parser.add_argument(
+            "--mix", default="create=0.7,detail=0.2,list=0.1",
+            help="weights of the endpoints of the generated requests, "
+                 "default to create=0.7,detail=0.2,list=0.1")
+        parser.add_argument(
+            "--cached-ratio", type=float, default=0.5,
+            help="ratio of the generated create and detail requests hitting "
+                 "the cache, default to 0.5")
+        parser.add_argument(
+            "--warmup", type=int, default=10,
+            help="number of objects created before the run, which cached "
+                 "requests target, default to 10")
+        parser.add_argument(
+            "--category", nargs="+", default=None,
+            help="corpus categories of the generated requests, default to all")
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument("--timeout", type=float, default=60)
+        parser.add_argument("--output", help="path of the JSON report")
+
+    def handle(self, *args, **options):
+        if options["replay"]:
+            plan = ReplayPlan(read_ndjson(options["replay"]))
+        else:
+            if not 0 <= options["cached_ratio"] <= 1:
+                raise CommandError("--cached-ratio must be in [0, 1]")
+            plan = CorpusPlan(
+                parse_mix(options["mix"]), options["cached_ratio"],
+                options["category"], options["seed"])
+
+        if any(c < 1 for c in options["concurrency"]):
+            raise CommandError("--concurrency must be positive")
+
+        with ExitStack() as stack:
+            if options["serve"]:
+                url, token = stack.enter_context(
+                    LocalServer(options["latency_scale"]))
+            else:
+                url, token = options["url"], options["token"]
+                if not token:
+                    raise CommandError(
+                        "An API token is required, use --token or "
+                        "env L2I_LOADTEST_TOKEN")
+
+            record = None
+            if options["record"]:
+                record = stack.enter_context(
+                    open(options["record"], "w", encoding="utf-8"))
+
+            client = Client(url, token, options["timeout"])
+            levels = self.run(client, plan, options, record)
+
+        report = {
+            "meta": {
+                "time": datetime.now(timezone.utc).isoformat(),
+                "url": None if options["serve"] else options["url"],
+                "source": options["replay"] or "corpus",
+                "requests_per_level": options["requests"],
+                "mix": None if options["replay"] else options["mix"],
+                "cached_ratio": (
+                    None if options["replay"] else options["cached_ratio"]),
+                "latency_scale": (
+                    options["latency_scale"] if options["serve"] else None),
+            },
+            "levels": levels,
+        }
+        if options["output"]:
+            with open(options["output"], "w") as f:
+                json.dump(report, f, indent=2)
+
+    def run(self, client, plan, options, record=None):
+        def send_all(requests, concurrency):
+            if record is not None:
+                for req in requests:
+                    record.write(json.dumps(req) + "\n")
+            return run_level(client, requests, concurrency)
+
+        warmup = plan.get_warmup_requests(options["warmup"])
+        if warmup:
+            outcomes, _wall_time = send_all(
+                warmup, max(options["concurrency"]))
+            n_errors = sum(1 for o in outcomes if _is_error(o[1]))
+            if n_errors:
+                self.stderr.write(
+                    "%d of %d warm up requests failed"
+                    % (n_errors, len(outcomes)))
+
+        levels = []
+        for concurrency in options["concurrency"]:
+            outcomes, wall_time = send_all(
+                plan.get_requests(options["requests"]), concurrency)
+            level = get_level_result(concurrency, outcomes, wall_time)
+            levels.append(level)
+            self.print_level(level)
+
+        self.print_curve(levels)
+        return levels
+
+    def print_level(self, level):
+        self.stdout.write(
+            "concurrency %3d  %8s req/s  p50 %9s ms  p95 %9s ms  "
+            "p99 %9s ms  errors %d/%d" % (
+                level["concurrency"], level["throughput_per_s"],
+                level["p50_ms"], level["p95_ms"], level["p99_ms"],
+                level["errors"], level["requests"]))
+        for label, summary in level["endpoints"].items():
+            self.stdout.write(
+                "    %-18s n %5d  p50 %9s ms  p95 %9s ms  p99 %9s ms  "
+                "errors %d" % (
+                    label, summary["requests"], summary["p50_ms"],
+                    summary["p95_ms"], summary["p99_ms"], summary["errors"]))
+
+    def print_curve(self, levels):
+        if len(levels) < 2:
+            return
+        self.stdout.write("Throughput curve:")
+        peak = max(level["throughput_per_s"] or 0 for level in levels) or 1
+        for level in levels:
+            throughput = level["throughput_per_s"] or 0
+            self.stdout.write("%5d %s %s" % (
+                level["concurrency"], "#" * int(round(40 * throughput / peak)),
+                throughput))
+
+
+class LocalServer(object):
+    """
+    Context manager serving the site in a thread, on a temporary database
+    and storage, with the stub toolchain of the benchmarks.
+
+    :return: (from ``__enter__``) a tuple of the base url and a token.
+    """
+
+    def __init__(self, latency_scale=1.):
+        self.latency_scale = latency_scale
+        self.stack = ExitStack()
+
+    def __enter__(self):
+        from benchmarks.runners import TestDatabase
+        from benchmarks.stub_toolchain import StubToolchain
+        from django.contrib.auth import get_user_model
+        from django.core.servers.basehttp import (
+            ThreadedWSGIServer, get_internal_wsgi_application)
+        from django.test.testcases import QuietWSGIRequestHandler
+        from rest_framework.authtoken.models import Token
+
+        try:
+            self.stack.enter_context(StubToolchain(self.latency_scale))
+
+            fd, sqlite_file = tempfile.mkstemp(prefix="l2i_loadtest_")
+            os.close(fd)
+            self.stack.enter_context(TestDatabase(sqlite_file=sqlite_file))
+
+            user = get_user_model().objects.create_user(
+                username="l2i_loadtest")
+            token, _ = Token.objects.get_or_create(user=user)
+
+            self.httpd = ThreadedWSGIServer(
+                ("127.0.0.1", 0), QuietWSGIRequestHandler)
+            self.httpd.set_app(get_internal_wsgi_application())
+            thread = threading.Thread(target=self.httpd.serve_forever)
+            thread.daemon = True
+            thread.start()
+            self.stack.callback(self.httpd.server_close)
+            self.stack.callback(self.httpd.shutdown)
+        except Exception:
+            self.stack.close()
+            raise
+
+        return ("http://127.0.0.1:%d" % self.httpd.server_address[1],
+                token.key)
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stack.close()
+
+# vim: foldmethod=marker
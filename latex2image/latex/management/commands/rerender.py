@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import division
+
+__copyright__ = "Copyright (C) 2020 Dong Zhuang"
+
+__license__ = """
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+"""
+
+import threading
+from time import perf_counter
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from latex.archive import RerenderPipeline
+
+
+class Command(BaseCommand):
+    help = (
+        "Render the conversions of the source archive "
+        "(settings.L2I_SOURCE_ARCHIVE) under the tex_keys of a key "
+        "version, ahead of switching settings.L2I_KEY_VERSION to it, "
+        "e.g., with a new TeX Live version. Existing results are skipped, "
+        "so the command can be interrupted and run again.")
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--key-version", default=None,
+            help="the key version to render, default to "
+                 "settings.L2I_KEY_VERSION")
+        parser.add_argument(
+            "--workers", type=int, default=1,
+            help="number of parallel conversions, default to 1")
+        parser.add_argument(
+            "--rate", type=float, default=None,
+            help="maximum number of conversions per second, default to "
+                 "no limit")
+        parser.add_argument(
+            "--batch-size", type=int, default=100,
+            help="number of archived conversions per batch, default to 100")
+        parser.add_argument(
+            "--state-file", default=None,
+            help="file saving the progress, to resume an interrupted run")
+        parser.add_argument(
+            "--progress-interval", type=float, default=10,
+            help="seconds between progress reports, default to 10")
+        parser.add_argument(
+            "--status", action="store_true",
+            help="only report how many archived conversions are rendered "
+                 "under the key version")
+
+    def handle(self, *args, **options):
+        key_version = options["key_version"]
+        if key_version is None:
+            key_version = getattr(settings, "L2I_KEY_VERSION", 1)
+
+        if options["workers"] < 1 or options["batch_size"] < 1:
+            raise CommandError("--workers and --batch-size must be positive")
+        if options["rate"] is not None and options["rate"] <= 0:
+            raise CommandError("--rate must be positive")
+
+        lock = threading.Lock()
+        last_report = [perf_counter()]
+
+        def report_progress(progress):
+            with lock:
+                now = perf_counter()
+                if (now - last_report[0] < options["progress_interval"]
+                        and progress.done < progress.total):
+                    return
+                last_report[0] = now
+            self.write_progress(progress.as_dict())
+
+        pipeline = RerenderPipeline(
+            key_version, workers=options["workers"], rate=options["rate"],
+            batch_size=options["batch_size"],
+            state_file=options["state_file"],
+            progress_callback=report_progress)
+
+        if options["status"]:
+            status = pipeline.get_status()
+            self.stdout.write(
+                "Key version %s: %d of %d archived conversions rendered, "
+                "%d missing" % (
+                    key_version, status["rendered"], status["total"],
+                    status["missing"]))
+            return
+
+        progress = pipeline.run()
+        result = progress.as_dict()
+        self.stdout.write(
+            "Done in %ss: %d rendered, %d compile errors, %d skipped "
+            "(already rendered), %d failed" % (
+                result["elapsed_s"], result["rendered"],
+                result["compile_error"], result["skipped"], result["failed"]))
+        if result["failed"]:
+            self.stdout.write(
+                "Failed conversions are retried by running the command "
+                "again.")
+
+    def write_progress(self, progress):
+        eta = progress["eta_s"]
+        self.stdout.write(
+            "%(done)d/%(total)d (%(percent)s%%) rendered %(rendered)d, "
+            "compile errors %(compile_error)d, skipped %(skipped)d, "
+            "failed %(failed)d, %(rate_per_s)s/s" % progress
+            + (", ETA %ss" % eta if eta is not None else ""))
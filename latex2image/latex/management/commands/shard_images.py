@@ -0,0 +1,170 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import division
+
+__copyright__ = "Copyright (C) 2020 Dong Zhuang"
+
+__license__ = """
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+"""
+
+import os
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management.base import BaseCommand, CommandError
+
+from latex.api import get_field_cache_key
+from latex.models import (UPLOAD_TO, LatexImage, ScaledImage, get_image_path,
+                          get_image_storage, move_storage_file)
+from latex.storage_manifest import get_storage_manifest
+
+
+def iter_image_file_names(storage, sharded):
+    """
+    Yield the storage names of the image files stored in the (*sharded* or
+    flat) layout.
+    """
+    if not storage.exists(UPLOAD_TO):
+        return
+
+    dirs, files = storage.listdir(UPLOAD_TO)
+    if not sharded:
+        for file_name in files:
+            yield "/".join([UPLOAD_TO, file_name])
+        return
+
+    for level1 in sorted(dirs):
+        level1_path = "/".join([UPLOAD_TO, level1])
+        for level2 in sorted(storage.listdir(level1_path)[0]):
+            level2_path = "/".join([level1_path, level2])
+            for file_name in storage.listdir(level2_path)[1]:
+                yield "/".join([level2_path, file_name])
+
+
+class Command(BaseCommand):
+    help = (
+        "Move the stored images to the sharded layout "
+        "(l2i_images/ab/cd/<tex_key>.<ext>, see settings.L2I_SHARDED_STORAGE)"
+        ", or back to the flat one, in parallel batches, and update the "
+        "image paths in the database and in the cache.")
+
+    requires_system_checks = []
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--to", choices=["sharded", "flat"], default="sharded",
+            help="the target layout, default to sharded")
+        parser.add_argument(
+            "--workers", type=int, default=8,
+            help="number of files moved in parallel, default to 8")
+        parser.add_argument(
+            "--batch-size", type=int, default=500,
+            help="number of files per batch, default to 500")
+        parser.add_argument(
+            "--dry-run", action="store_true",
+            help="only count the files to be moved")
+
+    def handle(self, *args, **options):
+        if options["workers"] < 1 or options["batch_size"] < 1:
+            raise CommandError("--workers and --batch-size must be positive")
+
+        to_sharded = options["to"] == "sharded"
+        storage = get_image_storage()
+        file_names = iter_image_file_names(storage, not to_sharded)
+
+        if options["dry_run"]:
+            n_files = sum(1 for _name in file_names)
+            self.stdout.write("%d files to be moved" % n_files)
+            return
+
+        try:
+            import django.core.cache as cache
+            def_cache = cache.caches["default"]
+        except ImproperlyConfigured:
+            def_cache = None
+
+        def move(names):
+            old_name, new_name = names
+            try:
+                move_storage_file(storage, old_name, new_name)
+            except Exception as e:
+                return "%s: %s: %s" % (old_name, type(e).__name__, str(e))
+            return None
+
+        manifest = get_storage_manifest()
+
+        def get_new_names(batch):
+            # The images rasterized at other scales are in the shard of
+            # the key of their result, not of their file name, see
+            # latex.models.scaled_image_upload_to
+            scaled_tex_keys = dict(
+                ScaledImage.objects.filter(image__in=batch)
+                .values_list("image", "result__tex_key"))
+            return [
+                (old_name, get_image_path(
+                    old_name.rsplit("/", 1)[-1], to_sharded,
+                    tex_key=scaled_tex_keys.get(old_name)),
+                 scaled_tex_keys.get(old_name))
+                for old_name in batch]
+
+        def update_paths(old_name, new_name, scaled_tex_key):
+            # Done in the main thread, with the database connection of the
+            # command
+            if scaled_tex_key is not None:
+                ScaledImage.objects.filter(image=old_name).update(
+                    image=new_name)
+                cache_key = get_field_cache_key(
+                    scaled_tex_key, "scaled_images")
+            else:
+                LatexImage.objects.filter(image=old_name).update(
+                    image=new_name)
+                cache_key = get_field_cache_key(
+                    os.path.splitext(old_name.rsplit("/", 1)[-1])[0],
+                    "image")
+            if manifest is not None:
+                manifest.discard([old_name])
+                manifest.add([new_name])
+            if def_cache is not None:
+                def_cache.delete(cache_key)
+
+        n_moved = n_failed = 0
+        with ThreadPoolExecutor(max_workers=options["workers"]) as executor:
+            while True:
+                batch = get_new_names(
+                    list(islice(file_names, options["batch_size"])))
+                if not batch:
+                    break
+                errors = executor.map(
+                    move, [(old_name, new_name)
+                           for old_name, new_name, _tex_key in batch])
+                for names, error in zip(batch, errors):
+                    if error is None:
+                        update_paths(*names)
+                        n_moved += 1
+                    else:
+                        n_failed += 1
+                        self.stderr.write(error)
+                self.stdout.write(
+                    "%d files moved, %d failed" % (n_moved, n_failed))
+
+        self.stdout.write(
+            "Done: %d files moved to the %s layout, %d failed"
+            % (n_moved, options["to"], n_failed))
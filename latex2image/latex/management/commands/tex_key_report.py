@@ -0,0 +1,156 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import division
+
+__copyright__ = "Copyright (C) 2020 Dong Zhuang"
+
+__license__ = """
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+"""
+
+import json
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+
+from latex.converter import build_key
+from latex.utils import CANONICALIZATION_UNSAFE_RE
+
+
+def iter_create_requests(path, compiler, image_format):
+    """
+    Yield (tex_source, compiler, image_format) of the create requests in
+    an NDJSON file (as written by ``loadtest --record``), of a .tex file,
+    or of the .tex files in a folder.
+    """
+    if os.path.isdir(path):
+        for root, _dirs, files in os.walk(path):
+            for filename in sorted(files):
+                if filename.endswith(".tex"):
+                    yield from iter_create_requests(
+                        os.path.join(root, filename), compiler, image_format)
+        return
+
+    if not os.path.isfile(path):
+        raise CommandError("No such file or directory: %s" % path)
+
+    with open(path, encoding="utf-8") as f:
+        if path.endswith(".tex"):
+            yield f.read(), compiler, image_format
+            return
+
+        for lineno, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                req = json.loads(line)
+            except ValueError as e:
+                raise CommandError("%s:%d: %s" % (path, lineno, e))
+            data = req.get("data") or {}
+            if req.get("endpoint") != "create" or "tex_source" not in data:
+                continue
+            yield (data["tex_source"],
+                   data.get("compiler", compiler),
+                   data.get("image_format", image_format))
+
+
+def get_hit_rate(n_requests, n_keys):
+    # Each distinct key compiles once, other requests hit an existing result
+    if not n_requests:
+        return None
+    return round((n_requests - n_keys) / n_requests, 4)
+
+
+class Command(BaseCommand):
+    help = (
+        "Estimate the hit rate gained by tex source canonicalization "
+        "(settings.L2I_CANONICALIZE_TEX_SOURCE): count the distinct keys "
+        "of the create requests recorded in NDJSON files, or of .tex "
+        "files, with and without canonicalization.")
+
+    requires_system_checks = []
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "paths", nargs="+", metavar="path",
+            help="NDJSON files of requests (see loadtest --record), .tex "
+                 "files or folders of .tex files")
+        parser.add_argument(
+            "--compiler", default="xelatex",
+            help="compiler of .tex files, default to xelatex")
+        parser.add_argument(
+            "--image-format", default="svg",
+            help="image format of .tex files, default to svg")
+        parser.add_argument(
+            "--json", action="store_true", help="output the report as JSON")
+
+    def handle(self, *args, **options):
+        n_requests = 0
+        n_unsafe = 0
+        verbatim_keys = set()
+        canonical_keys = set()
+
+        for path in options["paths"]:
+            for tex_source, compiler, image_format in iter_create_requests(
+                    path, options["compiler"], options["image_format"]):
+                n_requests += 1
+                tex_source = tex_source.strip()
+                verbatim_keys.add(
+                    build_key(tex_source, compiler, image_format,
+                              canonicalize=False))
+                canonical_keys.add(
+                    build_key(tex_source, compiler, image_format,
+                              canonicalize=True))
+                if CANONICALIZATION_UNSAFE_RE.search(tex_source):
+                    n_unsafe += 1
+
+        verbatim_hit_rate = get_hit_rate(n_requests, len(verbatim_keys))
+        canonical_hit_rate = get_hit_rate(n_requests, len(canonical_keys))
+        report = {
+            "requests": n_requests,
+            "verbatim_keys": len(verbatim_keys),
+            "canonical_keys": len(canonical_keys),
+            "verbatim_hit_rate": verbatim_hit_rate,
+            "canonical_hit_rate": canonical_hit_rate,
+            "hit_rate_gain": (
+                None if not n_requests
+                else round(canonical_hit_rate - verbatim_hit_rate, 4)),
+            "line_endings_only": n_unsafe,
+        }
+
+        if options["json"]:
+            self.stdout.write(json.dumps(report, indent=2))
+            return
+
+        if not n_requests:
+            self.stdout.write("No create requests found.")
+            return
+
+        self.stdout.write(
+            "Requests:                        %d\n"
+            "Distinct keys, verbatim:         %d (hit rate %.2f%%)\n"
+            "Distinct keys, canonical:        %d (hit rate %.2f%%)\n"
+            "Hit rate gain:                   %+.2f points\n"
+            "Only line endings canonicalized: %d (verbatim like content)" % (
+                n_requests,
+                len(verbatim_keys), verbatim_hit_rate * 100,
+                len(canonical_keys), canonical_hit_rate * 100,
+                report["hit_rate_gain"] * 100,
+                n_unsafe))
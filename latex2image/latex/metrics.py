@@ -0,0 +1,176 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import division
+
+__copyright__ = "Copyright (C) 2020 Dong Zhuang"
+
+__license__ = """
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+"""
+
+import os
+
+from django.http import Http404, HttpResponse
+from django.utils.crypto import constant_time_compare
+from prometheus_client import (CONTENT_TYPE_LATEST, REGISTRY,
+                               CollectorRegistry, Counter, Gauge, Histogram,
+                               generate_latest, multiprocess)
+
+# When running with multiple (gunicorn) worker processes, the environment
+# variable PROMETHEUS_MULTIPROC_DIR must point to an empty directory shared
+# by the workers, so that the metrics of all workers are aggregated. See
+# start-server.sh and gunicorn.conf.py.
+
+# {{{ metrics
+
+COMPILE_DURATION = Histogram(
+    "l2i_compile_duration_seconds",
+    "Time spent converting tex source to image (compile and convert).",
+    ["compiler", "image_format"],
+    buckets=(.1, .25, .5, 1, 2, 4, 8, 15, 30, 60, float("inf")))
+
+COMPILE_ERRORS = Counter(
+    "l2i_compile_errors_total",
+    "Failed conversions, by exception class.",
+    ["compiler", "image_format", "exception"])
+
+COMPILES_IN_PROGRESS = Gauge(
+    "l2i_compiles_in_progress",
+    "Conversions currently running.",
+    multiprocess_mode="livesum")
+
+REQUESTS_IN_PROGRESS = Gauge(
+    "l2i_requests_in_progress",
+    "Requests currently being processed, i.e., busy workers.",
+    multiprocess_mode="livesum")
+
+ACTIVE_SUBPROCESSES = Gauge(
+    "l2i_active_subprocesses",
+    "Subprocesses (compilers, converters) currently running.",
+    multiprocess_mode="livesum")
+
+CACHE_LOOKUPS = Counter(
+    "l2i_cache_lookups_total",
+    "Cache lookups of a field by tex_key.",
+    ["field", "result"])
+
+TEX_KEY_LOOKUPS = Counter(
+    "l2i_tex_key_lookups_total",
+    "Database lookups of existing results on create; legacy_hit are the "
+    "results found under the key of the verbatim source.",
+    ["result"])
+
+STORAGE_SAVES = Counter(
+    "l2i_storage_saves_total",
+    "Image saves to the storage; unchanged are those skipped because the "
+    "same content was already stored.",
+    ["result"])
+
+WRITE_BEHIND_OPERATIONS = Counter(
+    "l2i_write_behind_total",
+    "Results queued, committed, committed already (duplicate) or failed to "
+    "commit in write behind mode.",
+    ["result"])
+
+STORAGE_CACHE_LOOKUPS = Counter(
+    "l2i_storage_cache_lookups_total",
+    "Lookups of storage files in the local disk cache.",
+    ["operation", "result"])
+
+STORAGE_MANIFEST_LOOKUPS = Counter(
+    "l2i_storage_manifest_lookups_total",
+    "Existence checks of image files answered by the storage manifest.",
+    ["result"])
+
+IMAGE_BLOB_OPERATIONS = Counter(
+    "l2i_image_blobs_total",
+    "Content addressed image blobs created, shared by another result, "
+    "released by a result, and deleted with their last result.",
+    ["result"])
+
+IMAGE_OPTIMIZATION_BYTES = Counter(
+    "l2i_image_optimization_bytes_total",
+    "Bytes of the converted images before and after their optimization.",
+    ["image_format", "stage"])
+
+STORAGE_OPERATION_DURATION = Histogram(
+    "l2i_storage_operation_duration_seconds",
+    "Time spent in storage operations.",
+    ["operation"],
+    buckets=(.005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, float("inf")))
+
+# }}}
+
+
+def observe_storage_operation(operation):
+    """
+    Context manager timing a storage operation, e.g.,
+    ``with observe_storage_operation("exists"): ...``
+    """
+    return STORAGE_OPERATION_DURATION.labels(operation=operation).time()
+
+
+def get_registry():
+    if "PROMETHEUS_MULTIPROC_DIR" in os.environ:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return registry
+    return REGISTRY
+
+
+class RequestsInProgressMiddleware(object):
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        with REQUESTS_IN_PROGRESS.track_inprogress():
+            return self.get_response(request)
+
+
+def is_metrics_request_authorized(request):
+    """
+    :return: whether *request* is from a staff user, or has the bearer token
+        of settings.L2I_METRICS_TOKEN (e.g., from a Prometheus scraper).
+    """
+    from django.conf import settings
+    token = getattr(settings, "L2I_METRICS_TOKEN", None)
+    if token:
+        scheme, _sep, value = request.META.get(
+            "HTTP_AUTHORIZATION", "").partition(" ")
+        if (scheme.lower() == "bearer"
+                and constant_time_compare(value.strip(), token)):
+            return True
+    user = getattr(request, "user", None)
+    return bool(user is not None and user.is_authenticated and user.is_staff)
+
+
+def metrics_view(request):
+    from django.conf import settings
+    if not getattr(settings, "L2I_METRICS", False):
+        raise Http404()
+
+    if not is_metrics_request_authorized(request):
+        response = HttpResponse(status=401)
+        response["WWW-Authenticate"] = "Bearer"
+        return response
+
+    return HttpResponse(
+        generate_latest(get_registry()), content_type=CONTENT_TYPE_LATEST)
+
+# vim: foldmethod=marker
@@ -0,0 +1,46 @@
+# Generated by Django 3.2.15 on 2026-10-19 10:08
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('latex', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivedTexSource',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('digest', models.CharField(db_index=True, max_length=64, unique=True, verbose_name='Digest')),
+                ('data', models.BinaryField(verbose_name='Compressed source')),
+                ('creation_time', models.DateTimeField(default=django.utils.timezone.now, verbose_name='Creation time')),
+            ],
+            options={
+                'verbose_name': 'Archived tex source',
+                'verbose_name_plural': 'Archived tex sources',
+            },
+        ),
+        migrations.CreateModel(
+            name='ArchivedConversion',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('compiler', models.CharField(max_length=30, verbose_name='Compiler')),
+                ('image_format', models.CharField(max_length=10, verbose_name='Image format')),
+                ('creation_time', models.DateTimeField(default=django.utils.timezone.now, verbose_name='Creation time')),
+                ('creator', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL, verbose_name='Creator')),
+                ('source', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='latex.archivedtexsource', verbose_name='Source')),
+            ],
+            options={
+                'verbose_name': 'Archived conversion',
+                'verbose_name_plural': 'Archived conversions',
+                'unique_together': {('source', 'compiler', 'image_format')},
+            },
+        ),
+    ]
@@ -0,0 +1,20 @@
+# Generated by Django 3.2.15 on 2026-10-19 10:14
+
+from django.db import migrations, models
+
+import latex.models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('latex', '0002_archived_tex_source'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='lateximage',
+            name='image',
+            field=models.ImageField(blank=True, null=True, storage=latex.models.OverwriteStorage(), upload_to=latex.models.image_upload_to),
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 3.2.15 on 2026-10-19 10:26
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('latex', '0003_image_upload_to'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CreatorUsage',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('n_objects', models.BigIntegerField(default=0, verbose_name='Objects')),
+                ('n_bytes', models.BigIntegerField(default=0, verbose_name='Bytes')),
+                ('creator', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='l2i_usage', to=settings.AUTH_USER_MODEL, verbose_name='Creator')),
+            ],
+            options={
+                'verbose_name': 'Creator usage',
+                'verbose_name_plural': 'Creator usages',
+            },
+        ),
+    ]
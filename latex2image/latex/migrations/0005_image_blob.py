@@ -0,0 +1,37 @@
+# Generated by Django 3.2.15 on 2026-10-19 10:30
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+import latex.models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('latex', '0004_creator_usage'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ImageBlob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('digest', models.CharField(db_index=True, max_length=64, unique=True, verbose_name='Digest')),
+                ('image', models.FileField(storage=latex.models.OverwriteStorage(), upload_to='l2i_blobs', verbose_name='Image')),
+                ('size', models.BigIntegerField(default=0, verbose_name='Size')),
+                ('ref_count', models.PositiveIntegerField(default=0, verbose_name='Reference count')),
+                ('creation_time', models.DateTimeField(default=django.utils.timezone.now, verbose_name='Creation time')),
+            ],
+            options={
+                'verbose_name': 'Image blob',
+                'verbose_name_plural': 'Image blobs',
+            },
+        ),
+        migrations.AddField(
+            model_name='lateximage',
+            name='blob',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='images', to='latex.imageblob', verbose_name='Blob'),
+        ),
+    ]
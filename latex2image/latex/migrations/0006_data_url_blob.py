@@ -0,0 +1,96 @@
+# Generated by Django 3.2.15 on 2026-10-19 10:34
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+BATCH_SIZE = 500
+
+
+def get_data_url_size(data_url):
+    """
+    The size in bytes of the image in *data_url*, without decoding it.
+    Copied from :mod:`latex.models` as of this migration, which must not
+    change with it.
+    """
+    if not data_url:
+        return 0
+    start = data_url.index("base64,") + 7
+    n_padding = (
+        2 if data_url.endswith("==") else 1 if data_url.endswith("=") else 0)
+    return (len(data_url) - start) // 4 * 3 - n_padding
+
+
+def iter_pk_batches(queryset, batch_size=BATCH_SIZE):
+    """
+    Yield the (pk, ...) rows of *queryset* in batches ordered by pk, each
+    one queried after the previous one is handled, so that the table is
+    never loaded as a whole.
+    """
+    last_pk = None
+    while True:
+        batch = queryset.order_by("pk")
+        if last_pk is not None:
+            batch = batch.filter(pk__gt=last_pk)
+        batch = list(batch[:batch_size])
+        if not batch:
+            return
+        yield batch
+        last_pk = batch[-1][0]
+
+
+def move_data_urls_to_blobs(apps, schema_editor):
+    LatexImage = apps.get_model("latex", "LatexImage")
+    DataUrlBlob = apps.get_model("latex", "DataUrlBlob")
+
+    queryset = LatexImage.objects.filter(
+        data_url__isnull=False).values_list("pk", "data_url")
+    for batch in iter_pk_batches(queryset):
+        # Moved already by an interrupted run (the migration is not atomic)
+        moved = set(DataUrlBlob.objects.filter(
+            pk__in=[pk for pk, _data_url in batch]
+        ).values_list("pk", flat=True))
+        DataUrlBlob.objects.bulk_create([
+            DataUrlBlob(
+                result_id=pk, data_url=data_url,
+                size=get_data_url_size(data_url))
+            for pk, data_url in batch if pk not in moved])
+
+
+def move_data_urls_back(apps, schema_editor):
+    LatexImage = apps.get_model("latex", "LatexImage")
+    DataUrlBlob = apps.get_model("latex", "DataUrlBlob")
+
+    queryset = DataUrlBlob.objects.values_list("pk", "data_url")
+    for batch in iter_pk_batches(queryset):
+        for pk, data_url in batch:
+            LatexImage.objects.filter(pk=pk).update(data_url=data_url)
+
+
+class Migration(migrations.Migration):
+    # Each batch is committed on its own, not to hold all the data urls in
+    # one transaction
+    atomic = False
+
+    dependencies = [
+        ('latex', '0005_image_blob'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DataUrlBlob',
+            fields=[
+                ('result', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='data_url_blob', serialize=False, to='latex.lateximage', verbose_name='Result')),
+                ('data_url', models.TextField(verbose_name='Data Url')),
+                ('size', models.BigIntegerField(default=0, verbose_name='Size')),
+            ],
+            options={
+                'verbose_name': 'Data url blob',
+                'verbose_name_plural': 'Data url blobs',
+            },
+        ),
+        migrations.RunPython(move_data_urls_to_blobs, move_data_urls_back),
+        migrations.RemoveField(
+            model_name='lateximage',
+            name='data_url',
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 3.2.15 on 2026-10-19 10:38
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('latex', '0006_data_url_blob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='dataurlblob',
+            name='data',
+            field=models.BinaryField(blank=True, null=True, verbose_name='Compressed data'),
+        ),
+        migrations.AddField(
+            model_name='dataurlblob',
+            name='encoding',
+            field=models.CharField(blank=True, max_length=10, verbose_name='Encoding'),
+        ),
+        migrations.AddField(
+            model_name='dataurlblob',
+            name='mime_type',
+            field=models.CharField(blank=True, max_length=50, verbose_name='Mime type'),
+        ),
+        migrations.AlterField(
+            model_name='dataurlblob',
+            name='data_url',
+            field=models.TextField(blank=True, verbose_name='Data Url'),
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 3.2.15 on 2026-10-19 10:59
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+import latex.models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('latex', '0007_data_url_blob_compression'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ScaledImage',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('scale', models.FloatField(verbose_name='Scale')),
+                ('image', models.FileField(storage=latex.models.OverwriteStorage(), upload_to=latex.models.scaled_image_upload_to, verbose_name='Image')),
+                ('result', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='scaled_images', to='latex.lateximage', verbose_name='Result')),
+            ],
+            options={
+                'verbose_name': 'Scaled image',
+                'verbose_name_plural': 'Scaled images',
+                'unique_together': {('result', 'scale')},
+            },
+        ),
+    ]
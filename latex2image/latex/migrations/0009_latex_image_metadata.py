@@ -0,0 +1,28 @@
+# Generated by Django 3.2.15 on 2026-10-19 11:09
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('latex', '0008_scaled_image'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='lateximage',
+            name='depth',
+            field=models.FloatField(blank=True, help_text='Below the baseline', null=True, verbose_name='Depth'),
+        ),
+        migrations.AddField(
+            model_name='lateximage',
+            name='height',
+            field=models.FloatField(blank=True, help_text='Above the baseline', null=True, verbose_name='Height'),
+        ),
+        migrations.AddField(
+            model_name='lateximage',
+            name='width',
+            field=models.FloatField(blank=True, null=True, verbose_name='Width'),
+        ),
+    ]
@@ -23,48 +23,478 @@ THE SOFTWARE.
 """
 
 import io
+import os
+import zlib
+from binascii import a2b_base64
+from hashlib import md5, sha256
 from mimetypes import guess_type
+from typing import Any, Dict, List, Optional, Text, Tuple  # noqa
 from urllib.parse import urljoin
 
 from django.conf import settings
 from django.core.exceptions import ValidationError
-from django.core.files.storage import default_storage, get_storage_class
-from django.core.files.uploadedfile import InMemoryUploadedFile
+from django.core.files.base import ContentFile, File
+from django.core.files.storage import get_storage_class
 from django.core.validators import validate_slug
-from django.db import models
+from django.db import (DEFAULT_DB_ALIAS, IntegrityError, connections, models,
+                       transaction)
 from django.utils.html import mark_safe
 from django.utils.timezone import now
 from django.utils.translation import gettext_lazy as _
 
+from latex.compression import (COMPRESSED_EXTENSIONS, SVG_MIME_TYPE,
+                               CompressedDataUrl, compress, compress_data_url,
+                               decompress, decompress_data_url,
+                               get_data_url_compression,
+                               get_file_name_encoding, split_data_url)
+from latex.constants import IMAGE_FORMAT_MIME_TYPES
+from latex.metrics import (IMAGE_BLOB_OPERATIONS, STORAGE_SAVES,
+                           observe_storage_operation)
+from latex.storage_cache import DiskCachedStorageMixin
+from latex.storage_manifest import ManifestStorageMixin
+from latex.timing import span
 from latex.utils import get_data_url_from_buf_and_mimetype
 
 UPLOAD_TO = "l2i_images"
+BLOB_UPLOAD_TO = "l2i_blobs"
+COMPILED_UPLOAD_TO = "l2i_compiled"
+
+_NOT_LOADED = object()
+
+
+# {{{ image storage layout
+
+def is_sharded_storage_enabled():
+    # type: () -> bool
+    return getattr(settings, "L2I_SHARDED_STORAGE", False)
+
+
+def get_image_shard(tex_key):
+    # type: (Text) -> Tuple[Text, Text]
+    """
+    :return: the two levels of folders of the image of *tex_key* in the
+        sharded layout, taken from the hash of the key, so that they are
+        evenly used whatever the keys look like.
+    """
+    digest = md5(tex_key.encode("utf-8")).hexdigest()
+    return digest[:2], digest[2:4]
+
+
+def get_image_path(file_name, sharded=None, tex_key=None):
+    # type: (Text, Optional[bool], Optional[Text]) -> Text
+    """
+    :param file_name: the image file name, i.e., ``<tex_key>.<ext>``.
+    :param sharded: whether to use the sharded layout
+        (``l2i_images/ab/cd/<tex_key>.<ext>``) or the flat one
+        (``l2i_images/<tex_key>.<ext>``), default to
+        settings.L2I_SHARDED_STORAGE.
+    :param tex_key: the key the shard is taken from, default to
+        *file_name* without the extension.
+    :return: the storage path of the image.
+    """
+    if sharded is None:
+        sharded = is_sharded_storage_enabled()
+    if not sharded:
+        return "/".join([UPLOAD_TO, file_name])
+    if tex_key is None:
+        tex_key = os.path.splitext(file_name)[0]
+    return "/".join([UPLOAD_TO, *get_image_shard(tex_key), file_name])
+
+
+def get_image_path_candidates(file_name):
+    # type: (Text) -> List[Text]
+    """
+    :return: the storage paths where the image may be, the one of the
+        configured layout first.
+    """
+    sharded = is_sharded_storage_enabled()
+    return [get_image_path(file_name, sharded),
+            get_image_path(file_name, not sharded)]
+
+
+def image_upload_to(instance, filename):
+    return get_image_path(filename)
+
+
+def format_scale(scale):
+    # type: (float) -> Text
+    return ("%f" % scale).rstrip("0").rstrip(".")
+
+
+def get_scaled_image_file_name(tex_key, scale, ext):
+    # type: (Text, float, Text) -> Text
+    """
+    :return: the file name of the image of *tex_key* rasterized at *scale*
+        times the resolution, i.e., ``<tex_key>-<scale>x<ext>`` (storages
+        drop the "@" of the usual ``@2x``).
+    """
+    return "%s-%sx%s" % (tex_key, format_scale(scale), ext)
+
+
+def scaled_image_upload_to(instance, filename):
+    # Next to the image of the result
+    return get_image_path(filename, tex_key=instance.result.tex_key)
+
+
+def is_dedup_storage_enabled():
+    # type: () -> bool
+    return getattr(settings, "L2I_DEDUP_STORAGE", False)
+
+
+def get_blob_path(digest, ext):
+    # type: (Text, Text) -> Text
+    """
+    :return: the storage path of the image blob whose content has the sha256
+        hex *digest*, i.e., ``l2i_blobs/ab/cd/<digest><ext>``.
+    """
+    return "/".join([BLOB_UPLOAD_TO, digest[:2], digest[2:4], digest + ext])
+
+
+def get_compiled_file_path(source_key, ext):
+    # type: (Text, Text) -> Text
+    """
+    :return: the storage path of the compiled file kept for the source
+        key *source_key* (see :mod:`latex.variants`), i.e.,
+        ``l2i_compiled/ab/cd/<source_key><ext>``.
+    """
+    return "/".join(
+        [COMPILED_UPLOAD_TO, source_key[:2], source_key[2:4], source_key + ext])
+
+# }}}
+
+
+# {{{ counters
+
+def is_mongodb(using=DEFAULT_DB_ALIAS):
+    # type: (Text) -> bool
+    return connections[using].vendor == "djongo"
+
+
+def get_mongodb_collection(model, using=DEFAULT_DB_ALIAS):
+    # type: (Any, Text) -> Any
+    """
+    :return: the pymongo collection of *model*, with djongo.
+    """
+    connection = connections[using]
+    connection.ensure_connection()
+    return connection.connection[model._meta.db_table]
+
+
+def increment_fields(model, filters, **deltas):
+    # type: (Any, Dict[Text, Any], **int) -> int
+    """
+    Add *deltas* to the fields of the rows of *model* matching *filters*
+    (exact, ``__gt``, ``__gte``, ``__lt`` or ``__lte`` lookups of concrete
+    fields), atomically per row. djongo does not translate ``F()``
+    expressions in updates (it only sets values) and has no transactions,
+    thus with MongoDB the rows are updated by ``$inc`` on the collection.
+
+    :return: the number of rows matched.
+    """
+    if not is_mongodb():
+        return model.objects.filter(**filters).update(**{
+            name: models.F(name) + delta for name, delta in deltas.items()})
+
+    def get_column(name):
+        # type: (Text) -> Text
+        field = (model._meta.pk if name == "pk"
+                 else model._meta.get_field(name))
+        return field.column
+
+    query = {}  # type: Dict[Text, Any]
+    for lookup, value in filters.items():
+        name, _sep, operator = lookup.partition("__")
+        if operator:
+            assert operator in ("gt", "gte", "lt", "lte")
+            query.setdefault(get_column(name), {})["$" + operator] = value
+        else:
+            query[get_column(name)] = value
+
+    return get_mongodb_collection(model).update_many(
+        query, {"$inc": {get_column(name): delta
+                         for name, delta in deltas.items()}}).matched_count
+
+# }}}
 
 
 def convert_data_url_to_image_obj(data_url):
-    from binascii import a2b_base64
     return a2b_base64(data_url)
 
 
-def make_image_file(data_url, file_base_name):
-    output = io.BytesIO(
-        convert_data_url_to_image_obj(data_url[data_url.index("base64,") + 7:]))
+def get_base64_decoded_size(b64, start=0):
+    # type: (Text, int) -> int
+    n_padding = 2 if b64.endswith("==") else 1 if b64.endswith("=") else 0
+    return (len(b64) - start) // 4 * 3 - n_padding
+
+
+def get_data_url_size(data_url):
+    # type: (Optional[Text]) -> int
+    """
+    :return: the size in bytes of the image in *data_url*, without decoding
+        it, 0 if None.
+    """
+    if not data_url:
+        return 0
+    return get_base64_decoded_size(data_url, data_url.index("base64,") + 7)
+
+
+class Base64DecodingStream(io.RawIOBase):
+    """
+    Readable and seekable stream of the bytes encoded in ``b64[start:]``,
+    decoded piece by piece as it is read, so that the decoded content is
+    never held in memory as a whole.
+    """
+
+    def __init__(self, b64, start=0):
+        # type: (Text, int) -> None
+        super().__init__()
+        self._b64 = b64
+        self._start = start
+        self._pos = 0
+        self.size = get_base64_decoded_size(b64, start)
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._pos
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self._pos
+        elif whence == io.SEEK_END:
+            offset += self.size
+        self._pos = max(offset, 0)
+        return self._pos
+
+    def readinto(self, b):
+        n = min(len(b), self.size - self._pos)
+        if n <= 0:
+            return 0
+
+        # Decode whole 4 characters groups around the requested bytes
+        skip = self._pos % 3
+        first = self._start + self._pos // 3 * 4
+        last = first + (skip + n + 2) // 3 * 4
+        b[:n] = a2b_base64(self._b64[first:last])[skip:skip + n]
+        self._pos += n
+        return n
+
+
+def get_image_ext(data_url):
+    # type: (Text) -> Text
+    encoding = get_data_url_compression(data_url)
+    if encoding is not None:
+        return COMPRESSED_EXTENSIONS[encoding]
     mime_type = data_url[5: data_url.index(";")]
-    if mime_type == "image/png":
-        ext = ".png"
-    else:
-        ext = ".svg"
+    for image_format, format_mime_type in IMAGE_FORMAT_MIME_TYPES.items():
+        if mime_type == format_mime_type:
+            return ".%s" % image_format
+    return ".svg"
+
+
+def make_image_file(data_url, file_base_name):
+    name = "%s%s" % (file_base_name, get_image_ext(data_url))
+    encoding = get_data_url_compression(data_url)
+    if encoding is not None:
+        content = ContentFile(
+            compress(split_data_url(data_url)[1], encoding), name=name)
+        # Taken by storages like S3 as the metadata of the file, while the
+        # Content-Encoding is guessed from the name
+        content.content_type = SVG_MIME_TYPE
+        return content
+
+    return File(
+        Base64DecodingStream(data_url, data_url.index("base64,") + 7),
+        name=name)
+
+
+def get_image_mime_type(name):
+    # type: (Text) -> Optional[Text]
+    encoding = get_file_name_encoding(name)
+    if encoding is not None:
+        name = name[:-len(COMPRESSED_EXTENSIONS[encoding])] + ".svg"
+    return guess_type(name)[0]
+
+
+def read_image_data_url(storage, name):
+    # type: (Any, Text) -> Text
+    """
+    :return: the data_url of the image file *name*, decompressed if needed.
+    """
+    with storage.open(name) as f:
+        buf = f.read()
+    encoding = get_file_name_encoding(name)
+    if encoding is not None:
+        buf = decompress(buf, encoding)
+    return get_data_url_from_buf_and_mimetype(
+        buf=buf, mime_type=get_image_mime_type(name))
 
-    return InMemoryUploadedFile(
-        output, 'SVGAndImageFormField', "%s%s" % (file_base_name, ext),
-        mime_type, output.tell(), None)
 
+def get_content_hexdigest(content, hash_factory):
+    # type: (File, Any) -> Text
+    content_hash = hash_factory()
+    for chunk in content.chunks():
+        content_hash.update(chunk)
+    return content_hash.hexdigest()
 
-class OverwriteStorage(get_storage_class()):
+
+def get_content_md5(content):
+    # type: (File) -> Text
+    return get_content_hexdigest(content, md5)
+
+
+class OverwriteStorage(
+        ManifestStorageMixin, DiskCachedStorageMixin, get_storage_class()):
     def get_available_name(self, name, max_length=None):
-        self.delete(name)
+        # The existing file is deleted in _save, only if its content changed
         return name
 
+    def get_stored_md5(self, name):
+        # type: (Text) -> Optional[Text]
+        """
+        :return: the md5 hex digest of the file stored as *name*, or None if
+            it can't be known.
+        :raises FileNotFoundError: if no file is stored as *name*.
+        """
+        meta = getattr(self, "meta", None)
+        if meta is not None:
+            # django-s3-storage: the ETag of an object uploaded in one part
+            # is the md5 of its content (unless gzipped, in which case the
+            # content is always uploaded again).
+            etag = meta(name).get("ETag", "").strip('"')
+            return etag if len(etag) == 32 else None
+
+        try:
+            path = self.path(name)
+        except NotImplementedError:
+            return None
+
+        md5_hash = md5()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(File.DEFAULT_CHUNK_SIZE), b""):
+                md5_hash.update(chunk)
+        return md5_hash.hexdigest()
+
+    def _save(self, name, content):
+        exists = True
+        try:
+            with observe_storage_operation("stat"):
+                stored_md5 = self.get_stored_md5(name)
+        except FileNotFoundError:
+            exists = False
+        except Exception:
+            stored_md5 = None
+
+        if exists:
+            if stored_md5 is not None and stored_md5 == get_content_md5(content):
+                STORAGE_SAVES.labels(result="unchanged").inc()
+                return name
+            self.delete(name)
+
+        with span("storage_upload"), observe_storage_operation("save"):
+            name = super()._save(name, content)
+        STORAGE_SAVES.labels(result="uploaded").inc()
+        return name
+
+    def delete(self, name):
+        with observe_storage_operation("delete"):
+            return super().delete(name)
+
+
+class ImageBlob(models.Model):
+    """
+    An image stored once under the sha256 digest of its content, and
+    shared by the results which render to the same bytes (with
+    settings.L2I_DEDUP_STORAGE). *ref_count* is the number of results
+    referencing it, it is deleted with its file once released by the last
+    one.
+    """
+    digest = models.CharField(
+        max_length=64, unique=True, db_index=True, verbose_name=_('Digest'))
+    image = models.FileField(
+        upload_to=BLOB_UPLOAD_TO, storage=OverwriteStorage(),
+        verbose_name=_('Image'))
+    size = models.BigIntegerField(default=0, verbose_name=_('Size'))
+    ref_count = models.PositiveIntegerField(
+        default=0, verbose_name=_('Reference count'))
+    creation_time = models.DateTimeField(
+        blank=False, default=now, verbose_name=_('Creation time'))
+
+    class Meta:
+        verbose_name = _("Image blob")
+        verbose_name_plural = _("Image blobs")
+
+    @classmethod
+    def acquire(cls, data_url):
+        # type: (Text) -> ImageBlob
+        """
+        :return: the blob of the image in *data_url*, with one more
+            reference, stored and created if needed.
+        """
+        content = make_image_file(data_url, "blob")
+        with span("blob_digest"):
+            digest = get_content_hexdigest(content, sha256)
+
+        for _i in range(2):
+            if increment_fields(cls, {"digest": digest}, ref_count=1):
+                IMAGE_BLOB_OPERATIONS.labels(result="shared").inc()
+                return cls.objects.get(digest=digest)
+
+            # Stored before the row is created, so that a blob never
+            # references a missing file
+            name = get_blob_path(digest, get_image_ext(data_url))
+            cls._meta.get_field("image").storage.save(name, content)
+            try:
+                with transaction.atomic():
+                    blob = cls.objects.create(
+                        digest=digest, image=name, size=content.size,
+                        ref_count=1)
+            except IntegrityError:
+                # Created concurrently, reference it
+                continue
+            IMAGE_BLOB_OPERATIONS.labels(result="created").inc()
+            return blob
+
+        raise IntegrityError("Failed to acquire the blob '%s'" % digest)
+
+    @classmethod
+    def release(cls, pk):
+        # type: (int) -> None
+        """
+        Drop a reference to the blob *pk*, and delete it if it was the last
+        one.
+        """
+        # Not with select_for_update(), which djongo lacks, see
+        # increment_fields
+        if increment_fields(cls, {"pk": pk, "ref_count__gt": 1},
+                            ref_count=-1):
+            IMAGE_BLOB_OPERATIONS.labels(result="released").inc()
+            return
+
+        blob = cls.objects.filter(pk=pk).first()
+        if blob is None:
+            return
+        IMAGE_BLOB_OPERATIONS.labels(result="released").inc()
+
+        # Counted, not to delete the image of results whose references
+        # were lost (e.g., by a failed save)
+        n_refs = blob.images.count()
+        if n_refs:
+            cls.objects.filter(pk=pk).update(ref_count=n_refs)
+            return
+
+        # Unless acquired meanwhile. The file is deleted by
+        # latex.receivers.blob_delete
+        if cls.objects.filter(pk=pk, ref_count__lte=1).delete()[0]:
+            IMAGE_BLOB_OPERATIONS.labels(result="deleted").inc()
+
+    def __repr__(self):
+        return "<digest:%s, ref_count:%d>" % (self.digest, self.ref_count)
+
 
 class LatexImage(models.Model):
     tex_key = models.TextField(
@@ -73,18 +503,63 @@ class LatexImage(models.Model):
     creation_time = models.DateTimeField(
         blank=False, default=now, verbose_name=_('Creation time'))
     image = models.ImageField(
-        null=True, blank=True, upload_to=UPLOAD_TO, storage=OverwriteStorage())
-    data_url = models.TextField(null=True, blank=True, verbose_name=_('Data Url'))
+        null=True, blank=True, upload_to=image_upload_to,
+        storage=OverwriteStorage())
     compile_error = models.TextField(
         null=True, blank=True, verbose_name=_('Compile Error'))
     creator = models.ForeignKey(
         settings.AUTH_USER_MODEL, verbose_name=_('Creator'),
         on_delete=models.CASCADE)
+    blob = models.ForeignKey(
+        ImageBlob, null=True, blank=True, verbose_name=_('Blob'),
+        on_delete=models.PROTECT, related_name="images")
+
+    # The dimensions of the image in pt, for results compiled on a tight
+    # page (see latex.utils.get_preview_metadata), e.g., to align the
+    # baseline of the image with the surrounding text.
+    width = models.FloatField(
+        null=True, blank=True, verbose_name=_('Width'))
+    height = models.FloatField(
+        null=True, blank=True, verbose_name=_('Height'),
+        help_text=_("Above the baseline"))
+    depth = models.FloatField(
+        null=True, blank=True, verbose_name=_('Depth'),
+        help_text=_("Below the baseline"))
+
+    # The data_url is stored apart (see DataUrlBlob), not to be read by
+    # every query of results, and loaded when first accessed.
+    _data_url = _NOT_LOADED
+    _data_url_changed = False
 
     class Meta:
         verbose_name = _("LaTeXImage")
         verbose_name_plural = _("LaTeXImages")
 
+    @property
+    def data_url(self):
+        # type: () -> Optional[Text]
+        if self._data_url is _NOT_LOADED:
+            self._data_url = None
+            if self.pk is not None:
+                with span("data_url_load"):
+                    try:
+                        # Prefetched by LatexImageList
+                        self._data_url = self.data_url_blob.get_data_url()
+                    except DataUrlBlob.DoesNotExist:
+                        pass
+        return self._data_url
+
+    @data_url.setter
+    def data_url(self, value):
+        # type: (Optional[Text]) -> None
+        self._data_url = value
+        self._data_url_changed = True
+
+    def refresh_from_db(self, *args, **kwargs):
+        super().refresh_from_db(*args, **kwargs)
+        self.__dict__.pop("_data_url", None)
+        self.__dict__.pop("_data_url_changed", None)
+
     def _get_changed_fields(self):
         # Get updated_fields: https://stackoverflow.com/a/55005137/3437454
         # This method should only be used before saving.
@@ -99,7 +574,7 @@ class LatexImage(models.Model):
             # This gets the newly instantiated Mode object with the new values.
             new = self
             changed_fields = []
-            for field in cls._meta.get_fields():
+            for field in cls._meta.concrete_fields:
                 field_name = field.name
                 try:
                     if getattr(old, field_name) != getattr(new, field_name):
@@ -107,6 +582,13 @@ class LatexImage(models.Model):
                 except Exception:
                     # Catch field does not exist exception
                     pass
+
+            if self._data_url_changed:
+                old_blob = DataUrlBlob.objects.filter(pk=self.pk).first()
+                old_data_url = (
+                    old_blob.get_data_url() if old_blob is not None else None)
+                if old_data_url != self._data_url:
+                    changed_fields.append("data_url")
             return changed_fields
         return []
 
@@ -114,17 +596,61 @@ class LatexImage(models.Model):
         # https://stackoverflow.com/a/18803218/3437454
         changed_fields = self._get_changed_fields()
 
+        acquired_blob_id = released_blob_id = replaced_name = None
         if (self.data_url and not self.image) or "data_url" in changed_fields:
-            self.image = make_image_file(self.data_url, self.tex_key)
+            released_blob_id = self.blob_id
+            if self.image and self.blob_id is None:
+                replaced_name = self.image.name
+
+            if is_dedup_storage_enabled():
+                self.blob = ImageBlob.acquire(self.data_url)
+                acquired_blob_id = self.blob_id
+                self.image = self.blob.image.name
+            else:
+                self.blob = None
+                self.image = make_image_file(self.data_url, self.tex_key)
 
         if self.image and not self.data_url:
-            file = default_storage.open(self.image.name)
-            self.data_url = get_data_url_from_buf_and_mimetype(
-                buf=file.read(), mime_type=guess_type(self.image.name)[0])
-            file.close()
+            with span("storage_read"), observe_storage_operation("open"):
+                self.data_url = read_image_data_url(
+                    self.image.storage, self.image.name)
 
-        self.full_clean()
-        return super().save(**kwargs)
+        adding = self._state.adding
+        try:
+            with span("full_clean"):
+                self.full_clean()
+            with span("db_save"):
+                result = super().save(**kwargs)
+                self._save_data_url(adding)
+        except Exception:
+            if acquired_blob_id is not None:
+                ImageBlob.release(acquired_blob_id)
+            raise
+
+        if released_blob_id is not None:
+            ImageBlob.release(released_blob_id)
+        if replaced_name is not None and replaced_name != self.image.name:
+            # The file of the tex_key, replaced by a blob
+            with span("storage_delete"):
+                self.image.storage.delete(replaced_name)
+        return result
+
+    def _save_data_url(self, adding):
+        # type: (bool) -> None
+        if not (adding or self._data_url_changed):
+            return
+
+        data_url = self.data_url
+        if data_url is None:
+            if not adding:
+                DataUrlBlob.objects.filter(pk=self.pk).delete()
+        else:
+            values = DataUrlBlob.get_values(data_url)
+            if (adding
+                    or not DataUrlBlob.objects.filter(pk=self.pk).update(
+                        **values)):
+                DataUrlBlob.objects.create(result=self, **values)
+        self._data_url_changed = False
 
     def clean(self):
         super().clean()
@@ -154,3 +680,176 @@ class LatexImage(models.Model):
         else:
             return "<tex_key:%s, creation_time:%s, compile_error:%s>" % (
                 self.tex_key, self.creation_time, self.compile_error[:50] + "...")
+
+
+class DataUrlBlob(models.Model):
+    """
+    The data_url of a result (i.e., :attr:`LatexImage.data_url`), kept out
+    of the rows of the results. With settings.L2I_SVG_COMPRESSION, the
+    content of an SVG data_url is stored compressed in *data* instead, and
+    decompressed when read.
+    """
+    result = models.OneToOneField(
+        LatexImage, primary_key=True, verbose_name=_('Result'),
+        on_delete=models.CASCADE, related_name="data_url_blob")
+    data_url = models.TextField(blank=True, verbose_name=_('Data Url'))
+    mime_type = models.CharField(
+        max_length=50, blank=True, verbose_name=_('Mime type'))
+    encoding = models.CharField(
+        max_length=10, blank=True, verbose_name=_('Encoding'))
+    data = models.BinaryField(
+        null=True, blank=True, verbose_name=_('Compressed data'))
+    size = models.BigIntegerField(default=0, verbose_name=_('Size'))
+
+    class Meta:
+        verbose_name = _("Data url blob")
+        verbose_name_plural = _("Data url blobs")
+
+    @staticmethod
+    def get_values(data_url):
+        # type: (Text) -> Dict[Text, Any]
+        """
+        :return: the field values storing *data_url*.
+        """
+        values = {"data_url": data_url, "mime_type": "", "encoding": "",
+                  "data": None, "size": get_data_url_size(data_url)}
+        encoding = get_data_url_compression(data_url)
+        if encoding is not None:
+            compressed = compress_data_url(data_url, encoding)
+            values.update(
+                data_url="", mime_type=compressed.mime_type,
+                encoding=encoding, data=compressed.data)
+        return values
+
+    def get_data_url(self):
+        # type: () -> Text
+        if not self.encoding:
+            return self.data_url
+        return decompress_data_url(CompressedDataUrl(
+            self.mime_type, self.encoding, bytes(self.data)))
+
+
+class ScaledImage(models.Model):
+    """
+    The image of a result rasterized at *scale* times the resolution, e.g.,
+    for the ``srcset`` of HiDPI screens, converted from the same compiled
+    file as the image of the result. See :mod:`latex.srcset`.
+    """
+    result = models.ForeignKey(
+        LatexImage, verbose_name=_('Result'), on_delete=models.CASCADE,
+        related_name="scaled_images")
+    scale = models.FloatField(verbose_name=_('Scale'))
+    image = models.FileField(
+        upload_to=scaled_image_upload_to, storage=OverwriteStorage(),
+        verbose_name=_('Image'))
+
+    class Meta:
+        verbose_name = _("Scaled image")
+        verbose_name_plural = _("Scaled images")
+        unique_together = ("result", "scale")
+
+
+def get_image_storage():
+    return LatexImage._meta.get_field("image").storage
+
+
+def move_storage_file(storage, old_name, new_name):
+    """
+    Move a file within the storage, by renaming it if the storage is on the
+    local filesystem, else by copying then deleting it.
+    """
+    try:
+        old_path, new_path = storage.path(old_name), storage.path(new_name)
+    except NotImplementedError:
+        with storage.open(old_name) as f:
+            saved_name = storage.save(new_name, f)
+        if saved_name != new_name:
+            raise RuntimeError(
+                "'%s' was saved as '%s'" % (new_name, saved_name))
+        storage.delete(old_name)
+        return
+
+    os.makedirs(os.path.dirname(new_path), exist_ok=True)
+    os.replace(old_path, new_path)
+
+
+class ArchivedTexSource(models.Model):
+    """
+    A tex source archived for re-rendering (see :mod:`latex.archive`),
+    stored compressed and addressed by the sha256 digest of its content.
+    """
+    digest = models.CharField(
+        max_length=64, unique=True, db_index=True, verbose_name=_('Digest'))
+    data = models.BinaryField(verbose_name=_('Compressed source'))
+    creation_time = models.DateTimeField(
+        blank=False, default=now, verbose_name=_('Creation time'))
+
+    class Meta:
+        verbose_name = _("Archived tex source")
+        verbose_name_plural = _("Archived tex sources")
+
+    @property
+    def tex_source(self):
+        return zlib.decompress(bytes(self.data)).decode("utf-8")
+
+
+class ArchivedConversion(models.Model):
+    """
+    A (source, compiler, image format) requested with an auto-generated
+    tex_key, i.e., a key which changes with settings.L2I_KEY_VERSION.
+    """
+    source = models.ForeignKey(
+        ArchivedTexSource, verbose_name=_('Source'), on_delete=models.CASCADE)
+    compiler = models.CharField(max_length=30, verbose_name=_('Compiler'))
+    image_format = models.CharField(
+        max_length=10, verbose_name=_('Image format'))
+    creator = models.ForeignKey(
+        settings.AUTH_USER_MODEL, verbose_name=_('Creator'),
+        on_delete=models.CASCADE)
+    creation_time = models.DateTimeField(
+        blank=False, default=now, verbose_name=_('Creation time'))
+
+    class Meta:
+        verbose_name = _("Archived conversion")
+        verbose_name_plural = _("Archived conversions")
+        unique_together = ("source", "compiler", "image_format")
+
+
+class CreatorUsage(models.Model):
+    """
+    Number of results and bytes of images of a creator, updated as results
+    are saved and deleted (see :mod:`latex.receivers`), and recounted by
+    ``python manage.py gc --recount-usage``.
+    """
+    creator = models.OneToOneField(
+        settings.AUTH_USER_MODEL, verbose_name=_('Creator'),
+        on_delete=models.CASCADE, related_name="l2i_usage")
+    n_objects = models.BigIntegerField(default=0, verbose_name=_('Objects'))
+    n_bytes = models.BigIntegerField(default=0, verbose_name=_('Bytes'))
+
+    class Meta:
+        verbose_name = _("Creator usage")
+        verbose_name_plural = _("Creator usages")
+
+    @classmethod
+    def add(cls, creator_id, n_objects, n_bytes):
+        # type: (int, int, int) -> None
+        if not (n_objects or n_bytes):
+            return
+        for _i in range(2):
+            if increment_fields(cls, {"creator_id": creator_id},
+                                n_objects=n_objects, n_bytes=n_bytes):
+                return
+            if n_objects < 0 or n_bytes < 0:
+                # Not counted yet (e.g., created before usage was counted),
+                # also not to create a row for a creator being deleted
+                return
+            try:
+                with transaction.atomic():
+                    cls.objects.create(
+                        creator_id=creator_id, n_objects=n_objects,
+                        n_bytes=n_bytes)
+                return
+            except IntegrityError:
+                # Created concurrently, update it
+                continue
@@ -0,0 +1,643 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import division
+
+__copyright__ = "Copyright (C) 2020 Dong Zhuang"
+
+__license__ = """
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+"""
+
+
+import logging
+import os
+import re
+import struct
+import xml.etree.ElementTree as ET
+import zlib
+from io import BytesIO
+from typing import Any, Dict, Optional, Text, Tuple  # noqa
+
+from latex.metrics import IMAGE_OPTIMIZATION_BYTES
+from latex.timing import span
+
+logger = logging.getLogger(__name__)
+
+
+# {{{ svg optimizer
+
+SVG_NS = "http://www.w3.org/2000/svg"
+XLINK_NS = "http://www.w3.org/1999/xlink"
+XLINK_HREF = "{%s}href" % XLINK_NS
+SVG_DEFS_TAG = "{%s}defs" % SVG_NS
+
+# Serialize the svg namespace as the default, and xlink as "xlink:"
+ET.register_namespace("", SVG_NS)
+ET.register_namespace("xlink", XLINK_NS)
+
+# Attributes whose numbers (coordinates and lengths) are rounded, not
+# "transform", whose scale factors (e.g., of \scalebox) may be small
+SVG_NUMERIC_ATTRIBUTES = frozenset([
+    "d", "points", "viewBox", "x", "y", "x1", "y1", "x2", "y2",
+    "cx", "cy", "r", "rx", "ry", "width", "height", "stroke-width"])
+
+# Elements in which whitespace is content
+SVG_TEXT_TAGS = frozenset(["{%s}%s" % (SVG_NS, tag) for tag in (
+    "text", "tspan", "textPath", "title", "desc", "style", "script")])
+
+SVG_STYLE_TAGS = frozenset(
+    ["{%s}%s" % (SVG_NS, tag) for tag in ("style", "script")])
+
+NUMBER_RE = re.compile(r"[-+]?(?:\d+\.\d*|\.\d+|\d+)(?:[eE][-+]?\d+)?")
+URL_REF_RE = re.compile(r"url\(\s*#([^)\s]+)\s*\)")
+
+
+def format_number(value, precision):
+    # type: (float, int) -> Text
+    text = "%.*f" % (precision, value)
+    if "." in text:
+        text = text.rstrip("0").rstrip(".")
+    if text in ("-0", ""):
+        text = "0"
+    return text
+
+
+def round_numbers(value, precision):
+    # type: (Text, int) -> Text
+    """
+    Round the numbers in an attribute *value*, e.g., path data, to
+    *precision* decimals, keeping the units and separators. In compact
+    path data (e.g., ``M1.0004.5`` of dvisvgm), where the "." or the sign
+    of a number separates it from the previous one, a space is inserted
+    if the rounded numbers would run together.
+    """
+    parts = []
+    end = 0
+    previous = None  # type: Optional[Text]
+    for match in NUMBER_RE.finditer(value):
+        text = format_number(float(match.group()), precision)
+        parts.append(value[end:match.start()])
+        if (match.start() == end and previous is not None
+                and text[0] not in "+-"
+                and not (text[0] == "." and "." in previous)):
+            parts.append(" ")
+        parts.append(text)
+        end = match.end()
+        previous = text
+    parts.append(value[end:])
+    return "".join(parts)
+
+
+class SvgOptimizer(object):
+    """
+    Minify the SVG images of dvisvgm and pdf2svg: round coordinates to
+    *precision* decimals, merge the identical definitions (e.g., the glyph
+    paths of each font size) and drop the unused ones with their unused
+    ids, and strip the whitespace between elements.
+    """
+
+    image_format = "svg"
+
+    # *precision* None keeps the numbers as converted
+    def __init__(self, precision=3, dedup=True, strip_whitespace=True):
+        # type: (int, bool, bool) -> None
+        if precision is not None and (
+                not isinstance(precision, int) or precision < 0):
+            raise ValueError(
+                "precision must be a non negative int or None, got %r"
+                % (precision,))
+        self.precision = precision
+        self.dedup = dedup
+        self.strip_whitespace = strip_whitespace
+
+    def _round(self, root):
+        # type: (ET.Element) -> None
+        for element in root.iter():
+            for name, value in element.attrib.items():
+                if name in SVG_NUMERIC_ATTRIBUTES:
+                    element.set(name, round_numbers(value, self.precision))
+
+    @staticmethod
+    def _iter_refs(element):
+        # type: (ET.Element) -> Any
+        for name, value in element.attrib.items():
+            if name in (XLINK_HREF, "href"):
+                if value.startswith("#"):
+                    yield name, value[1:]
+            else:
+                for match in URL_REF_RE.finditer(value):
+                    yield name, match.group(1)
+
+    @staticmethod
+    def _iter_definitions(container):
+        # type: (ET.Element) -> Any
+        """
+        :return: an iterator of the (parent, element) of the elements with an
+            id in *container*, a ``<defs>``, descending into those without,
+            e.g., the ``<g>`` of the glyph ``<symbol>`` of pdf2svg.
+        """
+        for element in list(container):
+            if "id" in element.attrib:
+                yield container, element
+            else:
+                yield from SvgOptimizer._iter_definitions(element)
+
+    def _dedup(self, root):
+        # type: (ET.Element) -> None
+        if any(element.tag in SVG_STYLE_TAGS for element in root.iter()):
+            # Ids may be referenced by selectors or scripts
+            return
+
+        all_defs = list(root.iter(SVG_DEFS_TAG))
+
+        # {{{ merge identical definitions
+
+        replaced_ids = {}  # type: Dict[Text, Text]
+        kept_ids = {}  # type: Dict[bytes, Text]
+        for defs in all_defs:
+            for parent, element in self._iter_definitions(defs):
+                element_id = element.attrib.pop("id")
+                content = ET.tostring(element)
+                element.set("id", element_id)
+
+                kept_id = kept_ids.setdefault(content, element_id)
+                if kept_id != element_id:
+                    replaced_ids[element_id] = kept_id
+                    parent.remove(element)
+
+        if replaced_ids:
+            for element in root.iter():
+                for name, ref in list(self._iter_refs(element)):
+                    if ref in replaced_ids:
+                        element.set(name, element.get(name).replace(
+                            "#%s" % ref, "#%s" % replaced_ids[ref]))
+
+        # }}}
+
+        # {{{ drop unreferenced definitions and ids
+
+        referenced = set(
+            ref for element in root.iter()
+            for _name, ref in self._iter_refs(element))
+
+        for defs in all_defs:
+            for parent, element in self._iter_definitions(defs):
+                if element.get("id") not in referenced:
+                    parent.remove(element)
+
+        for parent in list(root.iter()):
+            for child in list(parent):
+                if child.tag == SVG_DEFS_TAG and not len(child):
+                    parent.remove(child)
+
+        for element in root.iter():
+            element_id = element.get("id")
+            if element_id is not None and element_id not in referenced:
+                del element.attrib["id"]
+
+        # }}}
+
+    @staticmethod
+    def _strip_whitespace(element):
+        # type: (ET.Element) -> None
+        if element.tag in SVG_TEXT_TAGS:
+            return
+        if element.text is not None and not element.text.strip():
+            element.text = None
+        for child in element:
+            if child.tail is not None and not child.tail.strip():
+                child.tail = None
+            SvgOptimizer._strip_whitespace(child)
+
+    def optimize(self, data):
+        # type: (bytes) -> bytes
+        # Comments, processing instructions and the XML declaration are
+        # dropped by the parser
+        root = ET.fromstring(data)
+        if self.precision is not None:
+            self._round(root)
+        if self.dedup:
+            self._dedup(root)
+        if self.strip_whitespace:
+            self._strip_whitespace(root)
+        # ">" is escaped in attribute values and text, thus " />" only
+        # closes empty elements
+        return ET.tostring(
+            root, encoding="utf-8", xml_declaration=False,
+        ).replace(b" />", b"/>")
+
+# }}}
+
+
+# {{{ png optimizer
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+
+# PNG color types
+GRAY = 0
+RGB = 2
+PALETTE = 3
+GRAY_ALPHA = 4
+RGBA = 6
+
+CHANNELS = {GRAY: 1, RGB: 3, PALETTE: 1, GRAY_ALPHA: 2, RGBA: 4}
+
+# Ancillary chunks kept with *strip_metadata* False, the others (e.g.,
+# tRNS, bKGD or sBIT) depend on the color type of the original image
+KEPT_CHUNKS = (b"gAMA", b"cHRM", b"sRGB", b"iCCP", b"pHYs", b"tEXt",
+               b"zTXt", b"iTXt", b"tIME")
+
+FILTER_SEARCH = "search"
+FILTER_ADAPTIVE = "adaptive"
+FILTER_NONE = "none"
+FILTER_STRATEGIES = (FILTER_SEARCH, FILTER_ADAPTIVE, FILTER_NONE)
+
+
+def is_numpy_available():
+    # type: () -> bool
+    try:
+        import numpy  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def iter_png_chunks(data):
+    # type: (bytes) -> Any
+    """
+    :return: an iterator of the (type, content) of the chunks of the PNG
+        *data*.
+    """
+    pos = len(PNG_SIGNATURE)
+    while pos + 8 <= len(data):
+        length, chunk_type = struct.unpack(">I4s", data[pos:pos + 8])
+        yield chunk_type, data[pos + 8:pos + 8 + length]
+        pos += length + 12
+
+
+def make_png_chunk(chunk_type, content):
+    # type: (bytes, bytes) -> bytes
+    return b"".join([
+        struct.pack(">I", len(content)), chunk_type, content,
+        struct.pack(">I", zlib.crc32(chunk_type + content) & 0xffffffff)])
+
+
+def filter_scanlines(raw, bpp):
+    # type: (Any, int) -> Any
+    """
+    :arg raw: the (height, row bytes) uint8 array of the scanlines.
+    :arg bpp: the bytes per complete pixel, at least 1.
+    :return: the (5, height, row bytes) uint8 array of the scanlines
+        filtered with each of the 5 PNG filter types (None, Sub, Up,
+        Average and Paeth).
+    """
+    import numpy as np
+
+    x = raw.astype(np.int16)
+    left = np.zeros_like(x)
+    left[:, bpp:] = x[:, :-bpp]
+    up = np.zeros_like(x)
+    up[1:] = x[:-1]
+    up_left = np.zeros_like(x)
+    up_left[:, bpp:] = up[:, :-bpp]
+
+    p = left + up - up_left
+    pa = np.abs(p - left)
+    pb = np.abs(p - up)
+    pc = np.abs(p - up_left)
+    paeth = np.where(
+        (pa <= pb) & (pa <= pc), left, np.where(pb <= pc, up, up_left))
+
+    return np.stack([
+        x, x - left, x - up, x - ((left + up) >> 1), x - paeth,
+    ]).astype(np.uint8)
+
+
+class PngOptimizer(object):
+    """
+    Re-encode the PNG images of dvipng and ImageMagick losslessly, in the
+    smallest of: a palette image if there are at most *max_colors* colors
+    (typically black glyphs with anti-aliased edges), a grayscale image if
+    all the pixels are gray, at the lowest bit depth which holds the
+    pixels, and without the alpha channel if opaque. The filter type of
+    the scanlines is chosen by *filter_strategy*: "search" compresses with
+    each filter type, and with the per-row heuristic of libpng
+    ("adaptive"), and keeps the smallest. Metadata chunks are dropped
+    unless *strip_metadata* is False. The color of fully transparent pixels,
+    which is not visible, is dropped.
+    """
+
+    image_format = "png"
+
+    def __init__(self, max_colors=256, filter_strategy=FILTER_SEARCH,
+                 strip_metadata=True, compress_level=9):
+        # type: (int, Text, bool, int) -> None
+        if not is_numpy_available():
+            raise ValueError("the png optimizer requires the numpy package")
+        if (not isinstance(max_colors, int)
+                or not 0 <= max_colors <= 256):
+            raise ValueError(
+                "max_colors must be an int in [0, 256], got %r"
+                % (max_colors,))
+        if filter_strategy not in FILTER_STRATEGIES:
+            raise ValueError(
+                "filter_strategy must be one of %s, got %r"
+                % (", ".join(FILTER_STRATEGIES), filter_strategy))
+        if (not isinstance(compress_level, int)
+                or not 1 <= compress_level <= 9):
+            raise ValueError(
+                "compress_level must be an int in [1, 9], got %r"
+                % (compress_level,))
+        self.max_colors = max_colors
+        self.filter_strategy = filter_strategy
+        self.strip_metadata = strip_metadata
+        self.compress_level = compress_level
+
+    # {{{ pixels
+
+    @staticmethod
+    def _load_pixels(data):
+        # type: (bytes) -> Optional[Any]
+        """
+        :return: the (height, width, 4) uint8 RGBA array of the PNG *data*,
+            or None if it's not an 8 bit (or less) still image.
+        """
+        import numpy as np
+        from PIL import Image
+
+        with Image.open(BytesIO(data)) as image:
+            if (image.format != "PNG"
+                    or getattr(image, "n_frames", 1) > 1
+                    or image.mode not in ("1", "L", "LA", "P", "RGB", "RGBA")):
+                return None
+            rgba = np.array(image.convert("RGBA"))
+
+        # The color of fully transparent pixels is not visible
+        rgba[rgba[..., 3] == 0] = 0
+        return rgba
+
+    @staticmethod
+    def _pack(values, bit_depth):
+        # type: (Any, int) -> Any
+        """
+        :arg values: the (height, width) uint8 array of samples of
+            *bit_depth* bits.
+        :return: the (height, row bytes) uint8 array of the scanlines.
+        """
+        import numpy as np
+
+        if bit_depth == 8:
+            return values
+        per_byte = 8 // bit_depth
+        height, width = values.shape
+        padded = np.zeros(
+            (height, -(-width // per_byte) * per_byte), dtype=np.uint8)
+        padded[:, :width] = values
+        shifts = np.arange(8 - bit_depth, -1, -bit_depth, dtype=np.uint8)
+        return np.bitwise_or.reduce(
+            padded.reshape(height, -1, per_byte) << shifts, axis=2)
+
+    @staticmethod
+    def _get_gray_bit_depth(gray):
+        # type: (Any) -> int
+        """
+        :return: the lowest bit depth the 8 bit *gray* samples are exactly
+            represented in.
+        """
+        for bit_depth in (1, 2, 4):
+            if not (gray % (255 // (2 ** bit_depth - 1))).any():
+                return bit_depth
+        return 8
+
+    def _iter_candidates(self, rgba):
+        # type: (Any) -> Any
+        """
+        :return: an iterator of the (color type, bit depth, scanlines,
+            bytes per pixel, extra chunks before IDAT) the pixels *rgba*
+            can be encoded as, losslessly.
+        """
+        import numpy as np
+
+        height, width = rgba.shape[:2]
+        opaque = bool((rgba[..., 3] == 255).all())
+        gray = bool(((rgba[..., 0] == rgba[..., 1])
+                     & (rgba[..., 1] == rgba[..., 2])).all())
+        n_candidates = 0
+
+        colors, indices = np.unique(
+            rgba.reshape(-1, 4).view(np.uint32)[:, 0], return_inverse=True)
+        if len(colors) <= self.max_colors:
+            palette = colors.view(np.uint8).reshape(-1, 4)
+
+            # Translucent colors first, so that tRNS is the shortest
+            order = np.argsort(palette[:, 3] == 255, kind="stable")
+            palette = palette[order]
+            ranks = np.empty_like(order)
+            ranks[order] = np.arange(len(order))
+            indices = ranks[indices].astype(np.uint8).reshape(height, width)
+
+            bit_depth = next(
+                depth for depth in (1, 2, 4, 8) if len(palette) <= 2 ** depth)
+            chunks = [(b"PLTE", palette[:, :3].tobytes())]
+            n_translucent = int((palette[:, 3] < 255).sum())
+            if n_translucent:
+                chunks.append(
+                    (b"tRNS", palette[:n_translucent, 3].tobytes()))
+            yield (PALETTE, bit_depth, self._pack(indices, bit_depth), 1,
+                   chunks)
+            n_candidates += 1
+
+        if gray and opaque:
+            bit_depth = self._get_gray_bit_depth(rgba[..., 0])
+            samples = rgba[..., 0] // (255 // (2 ** bit_depth - 1))
+            yield GRAY, bit_depth, self._pack(samples, bit_depth), 1, []
+            n_candidates += 1
+        elif gray:
+            yield (GRAY_ALPHA, 8, rgba[..., [0, 3]].reshape(height, -1), 2,
+                   [])
+            n_candidates += 1
+
+        if not n_candidates:
+            if opaque:
+                yield RGB, 8, rgba[..., :3].reshape(height, -1), 3, []
+            else:
+                yield RGBA, 8, rgba.reshape(height, -1), 4, []
+
+    # }}}
+
+    def _compress(self, scanlines, bpp, filterable):
+        # type: (Any, int, bool) -> bytes
+        """
+        :arg filterable: False for palette images and bit depths below 8,
+            which, as libpng does, are not filtered with the "adaptive"
+            strategy.
+        :return: the smallest IDAT content of the *scanlines* among those
+            of the filter strategy.
+        """
+        import numpy as np
+
+        def deflate(filter_types, rows):
+            return zlib.compress(
+                np.concatenate([filter_types[:, None], rows], axis=1).tobytes(),
+                self.compress_level)
+
+        height = scanlines.shape[0]
+        strategy = self.filter_strategy
+        if strategy == FILTER_ADAPTIVE and not filterable:
+            strategy = FILTER_NONE
+        if strategy == FILTER_NONE:
+            return deflate(np.zeros(height, dtype=np.uint8), scanlines)
+
+        filtered = filter_scanlines(scanlines, bpp)
+
+        # The heuristic of libpng: the filter type minimizing the sum of
+        # the absolute (signed) differences, row by row
+        adaptive = np.abs(filtered.view(np.int8).astype(np.int32)).sum(
+            axis=2).argmin(axis=0)
+        results = [deflate(
+            adaptive.astype(np.uint8), filtered[adaptive, np.arange(height)])]
+
+        if strategy == FILTER_SEARCH:
+            results.extend(
+                deflate(np.full(height, filter_type, dtype=np.uint8),
+                        filtered[filter_type])
+                for filter_type in range(5))
+        return min(results, key=len)
+
+    def optimize(self, data):
+        # type: (bytes) -> bytes
+        rgba = self._load_pixels(data)
+        if rgba is None:
+            return data
+
+        metadata = []
+        if not self.strip_metadata:
+            metadata = [(chunk_type, content)
+                        for chunk_type, content in iter_png_chunks(data)
+                        if chunk_type in KEPT_CHUNKS]
+
+        height, width = rgba.shape[:2]
+        encoded = []
+        for color_type, bit_depth, scanlines, bpp, chunks in (
+                self._iter_candidates(rgba)):
+            header = struct.pack(
+                ">IIBBBBB", width, height, bit_depth, color_type, 0, 0, 0)
+            encoded.append(b"".join(
+                [PNG_SIGNATURE, make_png_chunk(b"IHDR", header)]
+                + [make_png_chunk(chunk_type, content)
+                   for chunk_type, content in metadata + chunks]
+                + [make_png_chunk(b"IDAT", self._compress(
+                    scanlines, bpp,
+                    filterable=color_type != PALETTE and bit_depth == 8)),
+                   make_png_chunk(b"IEND", b"")]))
+        return min(encoded + [data], key=len)
+
+# }}}
+
+
+# {{{ optimizer registry
+
+IMAGE_OPTIMIZER_CLASSES = {
+    "png": PngOptimizer,
+    "svg": SvgOptimizer,
+}
+
+
+def get_image_optimizers_options():
+    # type: () -> Dict[Text, Dict[Text, Any]]
+    """
+    :return: the options of the optimizer of each image format which is
+        optimized (settings.L2I_IMAGE_OPTIMIZERS).
+    """
+    from django.conf import settings
+    return getattr(settings, "L2I_IMAGE_OPTIMIZERS", None) or {}
+
+
+def make_image_optimizer(image_format, options):
+    # type: (Text, Dict[Text, Any]) -> Any
+    """
+    :raise ValueError: if there's no optimizer for *image_format*, or the
+        *options* are not valid.
+    """
+    try:
+        optimizer_class = IMAGE_OPTIMIZER_CLASSES[image_format]
+    except KeyError:
+        raise ValueError("no optimizer for '%s' images" % image_format)
+    if not isinstance(options, dict):
+        raise ValueError("options must be a dict, got %r" % (options,))
+    try:
+        return optimizer_class(**options)
+    except TypeError as e:
+        raise ValueError(str(e))
+
+
+def get_image_optimizer(image_format):
+    # type: (Text) -> Optional[Any]
+    """
+    :return: the optimizer of *image_format* images, or None if they are
+        not optimized.
+    """
+    options = get_image_optimizers_options().get(image_format)
+    if options is None:
+        return None
+    return make_image_optimizer(image_format, options)
+
+
+def optimize_image_file(image_path, image_format):
+    # type: (Text, Text) -> Optional[Tuple[int, int]]
+    """
+    Optimize the image at *image_path* in place, if its format is optimized.
+    The optimized image is only kept if it is smaller. A failed optimization
+    leaves the image as converted.
+
+    :return: the sizes before and after the optimization, or None if the
+        image was not optimized.
+    """
+    optimizer = get_image_optimizer(image_format)
+    if optimizer is None:
+        return None
+
+    with span("optimize"):
+        with open(image_path, "rb") as f:
+            data = f.read()
+        try:
+            optimized = optimizer.optimize(data)
+        except Exception:
+            logger.exception("Failed to optimize %s", image_path)
+            return None
+
+        if len(optimized) >= len(data):
+            optimized = data
+        else:
+            tmp_path = image_path + ".tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(optimized)
+            os.replace(tmp_path, image_path)
+
+    logger.debug("Optimized %s: %d -> %d bytes",
+                 image_path, len(data), len(optimized))
+    IMAGE_OPTIMIZATION_BYTES.labels(
+        image_format=image_format, stage="before").inc(len(data))
+    IMAGE_OPTIMIZATION_BYTES.labels(
+        image_format=image_format, stage="after").inc(len(optimized))
+    return len(data), len(optimized)
+
+# }}}
+
+# vim: foldmethod=marker
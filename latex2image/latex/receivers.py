@@ -1,12 +1,18 @@
 from django.contrib.auth import get_user_model
 from django.core.exceptions import ImproperlyConfigured
-from django.db.models.signals import post_delete, post_save
+from django.db.models.signals import (post_delete, post_save, pre_delete,
+                                      pre_save)
 from django.dispatch import receiver
 from rest_framework.authtoken.models import Token
 
 from latex.api import get_field_cache_key
-from latex.models import LatexImage
+from latex.compression import get_cache_value, get_cache_value_size
+from latex.converter import get_source_key
+from latex.models import (CreatorUsage, DataUrlBlob, ImageBlob, LatexImage,
+                          ScaledImage, get_data_url_size)
 from latex.serializers import LatexImageSerializer
+from latex.timing import span
+from latex.variants import delete_unused_compiled_file, get_variant_formats
 
 
 @receiver(post_save, sender=get_user_model())
@@ -27,7 +33,16 @@ def image_delete(sender, instance, **kwargs):
     # method and a queryset’s delete() method.
     # This is safer as it does not execute unless the parent object
     # is successfully deleted.
-    instance.image.delete(False)
+    with span("storage_delete"):
+        if instance.blob_id is not None:
+            # Shared with the other results of the same content
+            ImageBlob.release(instance.blob_id)
+        else:
+            instance.image.delete(False)
+
+        source_key = get_source_key(instance.tex_key)
+        if source_key is not None and get_variant_formats():
+            delete_unused_compiled_file(source_key)
 
     try:
         import django.core.cache as cache
@@ -36,8 +51,22 @@ def image_delete(sender, instance, **kwargs):
 
     def_cache = cache.caches["default"]
 
-    for attr in ("image", "creation_time", "data_url", "compile_error", "creator"):
-        def_cache.delete(get_field_cache_key(instance.tex_key, attr))
+    with span("cache_invalidate"):
+        for attr in (
+                "image", "creation_time", "data_url", "compile_error", "creator",
+                "scaled_images"):
+            def_cache.delete(get_field_cache_key(instance.tex_key, attr))
+
+
+@receiver(post_delete, sender=ImageBlob)
+def blob_delete(sender, instance, **kwargs):
+    instance.image.delete(False)
+
+
+@receiver(post_delete, sender=ScaledImage)
+def scaled_image_delete(sender, instance, **kwargs):
+    with span("storage_delete"):
+        instance.image.delete(False)
 
 
 @receiver(post_save, sender=LatexImage)
@@ -68,10 +97,58 @@ def create_image_cache_on_save(sender, instance, **kwargs):
     if getattr(settings, "L2I_CACHE_DATA_URL_ON_SAVE", False):
         attr_to_cache.append("data_url")
 
-    for attr in attr_to_cache:
-        attr_value = data[attr]
-        if (attr_value is not None
-                and len(str(attr_value)) <= getattr(
-                    settings, "L2I_CACHE_MAX_BYTES", 0)):
-            def_cache.add(
-                get_field_cache_key(instance.tex_key, attr), attr_value, None)
+    with span("cache_fill"):
+        for attr in attr_to_cache:
+            if data[attr] is None:
+                continue
+            attr_value = get_cache_value(attr, data[attr])
+            if get_cache_value_size(attr_value) <= getattr(
+                    settings, "L2I_CACHE_MAX_BYTES", 0):
+                def_cache.add(
+                    get_field_cache_key(instance.tex_key, attr), attr_value,
+                    None)
+
+
+# {{{ creator usage
+
+@receiver(pre_save, sender=LatexImage)
+def remember_usage_before_save(sender, instance, **kwargs):
+    instance._usage_before_save = None
+    if not instance._state.adding and instance.pk is not None:
+        saved = LatexImage.objects.filter(pk=instance.pk).values_list(
+            "creator_id", "data_url_blob__size").first()
+        if saved is not None:
+            instance._usage_before_save = (saved[0], saved[1] or 0)
+
+
+@receiver(post_save, sender=LatexImage)
+def update_usage_on_save(sender, instance, **kwargs):
+    n_bytes = get_data_url_size(instance.data_url)
+    before = getattr(instance, "_usage_before_save", None)
+    with span("usage_update"):
+        if before is None:
+            CreatorUsage.add(instance.creator_id, 1, n_bytes)
+        elif before[0] == instance.creator_id:
+            CreatorUsage.add(instance.creator_id, 0, n_bytes - before[1])
+        else:
+            CreatorUsage.add(before[0], -1, -before[1])
+            CreatorUsage.add(instance.creator_id, 1, n_bytes)
+
+
+@receiver(pre_delete, sender=LatexImage)
+def remember_usage_before_delete(sender, instance, **kwargs):
+    # The data_url is deleted (by cascade) before post_delete is sent
+    instance._size_before_delete = DataUrlBlob.objects.filter(
+        pk=instance.pk).values_list("size", flat=True).first() or 0
+
+
+@receiver(post_delete, sender=LatexImage)
+def update_usage_on_delete(sender, instance, **kwargs):
+    with span("usage_update"):
+        CreatorUsage.add(
+            instance.creator_id, -1,
+            -getattr(instance, "_size_before_delete", 0))
+
+# }}}
+
+# vim: foldmethod=marker
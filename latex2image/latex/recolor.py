@@ -0,0 +1,291 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import division
+
+__copyright__ = "Copyright (C) 2020 Dong Zhuang"
+
+__license__ = """
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+"""
+
+
+import re
+import xml.etree.ElementTree as ET
+from io import BytesIO
+from typing import Any, Dict, List, Optional, Text, Tuple  # noqa
+
+from latex.optimizers import SVG_NS, get_image_optimizer, is_numpy_available
+
+RGB = Tuple[int, int, int]
+
+HEX_COLOR_RE = re.compile(r"^(?:[0-9a-fA-F]{3}){1,2}$")
+
+
+# {{{ palette
+
+def parse_color(value):
+    # type: (Text) -> RGB
+    """
+    :param value: a CSS color, e.g., ``#000``, ``rgb(0%,0%,0%)``, ``black``,
+        or a hex color without the ``#`` (as in URLs).
+    :raises ValueError: if *value* is not a color.
+    """
+    from PIL import ImageColor
+
+    value = value.strip()
+    if HEX_COLOR_RE.match(value):
+        value = "#" + value
+    return tuple(ImageColor.getrgb(value)[:3])  # type: ignore
+
+
+def format_color(rgb):
+    # type: (RGB) -> Text
+    return "#%02x%02x%02x" % rgb
+
+
+class Palette(object):
+    """
+    A mapping of source colors to target colors, e.g., for a dark theme,
+    from black to white and white to black.
+
+    The source colors are mapped to their targets exactly. Any other color
+    is taken as a mix of its two nearest source colors (e.g., an
+    anti-aliased edge between black and white), which is mapped to the same
+    mix of their targets, plus its offset from that mix (e.g., the hue of a
+    red glyph, which is kept). With a single source color, every color is
+    shifted as it is.
+    """
+
+    def __init__(self, pairs):
+        # type: (List[Tuple[RGB, RGB]]) -> None
+        if not pairs:
+            raise ValueError("a palette maps at least one color")
+        self.pairs = sorted(dict(pairs).items())
+
+    @property
+    def key(self):
+        # type: () -> Text
+        """
+        The canonical form of the palette, whatever the order and the
+        notation of its colors.
+        """
+        return ".".join(
+            "%s-%s" % (format_color(source)[1:], format_color(target)[1:])
+            for source, target in self.pairs)
+
+    def map_color(self, rgb):
+        # type: (RGB) -> RGB
+        sources = [source for source, _target in self.pairs]
+        targets = [target for _source, target in self.pairs]
+
+        order = sorted(
+            range(len(sources)),
+            key=lambda i: sum((c - s) ** 2 for c, s in zip(rgb, sources[i])))
+        a = order[0]
+        if len(order) == 1:
+            mapped = [c + t - s for c, s, t in zip(rgb, sources[a], targets[a])]
+        else:
+            b = order[1]
+            v = [sb - sa for sa, sb in zip(sources[a], sources[b])]
+            t = sum((c - sa) * vi for c, sa, vi in zip(rgb, sources[a], v)) / sum(
+                vi * vi for vi in v)
+            t = min(max(t, 0.), 1.)
+            mapped = [
+                ta + t * (tb - ta) + c - (sa + t * vi)
+                for c, sa, vi, ta, tb in zip(
+                    rgb, sources[a], v, targets[a], targets[b])]
+        return tuple(
+            min(max(int(round(c)), 0), 255) for c in mapped)  # type: ignore
+
+    def map_pixels(self, rgb):
+        # type: (Any) -> Any
+        """
+        :param rgb: a numpy array of colors, of shape (n, 3).
+        :return: the mapped colors, as :meth:`map_color` maps them.
+        """
+        import numpy as np
+
+        rgb = rgb.astype(np.float64)
+        sources = np.array(
+            [source for source, _target in self.pairs], dtype=np.float64)
+        targets = np.array(
+            [target for _source, target in self.pairs], dtype=np.float64)
+
+        distances = ((rgb[:, None, :] - sources[None, :, :]) ** 2).sum(axis=2)
+        # Stable, so that ties are broken as by map_color
+        order = np.argsort(distances, axis=1, kind="stable")
+        a = order[:, 0]
+        if len(sources) == 1:
+            mapped = rgb + (targets[a] - sources[a])
+        else:
+            b = order[:, 1]
+            v = sources[b] - sources[a]
+            t = ((rgb - sources[a]) * v).sum(axis=1) / (v * v).sum(axis=1)
+            t = np.clip(t, 0., 1.)[:, None]
+            mapped = (targets[a] + t * (targets[b] - targets[a])
+                      + rgb - (sources[a] + t * v))
+        return np.clip(np.rint(mapped), 0, 255).astype(np.uint8)
+
+
+def get_palettes():
+    # type: () -> Dict[Text, Dict[Text, Text]]
+    from django.conf import settings
+    return getattr(settings, "L2I_PALETTES", None) or {}
+
+
+def get_palette(name):
+    # type: (Text) -> Palette
+    """
+    :param name: the name of a palette of settings.L2I_PALETTES. Only those
+        are accepted, so that the recolored images, which are derived on
+        unauthenticated requests and cached, are bounded.
+    :raises ValueError: if *name* is not a palette.
+    """
+    palettes = get_palettes()
+    if name not in palettes:
+        raise ValueError("'%s' is not a palette of settings.L2I_PALETTES"
+                         % name)
+    return Palette([(parse_color(source), parse_color(target))
+                    for source, target in palettes[name].items()])
+
+# }}}
+
+
+# {{{ svg
+
+# Properties (as attributes or in styles) whose value is a color
+SVG_COLOR_PROPERTIES = frozenset([
+    "fill", "stroke", "stop-color", "flood-color", "lighting-color", "color"])
+
+STYLE_DECLARATION_RE = re.compile(
+    r"(?P<name>[a-zA-Z-]+)(?P<sep>\s*:\s*)(?P<value>[^;}]+)")
+
+
+def map_css_color(value, palette):
+    # type: (Text, Palette) -> Text
+    try:
+        rgb = parse_color(value)
+    except ValueError:
+        # e.g., "none", "currentColor" or "url(#gradient)"
+        return value
+    return format_color(palette.map_color(rgb))
+
+
+def recolor_css(text, palette):
+    # type: (Text, Palette) -> Text
+    def replace(match):
+        if match.group("name").lower() not in SVG_COLOR_PROPERTIES:
+            return match.group(0)
+        value = match.group("value")
+        stripped = value.rstrip()
+        return "%s%s%s%s" % (
+            match.group("name"), match.group("sep"),
+            map_css_color(stripped, palette), value[len(stripped):])
+
+    return STYLE_DECLARATION_RE.sub(replace, text)
+
+
+def recolor_svg(data, palette):
+    # type: (bytes, Palette) -> bytes
+    root = ET.fromstring(data)
+    for element in root.iter():
+        for name in SVG_COLOR_PROPERTIES.intersection(element.attrib):
+            element.set(name, map_css_color(element.get(name), palette))
+        style = element.get("style")
+        if style:
+            element.set("style", recolor_css(style, palette))
+        if element.tag == "{%s}style" % SVG_NS and element.text:
+            element.text = recolor_css(element.text, palette)
+
+    # The glyphs of dvisvgm have no fill, i.e., the initial black
+    if root.get("fill") is None:
+        black = (0, 0, 0)
+        if palette.map_color(black) != black:
+            root.set("fill", format_color(palette.map_color(black)))
+
+    return ET.tostring(
+        root, encoding="utf-8", xml_declaration=False).replace(b" />", b"/>")
+
+# }}}
+
+
+# {{{ raster images
+
+def recolor_raster(data, palette, image_format):
+    # type: (bytes, Palette, Text) -> bytes
+    """
+    Map the colors of the pixels, leaving their alpha as it is.
+    """
+    if not is_numpy_available():
+        raise ValueError(
+            "recoloring %s images requires numpy" % image_format)
+
+    import numpy as np
+    from PIL import Image
+
+    with Image.open(BytesIO(data)) as image:
+        has_alpha = (image.mode in ("RGBA", "LA", "PA")
+                     or "transparency" in image.info)
+        rgba = np.asarray(image.convert("RGBA"))
+
+    height, width = rgba.shape[:2]
+
+    # Rendered formulas have few colors, which are mapped once
+    colors, inverse = np.unique(
+        rgba[..., :3].reshape(-1, 3), axis=0, return_inverse=True)
+    rgb = palette.map_pixels(colors)[inverse.reshape(-1)]
+
+    recolored = Image.fromarray(np.concatenate(
+        [rgb.reshape(height, width, 3), rgba[..., 3:]], axis=2), "RGBA")
+    if not has_alpha:
+        recolored = recolored.convert("RGB")
+
+    save_options = {}  # type: Dict[Text, Any]
+    if image_format in ("webp", "avif"):
+        # Encoded as converted
+        from latex.converter import (ImageMagickAvif, ImageMagickWebp,
+                                     get_command_instance)
+        converter_class = (
+            ImageMagickWebp if image_format == "webp" else ImageMagickAvif)
+        save_options = get_command_instance(converter_class).get_save_options()
+
+    buf = BytesIO()
+    recolored.save(buf, format=image_format.upper(), **save_options)
+    recolored_data = buf.getvalue()
+
+    optimizer = get_image_optimizer(image_format)
+    if optimizer is not None:
+        recolored_data = optimizer.optimize(recolored_data)
+    return recolored_data
+
+
+def recolor_image(data, image_format, palette):
+    # type: (bytes, Text, Palette) -> bytes
+    """
+    :param data: the (uncompressed) image.
+    :return: the image with its colors mapped by *palette*, in the same
+        format.
+    """
+    if image_format == "svg":
+        return recolor_svg(data, palette)
+    return recolor_raster(data, palette, image_format)
+
+# }}}
+
+# vim: foldmethod=marker
@@ -2,11 +2,14 @@ from django.conf import settings
 from django.utils.translation import gettext_lazy as _
 from rest_framework import serializers
 
-from latex.constants import ALLOWED_COMPILER, ALLOWED_LATEX2IMG_FORMAT
+from latex.constants import (ALLOWED_COMPILER, ALLOWED_LATEX2IMG_FORMAT,
+                             MAX_IMAGE_SCALE, MAX_IMAGE_SCALES,
+                             MIN_IMAGE_SCALE, RASTER_IMAGE_FORMATS)
 from latex.models import LatexImage
 
 LATEX_IMAGE_ALLOWED_FIELDS_NAME = [
-    f.name for f in LatexImage._meta.get_fields() if f.name != "id"]
+    f.name for f in LatexImage._meta.concrete_fields
+    if f.name not in ("id", "blob")] + ["data_url"]
 
 
 class DynamicFieldsModelSerializer(serializers.ModelSerializer):
@@ -38,6 +41,9 @@ class DynamicFieldsModelSerializer(serializers.ModelSerializer):
 
 
 class LatexImageSerializer(DynamicFieldsModelSerializer):
+    # Not a model field, see LatexImage.data_url
+    data_url = serializers.CharField(
+        required=False, allow_null=True, allow_blank=True)
 
     class Meta:
         model = LatexImage
@@ -48,6 +54,9 @@ class LatexImageSerializer(DynamicFieldsModelSerializer):
                   "image",
                   "compile_error",
                   "creator",
+                  "width",
+                  "height",
+                  "depth",
                   )
 
     def to_representation(self, instance):
@@ -95,6 +104,10 @@ class LatexImageCreateDataSerialzier(serializers.Serializer):
     tex_key = serializers.CharField(max_length=None, required=False)
     fields = _FieldsSerializer(required=False, allow_null=False)
     use_storage_file_if_exists = serializers.BooleanField(required=False)
+    scales = serializers.ListField(
+        child=serializers.FloatField(
+            min_value=MIN_IMAGE_SCALE, max_value=MAX_IMAGE_SCALE),
+        required=False, allow_empty=False, max_length=MAX_IMAGE_SCALES)
 
     def validate(self, attrs):
 
@@ -125,4 +138,12 @@ class LatexImageCreateDataSerialzier(serializers.Serializer):
                     )
                 )
 
+        scales = attrs.get("scales")
+        if scales:
+            if attrs.get("image_format") not in RASTER_IMAGE_FORMATS:
+                raise serializers.ValidationError(
+                    {"scales": _("Only allowed with image formats {formats}.")
+                        .format(formats=", ".join(RASTER_IMAGE_FORMATS))})
+            attrs["scales"] = sorted(set(scales))
+
         return attrs
@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import division
+
+__copyright__ = "Copyright (C) 2020 Dong Zhuang"
+
+__license__ = """
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+"""
+
+
+import os
+from typing import Any, Dict, List, Optional, Text  # noqa
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import IntegrityError, transaction
+
+from latex.models import (ScaledImage, format_scale, get_image_storage,
+                          get_scaled_image_file_name)
+from latex.timing import span
+from latex.variants import get_variant_formats, read_compiled_file
+
+
+def save_scaled_images(instance, scaled_images):
+    # type: (Any, Dict[float, bytes]) -> Dict[float, Text]
+    """
+    Save *scaled_images*, the images of the result *instance* by scale.
+    :return: the storage names of the images, by scale.
+    """
+    ext = os.path.splitext(instance.image.name)[1]
+    names = {}
+    for scale, content in scaled_images.items():
+        scaled_image = ScaledImage(result=instance, scale=scale)
+        scaled_image.image.save(
+            get_scaled_image_file_name(instance.tex_key, scale, ext),
+            ContentFile(content), save=False)
+        try:
+            with span("save"), transaction.atomic():
+                scaled_image.save()
+        except IntegrityError:
+            # Saved concurrently, as the same file
+            scaled_image = ScaledImage.objects.get(
+                result=instance, scale=scale)
+        names[scale] = scaled_image.image.name
+    return names
+
+
+def get_scaled_image_names(instance, scales, converter):
+    # type: (Any, List[float], Any) -> Dict[float, Text]
+    """
+    :param converter: the :class:`latex.converter.Tex2ImgBase` of the
+        source of *instance*, by which the missing images are rasterized,
+        from the compiled file kept (see :mod:`latex.variants`) if any,
+        else by compiling the source again.
+    :return: the storage names of the images of the result *instance* at
+        *scales*, by scale.
+    """
+    names = dict(
+        instance.scaled_images.filter(scale__in=scales)
+        .values_list("scale", "image"))
+
+    missing = [scale for scale in scales if scale not in names]
+    if missing:
+        converter.scales = missing
+        compiled_data = None
+        if converter.source_key is not None and get_variant_formats():
+            compiled_data = read_compiled_file(converter.source_key)
+            if compiled_data is not None:
+                # Compiled with the result, whose metadata tells whether
+                # on a tight page
+                converter.tight_page = instance.depth is not None
+        names.update(save_scaled_images(
+            instance, converter.get_scaled_images(compiled_data)))
+    return names
+
+
+def get_srcset(names, request=None):
+    # type: (Dict[float, Text], Any) -> Text
+    """
+    :param names: the storage names of the images, by scale.
+    :return: the ``srcset`` of the images, their names (or their URLs if
+        not settings.L2I_API_IMAGE_RETURNS_RELATIVE_PATH, as the ``image``
+        field) followed by their scales, e.g.,
+        ``l2i_images/<tex_key>.png 1x, l2i_images/<tex_key>-2x.png 2x``.
+    """
+    relative = getattr(settings, "L2I_API_IMAGE_RETURNS_RELATIVE_PATH", True)
+    candidates = []
+    for scale, name in sorted(names.items()):
+        if not relative:
+            name = get_image_storage().url(name)
+            if request is not None:
+                name = request.build_absolute_uri(name)
+        candidates.append("%s %sx" % (name, format_scale(scale)))
+    return ", ".join(candidates)
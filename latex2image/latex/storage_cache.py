@@ -0,0 +1,308 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import division
+
+__copyright__ = "Copyright (C) 2020 Dong Zhuang"
+
+__license__ = """
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+"""
+
+import os
+import tempfile
+import threading
+from hashlib import sha1
+from typing import Dict, Optional, Text, Tuple  # noqa
+
+from django.core.files.base import File
+
+from latex.metrics import STORAGE_CACHE_LOOKUPS
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+# The cache is evicted down to this ratio of its maximum size, so that it is
+# not evicted again at the next put.
+EVICTION_TARGET_RATIO = 0.9
+
+LOCK_FILE_NAME = ".evict.lock"
+
+# Appended to the name of the cached file of a storage file, for its
+# metadata (its size, if known), cached apart when its content is not
+METADATA_SUFFIX = ".meta"
+
+
+def get_storage_cache_settings():
+    # type: () -> Tuple[Optional[Text], int]
+    from django.conf import settings
+    return (getattr(settings, "L2I_STORAGE_CACHE_DIR", None),
+            getattr(settings, "L2I_STORAGE_CACHE_MAX_BYTES", 1024 ** 3))
+
+
+class StorageDiskCache(object):
+    """
+    Local disk cache of storage files, keyed by their names, with the least
+    recently used files evicted when it outgrows *max_bytes*.
+
+    It may be shared by the worker processes of a node: files are written
+    to a temp file then renamed, so that a reader never sees a partial file,
+    a file being read is still readable when evicted, and one process evicts
+    at a time. The recency of a file is its mtime, updated when it is read.
+    """
+
+    def __init__(self, directory, max_bytes):
+        # type: (Text, int) -> None
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+
+        # Bytes put by this process since the last eviction, the total size
+        # is only computed (by listing the cache) when this could exceed
+        # what was left.
+        self._put_bytes = 0
+        self._free_bytes = 0
+        self._lock = threading.Lock()
+
+    def get_path(self, name):
+        # type: (Text) -> Text
+        return os.path.join(
+            self.directory, sha1(name.encode("utf-8")).hexdigest())
+
+    def get(self, name):
+        # type: (Text) -> Optional[Text]
+        """
+        :return: the path of the cached file of *name*, or None.
+        """
+        path = self.get_path(name)
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        return path
+
+    def put(self, name, chunks):
+        """
+        Cache the file of *name* with content *chunks*.
+
+        :return: the path of the cached file.
+        """
+        return self._put(self.get_path(name), chunks)
+
+    def get_metadata_path(self, name):
+        # type: (Text) -> Text
+        return self.get_path(name) + METADATA_SUFFIX
+
+    def get_size(self, name):
+        # type: (Text) -> Tuple[bool, Optional[int]]
+        """
+        :return: whether the file of *name* is known to exist, from its
+            cached file or its cached metadata, and its size if known.
+        """
+        path = self.get(name)
+        if path is not None:
+            try:
+                return True, os.path.getsize(path)
+            except FileNotFoundError:
+                # Evicted meanwhile
+                pass
+
+        metadata_path = self.get_metadata_path(name)
+        try:
+            os.utime(metadata_path)
+            with open(metadata_path) as f:
+                size = f.read()
+        except FileNotFoundError:
+            return False, None
+        return True, int(size) if size else None
+
+    def put_size(self, name, size=None):
+        # type: (Text, Optional[int]) -> None
+        """
+        Cache the existence of the file of *name*, and its *size* if known,
+        without its content.
+        """
+        self._put(self.get_metadata_path(name),
+                  [b"" if size is None else str(size).encode()])
+
+    def _put(self, path, chunks):
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, prefix=".")
+        size = 0
+        try:
+            with os.fdopen(fd, "wb") as f:
+                for chunk in chunks:
+                    f.write(chunk)
+                    size += len(chunk)
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+        with self._lock:
+            self._put_bytes += size
+            evict = self._put_bytes > self._free_bytes
+        if evict:
+            self.evict()
+        return path
+
+    def delete(self, name):
+        # type: (Text) -> None
+        for path in [self.get_path(name), self.get_metadata_path(name)]:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def evict(self):
+        # type: () -> None
+        """
+        Remove the least recently used files until the cache is below its
+        target size.
+        """
+        lock_file = open(os.path.join(self.directory, LOCK_FILE_NAME), "w")
+        try:
+            if fcntl is not None:
+                try:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except OSError:
+                    # Being evicted by another process
+                    return
+
+            entries = []
+            total = 0
+            with os.scandir(self.directory) as it:
+                for entry in it:
+                    if entry.name.startswith("."):
+                        continue
+                    try:
+                        stat = entry.stat()
+                    except FileNotFoundError:
+                        continue
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+                    total += stat.st_size
+
+            target = self.max_bytes * EVICTION_TARGET_RATIO
+            if total > self.max_bytes:
+                for _mtime, size, path in sorted(entries):
+                    if total <= target:
+                        break
+                    try:
+                        os.remove(path)
+                    except FileNotFoundError:
+                        pass
+                    total -= size
+
+            with self._lock:
+                self._put_bytes = 0
+                self._free_bytes = max(self.max_bytes - total, 0)
+        finally:
+            lock_file.close()
+
+
+_caches = {}  # type: Dict[Tuple[Text, int], StorageDiskCache]
+_caches_lock = threading.Lock()
+
+
+def get_storage_disk_cache():
+    # type: () -> Optional[StorageDiskCache]
+    """
+    :return: the cache configured by settings.L2I_STORAGE_CACHE_DIR and
+        settings.L2I_STORAGE_CACHE_MAX_BYTES, or None if not configured.
+    """
+    directory, max_bytes = get_storage_cache_settings()
+    if not directory:
+        return None
+    with _caches_lock:
+        key = (directory, max_bytes)
+        if key not in _caches:
+            _caches[key] = StorageDiskCache(directory, max_bytes)
+        return _caches[key]
+
+
+class DiskCachedStorageMixin(object):
+    """
+    Storage mixin reading files, their existence and size from the local
+    disk cache (if configured) before the storage, e.g., S3.
+
+    The metadata of the files which are not read, i.e., their existence
+    and size, are cached on their own. Only existing files are cached,
+    files saved or deleted by other nodes may be stale in the cache of a
+    node until evicted.
+    """
+
+    def open(self, name, mode="rb"):
+        cache = get_storage_disk_cache()
+        if cache is None or mode != "rb":
+            return super().open(name, mode)
+
+        path = cache.get(name)
+        if path is None:
+            STORAGE_CACHE_LOOKUPS.labels(operation="open", result="miss").inc()
+            with super().open(name, mode) as f:
+                path = cache.put(name, f.chunks())
+        else:
+            STORAGE_CACHE_LOOKUPS.labels(operation="open", result="hit").inc()
+
+        # Still readable if evicted once open
+        return File(open(path, mode), name=name)
+
+    def exists(self, name):
+        cache = get_storage_disk_cache()
+        if cache is None:
+            return super().exists(name)
+
+        if cache.get_size(name)[0]:
+            STORAGE_CACHE_LOOKUPS.labels(
+                operation="exists", result="hit").inc()
+            return True
+        STORAGE_CACHE_LOOKUPS.labels(operation="exists", result="miss").inc()
+        exists = super().exists(name)
+        if exists:
+            cache.put_size(name)
+        return exists
+
+    def size(self, name):
+        cache = get_storage_disk_cache()
+        if cache is None:
+            return super().size(name)
+
+        size = cache.get_size(name)[1]
+        if size is not None:
+            STORAGE_CACHE_LOOKUPS.labels(operation="size", result="hit").inc()
+            return size
+        STORAGE_CACHE_LOOKUPS.labels(operation="size", result="miss").inc()
+        size = super().size(name)
+        cache.put_size(name, size)
+        return size
+
+    def _save(self, name, content):
+        cache = get_storage_disk_cache()
+        if cache is not None:
+            cache.delete(name)
+        return super()._save(name, content)
+
+    def delete(self, name):
+        cache = get_storage_disk_cache()
+        if cache is not None:
+            cache.delete(name)
+        return super().delete(name)
+
+# vim: foldmethod=marker
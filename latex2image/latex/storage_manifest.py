@@ -0,0 +1,344 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import division
+
+__copyright__ = "Copyright (C) 2020 Dong Zhuang"
+
+__license__ = """
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+"""
+
+import logging
+import os
+import sqlite3
+import threading
+from typing import Any, Dict, Iterable, Iterator, Optional, Text  # noqa
+
+from latex.metrics import STORAGE_MANIFEST_LOOKUPS
+from latex.utils import iter_batches
+
+logger = logging.getLogger(__name__)
+
+REDIS_MANIFEST_KEY = "l2i:storage_manifest"
+REDIS_COMPLETE_KEY = "l2i:storage_manifest:complete"
+
+
+# {{{ manifests
+
+class StorageManifest(object):
+    """
+    Index of the names of the files in the image storage. It is complete
+    once built from a listing of the storage (see the build_storage_manifest
+    command), and kept current as files are saved and deleted; only then
+    are existence checks answered by it instead of the storage.
+
+    Files saved or deleted while it is being built may be missed.
+    """
+
+    def contains(self, name):
+        # type: (Text) -> bool
+        raise NotImplementedError
+
+    def add(self, names):
+        # type: (Iterable[Text]) -> None
+        raise NotImplementedError
+
+    def discard(self, names):
+        # type: (Iterable[Text]) -> None
+        raise NotImplementedError
+
+    def is_complete(self):
+        # type: () -> bool
+        raise NotImplementedError
+
+    def set_complete(self, complete):
+        # type: (bool) -> None
+        raise NotImplementedError
+
+    def rebuild(self, names, batch_size=1000):
+        # type: (Iterable[Text], int) -> int
+        """
+        Replace the content of the manifest by *names*, and mark it as
+        complete.
+
+        :return: the number of names.
+        """
+        raise NotImplementedError
+
+    def iter_names(self):
+        # type: () -> Iterator[Text]
+        raise NotImplementedError
+
+    def __len__(self):
+        raise NotImplementedError
+
+
+class SqliteStorageManifest(StorageManifest):
+    """
+    Manifest in a local SQLite file, which may be shared by the worker
+    processes of a node.
+    """
+
+    def __init__(self, filename):
+        # type: (Text) -> None
+        self.filename = filename
+        self._local = threading.local()
+
+    def _get_connection(self):
+        # type: () -> sqlite3.Connection
+        connection = getattr(self._local, "connection", None)
+        if connection is None or self._local.pid != os.getpid():
+            # Autocommit, transactions are explicit
+            connection = sqlite3.connect(
+                self.filename, timeout=30, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            for table in ["names", "names_new"]:
+                connection.execute(
+                    "CREATE TABLE IF NOT EXISTS %s "
+                    "(name TEXT PRIMARY KEY) WITHOUT ROWID" % table)
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS meta "
+                "(key TEXT PRIMARY KEY, value TEXT)")
+            self._local.connection = connection
+            self._local.pid = os.getpid()
+        return connection
+
+    def contains(self, name):
+        cursor = self._get_connection().execute(
+            "SELECT 1 FROM names WHERE name = ?", (name,))
+        return cursor.fetchone() is not None
+
+    def _executemany(self, sql, names):
+        connection = self._get_connection()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            connection.executemany(sql, ((name,) for name in names))
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+        connection.execute("COMMIT")
+
+    def add(self, names):
+        self._executemany("INSERT OR IGNORE INTO names VALUES (?)", names)
+
+    def discard(self, names):
+        self._executemany("DELETE FROM names WHERE name = ?", names)
+
+    def is_complete(self):
+        cursor = self._get_connection().execute(
+            "SELECT value FROM meta WHERE key = 'complete'")
+        row = cursor.fetchone()
+        return row is not None and row[0] == "1"
+
+    def set_complete(self, complete):
+        self._get_connection().execute(
+            "INSERT OR REPLACE INTO meta VALUES ('complete', ?)",
+            ("1" if complete else "0",))
+
+    def rebuild(self, names, batch_size=1000):
+        connection = self._get_connection()
+        connection.execute("DELETE FROM names_new")
+
+        # Listed into another table first, so that the manifest is only
+        # locked for the (local) copy.
+        n_names = 0
+        for batch in iter_batches(names, batch_size):
+            self._executemany("INSERT OR IGNORE INTO names_new VALUES (?)", batch)
+            n_names += len(batch)
+
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            connection.execute("DELETE FROM names")
+            connection.execute("INSERT INTO names SELECT name FROM names_new")
+            connection.execute("DELETE FROM names_new")
+            connection.execute(
+                "INSERT OR REPLACE INTO meta VALUES ('complete', '1')")
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+        connection.execute("COMMIT")
+        return n_names
+
+    def iter_names(self):
+        # Sorted, as the primary key
+        yield from (
+            row[0] for row in self._get_connection().execute(
+                "SELECT name FROM names ORDER BY name"))
+
+    def __len__(self):
+        return self._get_connection().execute(
+            "SELECT COUNT(*) FROM names").fetchone()[0]
+
+
+class RedisStorageManifest(StorageManifest):
+    """
+    Manifest as a Redis set, shared by all nodes.
+    """
+
+    def __init__(self, connection):
+        self.connection = connection
+
+    def contains(self, name):
+        return bool(self.connection.sismember(REDIS_MANIFEST_KEY, name))
+
+    def add(self, names):
+        names = list(names)
+        if names:
+            self.connection.sadd(REDIS_MANIFEST_KEY, *names)
+
+    def discard(self, names):
+        names = list(names)
+        if names:
+            self.connection.srem(REDIS_MANIFEST_KEY, *names)
+
+    def is_complete(self):
+        return self.connection.get(REDIS_COMPLETE_KEY) in (b"1", "1")
+
+    def set_complete(self, complete):
+        self.connection.set(REDIS_COMPLETE_KEY, "1" if complete else "0")
+
+    def rebuild(self, names, batch_size=1000):
+        tmp_key = "%s:new" % REDIS_MANIFEST_KEY
+        self.connection.delete(tmp_key)
+        n_names = 0
+        for batch in iter_batches(names, batch_size):
+            self.connection.sadd(tmp_key, *batch)
+            n_names += len(batch)
+
+        pipeline = self.connection.pipeline()
+        if n_names:
+            pipeline.rename(tmp_key, REDIS_MANIFEST_KEY)
+        else:
+            pipeline.delete(REDIS_MANIFEST_KEY)
+        pipeline.set(REDIS_COMPLETE_KEY, "1")
+        pipeline.execute()
+        return n_names
+
+    def iter_names(self):
+        for name in self.connection.sscan_iter(REDIS_MANIFEST_KEY, count=1000):
+            yield name.decode() if isinstance(name, bytes) else name
+
+    def __len__(self):
+        return self.connection.scard(REDIS_MANIFEST_KEY)
+
+
+_manifests = {}  # type: Dict[Text, StorageManifest]
+
+
+def get_storage_manifest():
+    # type: () -> Optional[StorageManifest]
+    """
+    :return: the manifest configured by settings.L2I_STORAGE_MANIFEST, i.e.,
+        a Redis set if "redis" (using the connection of the default
+        cache), else a SQLite file of this name, or None if not configured.
+    """
+    from django.conf import settings
+    location = getattr(settings, "L2I_STORAGE_MANIFEST", None)
+    if not location:
+        return None
+    if location not in _manifests:
+        if location == "redis":
+            from django_redis import get_redis_connection
+            _manifests[location] = RedisStorageManifest(
+                get_redis_connection("default"))
+        else:
+            _manifests[location] = SqliteStorageManifest(location)
+    return _manifests[location]
+
+# }}}
+
+
+def image_file_exists(storage, name):
+    # type: (Any, Text) -> bool
+    """
+    :return: whether *name* exists in *storage*, according to the manifest
+        if it is complete.
+    """
+    manifest = get_storage_manifest()
+    if manifest is not None:
+        try:
+            if manifest.is_complete():
+                exists = manifest.contains(name)
+                STORAGE_MANIFEST_LOOKUPS.labels(
+                    result="present" if exists else "absent").inc()
+                return exists
+        except Exception:
+            logger.exception("Failed to look up the storage manifest")
+    return storage.exists(name)
+
+
+def iter_storage_file_names(storage, directory):
+    # type: (Any, Text) -> Iterator[Text]
+    """
+    Yield the names of all files in *directory* of *storage*, recursively.
+    """
+    s3_connection = getattr(storage, "s3_connection", None)
+    if s3_connection is not None:
+        # django-s3-storage: list the objects by pages of 1000, instead of
+        # once per (shard) folder
+        prefix = storage._get_key_name(directory) + "/"
+        paginator = s3_connection.get_paginator("list_objects_v2")
+        for page in paginator.paginate(
+                Bucket=storage.settings.AWS_S3_BUCKET_NAME, Prefix=prefix):
+            for obj in page.get("Contents", []):
+                yield "/".join([directory, obj["Key"][len(prefix):]])
+        return
+
+    if not storage.exists(directory):
+        return
+    dirs, files = storage.listdir(directory)
+    for file_name in files:
+        yield "/".join([directory, file_name])
+    for dir_name in dirs:
+        yield from iter_storage_file_names(
+            storage, "/".join([directory, dir_name]))
+
+
+class ManifestStorageMixin(object):
+    """
+    Storage mixin keeping the manifest (if configured) current as files are
+    saved and deleted.
+    """
+
+    def _save(self, name, content):
+        name = super()._save(name, content)
+        manifest = get_storage_manifest()
+        if manifest is not None:
+            try:
+                manifest.add([name])
+            except Exception:
+                # Only costs a compilation if the image is requested again
+                logger.exception("Failed to add %s to the manifest", name)
+        return name
+
+    def delete(self, name):
+        super().delete(name)
+        manifest = get_storage_manifest()
+        if manifest is not None:
+            try:
+                manifest.discard([name])
+            except Exception:
+                # The manifest would tell the file exists
+                logger.exception("Failed to discard %s from the manifest", name)
+                try:
+                    manifest.set_complete(False)
+                except Exception:
+                    logger.exception("Failed to mark the manifest incomplete")
+
+# vim: foldmethod=marker
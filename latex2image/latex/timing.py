@@ -0,0 +1,142 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import division
+
+__copyright__ = "Copyright (C) 2020 Dong Zhuang"
+
+__license__ = """
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+"""
+
+import json
+import logging
+import threading
+from contextlib import contextmanager, nullcontext
+from time import perf_counter
+from typing import Dict, List, Optional, Text, Tuple  # noqa
+
+logger = logging.getLogger(__name__)
+
+_local = threading.local()
+
+# Returned by span() when no recorder is active, so that instrumented code
+# costs a function call and an attribute lookup when timing is disabled.
+_NULL_SPAN = nullcontext()
+
+
+class SpanRecorder(object):
+    """
+    Records the durations of the named stages (spans) of a request.
+    Spans with the same name are summed up.
+    """
+
+    def __init__(self):
+        # type: () -> None
+        self.start = perf_counter()
+        self.durations = {}  # type: Dict[Text, float]
+
+    @contextmanager
+    def span(self, name):
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, perf_counter() - start)
+
+    def add(self, name, duration):
+        # type: (Text, float) -> None
+        self.durations[name] = self.durations.get(name, 0.) + duration
+
+    def get_total(self):
+        # type: () -> float
+        return perf_counter() - self.start
+
+    def as_ms_items(self):
+        # type: () -> List[Tuple[Text, float]]
+        return [(name, round(duration * 1000, 3))
+                for name, duration in self.durations.items()]
+
+    def get_server_timing_header(self, total=None):
+        # type: (Optional[float]) -> Text
+        items = self.as_ms_items()
+        if total is not None:
+            items.append(("total", round(total * 1000, 3)))
+        return ", ".join("%s;dur=%s" % (name, dur) for name, dur in items)
+
+
+def get_current_recorder():
+    # type: () -> Optional[SpanRecorder]
+    return getattr(_local, "recorder", None)
+
+
+def span(name):
+    """
+    Context manager timing a stage of the current request, a no-op if
+    timing is not enabled for the request.
+    """
+    recorder = getattr(_local, "recorder", None)
+    if recorder is None:
+        return _NULL_SPAN
+    return recorder.span(name)
+
+
+@contextmanager
+def recording():
+    """Activate a new :class:`SpanRecorder` in the current thread."""
+    previous = getattr(_local, "recorder", None)
+    recorder = _local.recorder = SpanRecorder()
+    try:
+        yield recorder
+    finally:
+        _local.recorder = previous
+
+
+def is_server_timing_enabled():
+    # type: () -> bool
+    from django.conf import settings
+    return getattr(settings, "L2I_SERVER_TIMING", False)
+
+
+class ServerTimingMiddleware(object):
+    """
+    If settings.L2I_SERVER_TIMING is True, time the stages of each
+    request, add them to the response as a ``Server-Timing`` header and
+    log them as one JSON line to the ``latex.timing`` logger.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not is_server_timing_enabled():
+            return self.get_response(request)
+
+        with recording() as recorder:
+            response = self.get_response(request)
+        total = recorder.get_total()
+
+        response["Server-Timing"] = recorder.get_server_timing_header(total)
+        logger.info(json.dumps({
+            "method": request.method,
+            "path": request.path,
+            "status": response.status_code,
+            "total_ms": round(total * 1000, 3),
+            "spans": dict(recorder.as_ms_items()),
+        }))
+        return response
@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import division
+
+__copyright__ = "Copyright (C) 2020 Dong Zhuang"
+
+__license__ = """
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+"""
+
+import os
+from typing import Any, Dict, List, Sequence, Text, Tuple  # noqa
+
+# A page rasterized by ImageMagick: its width, height and RGBA pixels
+RasterPage = Tuple[int, int, bytes]
+
+
+# {{{ bounding boxes
+
+def get_bounding_boxes(pages):
+    # type: (Any) -> Any
+    """
+    :param pages: an array of shape ``(n_pages, height, width, 4)`` of the
+        RGBA pixels of pages.
+    :return: an array of shape ``(n_pages, 4)`` of the ``(top, left,
+        bottom, right)`` (bottom and right exclusive) of the content of
+        each page, i.e., the pixels different from the top left one, which
+        is taken as the background, as ImageMagick's ``-trim`` does. Any
+        transparent pixel is background on a transparent page. The box of
+        a blank page is its top left pixel.
+    """
+    import numpy as np
+
+    background = pages[:, :1, :1, :]
+    content = np.any(pages != background, axis=-1)
+    content &= ~((pages[..., 3] == 0) & (background[..., 3] == 0))
+
+    rows = content.any(axis=2)
+    columns = content.any(axis=1)
+    height, width = rows.shape[1], columns.shape[1]
+    boxes = np.stack([
+        rows.argmax(axis=1),
+        columns.argmax(axis=1),
+        height - rows[:, ::-1].argmax(axis=1),
+        width - columns[:, ::-1].argmax(axis=1)], axis=1)
+    boxes[~rows.any(axis=1)] = (0, 0, 1, 1)
+    return boxes
+
+
+def add_margin(boxes, margin, height, width):
+    # type: (Any, int, int, int) -> Any
+    """
+    :return: *boxes* grown by *margin* pixels on each side, within the
+        pages of *height* and *width*.
+    """
+    import numpy as np
+
+    if not margin:
+        return boxes
+    return np.clip(
+        boxes + np.array([-margin, -margin, margin, margin]),
+        0, [height, width, height, width])
+
+# }}}
+
+
+# {{{ trim
+
+def trim_pages(pages, margin=0):
+    # type: (Sequence[RasterPage], int) -> List[Any]
+    """
+    :param pages: the pages as rasterized, whose buffers are read in place.
+        Pages of the same size are trimmed together, in one pass.
+    :param margin: the pixels of background kept around the content.
+    :return: the arrays of shape ``(height, width, 4)`` of the RGBA pixels
+        of the pages trimmed, views of the buffers of *pages*.
+    """
+    import numpy as np
+
+    trimmed = [None] * len(pages)  # type: List[Any]
+    by_size = {}  # type: Dict[Tuple[int, int], List[int]]
+    for i, (width, height, _pixels) in enumerate(pages):
+        by_size.setdefault((width, height), []).append(i)
+
+    for (width, height), indices in by_size.items():
+        if len(indices) == 1:
+            stacked = np.frombuffer(pages[indices[0]][2], dtype=np.uint8)
+        else:
+            stacked = np.frombuffer(
+                b"".join(pages[i][2] for i in indices), dtype=np.uint8)
+        stacked = stacked.reshape(len(indices), height, width, 4)
+
+        boxes = add_margin(get_bounding_boxes(stacked), margin, height, width)
+        for i, page, (top, left, bottom, right) in zip(
+                indices, stacked, boxes):
+            trimmed[i] = page[top:bottom, left:right]
+
+    return trimmed
+
+
+def save_trimmed_pages(pages, image_path, margin=0):
+    # type: (Sequence[RasterPage], Text, int) -> None
+    """
+    Trim *pages* (see :func:`trim_pages`), and save them as PNG to
+    *image_path*, or (for more than one page) as ImageMagick names them,
+    i.e., ``<base>-<i><ext>``, so that they are counted by
+    :func:`latex.converter.get_number_of_images`. Pages without
+    transparency are saved as RGB.
+    """
+    import numpy as np
+    from PIL import Image
+
+    base, ext = os.path.splitext(image_path)
+    trimmed = trim_pages(pages, margin)
+    for i, pixels in enumerate(trimmed):
+        path = image_path if len(trimmed) == 1 else "%s-%d%s" % (base, i, ext)
+        if np.all(pixels[..., 3] == 255):
+            pixels = pixels[..., :3]
+        Image.fromarray(np.ascontiguousarray(pixels)).save(path, format="PNG")
+
+# }}}
+
+# vim: foldmethod=marker
@@ -24,9 +24,14 @@ OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
 THE SOFTWARE.
 """
 
+import json
 import os
+import re
+import tempfile
+from itertools import islice
 from subprocess import PIPE, Popen
-from typing import Any, List, Optional, Text, Tuple  # noqa
+from typing import (Any, Dict, Iterable, Iterator, List, Optional,  # noqa
+                    Text, Tuple)
 
 from codemirror import CodeMirrorJavascript, CodeMirrorTextarea
 from django.core.checks import Critical
@@ -35,6 +40,8 @@ from django.core.management.base import CommandError
 from django.utils.encoding import DEFAULT_LOCALE_ENCODING, force_str
 from django.utils.text import format_lazy
 
+from latex.metrics import ACTIVE_SUBPROCESSES
+
 # {{{ Constants
 
 ALLOWED_COMPILER = ['latex', 'xelatex', 'xelatex']
@@ -73,13 +80,14 @@ def popen_wrapper(args, os_err_exc_type=CommandError,
     Returns stdout output, stderr output and OS status code.
     """
 
-    try:
-        p = Popen(args, stdout=PIPE,
-                  stderr=PIPE, close_fds=os.name != 'nt', **kwargs)
-    except OSError as e:
-        raise os_err_exc_type from e
+    with ACTIVE_SUBPROCESSES.track_inprogress():
+        try:
+            p = Popen(args, stdout=PIPE,
+                      stderr=PIPE, close_fds=os.name != 'nt', **kwargs)
+        except OSError as e:
+            raise os_err_exc_type from e
 
-    output, errors = p.communicate()
+        output, errors = p.communicate()
     return (
         force_str(output, stdout_encoding, strings_only=True,
                    errors='strict'),
@@ -108,6 +116,28 @@ def file_write(filename, content):
         f.write(content)
 
 
+def write_json_atomically(filename, obj, fsync=False):
+    # type: (Text, Any, bool) -> None
+    '''
+    Write *obj* as JSON to a temp file, then move it to *filename*. With
+    *fsync*, the content is flushed to disk before it is moved.
+    '''
+    fd, tmp_path = tempfile.mkstemp(
+        dir=os.path.dirname(os.path.abspath(filename)),
+        prefix=".%s." % os.path.basename(filename))
+    try:
+        with os.fdopen(fd, "w") as f:
+            json.dump(obj, f)
+            if fsync:
+                f.flush()
+                os.fsync(f.fileno())
+        os.replace(tmp_path, filename)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
 # }}}
 
 
@@ -141,6 +171,187 @@ def get_abstract_latex_log(log):
 # }}}
 
 
+# {{{ tex source canonicalization
+
+# Bump this when the rules below change, so that keys built from the
+# canonical form change too.
+CANONICAL_FORM_VERSION = 1
+
+# Sources using any of these are only canonicalized for line endings,
+# because spaces, line breaks or "%" may be significant in them.
+CANONICALIZATION_UNSAFE_RE = re.compile(
+    r"\\(verb|lstinline|mintinline|url|href|path|catcode|obeyspaces|obeylines"
+    r"|begin\s*\{\s*(verbatim|Verbatim|BVerbatim|lstlisting|minted|comment"
+    r"|filecontents)\*?\s*\})(?![a-zA-Z])")
+
+END_DOCUMENT_RE = re.compile(r"\\end\s*\{document\}")
+
+HORIZONTAL_WHITESPACE_RE = re.compile(r"[ \t]+")
+BLANK_LINES_RE = re.compile(r"\n{3,}")
+
+
+def _find_comment_start(line):
+    # type: (Text) -> int
+    """
+    :return: the index of the "%" starting a comment in *line*, i.e., not
+        escaped by an odd number of backslashes, or -1.
+    """
+    pos = line.find("%")
+    while pos != -1:
+        n_backslashes = 0
+        while pos - n_backslashes > 0 and line[pos - n_backslashes - 1] == "\\":
+            n_backslashes += 1
+        if n_backslashes % 2 == 0:
+            return pos
+        pos = line.find("%", pos + 1)
+    return -1
+
+
+def canonicalize_tex_source(tex_source):
+    # type: (Text) -> Text
+    """
+    Return a canonical form of *tex_source*, which only serves as the input
+    of key hashing: sources which TeX reads the same way (under the default
+    catcodes) have the same canonical form. Rules:
+
+    * line endings are normalized to ``\\n``;
+    * comments are removed, keeping the "%" which swallows the line end
+      unless it follows a space, and lines with only a comment are removed;
+    * runs of spaces and tabs become one space, spaces at the beginning
+      and the end of lines are removed;
+    * runs of blank lines become one blank line;
+    * anything after ``\\end{document}`` is removed.
+
+    Sources using verbatim like commands or environments, or changing
+    catcodes, are only normalized for line endings.
+    """
+    tex_source = tex_source.replace("\r\n", "\n").replace("\r", "\n").strip()
+    if CANONICALIZATION_UNSAFE_RE.search(tex_source):
+        return tex_source
+
+    lines = []
+    for line in tex_source.split("\n"):
+        comment_start = _find_comment_start(line)
+        if comment_start != -1:
+            line = line[:comment_start].lstrip(" \t")
+            if not line:
+                # A comment line is not a blank line (which is a \par)
+                continue
+            if line[-1] in " \t":
+                # The space before the "%" stands for the swallowed line
+                # end, which is a space too
+                line = line.rstrip(" \t")
+            else:
+                line += "%"
+        else:
+            line = line.strip(" \t")
+        line = HORIZONTAL_WHITESPACE_RE.sub(" ", line)
+
+        end_document = END_DOCUMENT_RE.search(line)
+        if end_document is not None:
+            lines.append(line[:end_document.end()])
+            break
+        lines.append(line)
+
+    return BLANK_LINES_RE.sub("\n\n", "\n".join(lines)).strip()
+
+# }}}
+
+
+# {{{ tight page
+
+BEGIN_DOCUMENT_RE = re.compile(r"\\begin\s*\{document\}")
+
+# Sources whose pages are already tight, or which set up preview themselves
+TIGHT_PAGE_UNSAFE_RE = re.compile(
+    r"\\(documentclass\s*(\[[^\]]*\])?\s*\{\s*standalone\s*\}"
+    r"|usepackage\s*(\[[^\]]*\])?\s*\{[^}]*\bpreview\b)")
+
+TIGHT_PAGE_PREAMBLE = (
+    "\\usepackage[active,tightpage]{preview}\n"
+    "\\usepackage{varwidth}\n")
+TIGHT_PAGE_BEGIN = (
+    "\\begin{preview}\\begin{varwidth}{\\linewidth}"
+    "\\setlength{\\parindent}{0pt}\n")
+TIGHT_PAGE_END = "\n\\end{varwidth}\\end{preview}\n"
+
+
+def wrap_tight_page(tex_source):
+    # type: (Text) -> Optional[Text]
+    """
+    Wrap the body of *tex_source* in a ``preview`` environment of the
+    preview package with the ``tightpage`` option, so that the engine
+    emits a page as large as the content (set in a ``varwidth`` as wide as
+    its widest line), rather than a full page which would be trimmed after
+    rasterization. The dimensions of the content are reported in the log,
+    see :func:`get_preview_metadata`.
+
+    :return: the wrapped source, or None if *tex_source* is not a complete
+        document, or uses the standalone class or the preview package.
+    """
+    if TIGHT_PAGE_UNSAFE_RE.search(tex_source):
+        return None
+
+    begin = BEGIN_DOCUMENT_RE.search(tex_source)
+    end = END_DOCUMENT_RE.search(tex_source)
+    if begin is None or end is None or end.start() < begin.end():
+        return None
+
+    return "".join([
+        tex_source[:begin.start()], TIGHT_PAGE_PREAMBLE,
+        tex_source[begin.start():begin.end()], TIGHT_PAGE_BEGIN,
+        tex_source[begin.end():end.start()], TIGHT_PAGE_END,
+        tex_source[end.start():]])
+
+
+# The dimensions are in sp, the border is added to the page by "tightpage"
+PREVIEW_TIGHTPAGE_RE = re.compile(
+    r"^Preview: Tightpage (-?\d+) (-?\d+) (-?\d+) (-?\d+)", re.MULTILINE)
+PREVIEW_SNIPPET_RE = re.compile(
+    r"^Preview: Snippet \d+ ended\.\((-?\d+)\+(-?\d+)x(-?\d+)\)", re.MULTILINE)
+
+SP_PER_PT = 65536
+
+
+def get_preview_metadata(log):
+    # type: (Text) -> Optional[Dict[Text, float]]
+    """
+    :return: a dict of the ``width``, the ``height`` (above the baseline)
+        and the ``depth`` (below the baseline) in pt of the page of the
+        first preview snippet in the compile *log*, including the border of
+        the tight page, or None if no snippet is reported.
+    """
+    snippet = PREVIEW_SNIPPET_RE.search(log)
+    if snippet is None:
+        return None
+    height, depth, width = (int(value) for value in snippet.groups())
+
+    left = bottom = right = top = 0
+    tightpage = PREVIEW_TIGHTPAGE_RE.search(log)
+    if tightpage is not None:
+        left, bottom, right, top = (
+            int(value) for value in tightpage.groups())
+
+    return {
+        "width": round((width - left + right) / SP_PER_PT, 3),
+        "height": round((height + top) / SP_PER_PT, 3),
+        "depth": round((depth - bottom) / SP_PER_PT, 3),
+    }
+
+# }}}
+
+
+def iter_batches(iterable, batch_size):
+    # type: (Iterable[Any], int) -> Iterator[List[Any]]
+    """Yield lists of (at most) *batch_size* items of *iterable*."""
+    iterator = iter(iterable)
+    while True:
+        batch = list(islice(iterator, batch_size))
+        if not batch:
+            return
+        yield batch
+
+
 def get_all_indirect_subclasses(cls):
     # type: (Any) -> List[Any]
     all_subcls = []
@@ -0,0 +1,267 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import division
+
+__copyright__ = "Copyright (C) 2020 Dong Zhuang"
+
+__license__ = """
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+"""
+
+
+import logging
+import re
+from typing import Any, List, Optional, Text  # noqa
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.files import File
+from django.db import IntegrityError, transaction
+
+from latex.compression import parse_quality_values
+from latex.constants import (ALLOWED_COMPILER_FORMAT_COMBINATION,
+                             IMAGE_FORMAT_MIME_TYPES, IMAGE_METADATA_FIELDS)
+from latex.converter import get_tex2img_class
+from latex.metrics import observe_storage_operation
+from latex.models import LatexImage, get_compiled_file_path, get_image_storage
+from latex.timing import span
+
+logger = logging.getLogger(__name__)
+
+# A source key is a generated tex_key without the image format, see
+# latex.converter.get_source_key
+SOURCE_KEY_RE = re.compile(
+    r"^(?P<digest>[0-9a-f]{32})_(?P<compiler>[a-z]+)"
+    r"_v(?P<version>[a-zA-Z0-9]+)$")
+
+
+# {{{ variant keys
+
+def get_variant_formats():
+    # type: () -> List[Text]
+    """
+    :return: the image formats served by content negotiation, the most
+        preferred first, see settings.L2I_VARIANT_FORMATS.
+    """
+    return list(getattr(settings, "L2I_VARIANT_FORMATS", None) or [])
+
+
+def get_source_compiler(source_key):
+    # type: (Text) -> Optional[Text]
+    match = SOURCE_KEY_RE.match(source_key)
+    if match is None:
+        return None
+    return match.group("compiler")
+
+
+def get_variant_key(source_key, image_format):
+    # type: (Text, Text) -> Text
+    """
+    :return: the tex_key of the source of *source_key* in *image_format*,
+        as :func:`latex.converter.build_key` generates it.
+    """
+    match = SOURCE_KEY_RE.match(source_key)
+    assert match is not None
+    digest, compiler, version = match.group("digest", "compiler", "version")
+    return "%s_%s_%s_v%s" % (digest, compiler, image_format, version)
+
+
+# Formats which are only served if the result exists, not converted from
+# the compiled file: dvipng can't render TikZ/PGF pictures, such sources
+# are converted to svg (see latex.converter.tex_to_img_converter), while
+# the source is unknown here.
+UNCONVERTED_VARIANTS = [("latex", "png")]
+
+
+def get_compiler_formats(compiler):
+    # type: (Text) -> List[Text]
+    return [image_format for _compiler, image_format
+            in ALLOWED_COMPILER_FORMAT_COMBINATION if _compiler == compiler]
+
+
+def get_compiled_file_name(source_key):
+    # type: (Text) -> Text
+    compiler = get_source_compiler(source_key)
+    assert compiler is not None
+    tex2img_class = get_tex2img_class(
+        compiler, get_compiler_formats(compiler)[0])
+    return get_compiled_file_path(
+        source_key, ".%s" % tex2img_class.compiler_class.output_format)
+
+# }}}
+
+
+# {{{ compiled files
+
+def keep_compiled_file(source_key, compiled_file_path):
+    # type: (Text, Text) -> None
+    """
+    Save the compiled file of *source_key* to the storage, from which the
+    other image formats are converted, if content negotiation is enabled.
+    """
+    if not get_variant_formats():
+        return
+
+    with span("compiled_file_upload"), observe_storage_operation("save"):
+        with open(compiled_file_path, "rb") as f:
+            get_image_storage().save(
+                get_compiled_file_name(source_key), File(f))
+
+
+def read_compiled_file(source_key):
+    # type: (Text) -> Optional[bytes]
+    try:
+        with span("storage_read"), observe_storage_operation("open"):
+            with get_image_storage().open(
+                    get_compiled_file_name(source_key)) as f:
+                return f.read()
+    except FileNotFoundError:
+        return None
+
+
+def delete_unused_compiled_file(source_key):
+    # type: (Text) -> None
+    """
+    Delete the compiled file of *source_key* if no result of the source
+    is left, in whatever image format.
+    """
+    compiler = get_source_compiler(source_key)
+    assert compiler is not None
+    if LatexImage.objects.filter(tex_key__in=[
+            get_variant_key(source_key, image_format)
+            for image_format in get_compiler_formats(compiler)]).exists():
+        return
+
+    with span("storage_delete"), observe_storage_operation("delete"):
+        get_image_storage().delete(get_compiled_file_name(source_key))
+
+# }}}
+
+
+# {{{ content negotiation
+
+def negotiate_image_formats(accept, image_formats):
+    # type: (Optional[Text], List[Text]) -> List[Text]
+    """
+    :param accept: the ``Accept`` header of the request, if any.
+    :param image_formats: the image formats available, the most preferred
+        first.
+    :return: the formats of *image_formats* accepted, the best first. Those
+        listed with a higher quality come first, then, with the same quality,
+        those named explicitly (e.g., ``image/svg+xml`` by browsers) before
+        those accepted by a wildcard only (e.g., ``*/*`` by email clients),
+        of which PNG, the most widely supported, comes first.
+    """
+    qualities = parse_quality_values(accept or "*/*")
+    wildcard_quality = qualities.get("image/*", qualities.get("*/*", 0.))
+
+    ranked = []
+    for index, image_format in enumerate(image_formats):
+        quality = qualities.get(IMAGE_FORMAT_MIME_TYPES[image_format])
+        named = quality is not None
+        if not named:
+            quality = wildcard_quality
+        if quality <= 0:
+            continue
+        ranked.append((
+            (-quality, not named, not named and image_format != "png", index),
+            image_format))
+
+    return [image_format for _rank, image_format in sorted(ranked)]
+
+
+def get_variant(source_key, image_formats):
+    # type: (Text, List[Text]) -> Optional[LatexImage]
+    """
+    :return: the result of the source of *source_key* in the first possible
+        format of *image_formats*. A result which does not exist yet is
+        converted from the compiled file of the source (see
+        :func:`keep_compiled_file`) and saved, as if it was requested in
+        that format. None if none exists or can be converted.
+    """
+    compiler = get_source_compiler(source_key)
+    assert compiler is not None
+
+    # Of all the formats, the creator of the converted ones is taken from
+    # them, so are the metadata of the page, which tell whether it was
+    # compiled tight
+    instances = {
+        instance.tex_key: instance
+        for instance in LatexImage.objects.filter(tex_key__in=[
+            get_variant_key(source_key, image_format)
+            for image_format in get_compiler_formats(compiler)]).only(
+                "tex_key", "image", "creation_time", "creator_id",
+                *IMAGE_METADATA_FIELDS)}
+    if not instances:
+        return None
+
+    metadata = {}
+    for instance in instances.values():
+        if instance.depth is not None:
+            metadata = {field: getattr(instance, field)
+                        for field in IMAGE_METADATA_FIELDS}
+            break
+
+    compiled_data = None
+    for image_format in image_formats:
+        tex_key = get_variant_key(source_key, image_format)
+        instance = instances.get(tex_key)
+        if instance is not None:
+            if instance.image:
+                return instance
+            # A compile error
+            continue
+
+        if (compiler, image_format) in UNCONVERTED_VARIANTS:
+            continue
+
+        if compiled_data is None:
+            compiled_data = read_compiled_file(source_key)
+            if compiled_data is None:
+                compiled_data = b""
+        if not compiled_data:
+            continue
+
+        converter = get_tex2img_class(compiler, image_format)(
+            tex_source="", tex_key=tex_key, tight_page=bool(metadata))
+        try:
+            data_url = converter.get_converted_data_url(compiled_data)
+        except Exception:
+            logger.exception("Failed to convert '%s'" % tex_key)
+            continue
+
+        instance = LatexImage(
+            tex_key=tex_key,
+            creator_id=next(iter(instances.values())).creator_id,
+            data_url=data_url, **metadata)
+        try:
+            with span("save"), transaction.atomic():
+                instance.save()
+        except (IntegrityError, ValidationError):
+            # Created concurrently
+            instance = LatexImage.objects.filter(tex_key=tex_key).first()
+            if instance is None or not instance.image:
+                continue
+        return instance
+
+    return None
+
+# }}}
+
+# vim: foldmethod=marker
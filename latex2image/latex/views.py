@@ -121,6 +121,7 @@ def request_get_data_url_from_latex_form_request(request):
                         tex_key=_converter.tex_key,
                         data_url=data_url,
                         creator=request.user,
+                        **_converter.metadata
                     )
                     with atomic():
                         instance.save()
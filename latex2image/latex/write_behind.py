@@ -0,0 +1,367 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import division
+
+__copyright__ = "Copyright (C) 2020 Dong Zhuang"
+
+__license__ = """
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+"""
+
+import json
+import logging
+import os
+import tempfile
+import threading
+from time import time, time_ns
+from typing import Any, Dict, List, Optional, Text  # noqa
+
+from django.core.exceptions import ImproperlyConfigured, ValidationError
+from django.db import IntegrityError, close_old_connections, transaction
+from django.utils.dateparse import parse_datetime
+from django.utils.timezone import now
+
+from latex.constants import IMAGE_METADATA_FIELDS
+from latex.metrics import WRITE_BEHIND_OPERATIONS
+from latex.models import LatexImage
+from latex.utils import write_json_atomically
+
+logger = logging.getLogger(__name__)
+
+QUEUE_DIR_NAME = "l2i_write_behind_queue"
+ENTRY_SUFFIX = ".json"
+CLAIMED_SUFFIX = ".claimed"
+
+# Fields of LatexImage which a pending result has, the others ("id" and
+# "image") only exist once it is committed.
+PENDING_RESULT_FIELDS = (
+    "tex_key", "creation_time", "data_url", "compile_error", "creator",
+    *IMAGE_METADATA_FIELDS)
+
+
+# {{{ settings
+
+def is_write_behind_enabled():
+    # type: () -> bool
+    from django.conf import settings
+    return getattr(settings, "L2I_WRITE_BEHIND", False)
+
+
+def get_queue_dir():
+    # type: () -> Text
+    from django.conf import settings
+    return (getattr(settings, "L2I_WRITE_BEHIND_QUEUE_DIR", None)
+            or os.path.join(tempfile.gettempdir(), QUEUE_DIR_NAME))
+
+
+def get_pending_cache_timeout():
+    # type: () -> int
+    from django.conf import settings
+    return getattr(settings, "L2I_WRITE_BEHIND_CACHE_TIMEOUT", 600)
+
+
+def can_write_behind(fields):
+    # type: (Optional[List[Text]]) -> bool
+    """
+    :return: whether a result whose *fields* are requested can be returned
+        before it is committed.
+    """
+    return bool(fields) and set(fields) <= set(PENDING_RESULT_FIELDS)
+
+# }}}
+
+
+# {{{ pending results cache
+
+def _get_cache():
+    try:
+        import django.core.cache as cache
+    except ImproperlyConfigured:
+        return None
+    return cache.caches["default"]
+
+
+def get_pending_cache_key(tex_key):
+    # type: (Text) -> Text
+    from latex.api import get_field_cache_key
+    return get_field_cache_key(tex_key, "pending")
+
+
+def get_pending_record(tex_key):
+    # type: (Text) -> Optional[Dict[Text, Any]]
+    """
+    :return: the record of the result of *tex_key* which is queued but not
+        committed yet, or None.
+    """
+    def_cache = _get_cache()
+    if def_cache is None:
+        return None
+    return def_cache.get(get_pending_cache_key(tex_key))
+
+# }}}
+
+
+# {{{ records
+
+def make_record(tex_key, creator_id, data_url=None, compile_error=None,
+                metadata=None):
+    # type: (...) -> Dict[Text, Any]
+    return {
+        "tex_key": tex_key,
+        "creator_id": creator_id,
+        "creation_time": now().isoformat(),
+        "data_url": data_url,
+        "compile_error": compile_error,
+        "metadata": metadata or {},
+    }
+
+
+def get_instance_from_record(record):
+    # type: (Dict[Text, Any]) -> LatexImage
+    return LatexImage(
+        tex_key=record["tex_key"], creator_id=record["creator_id"],
+        creation_time=parse_datetime(record["creation_time"]),
+        data_url=record["data_url"], compile_error=record["compile_error"],
+        # Not in records queued before
+        **record.get("metadata", {}))
+
+
+def commit_record(record):
+    # type: (Dict[Text, Any]) -> LatexImage
+    """
+    Save the result of *record*, unless it has been saved already, e.g.,
+    by a concurrent request.
+
+    :return: the saved instance.
+    """
+    tex_key = record["tex_key"]
+    instance = get_instance_from_record(record)
+    try:
+        with transaction.atomic():
+            instance.save()
+    except (IntegrityError, ValidationError):
+        existing = LatexImage.objects.filter(tex_key=tex_key).first()
+        if existing is None:
+            raise
+        WRITE_BEHIND_OPERATIONS.labels(result="duplicate").inc()
+        instance = existing
+    else:
+        WRITE_BEHIND_OPERATIONS.labels(result="committed").inc()
+
+    def_cache = _get_cache()
+    if def_cache is not None:
+        def_cache.delete(get_pending_cache_key(tex_key))
+    return instance
+
+# }}}
+
+
+# {{{ queue
+
+class WriteBehindQueue(object):
+    """
+    Durable queue of results to be saved, as one JSON file per result in
+    *directory*, which may be shared by the worker processes of a node.
+    An entry is claimed by renaming it, and deleted once committed.
+    """
+
+    def __init__(self, directory):
+        # type: (Text) -> None
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def put(self, record):
+        # type: (Dict[Text, Any]) -> Text
+        # Named by time, so that entries are committed in order. The
+        # tex_key is a slug, thus safe as part of a file name.
+        path = os.path.join(
+            self.directory,
+            "%d-%s%s" % (time_ns(), record["tex_key"], ENTRY_SUFFIX))
+        write_json_atomically(path, record, fsync=True)
+        return path
+
+    def _list(self, suffix):
+        # type: (Text) -> List[Text]
+        return sorted(
+            os.path.join(self.directory, name)
+            for name in os.listdir(self.directory)
+            if name.endswith(suffix) and not name.startswith("."))
+
+    def __len__(self):
+        return len(self._list(ENTRY_SUFFIX)) + len(self._list(CLAIMED_SUFFIX))
+
+    def claim(self, max_entries):
+        # type: (int) -> List[Text]
+        """
+        :return: the paths of at most *max_entries* claimed entries.
+        """
+        claimed = []
+        for path in self._list(ENTRY_SUFFIX):
+            if len(claimed) >= max_entries:
+                break
+            claimed_path = path + CLAIMED_SUFFIX
+            try:
+                os.rename(path, claimed_path)
+            except FileNotFoundError:
+                # Claimed by another process
+                continue
+            # The time of the claim, see recover()
+            os.utime(claimed_path)
+            claimed.append(claimed_path)
+        return claimed
+
+    def release(self, claimed_path):
+        # type: (Text) -> None
+        """Put a claimed entry back, e.g., to retry it later."""
+        os.rename(claimed_path, claimed_path[:-len(CLAIMED_SUFFIX)])
+
+    def done(self, claimed_path):
+        # type: (Text) -> None
+        os.remove(claimed_path)
+
+    def recover(self, timeout):
+        # type: (float) -> int
+        """
+        Release the entries claimed more than *timeout* seconds ago, by a
+        process which died before committing them.
+
+        :return: the number of entries released.
+        """
+        n_released = 0
+        for claimed_path in self._list(CLAIMED_SUFFIX):
+            try:
+                if os.path.getmtime(claimed_path) > time() - timeout:
+                    continue
+                self.release(claimed_path)
+            except FileNotFoundError:
+                continue
+            n_released += 1
+        return n_released
+
+    def drain(self, batch_size=100):
+        # type: (int) -> Dict[Text, int]
+        """
+        Commit the queued results, failed ones are left in the queue.
+
+        :return: the numbers of committed and failed entries.
+        """
+        counts = {"committed": 0, "failed": 0}
+        failed = []
+        try:
+            while True:
+                batch = self.claim(batch_size)
+                if not batch:
+                    break
+                for claimed_path in batch:
+                    try:
+                        with open(claimed_path) as f:
+                            commit_record(json.load(f))
+                    except Exception:
+                        logger.exception(
+                            "Failed to commit %s", claimed_path)
+                        WRITE_BEHIND_OPERATIONS.labels(result="failed").inc()
+                        counts["failed"] += 1
+                        # Released after the loop, not to be claimed again
+                        failed.append(claimed_path)
+                    else:
+                        self.done(claimed_path)
+                        counts["committed"] += 1
+        finally:
+            for claimed_path in failed:
+                self.release(claimed_path)
+        return counts
+
+
+def get_queue():
+    # type: () -> WriteBehindQueue
+    return WriteBehindQueue(get_queue_dir())
+
+# }}}
+
+
+# {{{ background worker
+
+class WriteBehindWorker(threading.Thread):
+    """
+    Daemon thread draining the queue whenever an entry is put, and every
+    *interval* seconds, which retries failed entries and entries left
+    by a previous (crashed) process.
+    """
+
+    def __init__(self, queue, interval=5, claim_timeout=300):
+        # type: (WriteBehindQueue, float, float) -> None
+        super().__init__(name="l2i-write-behind", daemon=True)
+        self.queue = queue
+        self.interval = interval
+        self.claim_timeout = claim_timeout
+        self.wake_up = threading.Event()
+
+    def run(self):
+        while True:
+            self.wake_up.wait(self.interval)
+            self.wake_up.clear()
+            try:
+                self.queue.recover(self.claim_timeout)
+                self.queue.drain()
+            except Exception:
+                logger.exception("Failed to drain the write behind queue")
+            finally:
+                close_old_connections()
+
+
+_worker = None  # type: Optional[WriteBehindWorker]
+_worker_pid = None  # type: Optional[int]
+_worker_lock = threading.Lock()
+
+
+def get_worker():
+    # type: () -> WriteBehindWorker
+    """
+    :return: the running worker of this process, started if needed (e.g.,
+        in a forked gunicorn worker).
+    """
+    global _worker, _worker_pid
+
+    with _worker_lock:
+        if _worker is None or _worker_pid != os.getpid():
+            _worker = WriteBehindWorker(get_queue())
+            _worker_pid = os.getpid()
+            _worker.start()
+        return _worker
+
+# }}}
+
+
+def enqueue(record):
+    # type: (Dict[Text, Any]) -> None
+    """
+    Make the result of *record* readable from the cache until committed,
+    then queue it to be committed by the background worker.
+    """
+    def_cache = _get_cache()
+    if def_cache is not None:
+        def_cache.set(
+            get_pending_cache_key(record["tex_key"]), record,
+            get_pending_cache_timeout())
+
+    get_queue().put(record)
+    WRITE_BEHIND_OPERATIONS.labels(result="queued").inc()
+    get_worker().wake_up.set()
+
+# vim: foldmethod=marker
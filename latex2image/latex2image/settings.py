@@ -12,6 +12,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/2.2/ref/settings/
 """
 
+import json
 import os
 import sys
 
@@ -108,6 +109,8 @@ INSTALLED_APPS = [
 
 
 MIDDLEWARE = [
+    'latex.timing.ServerTimingMiddleware',
+    'latex.metrics.RequestsInProgressMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'corsheaders.middleware.CorsMiddleware',
@@ -193,6 +196,33 @@ DATABASES = {
 
 # L2I_IMAGEMAGICK_PNG_RESOLUTION = 96
 
+# L2I_TRIM_MARGIN: Default to 0. The pixels (at the resolution above, scaled
+# with the "scales" of a request) of background kept around the formula
+# when the pages rasterized by ImageMagick are trimmed. Pages are trimmed
+# with numpy if installed (all pages at once, on their pixel buffers), else
+# by ImageMagick, which ignores the margin.
+
+# L2I_TRIM_MARGIN = 0
+
+L2I_TRIM_MARGIN = int(os.getenv("L2I_TRIM_MARGIN", 0))
+
+# The webp and avif images are rasterized as png by ImageMagick, then
+# encoded by Pillow; the formats it is built without are not offered, with
+# a system check warning. L2I_WEBP_QUALITY: Default to None, i.e.,
+# lossless webp images, else the quality (0-100) of lossy ones.
+# L2I_AVIF_QUALITY: Default to 90, the quality (0-100) of avif images.
+
+# L2I_WEBP_QUALITY = None
+# L2I_AVIF_QUALITY = 90
+
+webp_quality = os.getenv("L2I_WEBP_QUALITY", None)
+if webp_quality:
+    L2I_WEBP_QUALITY = int(webp_quality)
+
+avif_quality = os.getenv("L2I_AVIF_QUALITY", None)
+if avif_quality:
+    L2I_AVIF_QUALITY = int(avif_quality)
+
 redis_location = os.getenv('L2I_REDIS_LOCATION', None)
 redis_cache_location = (
     f"{redis_location}/0" if redis_location
@@ -240,6 +270,223 @@ L2I_CACHE_DATA_URL_ON_SAVE = os.getenv('L2I_REDIS_LOCATION', None) == "true"
 
 L2I_KEY_VERSION = os.getenv("L2I_KEY_VERSION", 1)
 
+# L2I_CANONICALIZE_TEX_SOURCE: Default to False. If True, the auto-generated
+# tex_key is the hash of a canonical form of the tex source (line endings,
+# comments and whitespace insignificant to TeX normalized), so that sources
+# differing only in those produce the same key and share the results. Such
+# keys have a version part like "v1c1" (L2I_KEY_VERSION, then the version
+# of the canonical form). Use "python manage.py tex_key_report" to estimate
+# the gain in hit rate from recorded requests.
+
+# L2I_CANONICALIZE_TEX_SOURCE = False
+
+L2I_CANONICALIZE_TEX_SOURCE = (
+        os.getenv("L2I_CANONICALIZE_TEX_SOURCE", None) == "true")
+
+# L2I_LEGACY_KEY_LOOKUP: Default to True. With L2I_CANONICALIZE_TEX_SOURCE,
+# if no result exists under the canonical key, the result saved under the
+# key of the verbatim source (i.e., created before canonicalization was
+# enabled) is returned instead of compiling again.
+
+# L2I_LEGACY_KEY_LOOKUP = True
+
+L2I_LEGACY_KEY_LOOKUP = os.getenv("L2I_LEGACY_KEY_LOOKUP", None) != "false"
+
+# L2I_SOURCE_ARCHIVE: Default to False. If True, the tex sources of create
+# requests without a tex_key (i.e., whose key is generated, and changes with
+# L2I_KEY_VERSION) are archived, compressed and deduplicated by content, so
+# that "python manage.py rerender --key-version <new version>" can render
+# them under the new keys (e.g., with a new TeX Live version) before
+# L2I_KEY_VERSION is switched.
+
+# L2I_SOURCE_ARCHIVE = False
+
+L2I_SOURCE_ARCHIVE = os.getenv("L2I_SOURCE_ARCHIVE", None) == "true"
+
+# L2I_SHARDED_STORAGE: Default to False. If True, new images are stored as
+# l2i_images/ab/cd/<tex_key>.<ext>, where "ab" and "cd" are taken from the
+# hash of the tex_key, instead of all in l2i_images/, which gets slow to list
+# and look up with many files. Images stored in the other layout are still
+# found. Use "python manage.py shard_images" to move the existing images.
+
+# L2I_SHARDED_STORAGE = False
+
+L2I_SHARDED_STORAGE = os.getenv("L2I_SHARDED_STORAGE", None) == "true"
+
+# L2I_WRITE_BEHIND: Default to False. If True, create requests whose
+# "fields" are among "tex_key", "creation_time", "data_url", "compile_error"
+# and "creator" (i.e., not "id" or "image", which only exist once saved)
+# return as soon as the image is converted. The result is saved (storage
+# upload, database insert and cache fill) by a background thread from a
+# queue on the local disk, and is read from the cache until then. Results
+# left in the queue by a stopped server are saved once the next one queues
+# a result, or by "python manage.py drain_write_behind".
+
+# L2I_WRITE_BEHIND = False
+
+L2I_WRITE_BEHIND = os.getenv("L2I_WRITE_BEHIND", None) == "true"
+
+# L2I_WRITE_BEHIND_QUEUE_DIR: Default to "l2i_write_behind_queue" in the
+# system temp dir. Should be on a persistent volume, shared by the worker
+# processes of the server.
+
+# L2I_WRITE_BEHIND_QUEUE_DIR = "/var/lib/l2i/write_behind_queue"
+
+L2I_WRITE_BEHIND_QUEUE_DIR = os.getenv("L2I_WRITE_BEHIND_QUEUE_DIR", None)
+
+# L2I_WRITE_BEHIND_CACHE_TIMEOUT: Default to 600. Seconds during which a
+# queued result is readable from the cache, which should be longer than it
+# takes to save it.
+
+# L2I_WRITE_BEHIND_CACHE_TIMEOUT = 600
+
+L2I_WRITE_BEHIND_CACHE_TIMEOUT = int(
+    os.getenv("L2I_WRITE_BEHIND_CACHE_TIMEOUT", 600))
+
+# L2I_STORAGE_CACHE_DIR: Default to None. If set, image files read from the
+# storage (e.g., S3), their existence and size are cached in this local
+# directory, shared by the worker processes, so that repeated reads don't
+# leave the node. Files deleted or changed by another node may be stale
+# until evicted.
+
+# L2I_STORAGE_CACHE_DIR = "/var/cache/l2i/storage"
+
+L2I_STORAGE_CACHE_DIR = os.getenv("L2I_STORAGE_CACHE_DIR", None)
+
+# L2I_STORAGE_CACHE_MAX_BYTES: Default to 1 GiB. The least recently used
+# files are evicted when the cache outgrows it.
+
+# L2I_STORAGE_CACHE_MAX_BYTES = 1024 ** 3
+
+L2I_STORAGE_CACHE_MAX_BYTES = int(
+    os.getenv("L2I_STORAGE_CACHE_MAX_BYTES", 1024 ** 3))
+
+# L2I_STORAGE_MANIFEST: Default to None. If "redis", an index of the files
+# in the image storage is kept in the Redis of the default cache, else in a
+# SQLite file of this name (local to the node). Once built by "python
+# manage.py build_storage_manifest", it is kept current as images are saved
+# and deleted, and answers the existence checks of
+# L2I_USE_EXISTING_STORAGE_IMAGE_TO_CREATE_INSTANCE instead of the storage.
+# A storage shared by several nodes, e.g., S3, requires "redis".
+
+# L2I_STORAGE_MANIFEST = "redis"
+
+L2I_STORAGE_MANIFEST = os.getenv("L2I_STORAGE_MANIFEST", None)
+
+# L2I_DEDUP_STORAGE: Default to False. If True, images are stored once per
+# content, as l2i_blobs/ab/cd/<sha256>.<ext>, and shared by all the results
+# (whatever their tex_key) which render to the same bytes. A blob is deleted
+# with the last result referencing it. Use "python manage.py dedup_images"
+# to store the existing images as blobs.
+
+# L2I_DEDUP_STORAGE = False
+
+L2I_DEDUP_STORAGE = os.getenv("L2I_DEDUP_STORAGE", None) == "true"
+
+# L2I_SVG_COMPRESSION: Default to None. If "gzip" (or "zstd", which needs the
+# zstandard package), new SVG images are stored compressed: as <tex_key>.svgz
+# (or .svg.zst) in the storage, as compressed bytes in the database, and in
+# the cache. /api/image/<tex_key> sends them with "Content-Encoding" to
+# clients accepting it. They are only decompressed when the data_url is
+# requested.
+
+# L2I_SVG_COMPRESSION = "gzip"
+
+L2I_SVG_COMPRESSION = os.getenv("L2I_SVG_COMPRESSION", None)
+
+# L2I_IMAGE_OPTIMIZERS: Default to {}. Keyed by image format, the options
+# of the optimizer run on the converted images of that format, before they
+# are saved. For "svg", the options are "precision" (decimals of the
+# coordinates, default to 3, None to keep them), "dedup" (merge identical
+# definitions, e.g., glyph paths, and drop unused ones, default to True)
+# and "strip_whitespace" (default to True). For "png" (which needs numpy),
+# "max_colors" (the most colors of a palette image, default to 256, 0 to
+# never palettize), "filter_strategy" ("search", the default, "adaptive"
+# or "none"), "strip_metadata" (default to True) and "compress_level"
+# (default to 9). In the environment, as JSON.
+
+# L2I_IMAGE_OPTIMIZERS = {"svg": {"precision": 2}, "png": {}}
+
+L2I_IMAGE_OPTIMIZERS = json.loads(os.getenv("L2I_IMAGE_OPTIMIZERS", "{}"))
+
+# L2I_VARIANT_FORMATS: Default to []. If set, e.g., to ["svg", "webp", "png"],
+# /api/image/<source_key>, where <source_key> is a generated tex_key without
+# the image format (<md5 of the source>_<compiler>_v<key version>), sends the
+# image in the format negotiated on the "Accept" header of the request,
+# among those listed, the most preferred first (formats only accepted by a
+# wildcard, e.g., "*/*" by email clients, come after those named, PNG
+# first). The compiled file of each source is kept in the storage, from
+# which the image in another format is converted when first requested,
+# then saved as a result of its own. In the environment, comma separated.
+
+# L2I_VARIANT_FORMATS = ["svg", "webp", "png"]
+
+L2I_VARIANT_FORMATS = [
+    image_format
+    for image_format in os.getenv("L2I_VARIANT_FORMATS", "").split(",")
+    if image_format]
+
+# L2I_PALETTES: Default to {}. Named palettes by which images are recolored
+# with /api/image/<tex_key>?palette=<name>, each a dict of source colors to
+# target colors, e.g., for a dark theme. Only those are accepted, as the
+# image view is not authenticated. Recoloring PNG, WebP and AVIF images
+# requires numpy. In the environment, as JSON.
+
+# L2I_PALETTES = {"dark": {"#000000": "#e6e6e6", "#ffffff": "#121212"}}
+
+L2I_PALETTES = json.loads(os.getenv("L2I_PALETTES", "{}"))
+
+# L2I_TIGHT_PAGE: Default to False. If True, the body of complete documents
+# (not using the standalone class or the preview package) is wrapped in the
+# "preview" environment of the preview package with the "tightpage"
+# option, so that the engine emits a page as large as the formula, which is
+# converted without being trimmed, rather than a full page. The width, the
+# height and the depth (below the baseline) of such pages are returned in
+# pt, in the "width", "height" and "depth" fields. Existing results are not
+# compiled again, unless L2I_KEY_VERSION is bumped.
+
+# L2I_TIGHT_PAGE = False
+
+L2I_TIGHT_PAGE = os.getenv("L2I_TIGHT_PAGE", None) == "true"
+
+# L2I_SERVER_TIMING: Default to False. If True, the time spent in each stage
+# of a request (compile, convert, save, storage upload, cache fill...) is
+# returned in a "Server-Timing" response header, and logged as one JSON
+# line per request with the "latex.timing" logger (at INFO level).
+
+# L2I_SERVER_TIMING = False
+
+L2I_SERVER_TIMING = os.getenv("L2I_SERVER_TIMING", None) == "true"
+
+# L2I_METRICS: Default to False. If True, Prometheus metrics (compile
+# durations, compile errors, cache hits/misses, storage latencies...) are
+# exposed at /metrics. With multiple worker processes, the environment
+# variable PROMETHEUS_MULTIPROC_DIR must be set (see start-server.sh).
+
+# L2I_METRICS = False
+
+L2I_METRICS = os.getenv("L2I_METRICS", None) == "true"
+
+# L2I_METRICS_TOKEN: Default to None. The metrics are only sent to staff
+# users, and to requests with the header "Authorization: Bearer <token>"
+# of this token, e.g., set in the scrape config of Prometheus.
+
+# L2I_METRICS_TOKEN = "a-long-random-string"
+
+L2I_METRICS_TOKEN = os.getenv("L2I_METRICS_TOKEN", None)
+
+# L2I_BIN_CHECK_CACHE_FILE: Default to "l2i_bin_check_cache.json" in the
+# system temp dir. Successful toolchain checks (which run on every
+# manage.py command) are saved there, keyed by the path, mtime and size
+# of each binary, and are not re-run until the binary changes. Set it to
+# None to always run the checks.
+
+# L2I_BIN_CHECK_CACHE_FILE = "/tmp/l2i_bin_check_cache.json"
+
+bin_check_cache_file = os.getenv("L2I_BIN_CHECK_CACHE_FILE", None)
+if bin_check_cache_file is not None:
+    L2I_BIN_CHECK_CACHE_FILE = bin_check_cache_file or None
+
 
 # L2I_USE_EXIST_STORAGE_IMAGE_IF_EXIST: Default to False. If an / all instance(s)
 # were deleted while the image(s) were not delete from the default storage,
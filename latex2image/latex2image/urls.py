@@ -31,7 +31,7 @@ from django.contrib.auth import views as auth_views
 from django.urls import path, re_path
 from django.utils.translation import gettext_lazy as _
 
-from latex import api, auth, views
+from latex import api, auth, metrics, views
 
 admin.site.site_header = _("LaTeX2Image Admin")
 admin.site.site_title = _("LaTeX2Image Admin")
@@ -52,6 +52,9 @@ urlpatterns = [
     re_path(r"^api/detail/(?P<tex_key>[a-zA-Z0-9_]+)$",
             api.LatexImageDetail.as_view(),
             name="detail"),
+    re_path(r"^api/image/(?P<tex_key>[a-zA-Z0-9_]+)$", api.image_file,
+            name="image"),
+    re_path(r"^metrics$", metrics.metrics_view, name="metrics"),
 ]
 
 # For generated image files
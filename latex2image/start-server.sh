@@ -10,5 +10,11 @@ python manage.py migrate --noinput
 
 python manage.py createsuperuser --no-input
 
+# Metrics of all gunicorn workers are aggregated in this folder,
+# which must be emptied on startup.
+export PROMETHEUS_MULTIPROC_DIR=${PROMETHEUS_MULTIPROC_DIR:-/tmp/l2i_prometheus}
+rm -rf "$PROMETHEUS_MULTIPROC_DIR"
+mkdir -p "$PROMETHEUS_MULTIPROC_DIR"
+
 (gunicorn latex2image.wsgi --user l2i_user --bind 0.0.0.0:8010 --workers 3) &
 sudo nginx
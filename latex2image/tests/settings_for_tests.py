@@ -20,3 +20,6 @@ CACHES = {
         'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'
     }
 }
+
+# Always run the toolchain checks in tests.
+L2I_BIN_CHECK_CACHE_FILE = None
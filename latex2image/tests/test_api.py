@@ -41,7 +41,7 @@ from tests.base_test_mixins import (L2ITestMixinBase, get_fake_data_url,
 from tests.utils import SKIP_ON_WINDOWS_REASON, skip_on_windows
 
 from latex.api import LatexImageList
-from latex.converter import get_data_url
+from latex.converter import build_key, get_data_url
 from latex.models import LatexImage
 
 IMAGE_PATH_PREFIX = "l2i_images/"
@@ -170,6 +170,66 @@ class LatexListAPITest(APITestBaseMixin, TestCase):
         self.assertEqual(resp.status_code, 400)
         self.assertEqual(LatexImage.objects.all().count(), 1)
 
+    @override_settings(L2I_CANONICALIZE_TEX_SOURCE=True)
+    def test_canonical_key_shared_by_equivalent_sources(self):
+        post_data = self.get_post_data()
+        with mock.patch(
+                "latex.converter.Tex2ImgBase.get_converted_data_url"
+        ) as mock_convert:
+            mock_convert.return_value = get_fake_data_url("foob=")
+            resp = self.api_client.post(
+                self.get_list_url(), data=post_data, format='json')
+            self.assertEqual(resp.status_code, 201)
+
+            post_data["tex_source"] = "%% comment\n%s" % (
+                post_data["tex_source"].replace("\n", "  \r\n"))
+            resp = self.api_client.post(
+                self.get_list_url(), data=post_data, format='json')
+            self.assertEqual(resp.status_code, 200)
+            self.assertEqual(mock_convert.call_count, 1)
+
+        self.assertEqual(LatexImage.objects.all().count(), 1)
+
+    def test_legacy_key_lookup(self):
+        post_data = self.get_post_data()
+        legacy_tex_key = build_key(
+            post_data["tex_source"].strip(), "xelatex", "png")
+        factories.LatexImageFactory(
+            tex_key=legacy_tex_key, creator=self.test_user)
+
+        with mock.patch(
+                "latex.converter.Tex2ImgBase.get_converted_data_url"
+        ) as mock_convert:
+            mock_convert.return_value = get_fake_data_url("foob=")
+            with override_settings(L2I_CANONICALIZE_TEX_SOURCE=True):
+                resp = self.api_client.post(
+                    self.get_list_url(), data=post_data, format='json')
+            mock_convert.assert_not_called()
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.json()["tex_key"], legacy_tex_key)
+        self.assertEqual(LatexImage.objects.all().count(), 1)
+
+    @override_settings(L2I_CANONICALIZE_TEX_SOURCE=True,
+                       L2I_LEGACY_KEY_LOOKUP=False)
+    def test_legacy_key_lookup_disabled(self):
+        post_data = self.get_post_data()
+        factories.LatexImageFactory(
+            tex_key=build_key(post_data["tex_source"].strip(), "xelatex", "png",
+                              canonicalize=False),
+            creator=self.test_user)
+
+        with mock.patch(
+                "latex.converter.Tex2ImgBase.get_converted_data_url"
+        ) as mock_convert:
+            mock_convert.return_value = get_fake_data_url("foob=")
+            resp = self.api_client.post(
+                self.get_list_url(), data=post_data, format='json')
+            mock_convert.assert_called_once()
+
+        self.assertEqual(resp.status_code, 201)
+        self.assertEqual(LatexImage.objects.all().count(), 2)
+
     def test_post_data_validation_error(self):
         post_data = self.get_post_data()
         del post_data["tex_source"]
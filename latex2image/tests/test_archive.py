@@ -0,0 +1,201 @@
+import json
+import os
+import shutil
+import tempfile
+from io import StringIO
+from time import perf_counter
+from unittest import mock
+
+from django.core.management import call_command
+from django.test import SimpleTestCase, TestCase, override_settings
+from rest_framework.test import APIClient
+from tests.base_test_mixins import L2ITestMixinBase, get_fake_data_url
+
+from latex.archive import (COMPILE_ERROR, FAILED, RENDERED, SKIPPED,
+                           RateLimiter, RerenderPipeline, archive_conversion)
+from latex.converter import LatexCompileError, build_key
+from latex.models import ArchivedConversion, ArchivedTexSource, LatexImage
+
+CONVERT_PATH = "latex.converter.Tex2ImgBase.get_converted_data_url"
+
+
+class ArchiveTestMixin(L2ITestMixinBase):
+    def archive(self, tex_source="$a$", compiler="xelatex", image_format="png"):
+        return archive_conversion(
+            tex_source, compiler, image_format, self.test_user)
+
+    def mock_convert(self, **kwargs):
+        patch = mock.patch(CONVERT_PATH, **kwargs)
+        mock_convert = patch.start()
+        self.addCleanup(patch.stop)
+        return mock_convert
+
+
+class ArchiveConversionTest(ArchiveTestMixin, TestCase):
+    def test_source_deduplicated(self):
+        self.archive("$a$", image_format="png")
+        self.archive("$a$", image_format="svg")
+        self.archive("$a$", image_format="svg")
+        self.archive("$b$")
+
+        self.assertEqual(ArchivedTexSource.objects.count(), 2)
+        self.assertEqual(ArchivedConversion.objects.count(), 3)
+
+    def test_compressed(self):
+        tex_source = "$a+b$ " * 1000
+        conversion = self.archive(tex_source)
+        source = ArchivedTexSource.objects.get(pk=conversion.source.pk)
+        self.assertEqual(source.tex_source, tex_source)
+        self.assertLess(len(bytes(source.data)), len(tex_source) / 10)
+
+
+@override_settings(L2I_SOURCE_ARCHIVE=True)
+class CreateArchiveTest(ArchiveTestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.test_user)
+        self.mock_convert(return_value=get_fake_data_url("foob="))
+
+    def post(self, **kwargs):
+        data = {"compiler": "xelatex", "image_format": "png",
+                "tex_source": "$a$"}
+        data.update(kwargs)
+        return self.client.post("/api/create/", data=data, format="json")
+
+    def test_archived(self):
+        self.assertEqual(self.post().status_code, 201)
+        self.assertEqual(self.post().status_code, 200)
+        conversion = ArchivedConversion.objects.get()
+        self.assertEqual(conversion.source.tex_source, "$a$")
+        self.assertEqual(conversion.creator, self.test_user)
+
+    def test_client_tex_key_not_archived(self):
+        self.assertEqual(self.post(tex_key="foo").status_code, 201)
+        self.assertEqual(ArchivedConversion.objects.count(), 0)
+
+    @override_settings(L2I_SOURCE_ARCHIVE=False)
+    def test_disabled(self):
+        self.assertEqual(self.post().status_code, 201)
+        self.assertEqual(ArchivedConversion.objects.count(), 0)
+
+
+class RerenderPipelineTest(ArchiveTestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.mock_convert = self.mock_convert(
+            return_value=get_fake_data_url("foob="))
+        temp_dir = tempfile.mkdtemp(prefix="l2i_test_")
+        self.addCleanup(shutil.rmtree, temp_dir)
+        self.state_file = os.path.join(temp_dir, "state.json")
+
+    def test_render(self):
+        self.archive("$a$")
+        self.archive("$b$")
+
+        progress = RerenderPipeline("2").run()
+        self.assertEqual(progress.counts[RENDERED], 2)
+        self.assertTrue(LatexImage.objects.filter(
+            tex_key=build_key("$a$", "xelatex", "png", version="2")).exists())
+
+        # Rendered results are skipped
+        progress = RerenderPipeline("2").run()
+        self.assertEqual(progress.counts[SKIPPED], 2)
+        self.assertEqual(self.mock_convert.call_count, 2)
+
+        self.assertEqual(
+            RerenderPipeline("2").get_status(),
+            {"total": 2, "rendered": 2, "missing": 0})
+        self.assertEqual(
+            RerenderPipeline("3").get_status(),
+            {"total": 2, "rendered": 0, "missing": 2})
+
+    def test_compile_error_saved(self):
+        self.archive()
+        self.mock_convert.side_effect = LatexCompileError("foo")
+        progress = RerenderPipeline("2").run()
+        self.assertEqual(progress.counts[COMPILE_ERROR], 1)
+        self.assertIn("foo", LatexImage.objects.get().compile_error)
+
+    def test_resume(self):
+        for i in range(5):
+            self.archive("$%d$" % i)
+
+        RerenderPipeline("2", batch_size=2, state_file=self.state_file).run()
+        with open(self.state_file) as f:
+            state = json.load(f)
+        self.assertEqual(state["key_version"], "2")
+        self.assertEqual(state["last_pk"], ArchivedConversion.objects.last().pk)
+
+        # Resumed after the last batch, nothing to do
+        progress = RerenderPipeline(
+            "2", batch_size=2, state_file=self.state_file).run()
+        self.assertEqual(progress.total, 0)
+
+        # Another key version starts over
+        progress = RerenderPipeline(
+            "3", batch_size=2, state_file=self.state_file).run()
+        self.assertEqual(progress.counts[RENDERED], 5)
+
+    def test_failed_retried(self):
+        self.archive("$a$")
+        self.archive("$b$")
+        self.archive("$c$")
+        self.mock_convert.side_effect = [
+            RuntimeError(), get_fake_data_url("foob="),
+            get_fake_data_url("fooc=")]
+
+        progress = RerenderPipeline(
+            "2", batch_size=1, state_file=self.state_file).run()
+        self.assertEqual(progress.counts[FAILED], 1)
+        self.assertEqual(progress.counts[RENDERED], 2)
+
+        # Checkpointed past the failed conversion, which is recorded
+        pks = list(ArchivedConversion.objects.order_by("pk").values_list(
+            "pk", flat=True))
+        with open(self.state_file) as f:
+            state = json.load(f)
+        self.assertEqual(state["last_pk"], pks[-1])
+        self.assertEqual(state["failed_pks"], pks[:1])
+
+        self.mock_convert.side_effect = None
+        progress = RerenderPipeline(
+            "2", batch_size=1, state_file=self.state_file).run()
+        self.assertEqual(progress.total, 1)
+        self.assertEqual(progress.counts[RENDERED], 1)
+        with open(self.state_file) as f:
+            self.assertEqual(json.load(f)["failed_pks"], [])
+
+    def test_progress_callback(self):
+        self.archive("$a$")
+        self.archive("$b$")
+        callback = mock.MagicMock()
+        RerenderPipeline("2", progress_callback=callback).run()
+        self.assertEqual(callback.call_count, 2)
+        self.assertEqual(callback.call_args[0][0].as_dict()["percent"], 100)
+
+    def test_command(self):
+        self.archive()
+        stdout = StringIO()
+        call_command("rerender", "--key-version", "2", "--status", stdout=stdout)
+        self.assertIn("0 of 1", stdout.getvalue())
+
+        stdout = StringIO()
+        call_command("rerender", "--key-version", "2", stdout=stdout)
+        self.assertIn("1 rendered", stdout.getvalue())
+
+
+class RateLimiterTest(SimpleTestCase):
+    def test_rate(self):
+        limiter = RateLimiter(rate=20)
+        start = perf_counter()
+        for _i in range(4):
+            limiter.wait()
+        self.assertGreaterEqual(perf_counter() - start, 0.14)
+
+    def test_no_limit(self):
+        limiter = RateLimiter()
+        start = perf_counter()
+        for _i in range(100):
+            limiter.wait()
+        self.assertLess(perf_counter() - start, 0.1)
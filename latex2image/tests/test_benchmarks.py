@@ -0,0 +1,110 @@
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+from benchmarks.corpus import (CATEGORIES, get_category_sources,
+                               get_combinations)
+from benchmarks.runners import (_get_converted_images, percentile,
+                                run_convert_benchmarks,
+                                run_optimize_benchmarks)
+from benchmarks.stub_bin import COMPILE_ERROR_MARKER
+from benchmarks.stub_toolchain import StubToolchain
+from PIL import Image
+
+from latex.converter import (ImageConvertError, ImageMagick, LatexCompileError,
+                             tex_to_img_converter)
+
+
+class StubToolchainTest(TestCase):
+    def setUp(self):
+        toolchain = StubToolchain(latency_scale=0)
+        toolchain.__enter__()
+        self.addCleanup(toolchain.__exit__, None, None, None)
+
+    def test_convert(self):
+        _filename, tex_source = get_category_sources("inline_math")[0]
+        for compiler, image_format in get_combinations("inline_math"):
+            with self.subTest(compiler=compiler, image_format=image_format):
+                data_url = tex_to_img_converter(
+                    compiler, tex_source, image_format
+                ).get_converted_data_url()
+                self.assertTrue(
+                    data_url.startswith("data:image/%s" % image_format))
+
+    def test_imagemagick_scale_and_trim(self):
+        working_dir = tempfile.mkdtemp(prefix="l2i_test_")
+        self.addCleanup(shutil.rmtree, working_dir)
+        compiled_file_path = os.path.join(working_dir, "foo.pdf")
+        with open(compiled_file_path, "wb") as f:
+            f.write(b"x" * 100)
+
+        converter = ImageMagick()
+        for kwargs, expected_size in [
+                ({}, (50, 40)),
+                ({"scale": 2}, (100, 80)),
+                ({"trim": False}, (58, 48)),
+                ({"scale": 1.5, "trim": False}, (87, 72))]:
+            with self.subTest(**kwargs):
+                image_path = os.path.join(working_dir, "foo.png")
+                success, error = converter._convert(
+                    compiled_file_path, image_path, working_dir, **kwargs)
+                self.assertTrue(success, error)
+                with Image.open(image_path) as image:
+                    self.assertEqual(image.size, expected_size)
+
+    def test_compile_error(self):
+        with self.assertRaises(LatexCompileError) as cm:
+            tex_to_img_converter(
+                "xelatex", COMPILE_ERROR_MARKER, "svg"
+            ).get_converted_data_url()
+        self.assertIn("Undefined control sequence", str(cm.exception))
+
+    def test_more_than_one_pages_error(self):
+        with self.assertRaises(ImageConvertError):
+            tex_to_img_converter(
+                "pdflatex", "a\\newpage b", "png"
+            ).get_converted_data_url()
+
+    def test_run_convert_benchmarks(self):
+        results = run_convert_benchmarks(iterations=2, categories=["cjk"])
+        self.assertEqual(len(results), len(get_combinations("cjk")))
+        for result in results:
+            self.assertEqual(result["errors"], 0)
+            self.assertEqual(result["n"], 2)
+            self.assertEqual(
+                set(result["stages"]),
+                {"tex_write", "compile", "convert", "count_images",
+                 "data_url"})
+
+    def test_run_optimize_benchmarks(self):
+        results = run_optimize_benchmarks(
+            iterations=2, categories=["inline_math"])
+        self.assertTrue(results)
+        for result in results:
+            self.assertEqual(result["errors"], 0)
+            self.assertIn(result["image_format"], ["png", "svg"])
+            self.assertLessEqual(result["size_ratio"], 1)
+
+    def test_optimize_benchmarks_other_format_skipped(self):
+        # TikZ pictures are converted to svg by latex, even for png
+        images = _get_converted_images("tikz", "png")
+        self.assertNotIn("latex", [compiler for compiler, _data in images])
+        for _compiler, data in images:
+            self.assertTrue(data.startswith(b"\x89PNG"))
+
+
+class CorpusTest(TestCase):
+    def test_categories_not_empty(self):
+        for category in CATEGORIES:
+            with self.subTest(category=category):
+                self.assertTrue(get_category_sources(category))
+                self.assertTrue(get_combinations(category))
+
+
+class PercentileTest(TestCase):
+    def test_percentile(self):
+        self.assertIsNone(percentile([], 0.5))
+        self.assertEqual(percentile([1], 0.95), 1)
+        self.assertEqual(percentile([1, 2, 3], 0.5), 2)
+        self.assertAlmostEqual(percentile([0, 10], 0.95), 9.5)
@@ -24,12 +24,18 @@ OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
 THE SOFTWARE.
 """
 
+import importlib
+import os
+import shutil
+import sys
+import tempfile
 from unittest import mock
 
 from django.test import SimpleTestCase
 from django.test.utils import override_settings
 
-from latex.converter import CommandBase, Latexmk, Pdf2svg
+from latex.converter import (CommandBase, Latexmk, Pdf2svg,
+                             clear_toolchain_registry)
 
 
 class CheckL2ISettingsBase(SimpleTestCase):
@@ -285,3 +291,315 @@ class VersionCheckTestMocked(TestCase):
         fake_command = FakePdf2svg()
         errors = fake_command.check()
         self.assertEqual(len(errors), 1)
+
+
+class BinCheckCacheTest(TestCase):
+    def setUp(self):
+        cache_dir = tempfile.mkdtemp(prefix="l2i_test_")
+        self.addCleanup(shutil.rmtree, cache_dir)
+        self.cache_file = os.path.join(cache_dir, "bin_check.json")
+
+        settings_override = override_settings(
+            L2I_BIN_CHECK_CACHE_FILE=self.cache_file)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+        # Fake subclasses defined by other tests may still be alive, until
+        # collected, and would be checked instead of their real base class
+        def get_all_indirect_subclasses(cls):
+            leaves = set()
+            for subcls in cls.__subclasses__():
+                if subcls.__module__ == "latex.converter":
+                    leaves.update(
+                        get_all_indirect_subclasses(subcls) or [subcls])
+            return list(leaves)
+
+        get_subclasses = mock.patch(
+            "latex.checks.get_all_indirect_subclasses",
+            side_effect=get_all_indirect_subclasses)
+        get_subclasses.start()
+        self.addCleanup(get_subclasses.stop)
+
+        # The command instances are memoized with their bin_path: they are
+        # created again here with the fake one, and after the test with the
+        # real one, not to leak the fake to the other tests
+        clear_toolchain_registry()
+        self.addCleanup(clear_toolchain_registry)
+
+        # Every binary is found on disk, with version 4.39
+        get_bin_path = mock.patch(
+            "latex.converter.CommandBase.get_bin_path",
+            return_value=sys.executable)
+        get_bin_path.start()
+        self.addCleanup(get_bin_path.stop)
+
+        # The probes run in threads, where Mock.call_count may miss some
+        # (its increment is not atomic), thus counted by the side effect
+        self.version_output = ("4.39", "", 0)
+        self.version_calls = []
+
+        def version_popen(*args, **kwargs):
+            self.version_calls.append(args)
+            return self.version_output
+
+        version_popen_patch = mock.patch(
+            "latex.converter.CommandBase.version_popen",
+            side_effect=version_popen)
+        version_popen_patch.start()
+        self.addCleanup(version_popen_patch.stop)
+
+    def test_results_reused(self):
+        from latex.checks import bin_check
+        self.assertEqual(bin_check(None), [])
+        n_calls = len(self.version_calls)
+        self.assertGreater(n_calls, 0)
+        self.assertTrue(os.path.isfile(self.cache_file))
+
+        self.assertEqual(bin_check(None), [])
+        self.assertEqual(len(self.version_calls), n_calls)
+
+    def test_binary_changed(self):
+        from latex.checks import bin_check
+        bin_check(None)
+        n_calls = len(self.version_calls)
+
+        with mock.patch(
+                "latex.converter.CommandBase.get_check_cache_key",
+                return_value=[sys.executable, 0, 0, None, None]):
+            bin_check(None)
+        self.assertEqual(len(self.version_calls), 2 * n_calls)
+
+    def test_errors_not_cached(self):
+        from latex.checks import bin_check
+        self.version_output = ("foo", "error", 1)
+        self.assertNotEqual(bin_check(None), [])
+        n_calls = len(self.version_calls)
+
+        self.assertNotEqual(bin_check(None), [])
+        self.assertGreater(len(self.version_calls), n_calls)
+
+    def test_cache_disabled(self):
+        from latex.checks import bin_check
+        with override_settings(L2I_BIN_CHECK_CACHE_FILE=None):
+            bin_check(None)
+            bin_check(None)
+        self.assertFalse(os.path.isfile(self.cache_file))
+
+
+class CheckImageFormats(CheckL2ISettingsBase):
+    # test the support of the image formats encoded by Pillow
+    msg_id_prefix = "image_formats"
+
+    @property
+    def func(self):
+        from latex.checks import settings_check
+        return settings_check
+
+    def test_checks_supported(self):
+        with mock.patch("latex.constants.UNAVAILABLE_IMAGE_FORMATS", []):
+            self.assertCheckMessages([])
+
+    def test_checks_not_supported(self):
+        with mock.patch(
+                "latex.constants.UNAVAILABLE_IMAGE_FORMATS", ["avif"]):
+            self.assertCheckMessages(["image_formats.W001"])
+
+    def test_unavailable_formats_not_offered(self):
+        import latex.constants
+        self.addCleanup(importlib.reload, latex.constants)
+        with mock.patch(
+                "PIL.features.check_module",
+                side_effect=lambda feature: feature != "avif"):
+            constants = importlib.reload(latex.constants)
+        self.assertEqual(constants.UNAVAILABLE_IMAGE_FORMATS, ["avif"])
+        self.assertNotIn("avif", constants.ALLOWED_LATEX2IMG_FORMAT)
+        self.assertNotIn("avif", constants.RASTER_IMAGE_FORMATS)
+        self.assertIn(("xelatex", "webp"),
+                      constants.ALLOWED_COMPILER_FORMAT_COMBINATION)
+        self.assertNotIn(("xelatex", "avif"),
+                         constants.ALLOWED_COMPILER_FORMAT_COMBINATION)
+
+    def test_unknown_to_pillow(self):
+        from latex.constants import is_pillow_format_available
+        with mock.patch("PIL.features.check_module", side_effect=ValueError):
+            self.assertFalse(is_pillow_format_available("avif"))
+
+
+class CheckStorageManifest(CheckL2ISettingsBase):
+    # test L2I_STORAGE_MANIFEST
+    msg_id_prefix = "storage_manifest"
+
+    @property
+    def func(self):
+        from latex.checks import settings_check
+        return settings_check
+
+    @override_settings(L2I_STORAGE_MANIFEST=None)
+    def test_checks_none(self):
+        self.assertCheckMessages([])
+
+    @override_settings(L2I_STORAGE_MANIFEST="/tmp/l2i_manifest.sqlite3")
+    def test_checks_sqlite_local_storage(self):
+        self.assertCheckMessages([])
+
+    def test_checks_remote_storage(self):
+        with mock.patch(
+                "django.core.files.storage.FileSystemStorage.path",
+                side_effect=NotImplementedError):
+            with override_settings(
+                    L2I_STORAGE_MANIFEST="/tmp/l2i_manifest.sqlite3"):
+                self.assertCheckMessages(["storage_manifest.E001"])
+            with override_settings(L2I_STORAGE_MANIFEST="redis"):
+                self.assertCheckMessages([])
+
+
+class CheckSvgCompression(CheckL2ISettingsBase):
+    # test L2I_SVG_COMPRESSION
+    msg_id_prefix = "svg_compression"
+
+    @property
+    def func(self):
+        from latex.checks import settings_check
+        return settings_check
+
+    @override_settings(L2I_SVG_COMPRESSION=None)
+    def test_checks_none(self):
+        self.assertCheckMessages([])
+
+    @override_settings(L2I_SVG_COMPRESSION="gzip")
+    def test_checks_ok(self):
+        self.assertCheckMessages([])
+
+    @override_settings(L2I_SVG_COMPRESSION="brotli")
+    def test_checks_unknown(self):
+        self.assertCheckMessages(["svg_compression.E001"])
+
+    @override_settings(L2I_SVG_COMPRESSION="zstd")
+    def test_checks_zstd_not_installed(self):
+        with mock.patch(
+                "latex.compression.is_zstd_available", return_value=False):
+            self.assertCheckMessages(["svg_compression.E002"])
+
+
+class CheckImageOptimizers(CheckL2ISettingsBase):
+    # test L2I_IMAGE_OPTIMIZERS
+    msg_id_prefix = "image_optimizers"
+
+    @property
+    def func(self):
+        from latex.checks import settings_check
+        return settings_check
+
+    @override_settings(L2I_IMAGE_OPTIMIZERS={})
+    def test_checks_none(self):
+        self.assertCheckMessages([])
+
+    @override_settings(L2I_IMAGE_OPTIMIZERS={"svg": {"precision": 2}})
+    def test_checks_ok(self):
+        self.assertCheckMessages([])
+
+    @override_settings(L2I_IMAGE_OPTIMIZERS=["svg"])
+    def test_checks_not_dict(self):
+        self.assertCheckMessages(["image_optimizers.E001"])
+
+    @override_settings(L2I_IMAGE_OPTIMIZERS={
+        "pdf": {}, "svg": {"precision": -1}})
+    def test_checks_invalid(self):
+        self.assertCheckMessages(
+            ["image_optimizers.E002", "image_optimizers.E002"])
+
+    @override_settings(L2I_IMAGE_OPTIMIZERS={"svg": {"foo": 1}})
+    def test_checks_unknown_option(self):
+        self.assertCheckMessages(["image_optimizers.E002"])
+
+    @override_settings(L2I_IMAGE_OPTIMIZERS={"png": {}})
+    def test_checks_numpy_not_installed(self):
+        with mock.patch(
+                "latex.optimizers.is_numpy_available", return_value=False):
+            self.assertCheckMessages(["image_optimizers.E002"])
+
+
+class CheckRasterImageQuality(CheckL2ISettingsBase):
+    # test L2I_WEBP_QUALITY and L2I_AVIF_QUALITY
+    msg_id_prefix = ("webp_quality", "avif_quality")
+
+    @property
+    def func(self):
+        from latex.checks import settings_check
+        return settings_check
+
+    @override_settings(L2I_WEBP_QUALITY=None, L2I_AVIF_QUALITY=90)
+    def test_checks_ok(self):
+        self.assertCheckMessages([])
+
+    @override_settings(L2I_WEBP_QUALITY=101)
+    def test_checks_webp_quality(self):
+        self.assertCheckMessages(["webp_quality.E001"])
+
+    @override_settings(L2I_AVIF_QUALITY="high")
+    def test_checks_avif_quality(self):
+        self.assertCheckMessages(["avif_quality.E001"])
+
+
+class CheckVariantFormats(CheckL2ISettingsBase):
+    # test L2I_VARIANT_FORMATS
+    msg_id_prefix = "variant_formats"
+
+    @property
+    def func(self):
+        from latex.checks import settings_check
+        return settings_check
+
+    @override_settings(L2I_VARIANT_FORMATS=["svg", "webp", "png"])
+    def test_checks_ok(self):
+        self.assertCheckMessages([])
+
+    def test_checks_variant_formats(self):
+        for variant_formats in ["svg", ["svg", "pdf"]]:
+            with self.subTest(variant_formats=variant_formats):
+                with override_settings(L2I_VARIANT_FORMATS=variant_formats):
+                    self.assertCheckMessages(["variant_formats.E001"])
+
+
+class CheckPalettes(CheckL2ISettingsBase):
+    # test L2I_PALETTES
+    msg_id_prefix = "palettes"
+
+    @property
+    def func(self):
+        from latex.checks import settings_check
+        return settings_check
+
+    @override_settings(L2I_PALETTES={"dark": {"#000": "#fff", "#fff": "#000"}})
+    def test_checks_ok(self):
+        self.assertCheckMessages([])
+
+    @override_settings(L2I_PALETTES=["dark"])
+    def test_checks_not_dict(self):
+        self.assertCheckMessages(["palettes.E001"])
+
+    @override_settings(L2I_PALETTES={
+        "dark": "#000:#fff", "light": {"#000": "foo"}, "empty": {}})
+    def test_checks_invalid(self):
+        self.assertCheckMessages(
+            ["palettes.E002", "palettes.E002", "palettes.E002"])
+
+
+class CheckTrimMargin(CheckL2ISettingsBase):
+    # test L2I_TRIM_MARGIN
+    msg_id_prefix = "trim_margin"
+
+    @property
+    def func(self):
+        from latex.checks import settings_check
+        return settings_check
+
+    @override_settings(L2I_TRIM_MARGIN=2)
+    def test_checks_ok(self):
+        self.assertCheckMessages([])
+
+    def test_checks_trim_margin(self):
+        for trim_margin in [-1, "2", 1.5]:
+            with self.subTest(trim_margin=trim_margin):
+                with override_settings(L2I_TRIM_MARGIN=trim_margin):
+                    self.assertCheckMessages(["trim_margin.E001"])
@@ -0,0 +1,156 @@
+import gzip
+import mimetypes
+from unittest import skipUnless
+
+from django.core.files.base import ContentFile
+from django.test import RequestFactory, SimpleTestCase, TestCase
+from django.test.utils import override_settings
+from rest_framework.test import APIClient
+from tests.base_test_mixins import L2ITestMixinBase, get_fake_data_url
+
+from latex.compression import (GZIP, SVG_MIME_TYPE, ZSTD, CompressedDataUrl,
+                               accepts_encoding, compress, decompress,
+                               get_cache_value, get_file_name_encoding,
+                               get_value_from_cache, is_zstd_available)
+from latex.models import (DataUrlBlob, LatexImage, get_image_storage,
+                          make_image_file)
+from latex.utils import get_data_url_from_buf_and_mimetype
+
+SVG = b'<svg xmlns="http://www.w3.org/2000/svg">%s</svg>' % (b"<g/>" * 100)
+SVG_DATA_URL = get_data_url_from_buf_and_mimetype(SVG, "image/svg+xml")
+PNG_DATA_URL = get_fake_data_url("Zm9v")
+
+
+class CompressionTest(SimpleTestCase):
+    def test_gzip(self):
+        compressed = compress(SVG, GZIP)
+        self.assertLess(len(compressed), len(SVG))
+        self.assertEqual(decompress(compressed, GZIP), SVG)
+        # Deterministic, thus not uploaded again when unchanged
+        self.assertEqual(compress(SVG, GZIP), compressed)
+
+    @skipUnless(is_zstd_available(), "zstandard is not installed")
+    def test_zstd(self):
+        self.assertEqual(decompress(compress(SVG, ZSTD), ZSTD), SVG)
+
+    def test_unknown_encoding(self):
+        with self.assertRaises(ValueError):
+            compress(SVG, "brotli")
+
+    def test_get_file_name_encoding(self):
+        self.assertEqual(get_file_name_encoding("l2i_images/foo.svgz"), GZIP)
+        self.assertEqual(get_file_name_encoding("foo.svg.zst"), ZSTD)
+        self.assertIsNone(get_file_name_encoding("foo.svg"))
+
+    def test_accepts_encoding(self):
+        factory = RequestFactory()
+        for header, expected in [
+                ("gzip, deflate, br", True),
+                ("deflate;q=1.0, gzip;q=0.5", True),
+                ("gzip;q=0", False),
+                ("*", True),
+                ("*;q=0.1, gzip;q=0", False),
+                ("br", False),
+                ("", False)]:
+            with self.subTest(header=header):
+                request = factory.get("/", HTTP_ACCEPT_ENCODING=header)
+                self.assertEqual(accepts_encoding(request, GZIP), expected)
+
+    @override_settings(L2I_SVG_COMPRESSION=GZIP)
+    def test_cache_value(self):
+        value = get_cache_value("data_url", SVG_DATA_URL)
+        self.assertIsInstance(value, CompressedDataUrl)
+        self.assertEqual(get_value_from_cache(value), SVG_DATA_URL)
+
+        self.assertEqual(
+            get_cache_value("data_url", PNG_DATA_URL), PNG_DATA_URL)
+        self.assertEqual(get_cache_value("image", "foo.svgz"), "foo.svgz")
+
+    @override_settings(L2I_SVG_COMPRESSION=None)
+    def test_cache_value_not_compressed(self):
+        self.assertEqual(
+            get_cache_value("data_url", SVG_DATA_URL), SVG_DATA_URL)
+
+
+@override_settings(L2I_SVG_COMPRESSION=GZIP)
+class CompressedStorageTest(L2ITestMixinBase, TestCase):
+    def create_image(self, tex_key, data_url=SVG_DATA_URL):
+        return LatexImage.objects.create(
+            tex_key=tex_key, creator=self.test_user, data_url=data_url)
+
+    def test_stored_compressed(self):
+        instance = self.create_image("foo")
+        self.assertTrue(instance.image.name.endswith("foo.svgz"))
+        with instance.image.storage.open(instance.image.name) as f:
+            self.assertEqual(gzip.decompress(f.read()), SVG)
+        self.assertEqual(
+            mimetypes.guess_type(instance.image.name), (SVG_MIME_TYPE, GZIP))
+
+        blob = DataUrlBlob.objects.get()
+        self.assertEqual(blob.encoding, GZIP)
+        self.assertEqual(blob.data_url, "")
+        self.assertEqual(blob.size, len(SVG))
+        self.assertEqual(
+            LatexImage.objects.get(tex_key="foo").data_url, SVG_DATA_URL)
+
+    def test_file_metadata(self):
+        encodings = [GZIP] + ([ZSTD] if is_zstd_available() else [])
+        for encoding in encodings:
+            with self.subTest(encoding=encoding):
+                with override_settings(L2I_SVG_COMPRESSION=encoding):
+                    content = make_image_file(SVG_DATA_URL, "foo")
+                self.assertEqual(content.content_type, SVG_MIME_TYPE)
+                self.assertEqual(
+                    mimetypes.guess_type(content.name),
+                    (SVG_MIME_TYPE, encoding))
+        self.assertEqual(
+            mimetypes.guess_type("foo.svg.zst"), (SVG_MIME_TYPE, ZSTD))
+
+    def test_png_not_compressed(self):
+        instance = self.create_image("foo", data_url=PNG_DATA_URL)
+        self.assertTrue(instance.image.name.endswith("foo.png"))
+        self.assertEqual(DataUrlBlob.objects.get().encoding, "")
+
+    def test_read_from_storage(self):
+        get_image_storage().save(
+            "l2i_images/foo.svgz", ContentFile(compress(SVG, GZIP)))
+        instance = LatexImage(tex_key="foo", creator=self.test_user)
+        instance.image = "l2i_images/foo.svgz"
+        instance.save()
+        self.assertEqual(instance.data_url, SVG_DATA_URL)
+
+    def test_cached_data_url(self):
+        self.create_image("foo")
+        client = APIClient()
+        client.force_authenticate(user=self.test_user)
+        for _i in range(2):
+            resp = client.get(self.get_detail_url("foo", "data_url"))
+            self.assertEqual(resp.status_code, 200)
+            self.assertEqual(resp.json(), {"data_url": SVG_DATA_URL})
+        self.assertIsInstance(
+            self.test_cache.get("foo:data_url"), CompressedDataUrl)
+
+    def test_image_view(self):
+        self.create_image("foo")
+
+        resp = self.client.get("/api/image/foo", HTTP_ACCEPT_ENCODING="gzip")
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp["Content-Type"], "image/svg+xml")
+        self.assertEqual(resp["Content-Encoding"], "gzip")
+        self.assertIn("Accept-Encoding", resp["Vary"])
+        self.assertEqual(gzip.decompress(resp.content), SVG)
+
+        resp = self.client.get("/api/image/foo")
+        self.assertFalse(resp.has_header("Content-Encoding"))
+        self.assertEqual(resp.content, SVG)
+
+    def test_image_view_not_found(self):
+        self.assertEqual(self.client.get("/api/image/foo").status_code, 404)
+
+    @override_settings(L2I_SVG_COMPRESSION=None)
+    def test_image_view_uncompressed(self):
+        self.create_image("foo", data_url=PNG_DATA_URL)
+        resp = self.client.get("/api/image/foo", HTTP_ACCEPT_ENCODING="gzip")
+        self.assertEqual(resp["Content-Type"], "image/png")
+        self.assertFalse(resp.has_header("Content-Encoding"))
+        self.assertEqual(resp.content, b"foo")
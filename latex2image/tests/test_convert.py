@@ -1,13 +1,21 @@
 import os
+import shutil
+import tempfile
 from unittest import TestCase, mock, skipIf
 
+from django.test import override_settings
+from PIL import Image, ImageDraw
 from tests.base_test_mixins import get_latex_file_dir
 from tests.utils import SKIP_ON_WINDOWS_REASON, skip_on_windows
 
-from latex.converter import (ImageConvertError, LatexCompileError,
-                             UnknownCompileError, get_tex2img_class,
+from latex.converter import (ImageConvertError, ImageMagick, ImageMagickAvif,
+                             ImageMagickWebp, LatexCompileError, Latexmk,
+                             UnknownCompileError, XeLatex, Xelatex2Avif,
+                             Xelatex2Png, Xelatex2Svg, Xelatex2Webp, build_key,
+                             get_command_instance, get_tex2img_class,
                              tex_to_img_converter)
-from latex.utils import file_read, get_abstract_latex_log
+from latex.utils import (canonicalize_tex_source, file_read,
+                         get_abstract_latex_log)
 
 
 def get_file_content(file_path):
@@ -189,7 +197,7 @@ class TexToImgConverterTest(TestCase):
         tex_source = get_file_content(file_path).decode("utf-8")
 
         expected_error = "some ImageMagick error"
-        with mock.patch("latex.converter.wand_image.convert") as mock_im_convert:
+        with mock.patch("wand.image.Image.convert") as mock_im_convert:
             mock_im_convert.side_effect = RuntimeError(expected_error)
             with self.assertRaises(ImageConvertError) as cm:
                 tex_to_img_converter(
@@ -229,6 +237,193 @@ class GetTex2imgClassTest(TestCase):
             with self.assertRaises(ValueError):
                 get_tex2img_class("pdflatex", "jpg")
 
+    def test_webp_avif(self):
+        self.assertIs(get_tex2img_class("xelatex", "webp"), Xelatex2Webp)
+        self.assertIs(get_tex2img_class("XeLaTeX", ".AVIF"), Xelatex2Avif)
+
+        # The dvi of latex is not rasterized by ImageMagick
+        with self.assertRaises(ValueError):
+            get_tex2img_class("latex", "webp")
+
+
+class PillowEncodedImageMagickTest(TestCase):
+    def setUp(self):
+        self.working_dir = tempfile.mkdtemp(prefix="l2i_test_")
+        self.addCleanup(shutil.rmtree, self.working_dir)
+
+        self.image = Image.new("RGBA", (60, 20), (0, 0, 0, 0))
+        ImageDraw.Draw(self.image).ellipse([5, 5, 40, 15], fill="black")
+
+    def convert(self, converter_class, n_pages=1):
+        def rasterize(compiled_file_path, image_path, working_dir):
+            self.assertTrue(image_path.endswith(".png"))
+            if n_pages == 1:
+                self.image.save(image_path)
+            else:
+                for i in range(n_pages):
+                    self.image.save(image_path.replace(".png", "-%d.png" % i))
+            return True, ""
+
+        image_path = os.path.join(
+            self.working_dir, "foo.%s" % converter_class.output_format)
+        with mock.patch.object(ImageMagick, "_convert", side_effect=rasterize):
+            return (converter_class().do_convert(
+                "foo.pdf", image_path, self.working_dir), image_path)
+
+    def test_webp_lossless(self):
+        (success, _error), image_path = self.convert(ImageMagickWebp)
+        self.assertTrue(success)
+        with Image.open(image_path) as image:
+            self.assertEqual(image.format, "WEBP")
+            self.assertEqual(image.tobytes(), self.image.tobytes())
+
+    @override_settings(L2I_WEBP_QUALITY=50)
+    def test_webp_lossy(self):
+        self.assertEqual(
+            ImageMagickWebp().get_save_options(), {"quality": 50, "method": 6})
+
+    def test_avif(self):
+        self.assertEqual(
+            ImageMagickAvif().get_save_options()["quality"], 90)
+        with override_settings(L2I_AVIF_QUALITY=60):
+            self.assertEqual(
+                ImageMagickAvif().get_save_options()["quality"], 60)
+
+        (success, _error), image_path = self.convert(ImageMagickAvif)
+        self.assertTrue(success)
+        with Image.open(image_path) as image:
+            self.assertEqual(image.format, "AVIF")
+
+    def test_multiple_pages(self):
+        (success, _error), image_path = self.convert(
+            ImageMagickWebp, n_pages=2)
+        self.assertTrue(success)
+        for i in range(2):
+            self.assertTrue(os.path.isfile(
+                image_path.replace(".webp", "-%d.webp" % i)))
+
+    def test_encode_error(self):
+        with mock.patch("PIL.Image.open", side_effect=OSError("foo")):
+            (success, error), _image_path = self.convert(ImageMagickWebp)
+        self.assertFalse(success)
+        self.assertEqual(error, "OSError: foo")
+
+
+class ToolchainRegistryTest(TestCase):
+    # test latex.converter.get_command_instance
+    def test_instance_memoized(self):
+        self.assertIs(get_command_instance(Latexmk), get_command_instance(Latexmk))
+
+    def test_tex2img_classes_share_compiler(self):
+        self.assertIs(Xelatex2Png.compiler_class, XeLatex)
+        self.assertIs(
+            Xelatex2Png("foo").compiler, Xelatex2Svg("foo").compiler)
+
+    def test_latexmk_not_reinstantiated_per_cmdline(self):
+        compiler = get_command_instance(XeLatex)
+        with mock.patch("latex.converter.Latexmk.__init__") as mock_init:
+            compiler.get_latexmk_subpro_cmdline("foo.tex")
+            compiler.get_latexmk_subpro_cmdline("bar.tex")
+        mock_init.assert_not_called()
+
+
+class CanonicalizeTexSourceTest(TestCase):
+    # test latex.utils.canonicalize_tex_source
+    def assertSameCanonicalForm(self, source1, source2):  # noqa
+        self.assertEqual(
+            canonicalize_tex_source(source1), canonicalize_tex_source(source2))
+
+    def assertNotSameCanonicalForm(self, source1, source2):  # noqa
+        self.assertNotEqual(
+            canonicalize_tex_source(source1), canonicalize_tex_source(source2))
+
+    def test_line_endings(self):
+        self.assertSameCanonicalForm("a\r\nb\rc", "a\nb\nc")
+
+    def test_whitespace(self):
+        self.assertSameCanonicalForm("  a  \t b  \n\tc ", "a b\nc")
+        self.assertSameCanonicalForm("a\n\n\n \nb", "a\n\nb")
+
+        # A blank line is a \par
+        self.assertNotSameCanonicalForm("a\n\nb", "a\nb")
+
+    def test_comments(self):
+        self.assertSameCanonicalForm("a% foo\nb", "a%\nb")
+        self.assertSameCanonicalForm("a\n  % foo\nb", "a\nb")
+        self.assertSameCanonicalForm("a\n% foo\n\nb", "a\n\nb")
+
+        # The line end is swallowed by the comment, a space before is not
+        self.assertNotSameCanonicalForm("a% foo\nb", "a\nb")
+        self.assertNotSameCanonicalForm("a % foo\nb", "a% foo\nb")
+        self.assertSameCanonicalForm("a  % foo\nb", "a\nb")
+
+        # A comment line doesn't end a paragraph
+        self.assertNotSameCanonicalForm("a\n% foo\nb", "a\n\nb")
+
+    def test_escaped_percent(self):
+        self.assertEqual(canonicalize_tex_source("50\\% foo"), "50\\% foo")
+        self.assertEqual(canonicalize_tex_source("a\\\\% foo"), "a\\\\%")
+
+    def test_after_end_document(self):
+        self.assertSameCanonicalForm(
+            "\\begin{document}a\\end{document}\nfoo",
+            "\\begin{document}a\\end{document}")
+
+        # Commented out
+        self.assertNotSameCanonicalForm(
+            "\\begin{document}%\\end{document}\na\\end{document}",
+            "\\begin{document}%")
+
+    def test_verbatim_unchanged(self):
+        for source in [
+                "\\verb|a  b| % foo",
+                "\\begin{verbatim}\na  b\n\\end{verbatim}",
+                "\\begin{lstlisting}\na  b % foo\n\\end{lstlisting}",
+                "\\catcode`\\%=12 a % b"]:
+            with self.subTest(source=source):
+                self.assertEqual(canonicalize_tex_source(source), source)
+
+        self.assertEqual(
+            canonicalize_tex_source("\\verb|a|\r\nb  "), "\\verb|a|\nb")
+
+    def test_verb_prefix_is_not_verb(self):
+        self.assertEqual(canonicalize_tex_source("\\verbose  a"), "\\verbose a")
+
+
+class BuildKeyTest(TestCase):
+    # test latex.converter.build_key
+    def test_default_not_canonicalized(self):
+        self.assertNotEqual(
+            build_key("a  b", "xelatex", "png"),
+            build_key("a b", "xelatex", "png"))
+        self.assertTrue(build_key("a", "xelatex", "png").endswith("_v1"))
+
+    @override_settings(L2I_CANONICALIZE_TEX_SOURCE=True)
+    def test_canonicalized(self):
+        key = build_key("a  b% foo", "xelatex", "png")
+        self.assertEqual(key, build_key("a b%", "xelatex", "png"))
+        self.assertTrue(key.endswith("_v1c1"))
+
+        # Never the same as the key of a verbatim source
+        self.assertNotEqual(
+            build_key("a", "xelatex", "png"),
+            build_key("a", "xelatex", "png", canonicalize=False))
+
+    @override_settings(L2I_CANONICALIZE_TEX_SOURCE=True)
+    def test_legacy_tex_key(self):
+        converter = Xelatex2Png("a  b")
+        self.assertEqual(
+            converter.legacy_tex_key,
+            build_key("a  b", "xelatex", "png", canonicalize=False))
+
+        # The tex_key provided by the client is not changed
+        converter = Xelatex2Png("a  b", tex_key="foo")
+        self.assertEqual(converter.tex_key, "foo")
+        self.assertIsNone(converter.legacy_tex_key)
+
+    def test_no_legacy_tex_key(self):
+        self.assertIsNone(Xelatex2Png("a").legacy_tex_key)
+
 
 class GetAbstractLatexLogTest(TestCase):
     # test latex.utils.get_abstract_latex_log
@@ -0,0 +1,144 @@
+import shutil
+import tempfile
+from importlib import import_module
+
+from django.db import connection
+from django.db.migrations.executor import MigrationExecutor
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIClient
+from tests.base_test_mixins import L2ITestMixinBase, get_fake_data_url
+
+from latex.models import DataUrlBlob, LatexImage, get_data_url_size
+
+FOO_DATA_URL = get_fake_data_url("Zm9v")
+FOOBAR_DATA_URL = get_fake_data_url("Zm9vYmFy")
+
+data_url_blob_migration = import_module("latex.migrations.0006_data_url_blob")
+
+
+class DataUrlBlobTest(L2ITestMixinBase, TestCase):
+    def create_image(self, tex_key, data_url=FOO_DATA_URL):
+        return LatexImage.objects.create(
+            tex_key=tex_key, creator=self.test_user, data_url=data_url)
+
+    def test_stored_apart(self):
+        instance = self.create_image("foo")
+        blob = DataUrlBlob.objects.get()
+        self.assertEqual(blob.result, instance)
+        self.assertEqual(blob.data_url, FOO_DATA_URL)
+        self.assertEqual(blob.size, 3)
+
+        self.assertNotIn(
+            "data_url",
+            [f.name for f in LatexImage._meta.concrete_fields])
+
+    def test_loaded_on_access(self):
+        self.create_image("foo")
+        with self.assertNumQueries(1):
+            instance = LatexImage.objects.get(tex_key="foo")
+        with self.assertNumQueries(1):
+            self.assertEqual(instance.data_url, FOO_DATA_URL)
+        with self.assertNumQueries(0):
+            self.assertEqual(instance.data_url, FOO_DATA_URL)
+
+    def test_updated(self):
+        instance = self.create_image("foo")
+        instance = LatexImage.objects.get(pk=instance.pk)
+        instance.data_url = FOOBAR_DATA_URL
+        instance.save()
+        self.assertEqual(DataUrlBlob.objects.get().size, 6)
+
+        instance.refresh_from_db()
+        self.assertEqual(instance.data_url, FOOBAR_DATA_URL)
+
+    def test_deleted(self):
+        self.create_image("foo").delete()
+        self.assertFalse(DataUrlBlob.objects.exists())
+
+    def test_list_api_prefetched(self):
+        client = APIClient()
+        client.force_authenticate(user=self.test_user)
+
+        n_queries = []
+        for tex_key in ["foo", "bar"]:
+            self.create_image(tex_key)
+            with CaptureQueriesContext(connection) as context:
+                resp = client.get("/api/list/")
+            self.assertEqual(resp.status_code, 200)
+            self.assertEqual(
+                [result["data_url"] for result in resp.json()],
+                [FOO_DATA_URL] * len(n_queries + [None]))
+            n_queries.append(len(context))
+        self.assertEqual(n_queries[0], n_queries[1])
+
+
+class DataUrlBlobMigrationTest(TransactionTestCase):
+    migrate_from = [("latex", "0005_image_blob")]
+
+    def setUp(self):
+        super().setUp()
+        temp_storage_dir = tempfile.mkdtemp(prefix="l2i_test_")
+        self.addCleanup(shutil.rmtree, temp_storage_dir)
+        settings_override = override_settings(MEDIA_ROOT=temp_storage_dir)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def migrate(self, targets=None):
+        # Default to the latest migrations, i.e., the current models
+        executor = MigrationExecutor(connection)
+        executor.loader.build_graph()
+        if targets is None:
+            targets = executor.loader.graph.leaf_nodes()
+        executor.migrate(targets)
+        return executor.loader.project_state(targets).apps
+
+    def tearDown(self):
+        self.migrate()
+        super().tearDown()
+
+    def test_backfill(self):
+        apps = self.migrate(self.migrate_from)
+        User = apps.get_model("auth", "User")  # noqa
+        OldLatexImage = apps.get_model("latex", "LatexImage")  # noqa
+        user = User.objects.create(username="foo")
+        for i in range(5):
+            OldLatexImage.objects.create(
+                tex_key="foo%d" % i, creator=user, data_url=FOO_DATA_URL)
+        OldLatexImage.objects.create(
+            tex_key="bar", creator=user, compile_error="error")
+
+        self.migrate()
+        self.assertEqual(DataUrlBlob.objects.count(), 5)
+        for instance in LatexImage.objects.filter(tex_key__startswith="foo"):
+            self.assertEqual(instance.data_url, FOO_DATA_URL)
+        self.assertIsNone(LatexImage.objects.get(tex_key="bar").data_url)
+
+        apps = self.migrate(self.migrate_from)
+        self.assertEqual(
+            apps.get_model("latex", "LatexImage").objects.filter(
+                data_url=FOO_DATA_URL).count(), 5)
+
+    def test_iter_pk_batches(self):
+        user = self.create_user()
+        for i in range(5):
+            LatexImage.objects.create(
+                tex_key="foo%d" % i, creator=user, data_url=FOO_DATA_URL)
+        batches = list(data_url_blob_migration.iter_pk_batches(
+            LatexImage.objects.values_list("pk", "tex_key"), batch_size=2))
+        self.assertEqual([len(batch) for batch in batches], [2, 2, 1])
+        self.assertEqual(
+            [tex_key for batch in batches for _pk, tex_key in batch],
+            ["foo%d" % i for i in range(5)])
+
+    def test_get_data_url_size(self):
+        for data_url in [FOO_DATA_URL, get_fake_data_url("Zm9vYg=="),
+                         get_fake_data_url("Zm9vYmE="), None]:
+            with self.subTest(data_url=data_url):
+                self.assertEqual(
+                    data_url_blob_migration.get_data_url_size(data_url),
+                    get_data_url_size(data_url))
+
+    def create_user(self):
+        from django.contrib.auth import get_user_model
+        return get_user_model().objects.create(username="bar")
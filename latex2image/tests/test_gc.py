@@ -0,0 +1,159 @@
+import os
+import shutil
+import tempfile
+from io import StringIO
+
+from django.core.files.base import ContentFile
+from django.core.management import call_command
+from django.test import SimpleTestCase, TestCase
+from tests.base_test_mixins import L2ITestMixinBase, get_fake_data_url
+
+from latex.garbage_collection import (DELETE, MISSING, ORPHAN, QUARANTINE,
+                                      OrphanCollector, clean_temp_dirs,
+                                      iter_sorted, iter_sorted_diff,
+                                      recount_usage)
+from latex.models import CreatorUsage, LatexImage, get_image_storage
+
+
+class SortedMergeTest(SimpleTestCase):
+    def test_iter_sorted(self):
+        names = ["d", "a", "e", "c", "b"]
+        self.assertEqual(
+            list(iter_sorted(iter(names), run_size=2)), sorted(names))
+        self.assertEqual(list(iter_sorted([])), [])
+
+    def test_iter_sorted_diff(self):
+        self.assertEqual(
+            list(iter_sorted_diff(iter(["a", "b", "d"]), iter(["b", "c"]))),
+            [(ORPHAN, "a"), (MISSING, "c"), (ORPHAN, "d")])
+        self.assertEqual(
+            list(iter_sorted_diff(iter([]), iter(["a"]))), [(MISSING, "a")])
+        self.assertEqual(
+            list(iter_sorted_diff(iter(["a"]), iter(["a"]))), [])
+
+
+class OrphanCollectorTest(L2ITestMixinBase, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.storage = get_image_storage()
+        self.referenced = [
+            self.create_image("foo%d" % i).image.name for i in range(3)]
+        self.orphans = [
+            self.storage.save(name, ContentFile(b"orphan"))
+            for name in ["l2i_images/bar.png", "l2i_images/ab/cd/baz.svg"]]
+
+    def create_image(self, tex_key):
+        return LatexImage.objects.create(
+            tex_key=tex_key, creator=self.test_user,
+            data_url=get_fake_data_url("foob="))
+
+    def run_collector(self, **kwargs):
+        kwargs.setdefault("min_age", 0)
+        return OrphanCollector(
+            self.storage, batch_size=1, run_size=2, **kwargs).run()
+
+    def assertStored(self, names, stored=True):  # noqa
+        for name in names:
+            self.assertEqual(self.storage.exists(name), stored, name)
+
+    def test_report(self):
+        counts = self.run_collector()
+        self.assertEqual(counts["orphans"], 2)
+        self.assertEqual(counts["orphan_bytes"], 12)
+        self.assertStored(self.referenced + self.orphans)
+
+    def test_delete(self):
+        self.assertEqual(self.run_collector(action=DELETE)["orphans"], 2)
+        self.assertStored(self.referenced)
+        self.assertStored(self.orphans, stored=False)
+        self.assertEqual(self.run_collector()["orphans"], 0)
+
+    def test_quarantine(self):
+        self.assertEqual(self.run_collector(action=QUARANTINE)["orphans"], 2)
+        self.assertStored(self.orphans, stored=False)
+        self.assertStored(["l2i_quarantine/%s" % name for name in self.orphans])
+        self.assertEqual(self.run_collector()["orphans"], 0)
+
+    def test_recent_kept(self):
+        counts = self.run_collector(action=DELETE, min_age=3600)
+        self.assertEqual(counts["orphans"], 0)
+        self.assertEqual(counts["recent"], 2)
+        self.assertStored(self.orphans)
+
+    def test_missing(self):
+        self.storage.delete(self.referenced[0])
+        self.assertEqual(self.run_collector()["missing"], 1)
+
+    def test_command(self):
+        stdout = StringIO()
+        call_command("gc", "--min-age", "0", "--delete", stdout=stdout)
+        self.assertIn("2 orphan files (12 bytes) deleted", stdout.getvalue())
+        self.assertStored(self.orphans, stored=False)
+
+
+class CleanTempDirsTest(SimpleTestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp(prefix="l2i_test_")
+        self.addCleanup(shutil.rmtree, self.temp_dir)
+
+    def make_dir(self, name, age):
+        path = os.path.join(self.temp_dir, name)
+        os.mkdir(path)
+        with open(os.path.join(path, "foo.tex"), "w") as f:
+            f.write("foo")
+        mtime = os.path.getmtime(path) - age
+        os.utime(path, (mtime, mtime))
+        return path
+
+    def test_clean(self):
+        leaked = self.make_dir("LATEX_abc", 7200)
+        recent = self.make_dir("LATEX_def", 0)
+        other = self.make_dir("other", 7200)
+
+        self.assertEqual(
+            clean_temp_dirs(temp_dir=self.temp_dir), (1, 3))
+        self.assertTrue(os.path.exists(leaked))
+
+        self.assertEqual(
+            clean_temp_dirs(dry_run=False, temp_dir=self.temp_dir), (1, 3))
+        self.assertFalse(os.path.exists(leaked))
+        self.assertTrue(os.path.exists(recent))
+        self.assertTrue(os.path.exists(other))
+
+
+class CreatorUsageTest(L2ITestMixinBase, TestCase):
+    def create_image(self, tex_key, **kwargs):
+        kwargs.setdefault("data_url", get_fake_data_url("Zm9v"))
+        return LatexImage.objects.create(
+            tex_key=tex_key, creator=self.test_user, **kwargs)
+
+    def get_usage(self):
+        usage = CreatorUsage.objects.filter(creator=self.test_user).first()
+        return (usage.n_objects, usage.n_bytes) if usage else None
+
+    def test_counted(self):
+        instance = self.create_image("foo")
+        self.create_image("bar", data_url=None, compile_error="error")
+        self.assertEqual(self.get_usage(), (2, 3))
+
+        instance.data_url = get_fake_data_url("Zm9vYmFy")
+        instance.save()
+        self.assertEqual(self.get_usage(), (2, 6))
+
+        instance.delete()
+        self.assertEqual(self.get_usage(), (1, 0))
+
+    def test_recount(self):
+        self.create_image("foo")
+        CreatorUsage.objects.all().delete()
+
+        # Not counted yet, not decremented below zero
+        self.create_image("bar").delete()
+        CreatorUsage.objects.all().delete()
+
+        self.assertEqual(recount_usage(), 1)
+        self.assertEqual(self.get_usage(), (1, 3))
+
+        stdout = StringIO()
+        call_command("gc", "--usage", stdout=stdout)
+        self.assertIn("test_user: 1 objects, 3 bytes", stdout.getvalue())
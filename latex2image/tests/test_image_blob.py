@@ -0,0 +1,249 @@
+import os
+from io import StringIO
+from unittest import mock, skipUnless
+
+from django.core.exceptions import ValidationError
+from django.core.files.base import ContentFile
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, override_settings
+from rest_framework.test import APIClient
+from tests.base_test_mixins import L2ITestMixinBase, get_fake_data_url
+
+from latex.garbage_collection import OrphanCollector
+from latex.models import (CreatorUsage, ImageBlob, LatexImage,
+                          get_image_storage, increment_fields)
+
+# A MongoDB server to test $inc updates against, e.g.,
+# "mongodb://localhost:27017"
+TEST_MONGODB_URI = os.environ.get("L2I_TEST_MONGODB_URI")
+
+FOO_DATA_URL = get_fake_data_url("Zm9v")
+BAR_DATA_URL = get_fake_data_url("YmFy")
+
+
+@override_settings(L2I_DEDUP_STORAGE=True)
+class ImageBlobTest(L2ITestMixinBase, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.storage = get_image_storage()
+
+    def create_image(self, tex_key, data_url=FOO_DATA_URL):
+        return LatexImage.objects.create(
+            tex_key=tex_key, creator=self.test_user, data_url=data_url)
+
+    def test_shared(self):
+        foo = self.create_image("foo")
+        bar = self.create_image("bar")
+        blob = ImageBlob.objects.get()
+        self.assertEqual(blob.ref_count, 2)
+        self.assertEqual(blob.size, 3)
+        self.assertEqual(foo.blob, blob)
+        self.assertEqual(bar.image.name, foo.image.name)
+        self.assertRegex(
+            foo.image.name, r"^l2i_blobs/[0-9a-f]{2}/[0-9a-f]{2}/"
+                            r"[0-9a-f]{64}\.png$")
+        with self.storage.open(foo.image.name) as f:
+            self.assertEqual(f.read(), b"foo")
+
+        foo.delete()
+        blob.refresh_from_db()
+        self.assertEqual(blob.ref_count, 1)
+        self.assertTrue(self.storage.exists(blob.image.name))
+
+        bar.delete()
+        self.assertFalse(ImageBlob.objects.exists())
+        self.assertFalse(self.storage.exists(blob.image.name))
+
+    def test_data_url_changed(self):
+        foo = self.create_image("foo")
+        old_name = foo.image.name
+
+        foo.data_url = BAR_DATA_URL
+        foo.save()
+        self.assertEqual(ImageBlob.objects.get().images.get(), foo)
+        self.assertNotEqual(foo.image.name, old_name)
+        self.assertFalse(self.storage.exists(old_name))
+
+    def test_released_on_failed_save(self):
+        self.create_image("foo")
+        with self.assertRaises(ValidationError):
+            self.create_image("foo", data_url=BAR_DATA_URL)
+        self.assertEqual(ImageBlob.objects.count(), 1)
+
+    def test_lost_references_counted(self):
+        self.create_image("foo")
+        self.create_image("bar")
+        blob = ImageBlob.objects.get()
+        ImageBlob.objects.update(ref_count=1)
+
+        ImageBlob.release(blob.pk)
+        blob.refresh_from_db()
+        self.assertEqual(blob.ref_count, 2)
+
+    @override_settings(L2I_DEDUP_STORAGE=False)
+    def test_disabled(self):
+        foo = self.create_image("foo")
+        self.assertIsNone(foo.blob)
+        self.assertTrue(foo.image.name.endswith("foo.png"))
+        self.assertFalse(ImageBlob.objects.exists())
+
+    def test_api_unchanged(self):
+        client = APIClient()
+        client.force_authenticate(user=self.test_user)
+        with mock.patch(
+                "latex.converter.Tex2ImgBase.get_converted_data_url",
+                return_value=FOO_DATA_URL):
+            for tex_key in ["foo", "bar"]:
+                resp = client.post(
+                    "/api/create/", data={
+                        "compiler": "xelatex", "image_format": "png",
+                        "tex_source": "$a$", "tex_key": tex_key,
+                        "fields": "image,data_url"},
+                    format="json")
+                self.assertEqual(resp.status_code, 201, resp.content)
+                self.assertTrue(resp.json()["image"].startswith("l2i_blobs/"))
+                self.assertEqual(resp.json()["data_url"], FOO_DATA_URL)
+        self.assertEqual(ImageBlob.objects.get().ref_count, 2)
+
+    def test_dedup_images_command(self):
+        with override_settings(L2I_DEDUP_STORAGE=False):
+            names = [self.create_image(tex_key).image.name
+                     for tex_key in ["foo", "bar", "baz"]]
+
+        stdout = StringIO()
+        call_command("dedup_images", "--dry-run", stdout=stdout)
+        self.assertIn("3 results to be stored as blobs", stdout.getvalue())
+
+        stdout = StringIO()
+        call_command("dedup_images", "--batch-size", "2", stdout=stdout)
+        self.assertIn("Done: 3 results stored as blobs", stdout.getvalue())
+
+        blob = ImageBlob.objects.get()
+        self.assertEqual(blob.ref_count, 3)
+        for name in names:
+            self.assertFalse(self.storage.exists(name))
+        for instance in LatexImage.objects.all():
+            self.assertEqual(instance.image.name, blob.image.name)
+
+    def test_gc(self):
+        self.create_image("foo")
+        self.create_image("bar")
+        orphan = self.storage.save(
+            "l2i_blobs/ab/cd/%s.png" % ("a" * 64), ContentFile(b"foo"))
+
+        counts = OrphanCollector(self.storage, min_age=0).run()
+        self.assertEqual(counts["orphans"], 1)
+        self.assertEqual(counts["missing"], 0)
+        self.assertTrue(self.storage.exists(orphan))
+
+
+class SqlCollection(object):
+    """
+    The update_many() of a pymongo collection, on the table of the test
+    database, to run the queries built for djongo.
+    """
+
+    OPERATORS = {"$gt": ">", "$gte": ">=", "$lt": "<", "$lte": "<="}
+
+    def __init__(self, table):
+        self.table = table
+
+    def update_many(self, query, update):
+        conditions = []
+        params = []
+        for column, value in query.items():
+            if isinstance(value, dict):
+                for operator, operand in value.items():
+                    conditions.append(
+                        "%s %s %%s" % (column, self.OPERATORS[operator]))
+                    params.append(operand)
+            else:
+                conditions.append("%s = %%s" % column)
+                params.append(value)
+        (operator, increments), = update.items()
+        assert operator == "$inc"
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "UPDATE %s SET %s WHERE %s" % (
+                    self.table,
+                    ", ".join("%s = %s + %d" % (column, column, delta)
+                              for column, delta in increments.items()),
+                    " AND ".join(conditions)),
+                params)
+            return mock.Mock(matched_count=cursor.rowcount)
+
+
+@override_settings(L2I_DEDUP_STORAGE=True)
+class MongodbCountersTest(ImageBlobTest):
+    """The counters updated as with djongo."""
+
+    def setUp(self):
+        super().setUp()
+        patch = mock.patch("latex.models.is_mongodb", return_value=True)
+        patch.start()
+        self.addCleanup(patch.stop)
+
+        patch = mock.patch(
+            "latex.models.get_mongodb_collection",
+            side_effect=lambda model: SqlCollection(model._meta.db_table))
+        self.mock_collection = patch.start()
+        self.addCleanup(patch.stop)
+
+    def test_updated_on_collection(self):
+        self.create_image("foo")
+        self.create_image("bar")
+        self.assertTrue(self.mock_collection.called)
+        self.assertEqual(ImageBlob.objects.get().ref_count, 2)
+
+    def test_usage_counted(self):
+        self.create_image("foo")
+        self.create_image("bar", data_url=BAR_DATA_URL).delete()
+        usage = CreatorUsage.objects.get(creator=self.test_user)
+        self.assertEqual((usage.n_objects, usage.n_bytes), (1, 3))
+
+
+@skipUnless(TEST_MONGODB_URI, "L2I_TEST_MONGODB_URI is not set")
+class IncrementFieldsMongodbTest(TestCase):
+    def setUp(self):
+        import pymongo
+        client = pymongo.MongoClient(TEST_MONGODB_URI)
+        self.addCleanup(client.close)
+        database = client["l2i_test"]
+        self.addCleanup(client.drop_database, "l2i_test")
+        self.collection = database[ImageBlob._meta.db_table]
+        self.collection.insert_many([
+            {"id": 1, "digest": "a", "ref_count": 1},
+            {"id": 2, "digest": "b", "ref_count": 2}])
+
+        for name, kwargs in [("is_mongodb", {"return_value": True}),
+                             ("get_mongodb_collection",
+                              {"return_value": self.collection})]:
+            patch = mock.patch("latex.models.%s" % name, **kwargs)
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def get_ref_counts(self):
+        return {doc["id"]: doc["ref_count"]
+                for doc in self.collection.find()}
+
+    def test_increment(self):
+        self.assertEqual(
+            increment_fields(ImageBlob, {"digest": "a"}, ref_count=1), 1)
+        self.assertEqual(
+            increment_fields(
+                ImageBlob, {"pk": 1, "ref_count__gt": 1}, ref_count=-1), 1)
+        self.assertEqual(
+            increment_fields(
+                ImageBlob, {"pk": 1, "ref_count__gt": 1}, ref_count=-1), 0)
+        self.assertEqual(self.get_ref_counts(), {1: 1, 2: 2})
+
+    def test_several_fields(self):
+        with mock.patch(
+                "latex.models.get_mongodb_collection",
+                return_value=self.collection.database["l2i_usage"]):
+            self.collection.database["l2i_usage"].insert_one(
+                {"id": 1, "creator_id": 1, "n_objects": 1, "n_bytes": 3})
+            CreatorUsage.add(1, 1, 5)
+            doc = self.collection.database["l2i_usage"].find_one()
+        self.assertEqual((doc["n_objects"], doc["n_bytes"]), (2, 8))
@@ -0,0 +1,145 @@
+import json
+import os
+import tempfile
+from io import StringIO
+
+from benchmarks.stub_toolchain import StubToolchain
+from django.contrib.auth import get_user_model
+from django.core.management import CommandError, call_command
+from django.core.servers.basehttp import WSGIServer
+from django.test import LiveServerTestCase, SimpleTestCase, override_settings
+from django.test.testcases import LiveServerThread, QuietWSGIRequestHandler
+from rest_framework.authtoken.models import Token
+
+from latex.management.commands.loadtest import (CorpusPlan, parse_mix,
+                                                read_ndjson)
+
+
+class ParseMixTest(SimpleTestCase):
+    def test_parse_mix(self):
+        self.assertEqual(
+            parse_mix("create=0.5, detail=0.5"),
+            {"create": 0.5, "detail": 0.5})
+
+    def test_unknown_endpoint(self):
+        with self.assertRaises(CommandError):
+            parse_mix("delete=1")
+
+    def test_invalid_weight(self):
+        with self.assertRaises(CommandError):
+            parse_mix("create=a")
+
+    def test_zero_weights(self):
+        with self.assertRaises(CommandError):
+            parse_mix("create=0,list=0")
+
+
+class ReadNdjsonTest(SimpleTestCase):
+    def write(self, content):
+        fd, path = tempfile.mkstemp(suffix=".ndjson")
+        with os.fdopen(fd, "w") as f:
+            f.write(content)
+        self.addCleanup(os.remove, path)
+        return path
+
+    def test_read(self):
+        path = self.write(
+            '{"endpoint": "list"}\n\n'
+            '{"endpoint": "detail", "tex_key": "abc"}\n')
+        self.assertEqual(len(read_ndjson(path)), 2)
+
+    def test_invalid(self):
+        for content in ['{"endpoint": "delete"}', '{"endpoint": "detail"}',
+                        "not json", ""]:
+            with self.subTest(content=content):
+                with self.assertRaises(CommandError):
+                    read_ndjson(self.write(content))
+
+
+class CorpusPlanTest(SimpleTestCase):
+    def test_cached_ratio(self):
+        plan = CorpusPlan({"create": 1}, cached_ratio=1,
+                          categories=["inline_math"])
+        warmup = plan.get_warmup_requests(3)
+        self.assertEqual(len(warmup), 3)
+
+        warm_keys = {req["data"]["tex_key"] for req in warmup}
+        for req in plan.get_requests(10):
+            self.assertEqual(req["label"], "create.cached")
+            self.assertIn(req["data"]["tex_key"], warm_keys)
+
+    def test_uncached(self):
+        plan = CorpusPlan({"create": 1, "detail": 1}, cached_ratio=0,
+                          categories=["inline_math"])
+        plan.get_warmup_requests(2)
+        tex_keys = set()
+        for req in plan.get_requests(20):
+            self.assertIn(req["label"], ["create.uncached", "detail.uncached"])
+            if req["endpoint"] == "create":
+                self.assertNotIn(req["data"]["tex_key"], tex_keys)
+                tex_keys.add(req["data"]["tex_key"])
+
+
+class SerialLiveServerThread(LiveServerThread):
+    # The threads of the default server share the SQLite test database,
+    # whose tables are locked by concurrent writes: the requests are
+    # served one at a time, while still sent concurrently
+    def _create_server(self):
+        return WSGIServer((self.host, self.port), QuietWSGIRequestHandler,
+                          allow_reuse_address=False)
+
+
+class LoadtestCommandTest(LiveServerTestCase):
+    server_thread_class = SerialLiveServerThread
+
+    def setUp(self):
+        toolchain = StubToolchain(latency_scale=0)
+        toolchain.__enter__()
+        self.addCleanup(toolchain.__exit__, None, None, None)
+
+        media_override = override_settings(
+            MEDIA_ROOT=tempfile.mkdtemp(prefix="l2i_test_"))
+        media_override.enable()
+        self.addCleanup(media_override.disable)
+
+        user = get_user_model().objects.create_user(username="loadtest")
+        self.token = Token.objects.get(user=user).key
+
+    def test_loadtest(self):
+        output = os.path.join(tempfile.mkdtemp(), "report.json")
+        record = os.path.join(tempfile.mkdtemp(), "requests.ndjson")
+        stdout = StringIO()
+        stderr = StringIO()
+        call_command(
+            "loadtest", "--url", self.live_server_url, "--token", self.token,
+            "--requests", "6", "--concurrency", "1", "2", "--warmup", "2",
+            "--category", "inline_math", "--output", output,
+            "--record", record, stdout=stdout, stderr=stderr)
+        # No warm up request failed
+        self.assertEqual(stderr.getvalue(), "")
+
+        with open(output) as f:
+            report = json.load(f)
+        self.assertEqual(
+            [level["concurrency"] for level in report["levels"]], [1, 2])
+        for level in report["levels"]:
+            self.assertEqual(level["requests"], 6)
+            self.assertEqual(level["errors"], 0, level["statuses"])
+        self.assertIn("Throughput curve", stdout.getvalue())
+
+        # The warm up requests are recorded too
+        self.assertEqual(len(read_ndjson(record)), 14)
+
+        call_command(
+            "loadtest", "--url", self.live_server_url, "--token", self.token,
+            "--requests", "4", "--concurrency", "1", "--replay", record,
+            "--output", output, stdout=StringIO())
+        with open(output) as f:
+            report = json.load(f)
+        self.assertEqual(report["meta"]["source"], record)
+        self.assertEqual(report["levels"][0]["errors"], 0)
+
+    def test_token_required(self):
+        with self.assertRaises(CommandError):
+            call_command("loadtest", "--url", self.live_server_url,
+                         "--token", "", stdout=StringIO())
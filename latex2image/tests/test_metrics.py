@@ -0,0 +1,112 @@
+from unittest import mock
+
+from django.test import TestCase, override_settings
+from prometheus_client import REGISTRY
+from rest_framework.test import APIClient
+from tests import factories
+from tests.base_test_mixins import L2ITestMixinBase
+
+from latex.converter import LatexCompileError, tex_to_img_converter
+
+
+def get_sample_value(name, labels=None):
+    return REGISTRY.get_sample_value(name, labels or {}) or 0
+
+
+class MetricsViewTest(L2ITestMixinBase, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.api_client = APIClient()
+        self.api_client.force_authenticate(user=self.test_user)
+
+    @override_settings(L2I_METRICS=False)
+    def test_disabled(self):
+        resp = self.client.get("/metrics")
+        self.assertEqual(resp.status_code, 404)
+
+    @override_settings(L2I_METRICS=True, L2I_METRICS_TOKEN="s3cret")
+    def test_unauthorized(self):
+        for headers in [{}, {"HTTP_AUTHORIZATION": "Bearer wrong"},
+                        {"HTTP_AUTHORIZATION": "Token s3cret"}]:
+            with self.subTest(headers=headers):
+                resp = self.client.get("/metrics", **headers)
+                self.assertEqual(resp.status_code, 401)
+                self.assertNotIn(b"l2i_", resp.content)
+
+        # Not a staff user
+        self.client.force_login(self.test_user)
+        resp = self.client.get("/metrics")
+        self.assertEqual(resp.status_code, 401)
+
+    @override_settings(L2I_METRICS=True, L2I_METRICS_TOKEN="s3cret")
+    def test_token(self):
+        resp = self.client.get(
+            "/metrics", HTTP_AUTHORIZATION="Bearer s3cret")
+        self.assertEqual(resp.status_code, 200)
+
+    @override_settings(L2I_METRICS=True)
+    def test_enabled(self):
+        self.test_user.is_staff = True
+        self.test_user.save()
+        self.client.force_login(self.test_user)
+        resp = self.client.get("/metrics")
+        self.assertEqual(resp.status_code, 200)
+        content = resp.content.decode()
+        for name in ("l2i_compile_duration_seconds",
+                     "l2i_compile_errors_total",
+                     "l2i_cache_lookups_total",
+                     "l2i_storage_operation_duration_seconds",
+                     "l2i_requests_in_progress",
+                     "l2i_active_subprocesses"):
+            self.assertIn(name, content)
+
+    def test_cache_lookups(self):
+        instance = factories.LatexImageFactory(creator=self.test_user)
+        hit_labels = {"field": "image", "result": "hit"}
+        miss_labels = {"field": "image", "result": "miss"}
+        hits = get_sample_value("l2i_cache_lookups_total", hit_labels)
+        misses = get_sample_value("l2i_cache_lookups_total", miss_labels)
+
+        self.test_cache.clear()
+        self.api_client.get(self.get_detail_url(instance.tex_key, "image"))
+        self.api_client.get(self.get_detail_url(instance.tex_key, "image"))
+
+        self.assertEqual(
+            get_sample_value("l2i_cache_lookups_total", miss_labels),
+            misses + 1)
+        self.assertEqual(
+            get_sample_value("l2i_cache_lookups_total", hit_labels), hits + 1)
+
+    def test_storage_operations(self):
+        labels = {"operation": "save"}
+        n_saved = get_sample_value(
+            "l2i_storage_operation_duration_seconds_count", labels)
+        factories.LatexImageFactory(creator=self.test_user)
+        self.assertEqual(
+            get_sample_value(
+                "l2i_storage_operation_duration_seconds_count", labels),
+            n_saved + 1)
+
+
+class CompileMetricsTest(TestCase):
+    def test_compile_error(self):
+        labels = {"compiler": "xelatex", "image_format": "svg"}
+        error_labels = dict(labels, exception="LatexCompileError")
+        n_compiled = get_sample_value(
+            "l2i_compile_duration_seconds_count", labels)
+        n_errors = get_sample_value("l2i_compile_errors_total", error_labels)
+
+        with mock.patch(
+                "latex.converter.Tex2ImgBase._get_converted_data_url"
+        ) as mock_convert:
+            mock_convert.side_effect = LatexCompileError("error")
+            with self.assertRaises(LatexCompileError):
+                tex_to_img_converter(
+                    "xelatex", "foo", "svg").get_converted_data_url()
+
+        self.assertEqual(
+            get_sample_value("l2i_compile_duration_seconds_count", labels),
+            n_compiled + 1)
+        self.assertEqual(
+            get_sample_value("l2i_compile_errors_total", error_labels),
+            n_errors + 1)
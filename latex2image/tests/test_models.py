@@ -1,8 +1,15 @@
+import io
+import os
+from base64 import b64encode
+from unittest import mock
+
 from django.core.exceptions import ValidationError
-from django.test import TestCase
-from tests.base_test_mixins import get_fake_data_url
+from django.core.files.base import ContentFile
+from django.test import SimpleTestCase, TestCase
+from tests.base_test_mixins import L2ITestMixinBase, get_fake_data_url
 
-from latex.models import LatexImage
+from latex.models import (Base64DecodingStream, LatexImage, OverwriteStorage,
+                          get_image_ext, get_image_mime_type, make_image_file)
 
 
 class LatexImageModelTest(TestCase):
@@ -21,3 +28,77 @@ class LatexImageModelTest(TestCase):
         )
         with self.assertRaises(ValidationError):
             a.save()
+
+
+class Base64DecodingStreamTest(SimpleTestCase):
+    def test_read(self):
+        for n_bytes in range(8):
+            content = os.urandom(n_bytes * 7)
+            b64 = "prefix," + b64encode(content).decode()
+            with self.subTest(n_bytes=n_bytes * 7):
+                stream = Base64DecodingStream(b64, len("prefix,"))
+                self.assertEqual(stream.size, len(content))
+                self.assertEqual(stream.read(), content)
+
+                for pos in range(len(content)):
+                    for size in (1, 2, 3, 5):
+                        stream.seek(pos)
+                        self.assertEqual(
+                            stream.read(size), content[pos:pos + size])
+
+    def test_image_file(self):
+        content = os.urandom(200000)
+        image_file = make_image_file(
+            get_fake_data_url(b64encode(content).decode()), "foo")
+        self.assertEqual(image_file.name, "foo.png")
+        self.assertEqual(image_file.size, len(content))
+        self.assertEqual(b"".join(image_file.chunks(1000)), content)
+
+        image_file.seek(0)
+        self.assertEqual(io.BufferedReader(image_file.file).read(), content)
+
+
+class ImageExtTest(SimpleTestCase):
+    def test_image_ext(self):
+        for image_format, mime_type in [
+                ("png", "image/png"), ("svg", "image/svg+xml"),
+                ("webp", "image/webp"), ("avif", "image/avif")]:
+            with self.subTest(image_format=image_format):
+                self.assertEqual(
+                    get_image_ext("data:%s;base64,Zm9v" % mime_type),
+                    ".%s" % image_format)
+                self.assertEqual(
+                    get_image_mime_type("foo.%s" % image_format), mime_type)
+
+
+class OverwriteStorageTest(L2ITestMixinBase, SimpleTestCase):
+    def setUp(self):
+        super().setUp()
+        self.storage = OverwriteStorage()
+
+    def save(self, content):
+        with mock.patch.object(
+                OverwriteStorage, "delete",
+                autospec=True, side_effect=OverwriteStorage.delete) as delete:
+            name = self.storage.save("l2i_images/foo.png", ContentFile(content))
+        self.assertEqual(name, "l2i_images/foo.png")
+        with self.storage.open(name) as f:
+            self.assertEqual(f.read(), content)
+        return delete.call_count
+
+    def test_overwrite(self):
+        self.assertEqual(self.save(b"foo"), 0)
+
+        # Unchanged content is neither deleted nor uploaded again
+        with mock.patch(
+                "django.core.files.storage.FileSystemStorage._save") as save:
+            self.assertEqual(self.save(b"foo"), 0)
+        save.assert_not_called()
+
+        self.assertEqual(self.save(b"bar"), 1)
+
+    def test_stored_md5_unknown(self):
+        self.save(b"foo")
+        with mock.patch.object(
+                OverwriteStorage, "get_stored_md5", return_value=None):
+            self.assertEqual(self.save(b"foo"), 1)
@@ -0,0 +1,270 @@
+import os
+import shutil
+import tempfile
+from io import BytesIO
+from unittest import mock, skipUnless
+
+from django.test import SimpleTestCase, override_settings
+from PIL import Image, ImageDraw, PngImagePlugin
+
+from latex.converter import Pdf2svg
+from latex.optimizers import (PngOptimizer, SvgOptimizer, get_image_optimizer,
+                              is_numpy_available, make_image_optimizer,
+                              optimize_image_file, round_numbers)
+
+# As dvisvgm renders "$a+a$", the glyph of each font size defined apart
+DVISVGM_SVG = (
+    b"<?xml version='1.0' encoding='UTF-8'?>\n"
+    b"<!-- This file was generated by dvisvgm 2.9.1 -->\n"
+    b"<svg version='1.1' xmlns='http://www.w3.org/2000/svg' "
+    b"xmlns:xlink='http://www.w3.org/1999/xlink' width='27.135257pt' "
+    b"height='7.472534pt' viewBox='164.608592 -6.110951 27.135257 7.472534'>\n"
+    b"<defs>\n"
+    b"<path id='g0-97' d='M3.716065-3.765878C3.536737-4.134496 "
+    b"3.247821-4.403487 2.799502-4.403487Z'/>\n"
+    b"<path id='g1-97' d='M3.716065-3.765878C3.536737-4.134496 "
+    b"3.247821-4.403487 2.799502-4.403487Z'/>\n"
+    b"<path id='g1-43' d='M4.07472-2.291407H6.854296C6.993773-2.291407 "
+    b"7.183064-2.291407 7.183064-2.49066Z'/>\n"
+    b"<path id='g1-49' d='M2.929016-6.37609C2.929016-6.615193 "
+    b"2.929016-6.635118 2.699875-6.635118Z'/>\n"
+    b"</defs>\n"
+    b"<g id='page1'>\n"
+    b"<use x='164.608592' y='0' xlink:href='#g0-97'/>\n"
+    b"<use x='173.049102' y='0' xlink:href='#g1-43'/>\n"
+    b"<use x='182.999718' y='0' xlink:href='#g1-97'/>\n"
+    b"</g>\n"
+    b"</svg>\n")
+
+
+class RoundNumbersTest(SimpleTestCase):
+    def test_round_numbers(self):
+        self.assertEqual(
+            round_numbers("M3.716065-3.765878C1.0 2.5e-7 -0.0001 10", 3),
+            "M3.716-3.766C1 0 0 10")
+        self.assertEqual(round_numbers("27.135257pt", 2), "27.14pt")
+        self.assertEqual(
+            round_numbers("matrix(1 0 0 1 .5 -2.25)", 1),
+            "matrix(1 0 0 1 0.5 -2.2)")
+
+    def test_compact_path_data(self):
+        # As dvisvgm writes it, the leading zeros dropped
+        self.assertEqual(
+            round_numbers("M1.0004.5 2.9999.25", 3), "M1 0.5 3 0.25")
+        self.assertEqual(round_numbers("M1.5.25-.5", 2), "M1.5 0.25-0.5")
+        self.assertEqual(round_numbers("M1.5.0001", 2), "M1.5 0")
+
+        svg = (b"<svg xmlns='http://www.w3.org/2000/svg'>"
+               b"<path d='M1.0004.5L3 4'/></svg>")
+        self.assertIn(b'd="M1 0.5L3 4"', SvgOptimizer().optimize(svg))
+
+
+class SvgOptimizerTest(SimpleTestCase):
+    def test_optimize(self):
+        optimized = SvgOptimizer().optimize(DVISVGM_SVG)
+        self.assertLess(len(optimized), len(DVISVGM_SVG) * 0.7)
+
+        text = optimized.decode()
+        self.assertTrue(text.startswith(
+            '<svg xmlns="http://www.w3.org/2000/svg" '
+            'xmlns:xlink="http://www.w3.org/1999/xlink"'))
+        self.assertIn('width="27.135pt"', text)
+        self.assertNotIn("\n", text)
+        self.assertNotIn("dvisvgm", text)
+
+        # Merged, and the unused glyph and ids dropped
+        self.assertNotIn("g1-97", text)
+        self.assertNotIn("g1-49", text)
+        self.assertNotIn("page1", text)
+        self.assertEqual(text.count('xlink:href="#g0-97"'), 2)
+        self.assertEqual(text.count("<path"), 2)
+
+        # Idempotent
+        self.assertEqual(SvgOptimizer().optimize(optimized), optimized)
+
+    def test_options(self):
+        optimized = SvgOptimizer(
+            precision=None, dedup=False, strip_whitespace=False,
+        ).optimize(DVISVGM_SVG).decode()
+        self.assertIn('width="27.135257pt"', optimized)
+        self.assertEqual(optimized.count("<path"), 4)
+        self.assertIn("\n", optimized)
+
+    def test_referenced_by_style_kept(self):
+        svg = (b"<svg xmlns='http://www.w3.org/2000/svg'><style>#a{}</style>"
+               b"<defs><path id='a' d='M0 0'/></defs></svg>")
+        self.assertIn(b'id="a"', SvgOptimizer().optimize(svg))
+
+    def test_symbols_of_pdf2svg(self):
+        svg = (b"<svg xmlns='http://www.w3.org/2000/svg' "
+               b"xmlns:xlink='http://www.w3.org/1999/xlink'><defs><g>"
+               b"<symbol id='glyph0-1'><path d='M1 1'/></symbol>"
+               b"<symbol id='glyph1-1'><path d='M1 1'/></symbol>"
+               b"</g></defs><g id='surface1' fill='url(#glyph1-1)'>"
+               b"<use xlink:href='#glyph1-1'/></g></svg>")
+        optimized = SvgOptimizer().optimize(svg)
+        self.assertEqual(optimized.count(b"<symbol"), 1)
+        self.assertIn(b'fill="url(#glyph0-1)"', optimized)
+        self.assertIn(b'xlink:href="#glyph0-1"', optimized)
+        self.assertNotIn(b"surface1", optimized)
+
+
+def make_png(image, **kwargs):
+    buf = BytesIO()
+    image.save(buf, "PNG", **kwargs)
+    return buf.getvalue()
+
+
+def get_rgba_pixels(data):
+    with Image.open(BytesIO(data)) as image:
+        return image.mode, image.convert("RGBA").tobytes()
+
+
+@skipUnless(is_numpy_available(), "numpy is not installed")
+class PngOptimizerTest(SimpleTestCase):
+    def setUp(self):
+        # As ImageMagick renders a formula, black with anti-aliased edges
+        image = Image.new("RGBA", (120, 30), (0, 0, 0, 0))
+        draw = ImageDraw.Draw(image)
+        for i in range(40):
+            draw.line([(i * 3, 0), (i * 3, 29)], fill=(0, 0, 0, i * 6))
+        draw.ellipse([40, 5, 80, 25], fill=(0, 0, 0, 255))
+        self.rgba_png = make_png(image)
+
+    def assertSamePixels(self, data, optimized, mode=None):  # noqa
+        original_mode, original_pixels = get_rgba_pixels(data)
+        optimized_mode, optimized_pixels = get_rgba_pixels(optimized)
+        self.assertEqual(original_pixels, optimized_pixels)
+        if mode is not None:
+            self.assertEqual(optimized_mode, mode)
+
+    def test_palette(self):
+        for filter_strategy in ["search", "adaptive", "none"]:
+            with self.subTest(filter_strategy=filter_strategy):
+                optimized = PngOptimizer(
+                    filter_strategy=filter_strategy).optimize(self.rgba_png)
+                self.assertLess(len(optimized), len(self.rgba_png))
+                self.assertSamePixels(self.rgba_png, optimized)
+
+        image = Image.new("RGBA", (100, 100), (255, 0, 0, 128))
+        ImageDraw.Draw(image).rectangle([10, 10, 50, 50], fill=(0, 0, 255, 255))
+        data = make_png(image)
+        self.assertSamePixels(data, PngOptimizer().optimize(data), "P")
+
+    def test_gray_bit_depth(self):
+        image = Image.new("L", (50, 20), 255)
+        ImageDraw.Draw(image).rectangle([10, 5, 30, 15], fill=0)
+        data = make_png(image)
+        optimized = PngOptimizer(max_colors=0).optimize(data)
+        self.assertSamePixels(data, optimized, "1")
+
+        image.putpixel((0, 0), 85)
+        data = make_png(image)
+        self.assertSamePixels(
+            data, PngOptimizer(max_colors=0).optimize(data), "L")
+
+    def test_rgb(self):
+        image = Image.new("RGB", (64, 64))
+        image.putdata([(x * 4, y * 4, 128) for y in range(64)
+                       for x in range(64)])
+        data = make_png(image, compress_level=1)
+        optimized = PngOptimizer().optimize(data)
+        self.assertLess(len(optimized), len(data))
+        self.assertSamePixels(data, optimized, "RGB")
+
+    def test_transparent_color_dropped(self):
+        image = Image.new("RGBA", (10, 10), (0, 0, 0, 255))
+        image.putpixel((0, 0), (255, 0, 0, 0))
+        image.putpixel((1, 0), (0, 255, 0, 0))
+        _mode, pixels = get_rgba_pixels(
+            PngOptimizer().optimize(make_png(image)))
+        self.assertEqual(pixels[:8], bytes(8))
+
+    def test_metadata(self):
+        info = PngImagePlugin.PngInfo()
+        info.add_text("Software", "ImageMagick")
+        data = make_png(Image.new("L", (10, 10)), pnginfo=info)
+        self.assertNotIn(b"tEXt", PngOptimizer().optimize(data))
+        self.assertIn(
+            b"ImageMagick",
+            PngOptimizer(strip_metadata=False).optimize(data))
+
+    def test_not_optimized(self):
+        with Image.new("I;16", (10, 10)) as image:
+            data = make_png(image)
+        self.assertEqual(PngOptimizer().optimize(data), data)
+
+    def test_options(self):
+        for options in [{"max_colors": 300}, {"filter_strategy": "foo"},
+                        {"compress_level": 0}]:
+            with self.subTest(options=options):
+                with self.assertRaises(ValueError):
+                    PngOptimizer(**options)
+
+    def test_numpy_required(self):
+        with mock.patch(
+                "latex.optimizers.is_numpy_available", return_value=False):
+            with self.assertRaises(ValueError):
+                make_image_optimizer("png", {})
+
+
+class OptimizeImageFileTest(SimpleTestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp(prefix="l2i_test_")
+        self.addCleanup(shutil.rmtree, self.temp_dir)
+        self.image_path = os.path.join(self.temp_dir, "foo.svg")
+        self.write(DVISVGM_SVG)
+
+    def write(self, data):
+        with open(self.image_path, "wb") as f:
+            f.write(data)
+
+    def read(self):
+        with open(self.image_path, "rb") as f:
+            return f.read()
+
+    @override_settings(L2I_IMAGE_OPTIMIZERS={})
+    def test_disabled(self):
+        self.assertIsNone(get_image_optimizer("svg"))
+        self.assertIsNone(optimize_image_file(self.image_path, "svg"))
+        self.assertEqual(self.read(), DVISVGM_SVG)
+
+    @override_settings(L2I_IMAGE_OPTIMIZERS={"svg": {"precision": 2}})
+    def test_optimized(self):
+        size, optimized_size = optimize_image_file(self.image_path, "svg")
+        self.assertEqual(size, len(DVISVGM_SVG))
+        self.assertEqual(optimized_size, len(self.read()))
+        self.assertIn(b'width="27.14pt"', self.read())
+
+        # Not replaced if not smaller
+        self.assertEqual(
+            optimize_image_file(self.image_path, "svg"),
+            (optimized_size, optimized_size))
+
+    @override_settings(L2I_IMAGE_OPTIMIZERS={"svg": {}})
+    def test_failed_kept(self):
+        self.write(b"not svg")
+        with self.assertLogs("latex.optimizers", "ERROR"):
+            self.assertIsNone(optimize_image_file(self.image_path, "svg"))
+        self.assertEqual(self.read(), b"not svg")
+
+    def test_make_image_optimizer(self):
+        for image_format, options in [
+                ("pdf", {}), ("svg", []), ("svg", {"precision": "2"})]:
+            with self.assertRaises(ValueError):
+                make_image_optimizer(image_format, options)
+
+    @override_settings(L2I_IMAGE_OPTIMIZERS={"svg": {}})
+    def test_do_convert(self):
+        def _convert(compiled_file_path, image_path, working_dir):
+            with open(image_path, "wb") as f:
+                f.write(DVISVGM_SVG)
+            return True, None
+
+        image_path = os.path.join(self.temp_dir, "bar.svg")
+        with mock.patch.object(Pdf2svg, "_convert", side_effect=_convert):
+            self.assertEqual(
+                Pdf2svg().do_convert("bar.pdf", image_path, self.temp_dir),
+                (True, None))
+        with open(image_path, "rb") as f:
+            self.assertLess(len(f.read()), len(DVISVGM_SVG))
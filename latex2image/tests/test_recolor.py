@@ -0,0 +1,184 @@
+import base64
+from io import BytesIO
+from unittest import mock, skipUnless
+
+from django.test import SimpleTestCase, TestCase, override_settings
+from PIL import Image, ImageDraw
+from tests.base_test_mixins import L2ITestMixinBase
+
+from latex.models import LatexImage
+from latex.optimizers import is_numpy_available
+from latex.recolor import (Palette, get_palette, parse_color, recolor_image,
+                           recolor_svg)
+
+INVERT = Palette([((0, 0, 0), (255, 255, 255)), ((255, 255, 255), (0, 0, 0))])
+
+PDF2SVG_SVG = (
+    b"<svg xmlns='http://www.w3.org/2000/svg' width='10pt' height='5pt'>"
+    b"<style>path{stroke: #ff0000 }</style>"
+    b"<g style='fill:rgb(0%,0%,0%);fill-opacity:1;'>"
+    b"<path d='M1 1' fill='none' stroke='black'/></g>"
+    b"<rect width='10' height='5' fill='#fff'/></svg>")
+
+
+def make_image(mode, size, color, image_format="PNG", **kwargs):
+    image = Image.new(mode, size, color)
+    ImageDraw.Draw(image).ellipse([2, 2, 12, 8], **kwargs)
+    buf = BytesIO()
+    image.save(buf, image_format)
+    return buf.getvalue()
+
+
+def load_image(data):
+    with Image.open(BytesIO(data)) as image:
+        pixels = image.convert("RGBA").tobytes()
+        return image.format, image.mode, list(zip(*[iter(pixels)] * 4))
+
+
+class PaletteTest(SimpleTestCase):
+    def test_parse_color(self):
+        for value in ["000", "#000000", "black", "rgb(0%,0%,0%)",
+                      " rgb(0, 0, 0) "]:
+            with self.subTest(value=value):
+                self.assertEqual(parse_color(value), (0, 0, 0))
+        for value in ["none", "12", "url(#a)"]:
+            with self.subTest(value=value):
+                with self.assertRaises(ValueError):
+                    parse_color(value)
+
+    @override_settings(L2I_PALETTES={"dark": {"#fff": "#000", "#000": "#fff"}})
+    def test_get_palette(self):
+        self.assertEqual(get_palette("dark").key, INVERT.key)
+        self.assertEqual(INVERT.key, "000000-ffffff.ffffff-000000")
+        for value in ["light", "000:fff,fff:000", ""]:
+            with self.subTest(value=value):
+                with self.assertRaises(ValueError):
+                    get_palette(value)
+
+    def test_map_color(self):
+        self.assertEqual(INVERT.map_color((0, 0, 0)), (255, 255, 255))
+        self.assertEqual(INVERT.map_color((64, 64, 64)), (191, 191, 191))
+        # The hue kept
+        self.assertEqual(INVERT.map_color((255, 0, 0)), (255, 85, 85))
+
+        shift = Palette([((0, 0, 0), (0, 0, 200))])
+        self.assertEqual(shift.map_color((100, 100, 100)), (100, 100, 255))
+
+    @skipUnless(is_numpy_available(), "numpy is not installed")
+    def test_map_pixels(self):
+        import numpy as np
+
+        colors = [(0, 0, 0), (255, 255, 255), (64, 64, 64), (255, 0, 0),
+                  (10, 200, 30), (128, 128, 128)]
+        palettes = [INVERT, Palette([((0, 0, 0), (0, 0, 200))]),
+                    Palette([((0, 0, 0), (230, 230, 230)),
+                             ((255, 0, 0), (255, 128, 128)),
+                             ((255, 255, 255), (18, 18, 18))])]
+        for palette in palettes:
+            with self.subTest(palette=palette.key):
+                self.assertEqual(
+                    [tuple(int(c) for c in rgb)
+                     for rgb in palette.map_pixels(np.array(colors))],
+                    [palette.map_color(rgb) for rgb in colors])
+
+
+class RecolorSvgTest(SimpleTestCase):
+    def test_recolor(self):
+        svg = recolor_svg(PDF2SVG_SVG, INVERT).decode()
+        self.assertIn("stroke: #ff5555 }", svg)
+        self.assertIn('style="fill:#ffffff;fill-opacity:1;"', svg)
+        self.assertIn('fill="none" stroke="#ffffff"', svg)
+        self.assertIn('<rect width="10" height="5" fill="#000000"/>', svg)
+
+        # The initial fill
+        self.assertTrue(svg.startswith(
+            '<svg xmlns="http://www.w3.org/2000/svg" width="10pt" '
+            'height="5pt" fill="#ffffff">'))
+
+    def test_initial_fill_kept(self):
+        palette = Palette([((255, 255, 255), (0, 0, 0))])
+        self.assertNotIn(b'fill="#', recolor_svg(
+            b"<svg xmlns='http://www.w3.org/2000/svg'><path d='M0 0'/></svg>",
+            palette))
+
+
+@skipUnless(is_numpy_available(), "numpy is not installed")
+class RecolorRasterTest(SimpleTestCase):
+    def test_alpha_kept(self):
+        # As ImageMagick renders, black with anti-aliased alpha
+        data = make_image("RGBA", (20, 10), (0, 0, 0, 0), fill=(0, 0, 0, 255))
+        image_format, mode, pixels = load_image(
+            recolor_image(data, "png", INVERT))
+        self.assertEqual((image_format, mode), ("PNG", "RGBA"))
+        _format, _mode, original_pixels = load_image(data)
+        self.assertEqual(
+            [pixel[3] for pixel in pixels],
+            [pixel[3] for pixel in original_pixels])
+        self.assertEqual(pixels[20 * 5 + 7], (255, 255, 255, 255))
+
+    def test_opaque(self):
+        # As dvipng renders, on white with gray anti-aliased edges
+        data = make_image("RGB", (20, 10), "white", fill="black")
+        image_format, mode, pixels = load_image(
+            recolor_image(data, "png", INVERT))
+        self.assertEqual(mode, "RGB")
+        self.assertEqual(pixels[0], (0, 0, 0, 255))
+        self.assertEqual(pixels[20 * 5 + 7], (255, 255, 255, 255))
+
+    def test_webp(self):
+        data = make_image(
+            "RGBA", (20, 10), (0, 0, 0, 0), "WEBP", fill=(0, 0, 0, 255))
+        image_format, _mode, pixels = load_image(
+            recolor_image(data, "webp", INVERT))
+        self.assertEqual(image_format, "WEBP")
+        self.assertEqual(pixels[20 * 5 + 7], (255, 255, 255, 255))
+
+    def test_numpy_required(self):
+        with mock.patch(
+                "latex.recolor.is_numpy_available", return_value=False):
+            with self.assertRaises(ValueError):
+                recolor_image(b"", "png", INVERT)
+
+
+@override_settings(
+    L2I_PALETTES={"dark": {"#000": "#fff", "#fff": "#000"},
+                  "invert": {"ffffff": "black", "000": "fff"}},
+    L2I_CACHE_MAX_BYTES=100000)
+class RecolorImageViewTest(L2ITestMixinBase, TestCase):
+    def setUp(self):
+        super().setUp()
+        LatexImage.objects.create(
+            tex_key="foo", creator=self.test_user,
+            data_url="data:image/svg+xml;base64,%s"
+                     % base64.b64encode(PDF2SVG_SVG).decode())
+
+    def test_recolored(self):
+        resp = self.client.get("/api/image/foo", {"palette": "dark"})
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp["Content-Type"], "image/svg+xml")
+        self.assertIn(b'fill="#000000"', resp.content)
+
+        # Cached by the key of the palette
+        with mock.patch("latex.api.recolor_image") as mock_recolor:
+            resp2 = self.client.get(
+                "/api/image/foo", {"palette": "invert"})
+        mock_recolor.assert_not_called()
+        self.assertEqual(resp2.content, resp.content)
+
+        # Not once deleted and created again
+        LatexImage.objects.all().delete()
+        self.setUp()
+        with mock.patch(
+                "latex.api.recolor_image", return_value=b"<svg/>"
+        ) as mock_recolor:
+            self.client.get("/api/image/foo", {"palette": "dark"})
+        mock_recolor.assert_called_once()
+
+    def test_bad_palette(self):
+        for palette in ["light", "000:fff,fff:000"]:
+            with self.subTest(palette=palette):
+                with mock.patch("latex.api.recolor_image") as mock_recolor:
+                    resp = self.client.get(
+                        "/api/image/foo", {"palette": palette})
+                self.assertEqual(resp.status_code, 400)
+                mock_recolor.assert_not_called()
@@ -0,0 +1,170 @@
+import os
+import tempfile
+from unittest import mock
+
+from django.test import SimpleTestCase, TestCase, override_settings
+from rest_framework.test import APIClient
+from tests.base_test_mixins import L2ITestMixinBase
+
+from latex.converter import (Dvipng, ImageConverter, ImageMagick,
+                             ImageMagickWebp, Tex2ImgBase,
+                             tex_to_img_converter)
+from latex.garbage_collection import OrphanCollector
+from latex.models import (LatexImage, ScaledImage, format_scale,
+                          get_image_storage)
+
+
+def get_compiled_file(self):
+    self.working_dir = tempfile.mkdtemp(prefix="LATEX_")
+    path = os.path.join(self.working_dir, self.tex_key + self.compiled_ext)
+    with open(path, "wb") as f:
+        f.write(b"compiled")
+    return path
+
+
+def do_convert(self, compiled_file_path, image_path, working_dir,
+               scale=None):
+    with open(image_path, "wb") as f:
+        f.write(b"image@%s" % str(scale).encode())
+    return True, None
+
+
+class ScaleTest(SimpleTestCase):
+    def test_format_scale(self):
+        self.assertEqual(format_scale(2.0), "2")
+        self.assertEqual(format_scale(1.5), "1.5")
+
+    def test_dvipng(self):
+        cmdline, = Dvipng()._get_convert_cmdlines("a.dvi", "a.png", scale=2)
+        self.assertEqual(cmdline[-3:], ["-D", "200", "a.dvi"])
+        cmdline, = Dvipng()._get_convert_cmdlines("a.dvi", "a.png")
+        self.assertNotIn("-D", cmdline)
+
+    def test_pillow_encoded(self):
+        with mock.patch.object(
+                ImageMagick, "_convert",
+                return_value=(False, "error")) as mock_convert:
+            ImageMagickWebp().do_convert("a.pdf", "a.webp", "foo", scale=2)
+        mock_convert.assert_called_once_with(
+            "a.pdf", "a.png", "foo", scale=2)
+
+    def test_not_supported(self):
+        with self.assertRaises(ValueError):
+            tex_to_img_converter("xelatex", "$a$", "svg", scales=[2])
+
+    def test_scaled_images(self):
+        converter = tex_to_img_converter(
+            "xelatex", "$a$", "png", scales=[1, 2, 1.5])
+        self.assertEqual(converter.scales, [1.5, 2])
+        with mock.patch.object(
+                Tex2ImgBase, "get_compiled_file", autospec=True,
+                side_effect=get_compiled_file) as mock_compile, \
+                mock.patch.object(
+                    ImageConverter, "do_convert", autospec=True,
+                    side_effect=do_convert):
+            self.assertTrue(converter.get_converted_data_url())
+        mock_compile.assert_called_once()
+        self.assertEqual(
+            converter.scaled_images, {1.5: b"image@1.5", 2: b"image@2"})
+        self.assertFalse(os.path.exists(converter.working_dir))
+
+
+class SrcsetAPITest(L2ITestMixinBase, TestCase):
+    def setUp(self):
+        super().setUp()
+        patch = mock.patch.object(
+            Tex2ImgBase, "get_compiled_file", autospec=True,
+            side_effect=get_compiled_file)
+        self.mock_compile = patch.start()
+        self.addCleanup(patch.stop)
+
+        patch = mock.patch.object(
+            ImageConverter, "do_convert", autospec=True,
+            side_effect=do_convert)
+        self.mock_convert = patch.start()
+        self.addCleanup(patch.stop)
+
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.test_user)
+
+    def post(self, **kwargs):
+        data = {"compiler": "xelatex", "image_format": "png",
+                "tex_source": "$a$", "tex_key": "foo"}
+        data.update(kwargs)
+        if data["tex_key"] is None:
+            del data["tex_key"]
+        return self.client.post("/api/create/", data=data, format="json")
+
+    def test_srcset(self):
+        resp = self.post(scales=[2, 1])
+        self.assertEqual(resp.status_code, 201, resp.content)
+        self.assertEqual(
+            resp.json()["srcset"],
+            "l2i_images/foo.png 1x, l2i_images/foo-2x.png 2x")
+        self.assertEqual(self.mock_compile.call_count, 1)
+
+        storage = get_image_storage()
+        with storage.open("l2i_images/foo-2x.png") as f:
+            self.assertEqual(f.read(), b"image@2.0")
+
+        # Only the missing scales are rasterized
+        self.mock_convert.reset_mock()
+        resp = self.post(scales=[2, 3], fields="image")
+        self.assertEqual(resp.status_code, 200, resp.content)
+        self.assertEqual(
+            resp.json(),
+            {"image": "l2i_images/foo.png",
+             "srcset": "l2i_images/foo-2x.png 2x, l2i_images/foo-3x.png 3x"})
+        self.mock_convert.assert_called_once()
+        self.assertEqual(self.mock_convert.call_args[1], {"scale": 3})
+
+        # Cached
+        self.mock_convert.reset_mock()
+        with mock.patch(
+                "latex.srcset.get_scaled_image_names") as mock_get_names:
+            self.assertEqual(self.post(scales=[3]).status_code, 200)
+        mock_get_names.assert_not_called()
+
+        self.assertEqual(
+            OrphanCollector(storage, min_age=0).run()["orphans"], 0)
+
+        LatexImage.objects.get().delete()
+        self.assertFalse(ScaledImage.objects.exists())
+        self.assertFalse(storage.exists("l2i_images/foo-2x.png"))
+
+    @override_settings(L2I_VARIANT_FORMATS=["png"])
+    def test_compiled_file_kept(self):
+        self.assertEqual(self.post(tex_key=None).status_code, 201)
+        self.assertEqual(self.post(tex_key=None, scales=[2]).status_code, 200)
+        self.assertEqual(self.mock_compile.call_count, 1)
+
+    @override_settings(L2I_API_IMAGE_RETURNS_RELATIVE_PATH=False)
+    def test_urls(self):
+        resp = self.post(scales=[1.5])
+        self.assertEqual(
+            resp.json()["srcset"],
+            "http://testserver/media/l2i_images/foo-1.5x.png 1.5x")
+
+    def test_invalid(self):
+        for kwargs in [{"scales": [2], "image_format": "svg"},
+                       {"scales": [10]}, {"scales": []},
+                       {"scales": [1, 2, 3, 4, 0.5]}]:
+            with self.subTest(kwargs=kwargs):
+                self.assertEqual(self.post(**kwargs).status_code, 400)
+        self.assertFalse(LatexImage.objects.exists())
+
+    def test_convert_error(self):
+        self.assertEqual(self.post().status_code, 201)
+        self.mock_convert.side_effect = None
+        self.mock_convert.return_value = (False, "some error")
+        resp = self.post(scales=[2])
+        self.assertEqual(resp.status_code, 400)
+        self.assertIn("some error", resp.json()["error"])
+
+    def test_unexpected_error_not_hidden(self):
+        self.assertEqual(self.post().status_code, 201)
+        with mock.patch(
+                "latex.api.get_srcset_by_tex_key",
+                side_effect=RuntimeError("bug")):
+            with self.assertRaises(RuntimeError):
+                self.post(scales=[2])
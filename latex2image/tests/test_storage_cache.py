@@ -0,0 +1,150 @@
+import os
+import shutil
+import tempfile
+from unittest import mock
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import FileSystemStorage
+from django.test import SimpleTestCase, TestCase, override_settings
+from tests.base_test_mixins import L2ITestMixinBase, get_fake_data_url
+
+from latex.models import LatexImage, OverwriteStorage
+from latex.storage_cache import StorageDiskCache, get_storage_disk_cache
+
+
+def make_temp_dir(test_case):
+    temp_dir = tempfile.mkdtemp(prefix="l2i_test_")
+    test_case.addCleanup(shutil.rmtree, temp_dir)
+    return temp_dir
+
+
+class StorageDiskCacheTest(SimpleTestCase):
+    def setUp(self):
+        self.cache = StorageDiskCache(make_temp_dir(self), max_bytes=100)
+
+    def test_put_get(self):
+        self.assertIsNone(self.cache.get("a/b.png"))
+        path = self.cache.put("a/b.png", [b"foo", b"bar"])
+        self.assertEqual(self.cache.get("a/b.png"), path)
+        with open(path, "rb") as f:
+            self.assertEqual(f.read(), b"foobar")
+
+        self.cache.delete("a/b.png")
+        self.assertIsNone(self.cache.get("a/b.png"))
+
+    def test_put_get_size(self):
+        self.assertEqual(self.cache.get_size("a/b.png"), (False, None))
+        self.cache.put_size("a/b.png")
+        self.assertEqual(self.cache.get_size("a/b.png"), (True, None))
+        self.cache.put_size("a/b.png", 6)
+        self.assertEqual(self.cache.get_size("a/b.png"), (True, 6))
+        # Not the content
+        self.assertIsNone(self.cache.get("a/b.png"))
+
+        self.cache.delete("a/b.png")
+        self.assertEqual(self.cache.get_size("a/b.png"), (False, None))
+
+        self.cache.put("a/b.png", [b"foo"])
+        self.assertEqual(self.cache.get_size("a/b.png"), (True, 3))
+
+    def test_evict_least_recently_used(self):
+        for i in range(3):
+            path = self.cache.put(str(i), [b"x" * 30])
+            os.utime(path, (i, i))
+
+        # "0" is read, thus more recent than "1"
+        self.cache.get("0")
+        self.cache.put("3", [b"x" * 30])
+
+        self.assertIsNone(self.cache.get("1"))
+        for name in ["0", "2", "3"]:
+            self.assertIsNotNone(self.cache.get(name))
+
+    def test_not_evicted_below_max_bytes(self):
+        for i in range(3):
+            self.cache.put(str(i), [b"x" * 30])
+        for i in range(3):
+            self.assertIsNotNone(self.cache.get(str(i)))
+
+
+class CachedStorageTest(L2ITestMixinBase, TestCase):
+    def setUp(self):
+        super().setUp()
+        settings_override = override_settings(
+            L2I_STORAGE_CACHE_DIR=make_temp_dir(self))
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+        self.storage = OverwriteStorage()
+        self.storage.save("l2i_images/foo.png", ContentFile(b"foo"))
+
+    def test_open(self):
+        with mock.patch.object(
+                FileSystemStorage, "open",
+                autospec=True, side_effect=FileSystemStorage.open) as mock_open:
+            for _i in range(2):
+                with self.storage.open("l2i_images/foo.png") as f:
+                    self.assertEqual(f.read(), b"foo")
+        self.assertEqual(mock_open.call_count, 1)
+
+    def test_exists_and_size(self):
+        self.storage.open("l2i_images/foo.png").close()
+        with mock.patch.object(FileSystemStorage, "exists") as mock_exists, \
+                mock.patch.object(FileSystemStorage, "size") as mock_size:
+            self.assertTrue(self.storage.exists("l2i_images/foo.png"))
+            self.assertEqual(self.storage.size("l2i_images/foo.png"), 3)
+        mock_exists.assert_not_called()
+        mock_size.assert_not_called()
+
+        self.assertFalse(self.storage.exists("l2i_images/bar.png"))
+
+    def test_exists_and_size_cached_on_miss(self):
+        with mock.patch.object(
+                FileSystemStorage, "exists", autospec=True,
+                side_effect=FileSystemStorage.exists) as mock_exists, \
+                mock.patch.object(
+                    FileSystemStorage, "size", autospec=True,
+                    side_effect=FileSystemStorage.size) as mock_size:
+            for _i in range(2):
+                self.assertTrue(self.storage.exists("l2i_images/foo.png"))
+            self.assertEqual(mock_exists.call_count, 1)
+
+            # The size is unknown from the existence only
+            for _i in range(2):
+                self.assertEqual(self.storage.size("l2i_images/foo.png"), 3)
+            self.assertEqual(mock_size.call_count, 1)
+
+            # Files which don't exist are not cached
+            for _i in range(2):
+                self.assertFalse(self.storage.exists("l2i_images/bar.png"))
+            self.assertEqual(mock_exists.call_count, 3)
+
+        # Nor read
+        self.assertIsNone(get_storage_disk_cache().get("l2i_images/foo.png"))
+
+        self.storage.delete("l2i_images/foo.png")
+        self.assertFalse(self.storage.exists("l2i_images/foo.png"))
+
+    def test_invalidated(self):
+        self.storage.open("l2i_images/foo.png").close()
+        self.storage.save("l2i_images/foo.png", ContentFile(b"bar"))
+        with self.storage.open("l2i_images/foo.png") as f:
+            self.assertEqual(f.read(), b"bar")
+
+        self.storage.delete("l2i_images/foo.png")
+        self.assertFalse(self.storage.exists("l2i_images/foo.png"))
+        self.assertIsNone(get_storage_disk_cache().get("l2i_images/foo.png"))
+
+    def test_image_read_on_save(self):
+        instance = LatexImage(tex_key="foo", creator=self.test_user)
+        instance.image = "l2i_images/foo.png"
+        instance.save()
+        self.assertEqual(instance.data_url, get_fake_data_url("Zm9v"))
+        self.assertIsNotNone(
+            get_storage_disk_cache().get("l2i_images/foo.png"))
+
+    @override_settings(L2I_STORAGE_CACHE_DIR=None)
+    def test_disabled(self):
+        self.assertIsNone(get_storage_disk_cache())
+        with self.storage.open("l2i_images/foo.png") as f:
+            self.assertEqual(f.read(), b"foo")
@@ -0,0 +1,180 @@
+import os
+from io import StringIO
+from unittest import mock
+
+from django.core.management import call_command
+from django.db.models import signals
+from django.test import SimpleTestCase, TestCase, override_settings
+from factory.django import mute_signals
+from rest_framework.test import APIClient
+from tests.base_test_mixins import L2ITestMixinBase, get_fake_data_url
+
+from latex.api import get_field_cache_key
+from latex.models import (LatexImage, ScaledImage, get_image_path,
+                          get_image_path_candidates, get_image_shard)
+from latex.srcset import save_scaled_images
+
+CONVERT_PATH = "latex.converter.Tex2ImgBase.get_converted_data_url"
+
+
+class ImagePathTest(SimpleTestCase):
+    def test_flat(self):
+        self.assertEqual(get_image_path("foo.png", False), "l2i_images/foo.png")
+
+    def test_sharded(self):
+        level1, level2 = get_image_shard("foo")
+        self.assertEqual(len(level1 + level2), 4)
+        self.assertEqual(
+            get_image_path("foo.png", True),
+            "l2i_images/%s/%s/foo.png" % (level1, level2))
+
+        # Formats of a key are in the same shard
+        self.assertEqual(
+            os.path.dirname(get_image_path("foo.svg", True)),
+            os.path.dirname(get_image_path("foo.png", True)))
+
+    def test_default_to_setting(self):
+        with override_settings(L2I_SHARDED_STORAGE=True):
+            self.assertEqual(
+                get_image_path("foo.png"), get_image_path("foo.png", True))
+            self.assertEqual(
+                get_image_path_candidates("foo.png"),
+                [get_image_path("foo.png", True), "l2i_images/foo.png"])
+
+        with override_settings(L2I_SHARDED_STORAGE=False):
+            self.assertEqual(get_image_path("foo.png"), "l2i_images/foo.png")
+            self.assertEqual(
+                get_image_path_candidates("foo.png"),
+                ["l2i_images/foo.png", get_image_path("foo.png", True)])
+
+
+class StorageLayoutTestMixin(L2ITestMixinBase):
+    def setUp(self):
+        super().setUp()
+        patch = mock.patch(
+            CONVERT_PATH, return_value=get_fake_data_url("foob="))
+        self.mock_convert = patch.start()
+        self.addCleanup(patch.stop)
+
+    def create_image(self, tex_key):
+        return LatexImage.objects.create(
+            tex_key=tex_key, creator=self.test_user,
+            data_url=get_fake_data_url("foob="))
+
+    def assertStored(self, instance, sharded):  # noqa
+        instance.refresh_from_db()
+        self.assertEqual(
+            instance.image.name,
+            get_image_path("%s.png" % instance.tex_key, sharded))
+        self.assertTrue(instance.image.storage.exists(instance.image.name))
+
+
+class CreateShardedTest(StorageLayoutTestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.test_user)
+
+    def post(self, **kwargs):
+        data = {"compiler": "xelatex", "image_format": "png",
+                "tex_source": "$a$"}
+        data.update(kwargs)
+        return self.client.post("/api/create/", data=data, format="json")
+
+    @override_settings(L2I_SHARDED_STORAGE=True)
+    def test_saved_sharded(self):
+        self.assertEqual(self.post().status_code, 201)
+        self.assertStored(LatexImage.objects.get(), sharded=True)
+
+    def test_use_existing_storage_image_of_other_layout(self):
+        for sharded in [False, True]:
+            with self.subTest(sharded=sharded):
+                with override_settings(L2I_SHARDED_STORAGE=not sharded):
+                    self.assertEqual(self.post().status_code, 201)
+
+                instance = LatexImage.objects.get()
+                with mute_signals(signals.post_delete):
+                    instance.delete()
+
+                with override_settings(L2I_SHARDED_STORAGE=sharded):
+                    resp = self.post(use_storage_file_if_exists=True)
+                    self.assertEqual(resp.status_code, 200, resp.content)
+
+                self.assertEqual(self.mock_convert.call_count, 1)
+                self.assertStored(LatexImage.objects.get(), sharded=not sharded)
+
+                LatexImage.objects.all().delete()
+                self.mock_convert.reset_mock()
+
+
+class ShardImagesCommandTest(StorageLayoutTestMixin, TestCase):
+    def test_move(self):
+        instances = [self.create_image("key%d" % i) for i in range(5)]
+        for instance in instances:
+            self.assertStored(instance, sharded=False)
+
+        self.test_cache.set(get_field_cache_key("key0", "image"), "foo")
+
+        stdout = StringIO()
+        call_command("shard_images", "--batch-size", "2", stdout=stdout)
+        self.assertIn("5 files moved", stdout.getvalue())
+        for instance in instances:
+            self.assertStored(instance, sharded=True)
+        self.assertIsNone(
+            self.test_cache.get(get_field_cache_key("key0", "image")))
+
+        # Nothing left to move
+        stdout = StringIO()
+        call_command("shard_images", stdout=stdout)
+        self.assertIn("0 files moved", stdout.getvalue())
+
+        call_command("shard_images", "--to", "flat", stdout=StringIO())
+        for instance in instances:
+            self.assertStored(instance, sharded=False)
+
+    def test_move_scaled_images(self):
+        instance = self.create_image("foo")
+        name, = save_scaled_images(instance, {2: b"foo@2"}).values()
+        self.assertEqual(name, "l2i_images/foo-2x.png")
+        self.test_cache.set(
+            get_field_cache_key("foo", "scaled_images"), {2: name})
+
+        # In the shard of the result, not of "foo-2x"
+        call_command("shard_images", stdout=StringIO())
+        scaled_image = ScaledImage.objects.get()
+        self.assertEqual(
+            scaled_image.image.name,
+            get_image_path("foo-2x.png", True, tex_key="foo"))
+        self.assertEqual(
+            os.path.dirname(scaled_image.image.name),
+            os.path.dirname(get_image_path("foo.png", True)))
+        with scaled_image.image.open() as f:
+            self.assertEqual(f.read(), b"foo@2")
+        self.assertIsNone(self.test_cache.get(
+            get_field_cache_key("foo", "scaled_images")))
+        self.assertStored(instance, sharded=True)
+
+        stdout = StringIO()
+        call_command("shard_images", "--to", "flat", stdout=stdout)
+        self.assertIn("2 files moved, 0 failed", stdout.getvalue())
+        scaled_image.refresh_from_db()
+        self.assertEqual(scaled_image.image.name, name)
+        self.assertTrue(scaled_image.image.storage.exists(name))
+        self.assertStored(instance, sharded=False)
+
+    def test_dry_run(self):
+        instance = self.create_image("foo")
+        stdout = StringIO()
+        call_command("shard_images", "--dry-run", stdout=stdout)
+        self.assertIn("1 files to be moved", stdout.getvalue())
+        self.assertStored(instance, sharded=False)
+
+    def test_move_failed(self):
+        instance = self.create_image("foo")
+        stderr = StringIO()
+        with mock.patch(
+                "latex.management.commands.shard_images.os.replace",
+                side_effect=OSError("foo error")):
+            call_command("shard_images", stdout=StringIO(), stderr=stderr)
+        self.assertIn("foo error", stderr.getvalue())
+        self.assertStored(instance, sharded=False)
@@ -0,0 +1,199 @@
+import os
+import shutil
+import tempfile
+from io import StringIO
+from unittest import mock
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import FileSystemStorage
+from django.core.management import CommandError, call_command
+from django.test import SimpleTestCase, TestCase, override_settings
+from rest_framework.test import APIClient
+from tests.base_test_mixins import L2ITestMixinBase, get_fake_data_url
+
+from latex.models import LatexImage, get_image_path, get_image_storage
+from latex.storage_manifest import (RedisStorageManifest,
+                                    SqliteStorageManifest,
+                                    get_storage_manifest,
+                                    iter_storage_file_names)
+
+
+def make_temp_dir(test_case):
+    temp_dir = tempfile.mkdtemp(prefix="l2i_test_")
+    test_case.addCleanup(shutil.rmtree, temp_dir)
+    return temp_dir
+
+
+class FakeRedis(object):
+    """The commands used by RedisStorageManifest."""
+
+    def __init__(self):
+        self.data = {}
+
+    def sadd(self, key, *names):
+        self.data.setdefault(key, set()).update(
+            name.encode() for name in names)
+
+    def srem(self, key, *names):
+        self.data.get(key, set()).difference_update(
+            name.encode() for name in names)
+
+    def sismember(self, key, name):
+        return name.encode() in self.data.get(key, set())
+
+    def scard(self, key):
+        return len(self.data.get(key, set()))
+
+    def sscan_iter(self, key, count=None):
+        return iter(list(self.data.get(key, set())))
+
+    def get(self, key):
+        return self.data.get(key)
+
+    def set(self, key, value):
+        self.data[key] = value.encode()
+
+    def delete(self, key):
+        self.data.pop(key, None)
+
+    def rename(self, key, new_key):
+        self.data[new_key] = self.data.pop(key)
+
+    def pipeline(self):
+        return self
+
+    def execute(self):
+        pass
+
+
+class StorageManifestTestMixin(object):
+    def test_add_discard(self):
+        self.assertFalse(self.manifest.is_complete())
+        self.manifest.add(["a", "b"])
+        self.manifest.add(["a"])
+        self.assertTrue(self.manifest.contains("a"))
+        self.assertEqual(len(self.manifest), 2)
+
+        self.manifest.discard(["a", "c"])
+        self.assertFalse(self.manifest.contains("a"))
+        self.assertEqual(list(self.manifest.iter_names()), ["b"])
+
+    def test_rebuild(self):
+        self.manifest.add(["a"])
+        self.assertEqual(
+            self.manifest.rebuild(iter(["c", "b", "d"]), batch_size=2), 3)
+        self.assertTrue(self.manifest.is_complete())
+        self.assertFalse(self.manifest.contains("a"))
+        self.assertEqual(sorted(self.manifest.iter_names()), ["b", "c", "d"])
+
+        self.manifest.set_complete(False)
+        self.assertFalse(self.manifest.is_complete())
+
+        self.assertEqual(self.manifest.rebuild([]), 0)
+        self.assertEqual(len(self.manifest), 0)
+
+
+class SqliteStorageManifestTest(StorageManifestTestMixin, SimpleTestCase):
+    def setUp(self):
+        self.manifest = SqliteStorageManifest(
+            os.path.join(make_temp_dir(self), "manifest.sqlite3"))
+
+    def test_sorted(self):
+        self.manifest.add(["c", "a", "b"])
+        self.assertEqual(list(self.manifest.iter_names()), ["a", "b", "c"])
+
+
+class RedisStorageManifestTest(StorageManifestTestMixin, SimpleTestCase):
+    def setUp(self):
+        self.manifest = RedisStorageManifest(FakeRedis())
+
+
+class IterStorageFileNamesTest(SimpleTestCase):
+    def test_recursive(self):
+        storage = FileSystemStorage(location=make_temp_dir(self))
+        for name in ["l2i_images/a.png", "l2i_images/ab/cd/b.png",
+                     "l2i_images/ab/ef/c.svg", "other/d.png"]:
+            storage.save(name, ContentFile(b"foo"))
+
+        self.assertEqual(
+            sorted(iter_storage_file_names(storage, "l2i_images")),
+            ["l2i_images/a.png", "l2i_images/ab/cd/b.png",
+             "l2i_images/ab/ef/c.svg"])
+        self.assertEqual(list(iter_storage_file_names(storage, "foo")), [])
+
+
+class StorageManifestIntegrationTest(L2ITestMixinBase, TestCase):
+    def setUp(self):
+        super().setUp()
+        settings_override = override_settings(
+            L2I_STORAGE_MANIFEST=os.path.join(
+                make_temp_dir(self), "manifest.sqlite3"))
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.manifest = get_storage_manifest()
+
+        patch = mock.patch(
+            "latex.converter.Tex2ImgBase.get_converted_data_url",
+            return_value=get_fake_data_url("foob="))
+        self.mock_convert = patch.start()
+        self.addCleanup(patch.stop)
+
+    def create_image(self, tex_key):
+        return LatexImage.objects.create(
+            tex_key=tex_key, creator=self.test_user,
+            data_url=get_fake_data_url("foob="))
+
+    def test_kept_current(self):
+        instance = self.create_image("foo")
+        self.assertTrue(self.manifest.contains(instance.image.name))
+
+        instance.delete()
+        self.assertFalse(self.manifest.contains(instance.image.name))
+
+    def test_build_command(self):
+        names = [self.create_image("foo%d" % i).image.name for i in range(3)]
+        self.manifest.rebuild([])
+
+        stdout = StringIO()
+        call_command("build_storage_manifest", stdout=stdout)
+        self.assertIn("3 names", stdout.getvalue())
+        self.assertEqual(sorted(self.manifest.iter_names()), sorted(names))
+
+        stdout = StringIO()
+        call_command("build_storage_manifest", "--status", stdout=stdout)
+        self.assertIn("3 names, complete", stdout.getvalue())
+
+    @override_settings(L2I_STORAGE_MANIFEST=None)
+    def test_build_command_not_configured(self):
+        with self.assertRaises(CommandError):
+            call_command("build_storage_manifest", stdout=StringIO())
+
+    def test_existence_checked_in_manifest(self):
+        client = APIClient()
+        client.force_authenticate(user=self.test_user)
+        data = {"compiler": "xelatex", "image_format": "png",
+                "tex_source": "$a$", "tex_key": "foo",
+                "use_storage_file_if_exists": True}
+
+        storage = get_image_storage()
+        for complete in [False, True]:
+            with self.subTest(complete=complete):
+                LatexImage.objects.all().delete()
+                storage.save(get_image_path("foo.png"), ContentFile(b"foo"))
+                self.manifest.set_complete(complete)
+
+                with mock.patch.object(
+                        FileSystemStorage, "exists",
+                        return_value=True) as mock_exists:
+                    resp = client.post(
+                        "/api/create/", data=data, format="json")
+                self.assertEqual(resp.status_code, 200, resp.content)
+                self.assertEqual(mock_exists.called, not complete)
+                self.mock_convert.assert_not_called()
+
+        # Absent from the complete manifest, thus compiled
+        self.manifest.discard([get_image_path("foo.png")])
+        LatexImage.objects.all().delete()
+        resp = client.post("/api/create/", data=data, format="json")
+        self.assertEqual(resp.status_code, 201, resp.content)
+        self.mock_convert.assert_called_once()
@@ -0,0 +1,63 @@
+import json
+import os
+import shutil
+import tempfile
+from io import StringIO
+
+from django.core.management import CommandError, call_command
+from django.test import SimpleTestCase
+
+
+class TexKeyReportTest(SimpleTestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp(prefix="l2i_test_")
+        self.addCleanup(shutil.rmtree, self.temp_dir)
+
+    def write(self, filename, content):
+        path = os.path.join(self.temp_dir, filename)
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(content)
+        return path
+
+    def get_report(self, *args):
+        stdout = StringIO()
+        call_command("tex_key_report", *args, "--json", stdout=stdout)
+        return json.loads(stdout.getvalue())
+
+    def test_ndjson(self):
+        lines = [
+            {"endpoint": "create", "data": {
+                "compiler": "xelatex", "image_format": "png",
+                "tex_source": source}}
+            for source in ["$a+b$", "$a + b$ % foo", "$a+b$\r\n", "$c$"]]
+        lines.append({"endpoint": "list", "data": {}})
+        path = self.write(
+            "requests.ndjson", "\n".join(json.dumps(line) for line in lines))
+
+        report = self.get_report(path)
+        self.assertEqual(report["requests"], 4)
+        self.assertEqual(report["verbatim_keys"], 3)
+        self.assertEqual(report["canonical_keys"], 3)
+
+        # "$a+b$" and "$a + b$" are different sources in TeX
+        self.write("1.tex", "$a + b$")
+        self.write("2.tex", "$a  +  b$ % foo")
+        self.write("3.tex", "\\verb|a  b|")
+        self.write("4.tex", "\\verb|a b|")
+
+        report = self.get_report(self.temp_dir)
+        self.assertEqual(report["requests"], 4)
+        self.assertEqual(report["verbatim_keys"], 4)
+        self.assertEqual(report["canonical_keys"], 3)
+        self.assertEqual(report["hit_rate_gain"], 0.25)
+        self.assertEqual(report["line_endings_only"], 2)
+
+    def test_text_output(self):
+        path = self.write("1.tex", "$a$")
+        stdout = StringIO()
+        call_command("tex_key_report", path, stdout=stdout)
+        self.assertIn("Hit rate gain", stdout.getvalue())
+
+    def test_no_such_file(self):
+        with self.assertRaises(CommandError):
+            call_command("tex_key_report", os.path.join(self.temp_dir, "foo"))
@@ -0,0 +1,196 @@
+import os
+from unittest import mock
+
+from django.test import SimpleTestCase, TestCase, override_settings
+from rest_framework.test import APIClient
+from tests.base_test_mixins import L2ITestMixinBase
+
+from latex.converter import (Dvipng, Dvisvg, ImageConverter, Pdf2svg,
+                             Tex2ImgBase, get_source_key, tex_to_img_converter)
+from latex.models import LatexImage
+from latex.utils import get_preview_metadata, wrap_tight_page
+from latex.variants import get_variant_key
+
+ARTICLE_SOURCE = (
+    "\\documentclass{article}\n"
+    "\\usepackage{amsmath}\n"
+    "\\begin{document}\n"
+    "$a+b$\n"
+    "\\end{document}\n")
+
+# As "pdflatex" logs the source wrapped, with a border of 0.50003pt
+PREVIEW_LOG = (
+    "Preview: Fontsize 10pt\n"
+    "Preview: PDFoutput 1\n"
+    "Preview: Tightpage -32891 -32891 32891 32891\n"
+    "[1{/usr/share/texlive/texmf-dist/fonts/map/pdftex/updmap/pdftex.map}]\n"
+    "Preview: Snippet 1 ended.(491520+163840x1638400).\n")
+
+
+class WrapTightPageTest(SimpleTestCase):
+    def test_wrapped(self):
+        wrapped = wrap_tight_page(ARTICLE_SOURCE)
+        self.assertEqual(
+            wrapped,
+            "\\documentclass{article}\n"
+            "\\usepackage{amsmath}\n"
+            "\\usepackage[active,tightpage]{preview}\n"
+            "\\usepackage{varwidth}\n"
+            "\\begin{document}"
+            "\\begin{preview}\\begin{varwidth}{\\linewidth}"
+            "\\setlength{\\parindent}{0pt}\n"
+            "\n$a+b$\n"
+            "\n\\end{varwidth}\\end{preview}\n"
+            "\\end{document}\n")
+
+    def test_not_wrapped(self):
+        for tex_source in [
+                "$a+b$",
+                "\\documentclass[border=1pt]{standalone}\n"
+                "\\begin{document}$a$\\end{document}",
+                "\\documentclass{article}\n"
+                "\\usepackage[active,tightpage]{preview}\n"
+                "\\begin{document}$a$\\end{document}",
+                "\\documentclass{article}\\end{document}\\begin{document}"]:
+            with self.subTest(tex_source=tex_source):
+                self.assertIsNone(wrap_tight_page(tex_source))
+
+
+class GetPreviewMetadataTest(SimpleTestCase):
+    def test_metadata(self):
+        self.assertEqual(
+            get_preview_metadata(PREVIEW_LOG),
+            {"width": 26.004, "height": 8.002, "depth": 3.002})
+
+        self.assertEqual(
+            get_preview_metadata(
+                "Preview: Snippet 1 ended.(65536+0x131072)."),
+            {"width": 2, "height": 1, "depth": 0})
+
+        self.assertIsNone(get_preview_metadata("Preview: Fontsize 10pt"))
+
+
+class ConvertCmdlinesTest(SimpleTestCase):
+    def test_not_trimmed(self):
+        for converter_class in [Dvipng, Dvisvg, Pdf2svg]:
+            with self.subTest(converter=converter_class.__name__):
+                converter = converter_class()
+                trimmed = converter._get_convert_cmdlines("a.dvi", "a.png")
+                tight = converter._get_convert_cmdlines(
+                    "a.dvi", "a.png", trim=False)
+                self.assertNotEqual(trimmed, tight)
+
+        self.assertNotIn(
+            "tight", Dvipng()._get_convert_cmdlines(
+                "a.dvi", "a.png", trim=False)[0])
+        self.assertIn(
+            "--bbox=preview",
+            Dvisvg()._get_convert_cmdlines("a.dvi", "a.svg", trim=False)[0])
+        self.assertEqual(
+            len(Pdf2svg()._get_convert_cmdlines(
+                "a.pdf", "a.svg", trim=False)), 1)
+
+
+def compile_popen(self, cmdline):
+    base = os.path.join(self.working_dir, self.tex_key)
+    with open(base + ".tex", "rb") as f:
+        tex = f.read()
+    with open(base + self.compiled_ext, "wb") as f:
+        f.write(b"tight" if b"tightpage" in tex else b"full")
+    with open(base + ".log", "w") as f:
+        f.write(PREVIEW_LOG if b"tightpage" in tex else "")
+    return "", "", 0
+
+
+def do_convert(self, compiled_file_path, image_path, working_dir,
+               scale=None, trim=True):
+    with open(compiled_file_path, "rb") as f:
+        content = f.read()
+    with open(image_path, "wb") as f:
+        f.write(content + (b" trimmed" if trim else b""))
+    return True, None
+
+
+class TightPageConvertTest(SimpleTestCase):
+    def setUp(self):
+        patch = mock.patch.object(
+            Tex2ImgBase, "compile_popen", autospec=True,
+            side_effect=compile_popen)
+        patch.start()
+        self.addCleanup(patch.stop)
+
+        patch = mock.patch.object(
+            ImageConverter, "do_convert", autospec=True,
+            side_effect=do_convert)
+        self.mock_convert = patch.start()
+        self.addCleanup(patch.stop)
+
+    def convert(self, tex_source, **kwargs):
+        converter = tex_to_img_converter(
+            "pdflatex", tex_source, "svg", tex_key="foo", **kwargs)
+        return converter, converter.get_converted_data_url()
+
+    @override_settings(L2I_TIGHT_PAGE=True)
+    def test_tight(self):
+        converter, data_url = self.convert(ARTICLE_SOURCE)
+        self.assertTrue(converter.tight_page)
+        self.assertEqual(converter.tex_source, ARTICLE_SOURCE.strip())
+        self.assertEqual(data_url, "data:image/svg+xml;base64,dGlnaHQ=")
+        self.assertEqual(
+            converter.metadata,
+            {"width": 26.004, "height": 8.002, "depth": 3.002})
+
+    @override_settings(L2I_TIGHT_PAGE=True)
+    def test_not_wrapped(self):
+        converter, data_url = self.convert("$a$")
+        self.assertFalse(converter.tight_page)
+        self.assertEqual(converter.metadata, {})
+        self.assertEqual(data_url, "data:image/svg+xml;base64,ZnVsbCB0cmltbWVk")
+
+    def test_disabled(self):
+        converter, _data_url = self.convert(ARTICLE_SOURCE)
+        self.assertFalse(converter.tight_page)
+        self.assertEqual(converter.metadata, {})
+        self.assertEqual(self.mock_convert.call_args[1], {})
+
+
+@override_settings(L2I_TIGHT_PAGE=True, L2I_VARIANT_FORMATS=["svg", "png"])
+class TightPageAPITest(L2ITestMixinBase, TestCase):
+    def setUp(self):
+        super().setUp()
+        patch = mock.patch.object(
+            Tex2ImgBase, "compile_popen", autospec=True,
+            side_effect=compile_popen)
+        patch.start()
+        self.addCleanup(patch.stop)
+
+        patch = mock.patch.object(
+            ImageConverter, "do_convert", autospec=True,
+            side_effect=do_convert)
+        patch.start()
+        self.addCleanup(patch.stop)
+
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.test_user)
+
+    def test_metadata(self):
+        resp = self.client.post(
+            "/api/create/",
+            data={"compiler": "pdflatex", "image_format": "svg",
+                  "tex_source": ARTICLE_SOURCE,
+                  "fields": "tex_key,width,height,depth"},
+            format="json")
+        self.assertEqual(resp.status_code, 201, resp.content)
+        data = resp.json()
+        self.assertEqual(
+            [data["width"], data["height"], data["depth"]],
+            [26.004, 8.002, 3.002])
+
+        # Converted from the compiled file, with the metadata
+        source_key = get_source_key(data["tex_key"])
+        resp = self.client.get(
+            "/api/image/%s" % source_key, HTTP_ACCEPT="image/png")
+        self.assertEqual(resp.content, b"tight")
+        instance = LatexImage.objects.get(
+            tex_key=get_variant_key(source_key, "png"))
+        self.assertEqual(instance.depth, 3.002)
@@ -0,0 +1,83 @@
+import json
+from unittest import mock
+
+from django.test import SimpleTestCase, TestCase, override_settings
+from rest_framework.test import APIClient
+from tests.base_test_mixins import L2ITestMixinBase, get_fake_data_url
+
+from latex.timing import SpanRecorder, get_current_recorder, recording, span
+
+
+class SpanRecorderTest(SimpleTestCase):
+    def test_span_not_recording(self):
+        self.assertIsNone(get_current_recorder())
+        with span("foo"):
+            pass
+        self.assertIsNone(get_current_recorder())
+
+    def test_spans_summed(self):
+        with recording() as recorder:
+            with span("foo"):
+                pass
+            with span("bar"):
+                pass
+            with span("foo"):
+                pass
+        self.assertEqual(list(recorder.durations), ["foo", "bar"])
+        self.assertIsNone(get_current_recorder())
+
+    def test_span_recorded_on_error(self):
+        with recording() as recorder:
+            with self.assertRaises(RuntimeError):
+                with span("foo"):
+                    raise RuntimeError()
+        self.assertIn("foo", recorder.durations)
+
+    def test_server_timing_header(self):
+        recorder = SpanRecorder()
+        recorder.add("compile", 0.5)
+        recorder.add("convert", 0.0012345)
+        self.assertEqual(
+            recorder.get_server_timing_header(1),
+            "compile;dur=500.0, convert;dur=1.234, total;dur=1000")
+
+
+class ServerTimingMiddlewareTest(L2ITestMixinBase, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.api_client = APIClient()
+        self.api_client.force_authenticate(user=self.test_user)
+
+    def post_create(self):
+        with mock.patch(
+                "latex.converter.Tex2ImgBase.get_converted_data_url"
+        ) as mock_convert:
+            mock_convert.return_value = get_fake_data_url("foob=")
+            return self.api_client.post(
+                self.get_creat_url(),
+                data={"compiler": "xelatex", "tex_source": "foo",
+                      "image_format": "png"},
+                format="json")
+
+    @override_settings(L2I_SERVER_TIMING=False)
+    def test_disabled(self):
+        resp = self.post_create()
+        self.assertEqual(resp.status_code, 201)
+        self.assertFalse(resp.has_header("Server-Timing"))
+
+    @override_settings(L2I_SERVER_TIMING=True)
+    def test_enabled(self):
+        with self.assertLogs("latex.timing", level="INFO") as cm:
+            resp = self.post_create()
+        self.assertEqual(resp.status_code, 201)
+
+        server_timing = resp["Server-Timing"]
+        for name in ("db_lookup", "save", "full_clean", "storage_upload",
+                     "cache_fill", "total"):
+            self.assertIn("%s;dur=" % name, server_timing)
+
+        self.assertEqual(len(cm.records), 1)
+        log = json.loads(cm.records[0].getMessage())
+        self.assertEqual(log["status"], 201)
+        self.assertEqual(log["method"], "POST")
+        self.assertIn("save", log["spans"])
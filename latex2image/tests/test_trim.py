@@ -0,0 +1,93 @@
+import os
+import shutil
+import tempfile
+from unittest import skipUnless
+
+from django.test import SimpleTestCase
+from PIL import Image
+
+from latex.converter import get_number_of_images
+from latex.optimizers import is_numpy_available
+from latex.trim import (add_margin, get_bounding_boxes, save_trimmed_pages,
+                        trim_pages)
+
+
+def make_page(width, height, background, boxes=()):
+    import numpy as np
+
+    pixels = np.empty((height, width, 4), dtype=np.uint8)
+    pixels[...] = background
+    for (top, left, bottom, right), color in boxes:
+        pixels[top:bottom, left:right] = color
+    return width, height, pixels.tobytes()
+
+
+@skipUnless(is_numpy_available(), "numpy is not installed")
+class GetBoundingBoxesTest(SimpleTestCase):
+    def test_boxes(self):
+        import numpy as np
+
+        black = (0, 0, 0, 255)
+        pages = np.stack([
+            np.frombuffer(page[2], dtype=np.uint8).reshape(10, 20, 4)
+            for page in [
+                make_page(20, 10, (0, 0, 0, 0), [((2, 3, 5, 8), black)]),
+                make_page(20, 10, (255, 255, 255, 255),
+                          [((0, 0, 1, 20), (255, 255, 255, 255)),
+                           ((4, 10, 10, 11), black)]),
+                make_page(20, 10, (0, 0, 0, 0)),
+            ]])
+
+        # Transparent pixels of any color are background
+        pages[0, 9, 19] = (255, 0, 0, 0)
+
+        self.assertEqual(
+            get_bounding_boxes(pages).tolist(),
+            [[2, 3, 5, 8], [4, 10, 10, 11], [0, 0, 1, 1]])
+
+    def test_add_margin(self):
+        import numpy as np
+
+        boxes = np.array([[2, 3, 5, 8], [0, 0, 10, 20]])
+        self.assertIs(add_margin(boxes, 0, 10, 20), boxes)
+        self.assertEqual(
+            add_margin(boxes, 3, 10, 20).tolist(),
+            [[0, 0, 8, 11], [0, 0, 10, 20]])
+
+
+@skipUnless(is_numpy_available(), "numpy is not installed")
+class TrimPagesTest(SimpleTestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp(prefix="l2i_test_")
+        self.addCleanup(shutil.rmtree, self.temp_dir)
+        black = (0, 0, 0, 255)
+        self.pages = [
+            make_page(20, 10, (0, 0, 0, 0), [((2, 3, 5, 8), black)]),
+            make_page(30, 10, (255, 255, 255, 255), [((4, 10, 6, 11), black)]),
+            make_page(20, 10, (0, 0, 0, 0), [((9, 19, 10, 20), black)]),
+        ]
+
+    def test_trim_pages(self):
+        self.assertEqual(
+            [pixels.shape for pixels in trim_pages(self.pages)],
+            [(3, 5, 4), (2, 1, 4), (1, 1, 4)])
+        self.assertEqual(
+            [pixels.shape for pixels in trim_pages(self.pages, margin=1)],
+            [(5, 7, 4), (4, 3, 4), (2, 2, 4)])
+
+    def test_save(self):
+        image_path = os.path.join(self.temp_dir, "foo.png")
+        save_trimmed_pages(self.pages[:1], image_path, margin=1)
+        with Image.open(image_path) as image:
+            self.assertEqual((image.mode, image.size), ("RGBA", (7, 5)))
+            self.assertEqual(image.getpixel((0, 0)), (0, 0, 0, 0))
+            self.assertEqual(image.getpixel((1, 1)), (0, 0, 0, 255))
+
+    def test_save_pages(self):
+        image_path = os.path.join(self.temp_dir, "foo.png")
+        save_trimmed_pages(self.pages, image_path)
+        self.assertEqual(get_number_of_images(image_path, ".png"), 3)
+
+        # Opaque pages saved as RGB
+        with Image.open(os.path.join(self.temp_dir, "foo-1.png")) as image:
+            self.assertEqual((image.mode, image.size), ("RGB", (1, 2)))
@@ -0,0 +1,201 @@
+import base64
+import os
+import shutil
+import tempfile
+from unittest import mock
+
+from django.test import SimpleTestCase, TestCase, override_settings
+from rest_framework.test import APIClient
+from tests.base_test_mixins import L2ITestMixinBase
+
+from latex.converter import (ImageConverter, Tex2ImgBase, build_key,
+                             get_source_key)
+from latex.models import LatexImage, get_image_storage
+from latex.variants import (get_compiled_file_name, get_variant_key,
+                            negotiate_image_formats)
+
+CHROME_ACCEPT = "image/avif,image/webp,image/apng,image/svg+xml,image/*,*/*;q=0.8"
+FORMATS = ["svg", "avif", "webp", "png"]
+
+
+class NegotiateImageFormatsTest(SimpleTestCase):
+    def test_negotiate(self):
+        for accept, expected in [
+                (CHROME_ACCEPT, ["svg", "avif", "webp", "png"]),
+                ("image/webp,image/*;q=0.8", ["webp", "png", "svg", "avif"]),
+                (None, ["png", "svg", "avif", "webp"]),
+                ("*/*", ["png", "svg", "avif", "webp"]),
+                ("image/png;q=0.5,image/svg+xml;q=0.9", ["svg", "png"]),
+                ("image/*,image/svg+xml;q=0", ["png", "avif", "webp"]),
+                ("text/html", [])]:
+            with self.subTest(accept=accept):
+                self.assertEqual(
+                    negotiate_image_formats(accept, FORMATS), expected)
+
+
+class VariantKeyTest(SimpleTestCase):
+    def test_keys(self):
+        tex_key = build_key("$a$", "xelatex", "svg", canonicalize=True)
+        source_key = get_source_key(tex_key)
+        self.assertNotIn("svg", source_key)
+        self.assertEqual(get_variant_key(source_key, "svg"), tex_key)
+        self.assertEqual(
+            get_variant_key(source_key, "png"),
+            build_key("$a$", "xelatex", "png", canonicalize=True))
+        self.assertIsNone(get_source_key("foo"))
+
+        self.assertTrue(get_compiled_file_name(source_key).endswith(".pdf"))
+        self.assertTrue(get_compiled_file_name(
+            get_source_key(build_key("$a$", "latex", "svg"))).endswith(".dvi"))
+
+
+def get_compiled_file(self):
+    self.working_dir = tempfile.mkdtemp(prefix="LATEX_")
+    path = os.path.join(self.working_dir, self.tex_key + self.compiled_ext)
+    with open(path, "wb") as f:
+        f.write(b"compiled")
+    return path
+
+
+def do_convert(self, compiled_file_path, image_path, working_dir):
+    with open(compiled_file_path, "rb") as f:
+        content = f.read()
+    with open(image_path, "wb") as f:
+        f.write(content + os.path.splitext(image_path)[1].encode())
+    return True, None
+
+
+def get_vary(response):
+    return [header.strip() for header in response.get("Vary", "").split(",")]
+
+
+@override_settings(L2I_VARIANT_FORMATS=["svg", "png"])
+class VariantImageViewTest(L2ITestMixinBase, TestCase):
+    def setUp(self):
+        super().setUp()
+        patch = mock.patch.object(
+            Tex2ImgBase, "get_compiled_file", autospec=True,
+            side_effect=get_compiled_file)
+        patch.start()
+        self.addCleanup(patch.stop)
+
+        patch = mock.patch.object(
+            ImageConverter, "do_convert", autospec=True,
+            side_effect=do_convert)
+        self.mock_convert = patch.start()
+        self.addCleanup(patch.stop)
+
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.test_user)
+        resp = self.client.post(
+            "/api/create/",
+            data={"compiler": "xelatex", "image_format": "svg",
+                  "tex_source": "$a$"},
+            format="json")
+        self.assertEqual(resp.status_code, 201, resp.content)
+        self.tex_key = resp.json()["tex_key"]
+        self.source_key = get_source_key(self.tex_key)
+        self.client.logout()
+
+    def get(self, accept=None, tex_key=None):
+        kwargs = {} if accept is None else {"HTTP_ACCEPT": accept}
+        return self.client.get(
+            "/api/image/%s" % (tex_key or self.source_key), **kwargs)
+
+    def test_negotiated(self):
+        self.assertTrue(get_image_storage().exists(
+            get_compiled_file_name(self.source_key)))
+
+        resp = self.get(CHROME_ACCEPT)
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp["Content-Type"], "image/svg+xml")
+        self.assertEqual(resp.content, b"compiled.svg")
+        self.assertIn("Accept", get_vary(resp))
+        self.assertEqual(resp["Content-Location"], "/api/image/%s" % self.tex_key)
+
+        self.mock_convert.reset_mock()
+        for _i in range(2):
+            resp = self.get()
+            self.assertEqual(resp.status_code, 200)
+            self.assertEqual(resp["Content-Type"], "image/png")
+            self.assertEqual(resp.content, b"compiled.png")
+        self.assertEqual(self.mock_convert.call_count, 1)
+
+        png_key = get_variant_key(self.source_key, "png")
+        instance = LatexImage.objects.get(tex_key=png_key)
+        self.assertEqual(instance.creator, self.test_user)
+        self.assertEqual(
+            instance.data_url,
+            "data:image/png;base64,%s"
+            % base64.b64encode(b"compiled.png").decode())
+
+        # Not negotiated by the tex_key of a format
+        resp = self.get("image/svg+xml", tex_key=png_key)
+        self.assertEqual(resp["Content-Type"], "image/png")
+        self.assertNotIn("Accept", get_vary(resp))
+
+    def test_not_acceptable(self):
+        resp = self.get("image/webp")
+        self.assertEqual(resp.status_code, 406)
+        self.assertIn("Accept", get_vary(resp))
+
+    def test_not_found(self):
+        self.assertEqual(
+            self.get(tex_key="%s_xelatex_v1" % ("0" * 32)).status_code, 404)
+
+        with override_settings(L2I_VARIANT_FORMATS=[]):
+            self.assertEqual(self.get().status_code, 404)
+
+    def test_convert_failed(self):
+        self.mock_convert.side_effect = None
+        self.mock_convert.return_value = (False, "error")
+        with self.assertLogs("latex.variants", "ERROR"):
+            resp = self.get("image/png")
+        self.assertEqual(resp.status_code, 404)
+
+        # The next format accepted
+        with self.assertLogs("latex.variants", "ERROR"):
+            resp = self.get("image/png,image/svg+xml;q=0.5")
+        self.assertEqual(resp["Content-Type"], "image/svg+xml")
+
+    def test_dvipng_not_converted(self):
+        self.client.force_authenticate(user=self.test_user)
+        resp = self.client.post(
+            "/api/create/",
+            data={"compiler": "latex", "image_format": "svg",
+                  "tex_source": "\\begin{tikzpicture}\\end{tikzpicture}"},
+            format="json")
+        self.assertEqual(resp.status_code, 201, resp.content)
+        source_key = get_source_key(resp.json()["tex_key"])
+
+        self.mock_convert.reset_mock()
+        resp = self.get("image/png,image/svg+xml;q=0.5", tex_key=source_key)
+        self.assertEqual(resp["Content-Type"], "image/svg+xml")
+        self.mock_convert.assert_not_called()
+        self.assertFalse(LatexImage.objects.filter(
+            tex_key=get_variant_key(source_key, "png")).exists())
+
+    def test_compiled_file_deleted(self):
+        self.assertEqual(self.get("image/png").status_code, 200)
+        name = get_compiled_file_name(self.source_key)
+
+        LatexImage.objects.get(tex_key=self.tex_key).delete()
+        self.assertTrue(get_image_storage().exists(name))
+
+        LatexImage.objects.all().delete()
+        self.assertFalse(get_image_storage().exists(name))
+
+    @override_settings(L2I_VARIANT_FORMATS=[])
+    def test_compiled_file_not_kept(self):
+        LatexImage.objects.all().delete()
+        shutil.rmtree(os.path.join(
+            get_image_storage().location, "l2i_compiled"), ignore_errors=True)
+        self.client.force_authenticate(user=self.test_user)
+        resp = self.client.post(
+            "/api/create/",
+            data={"compiler": "xelatex", "image_format": "png",
+                  "tex_source": "$b$"},
+            format="json")
+        self.assertEqual(resp.status_code, 201, resp.content)
+        self.assertFalse(get_image_storage().exists(get_compiled_file_name(
+            get_source_key(resp.json()["tex_key"]))))
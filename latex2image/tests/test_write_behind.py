@@ -0,0 +1,172 @@
+import os
+import shutil
+import tempfile
+import threading
+from io import StringIO
+from unittest import mock
+
+from django.core.management import call_command
+from django.test import SimpleTestCase, TestCase, override_settings
+from rest_framework.test import APIClient
+from tests.base_test_mixins import L2ITestMixinBase, get_fake_data_url
+
+from latex.converter import LatexCompileError
+from latex.models import LatexImage
+from latex.write_behind import (WriteBehindQueue, WriteBehindWorker,
+                                get_pending_record, make_record)
+
+CONVERT_PATH = "latex.converter.Tex2ImgBase.get_converted_data_url"
+
+
+def make_temp_dir(test_case):
+    temp_dir = tempfile.mkdtemp(prefix="l2i_test_")
+    test_case.addCleanup(shutil.rmtree, temp_dir)
+    return temp_dir
+
+
+class WriteBehindQueueTest(SimpleTestCase):
+    def setUp(self):
+        self.queue = WriteBehindQueue(make_temp_dir(self))
+
+    def test_claim(self):
+        for tex_key in ["a", "b", "c"]:
+            self.queue.put(make_record(tex_key, 1, data_url="foo"))
+        self.assertEqual(len(self.queue), 3)
+
+        claimed = self.queue.claim(2)
+        self.assertEqual(
+            [os.path.basename(path).split("-")[1] for path in claimed],
+            ["a.json.claimed", "b.json.claimed"])
+
+        # Claimed entries are not claimed again
+        self.assertEqual(len(self.queue.claim(5)), 1)
+        self.assertEqual(self.queue.claim(5), [])
+
+        self.queue.done(claimed[0])
+        self.queue.release(claimed[1])
+        self.assertEqual(len(self.queue), 2)
+        self.assertEqual(len(self.queue.claim(5)), 1)
+
+    def test_recover(self):
+        self.queue.put(make_record("a", 1, data_url="foo"))
+        claimed_path, = self.queue.claim(1)
+        self.assertEqual(self.queue.recover(timeout=60), 0)
+
+        os.utime(claimed_path, (0, 0))
+        self.assertEqual(self.queue.recover(timeout=60), 1)
+        self.assertEqual(len(self.queue.claim(1)), 1)
+
+    def test_worker(self):
+        drained = threading.Event()
+        with mock.patch.object(
+                WriteBehindQueue, "drain", side_effect=drained.set):
+            worker = WriteBehindWorker(self.queue, interval=3600)
+            worker.start()
+            worker.wake_up.set()
+            self.assertTrue(drained.wait(5))
+
+
+@override_settings(L2I_WRITE_BEHIND=True)
+class WriteBehindAPITest(L2ITestMixinBase, TestCase):
+    def setUp(self):
+        super().setUp()
+        queue_dir = make_temp_dir(self)
+        settings_override = override_settings(
+            L2I_WRITE_BEHIND_QUEUE_DIR=queue_dir)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.queue = WriteBehindQueue(queue_dir)
+
+        # Drained explicitly, the worker thread can't see the test
+        # transaction
+        patch = mock.patch("latex.write_behind.get_worker")
+        self.mock_worker = patch.start()
+        self.addCleanup(patch.stop)
+
+        patch = mock.patch(
+            CONVERT_PATH, return_value=get_fake_data_url("foob="))
+        self.mock_convert = patch.start()
+        self.addCleanup(patch.stop)
+
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.test_user)
+
+    def post(self, **kwargs):
+        data = {"compiler": "xelatex", "image_format": "png",
+                "tex_source": "$a$", "tex_key": "foo", "fields": "data_url"}
+        data.update(kwargs)
+        return self.client.post("/api/create/", data=data, format="json")
+
+    def test_write_behind(self):
+        resp = self.post()
+        self.assertEqual(resp.status_code, 201, resp.content)
+        self.assertEqual(resp.json(), {"data_url": get_fake_data_url("foob=")})
+        self.mock_worker.return_value.wake_up.set.assert_called_once_with()
+        self.assertFalse(LatexImage.objects.exists())
+        self.assertEqual(len(self.queue), 1)
+
+        # Served from the cache until committed
+        resp = self.post()
+        self.assertEqual(resp.status_code, 200, resp.content)
+        self.assertEqual(resp.json(), {"data_url": get_fake_data_url("foob=")})
+
+        resp = self.client.get(self.get_detail_url("foo", "data_url"))
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.json(), {"data_url": get_fake_data_url("foob=")})
+        self.assertEqual(self.mock_convert.call_count, 1)
+
+        self.assertEqual(self.queue.drain(), {"committed": 1, "failed": 0})
+        instance = LatexImage.objects.get()
+        self.assertEqual(instance.creator, self.test_user)
+        self.assertTrue(instance.image.name.endswith("foo.png"))
+        self.assertIsNone(get_pending_record("foo"))
+        self.assertEqual(len(self.queue), 0)
+
+    def test_compile_error(self):
+        self.mock_convert.side_effect = LatexCompileError("some error")
+        resp = self.post()
+        self.assertEqual(resp.status_code, 400, resp.content)
+        self.assertIn("some error", resp.json()["compile_error"])
+
+        self.queue.drain()
+        self.assertIn("some error", LatexImage.objects.get().compile_error)
+
+    def test_saved_fields_requested(self):
+        # "image" only exists once saved
+        resp = self.post(fields="image")
+        self.assertEqual(resp.status_code, 201, resp.content)
+        self.assertEqual(LatexImage.objects.count(), 1)
+        self.assertEqual(len(self.queue), 0)
+
+    def test_pending_committed_when_saved_fields_requested(self):
+        self.assertEqual(self.post().status_code, 201)
+        resp = self.post(fields="image")
+        self.assertEqual(resp.status_code, 200, resp.content)
+        self.assertTrue(resp.json()["image"].endswith("foo.png"))
+        self.assertEqual(self.mock_convert.call_count, 1)
+
+        # Already committed
+        self.assertEqual(self.queue.drain(), {"committed": 1, "failed": 0})
+        self.assertEqual(LatexImage.objects.count(), 1)
+
+    def test_failed_commit_retried(self):
+        self.assertEqual(self.post().status_code, 201)
+        with mock.patch(
+                "latex.write_behind.commit_record", side_effect=RuntimeError):
+            self.assertEqual(self.queue.drain(), {"committed": 0, "failed": 1})
+        self.assertFalse(LatexImage.objects.exists())
+
+        stdout = StringIO()
+        call_command("drain_write_behind", "--status", stdout=stdout)
+        self.assertIn("1 results queued", stdout.getvalue())
+
+        stdout = StringIO()
+        call_command("drain_write_behind", stdout=stdout)
+        self.assertIn("1 results committed", stdout.getvalue())
+        self.assertTrue(LatexImage.objects.exists())
+
+    @override_settings(L2I_WRITE_BEHIND=False)
+    def test_disabled(self):
+        self.assertEqual(self.post().status_code, 201)
+        self.assertEqual(LatexImage.objects.count(), 1)
+        self.assertEqual(len(self.queue), 0)